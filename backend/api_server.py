@@ -9,6 +9,8 @@ from backend.app.routers import dashboard
 from backend.app.routers import teacher_problem
 # Import queues for initialization
 from backend.app.agents.debugging.OJ.queue_manager import analysis_queue
+from backend.app.agents.debugging.db import llm_charge_ledger
+from backend.app.agents.debugging.dashboard_feed import dashboard_feed
 
 # --- FastAPI App ---
 
@@ -47,6 +49,19 @@ async def startup_event():
     """
     await analysis_queue.start_workers()
     print(f"✅ AnalysisQueue initialized with {analysis_queue.max_workers} workers.")
+    await llm_charge_ledger.start()
+    print(f"✅ LLM charge ledger flushing every {llm_charge_ledger.flush_interval_sec}s.")
+    await dashboard_feed.start()
+    print(f"✅ Dashboard feed ready (backplane: {dashboard_feed.channel or 'in-process'}).")
+
+# --- Shutdown Event: Flush Buffered Writes ---
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Flush buffered LLM charges before the server exits so no cost records are lost.
+    """
+    await llm_charge_ledger.stop()
+    await dashboard_feed.stop()
 
 # --- Root, Health Check ---
 
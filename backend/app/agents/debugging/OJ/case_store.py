@@ -0,0 +1,91 @@
+"""
+Case Store: 測資內容的本機快取 (以內容雜湊命名、mmap 讀取)
+
+測資存於 debugging.problem_test_case (只存 input / output 的 content_blob hash)，
+load_problem_config 只讀 hash，判題時第一次存取某筆測資才把整題缺少的內容一次取回，
+寫入 CASE_CACHE_DIR/<hash[:2]>/<hash>。內容不可變，快取檔不會過期，
+多個 worker 共用同一份檔案與 page cache。
+"""
+import os
+import json
+import mmap
+import tempfile
+import threading
+from typing import Callable, Dict, Iterable, Optional
+
+
+DEFAULT_CACHE_DIR = os.getenv("CASE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "cookai_case_cache"))
+
+
+class CaseStore:
+    """fetch_blobs(hashes) -> {hash: JSON 文字}，由呼叫端提供 (資料庫讀取)"""
+
+    def __init__(self, fetch_blobs: Callable[[set], Dict[str, str]], cache_dir: str = DEFAULT_CACHE_DIR):
+        self.fetch_blobs = fetch_blobs
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def ensure(self, hashes: Iterable[str]):
+        """取回本機尚未快取的內容 (一次查詢)"""
+        missing = {h for h in hashes if h and not os.path.exists(self._path(h))}
+        if not missing:
+            return
+        with self._lock:
+            missing = {h for h in missing if not os.path.exists(self._path(h))}
+            if not missing:
+                return
+            for digest, content in self.fetch_blobs(missing).items():
+                path = self._path(digest)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+                with os.fdopen(fd, "wb") as f:
+                    f.write(content.encode("utf-8"))
+                os.replace(tmp_path, path)
+
+    def read(self, digest: str):
+        with open(self._path(digest), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return json.loads(m[:].decode("utf-8"))
+
+
+class CaseSet:
+    """單題的測資集合：第一次存取時一次補齊整題缺少的快取檔"""
+
+    def __init__(self, store: CaseStore, hashes: Iterable[str]):
+        self.store = store
+        self.hashes = {h for h in hashes if h}
+        self._ready = False
+
+    def read(self, digest: Optional[str]):
+        if digest is None:
+            return None
+        if not self._ready:
+            self.store.ensure(self.hashes)
+            self._ready = True
+        return self.store.read(digest)
+
+
+class LazyTestCase:
+    """與 TestCase 相同的介面 (input / expected)，內容在第一次存取時才讀取"""
+
+    def __init__(self, case_no: int, input_hash: Optional[str], expected_hash: Optional[str], case_set: CaseSet):
+        self.case_no = case_no
+        self.input_hash = input_hash
+        self.expected_hash = expected_hash
+        self._case_set = case_set
+        self._values: Dict[str, object] = {}
+
+    def _get(self, field: str, digest: Optional[str]):
+        if field not in self._values:
+            self._values[field] = self._case_set.read(digest)
+        return self._values[field]
+
+    @property
+    def input(self):
+        return self._get("input", self.input_hash)
+
+    @property
+    def expected(self):
+        return self._get("expected", self.expected_hash)
@@ -0,0 +1,405 @@
+"""
+Analytics Export: 將學習歷程資料增量匯出為 Parquet (離線分析用)
+
+研究分析不再直接查詢 OLTP 的 JSONB 欄位，改由此工具定期匯出扁平化的欄式檔案：
+
+- submissions          每次提交一列 (verdict、通過數、程式碼)
+- submission_cases     每次提交的每個測資一列 (展開 output.details)
+- dialogue_messages    每則對話訊息一列 (展開 chat_log)
+- llm_charge           LLM 花費累計表的完整快照 (此表為 upsert 累加，無法以時間增量)
+
+輸出結構:
+    <out>/<dataset>/date=YYYY-MM-DD/part-<run_id>-<n>.parquet
+    <out>/llm_charge/snapshot.parquet
+    <out>/_watermarks.json
+
+增量規則:
+- 以 (上次 watermark, 現在 - lag] 區間擷取，lag 預設 5 分鐘，避免漏掉尚未 commit 的資料
+- submissions / submission_cases 以 submitted_at 為 watermark
+- dialogue_messages 以訊息本身的 timestamp 為 watermark (chat_log 會在原列追加訊息)；
+  先以有索引的 debugging_dialogue.updated_at 篩出區間內有追加訊息的對話，再展開 chat_log
+- 每個 dataset 完整寫出後才更新 watermark，中斷後重跑不會遺漏 (已寫出的 part 檔可依 run_id 去重)
+
+用法:
+    python -m backend.app.agents.debugging.analytics_export --out ./analytics_export
+"""
+import os
+import json
+import argparse
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, text, and_
+
+from .db import (
+    engine, submission_table, llm_charge_table,
+    parse_submission_code, parse_submission_verdict,
+    load_blobs, collect_blob_hashes, hydrate_submission
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUT_DIR = os.getenv("ANALYTICS_EXPORT_DIR", "./analytics_export")
+DEFAULT_LAG_MINUTES = int(os.getenv("ANALYTICS_EXPORT_LAG_MINUTES", 5))
+# updated_at 由資料庫時鐘產生、訊息 timestamp 由 API server 產生，以列篩選時往前多涵蓋此誤差
+CLOCK_SKEW = timedelta(minutes=int(os.getenv("ANALYTICS_EXPORT_CLOCK_SKEW_MINUTES", 5)))
+BATCH_SIZE = 5000
+EPOCH = "1970-01-01T00:00:00"
+
+
+# ==========================================
+# Schemas
+# ==========================================
+
+SUBMISSION_SCHEMA = pa.schema([
+    ("student_id", pa.string()),
+    ("problem_id", pa.string()),
+    ("submitted_at", pa.timestamp("us")),
+    ("verdict", pa.string()),
+    ("passed_cases", pa.int32()),
+    ("total_cases", pa.int32()),
+    ("code", pa.string()),
+])
+
+SUBMISSION_CASE_SCHEMA = pa.schema([
+    ("student_id", pa.string()),
+    ("problem_id", pa.string()),
+    ("submitted_at", pa.timestamp("us")),
+    ("case_id", pa.int32()),
+    ("status", pa.string()),
+    ("expected", pa.string()),
+    ("actual", pa.string()),
+    ("error", pa.string()),
+])
+
+DIALOGUE_MESSAGE_SCHEMA = pa.schema([
+    ("dialogue_id", pa.int64()),
+    ("student_id", pa.string()),
+    ("problem_id", pa.string()),
+    ("num", pa.int32()),
+    ("message_index", pa.int32()),
+    ("role", pa.string()),
+    ("message_type", pa.string()),
+    ("zpd", pa.int32()),
+    ("content", pa.string()),
+    ("timestamp", pa.timestamp("us")),
+])
+
+LLM_CHARGE_SCHEMA = pa.schema([
+    ("student_id", pa.string()),
+    ("problem_id", pa.string()),
+    ("usage_type", pa.string()),
+    ("model_name", pa.string()),
+    ("input_tokens", pa.int64()),
+    ("cached_input_tokens", pa.int64()),
+    ("output_tokens", pa.int64()),
+    ("total_tokens", pa.int64()),
+    ("input_cost", pa.float64()),
+    ("cached_input_cost", pa.float64()),
+    ("output_cost", pa.float64()),
+    ("total_cost", pa.float64()),
+    ("cache_hits", pa.int64()),
+    ("cache_misses", pa.int64()),
+    ("saved_cost", pa.float64()),
+    ("parse_attempts", pa.int64()),
+    ("parse_failures", pa.int64()),
+    ("parse_repairs", pa.int64()),
+    ("created_at", pa.timestamp("us")),
+])
+
+
+# ==========================================
+# Helpers
+# ==========================================
+
+def _to_int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_str(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_passed(passed_cases: Any) -> Tuple[Optional[int], Optional[int]]:
+    """'3/5' -> (3, 5)"""
+    if not isinstance(passed_cases, str) or "/" not in passed_cases:
+        return None, None
+    passed, total = passed_cases.split("/", 1)
+    return _to_int(passed), _to_int(total)
+
+
+class WatermarkStore:
+    """以 JSON 檔記錄每個 dataset 已匯出的上界"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.values: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.values = json.load(f)
+
+    def get(self, dataset: str) -> str:
+        return self.values.get(dataset, EPOCH)
+
+    def set(self, dataset: str, value: str):
+        self.values[dataset] = value
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.values, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class PartitionedWriter:
+    """依日期分區寫出 Parquet，每批寫成獨立的 part 檔"""
+
+    def __init__(self, out_dir: str, dataset: str, schema: pa.Schema, partition_field: str, run_id: str):
+        self.base_dir = os.path.join(out_dir, dataset)
+        self.schema = schema
+        self.partition_field = partition_field
+        self.run_id = run_id
+        self.part_no = 0
+        self.rows_written = 0
+
+    def write(self, rows: List[Dict[str, Any]]):
+        by_date = defaultdict(list)
+        for row in rows:
+            ts = row.get(self.partition_field)
+            by_date[ts.strftime("%Y-%m-%d") if ts else "unknown"].append(row)
+
+        for date, date_rows in by_date.items():
+            partition_dir = os.path.join(self.base_dir, f"date={date}")
+            os.makedirs(partition_dir, exist_ok=True)
+            table = pa.Table.from_pylist(date_rows, schema=self.schema)
+            pq.write_table(table, os.path.join(partition_dir, f"part-{self.run_id}-{self.part_no:05d}.parquet"))
+            self.part_no += 1
+            self.rows_written += len(date_rows)
+
+
+def _stream(conn, stmt, params: Optional[Dict[str, Any]] = None) -> Iterator[List[Any]]:
+    result = conn.execution_options(stream_results=True).execute(stmt, params or {})
+    while True:
+        batch = result.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        yield batch
+
+
+# ==========================================
+# Extractors
+# ==========================================
+
+def export_submissions(conn, out_dir: str, run_id: str, low: str, high: str) -> int:
+    """匯出 submissions 與 submission_cases (同一個 watermark)"""
+    sub_writer = PartitionedWriter(out_dir, "submissions", SUBMISSION_SCHEMA, "submitted_at", run_id)
+    case_writer = PartitionedWriter(out_dir, "submission_cases", SUBMISSION_CASE_SCHEMA, "submitted_at", run_id)
+
+    stmt = (
+        select(
+            submission_table.c.student_id,
+            submission_table.c.problem_id,
+            submission_table.c.submitted_at,
+            submission_table.c.result,
+            submission_table.c.output,
+            submission_table.c.code,
+        )
+        .where(and_(
+            submission_table.c.submitted_at > datetime.fromisoformat(low),
+            submission_table.c.submitted_at <= datetime.fromisoformat(high),
+        ))
+        .order_by(submission_table.c.submitted_at)
+    )
+
+    # 串流中的連線不能再執行查詢，blob 以另一條連線按批次讀取
+    with engine.connect() as blob_conn:
+        for batch in _stream(conn, stmt):
+            hashes = set()
+            for row in batch:
+                hashes |= collect_blob_hashes(row.code, row.output)
+            blobs = load_blobs(blob_conn, hashes)
+            _write_submission_batch(batch, blobs, sub_writer, case_writer)
+
+    return sub_writer.rows_written
+
+
+def _write_submission_batch(batch, blobs: Dict[str, Any], sub_writer: PartitionedWriter, case_writer: PartitionedWriter):
+    """還原 blob 引用後，將一批提交展開為 submissions / submission_cases 列"""
+    sub_rows, case_rows = [], []
+    for row in batch:
+        m = row._mapping
+        code, output = hydrate_submission(m["code"], m["output"], blobs)
+        output = output if isinstance(output, dict) else {}
+        passed, total = _parse_passed(output.get("passed_cases"))
+        sub_rows.append({
+            "student_id": m["student_id"],
+            "problem_id": m["problem_id"],
+            "submitted_at": m["submitted_at"],
+            "verdict": parse_submission_verdict(m["output"], m["result"]),
+            "passed_cases": passed,
+            "total_cases": total,
+            "code": parse_submission_code(code),
+        })
+        for detail in output.get("details") or []:
+            if not isinstance(detail, dict):
+                continue
+            case_rows.append({
+                "student_id": m["student_id"],
+                "problem_id": m["problem_id"],
+                "submitted_at": m["submitted_at"],
+                "case_id": _to_int(detail.get("case_id")),
+                "status": _to_str(detail.get("status")),
+                "expected": _to_str(detail.get("expected")),
+                "actual": _to_str(detail.get("actual")),
+                "error": _to_str(detail.get("error")),
+            })
+    sub_writer.write(sub_rows)
+    case_writer.write(case_rows)
+
+
+DIALOGUE_MESSAGES_SQL = text(
+    """
+    SELECT *
+    FROM (
+        SELECT
+            d.id AS dialogue_id, d.student_id, d.problem_id, d.num,
+            (m.ord - 1)::int AS message_index,
+            m.elem->>'role' AS role,
+            m.elem->>'type' AS message_type,
+            m.elem->>'zpd' AS zpd,
+            m.elem->>'content' AS content,
+            COALESCE((m.elem->>'timestamp')::timestamp, d.submitted_at) AS ts
+        FROM debugging.debugging_dialogue d
+        CROSS JOIN LATERAL jsonb_array_elements(COALESCE(d.chat_log, '[]'::jsonb)) WITH ORDINALITY AS m(elem, ord)
+        WHERE d.updated_at > :row_low
+    ) msg
+    WHERE msg.ts > :low AND msg.ts <= :high
+    ORDER BY msg.ts
+    """
+)
+
+
+def export_dialogue_messages(conn, out_dir: str, run_id: str, low: str, high: str) -> int:
+    """
+    匯出 chat_log 中 timestamp 落在區間內的訊息。
+    區間內有新訊息的對話，其 updated_at 必定晚於 low (扣除時鐘誤差)，因此只展開這些對話。
+    """
+    writer = PartitionedWriter(out_dir, "dialogue_messages", DIALOGUE_MESSAGE_SCHEMA, "timestamp", run_id)
+    low_ts, high_ts = datetime.fromisoformat(low), datetime.fromisoformat(high)
+    params = {"low": low_ts, "high": high_ts, "row_low": low_ts - CLOCK_SKEW}
+
+    for batch in _stream(conn, DIALOGUE_MESSAGES_SQL, params):
+        rows = []
+        for row in batch:
+            m = row._mapping
+            rows.append({
+                "dialogue_id": m["dialogue_id"],
+                "student_id": m["student_id"],
+                "problem_id": m["problem_id"],
+                "num": m["num"],
+                "message_index": m["message_index"],
+                "role": m["role"],
+                "message_type": m["message_type"],
+                "zpd": _to_int(m["zpd"]),
+                "content": m["content"],
+                "timestamp": _parse_timestamp(m["ts"]),
+            })
+        writer.write(rows)
+
+    return writer.rows_written
+
+
+def export_llm_charge_snapshot(conn, out_dir: str) -> int:
+    """llm_charge 為累加表 (列會被更新)，每次匯出完整快照並原子替換"""
+    rows = [dict(row._mapping) for row in conn.execute(
+        select(*[llm_charge_table.c[name] for name in LLM_CHARGE_SCHEMA.names])
+    ).fetchall()]
+
+    dataset_dir = os.path.join(out_dir, "llm_charge")
+    os.makedirs(dataset_dir, exist_ok=True)
+    tmp_path = os.path.join(dataset_dir, "snapshot.parquet.tmp")
+    pq.write_table(pa.Table.from_pylist(rows, schema=LLM_CHARGE_SCHEMA), tmp_path)
+    os.replace(tmp_path, os.path.join(dataset_dir, "snapshot.parquet"))
+    return len(rows)
+
+
+INCREMENTAL_EXPORTS: Dict[str, Callable[..., int]] = {
+    "submissions": export_submissions,
+    "dialogue_messages": export_dialogue_messages,
+}
+
+ALL_DATASETS = list(INCREMENTAL_EXPORTS) + ["llm_charge"]
+
+
+# ==========================================
+# Entry
+# ==========================================
+
+def run_export(out_dir: str = DEFAULT_OUT_DIR, datasets: Optional[List[str]] = None,
+               lag_minutes: int = DEFAULT_LAG_MINUTES) -> Dict[str, int]:
+    """執行一次增量匯出，回傳各 dataset 寫出的列數"""
+    os.makedirs(out_dir, exist_ok=True)
+    watermarks = WatermarkStore(os.path.join(out_dir, "_watermarks.json"))
+    run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+    datasets = datasets or ALL_DATASETS
+    counts = {}
+
+    with engine.connect() as conn:
+        # 上界需與 watermark 欄位同一時鐘:
+        # submitted_at 由資料庫 now() 產生；chat_log 的 timestamp 由 API server 的 datetime.now() 產生
+        lag = timedelta(minutes=lag_minutes)
+        db_high = (conn.execute(text("SELECT LOCALTIMESTAMP")).scalar() - lag).isoformat()
+        app_high = (datetime.now() - lag).isoformat()
+
+        for dataset in datasets:
+            if dataset == "llm_charge":
+                counts[dataset] = export_llm_charge_snapshot(conn, out_dir)
+                continue
+
+            high = app_high if dataset == "dialogue_messages" else db_high
+            low = watermarks.get(dataset)
+            if low >= high:
+                counts[dataset] = 0
+                continue
+            counts[dataset] = INCREMENTAL_EXPORTS[dataset](conn, out_dir, run_id, low, high)
+            watermarks.set(dataset, high)
+            logger.info(f"[Analytics Export] {dataset}: {counts[dataset]} rows ({low} ~ {high}]")
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally export learning analytics to Parquet.")
+    parser.add_argument("--out", default=DEFAULT_OUT_DIR, help="Output directory")
+    parser.add_argument("--datasets", nargs="+", choices=ALL_DATASETS, default=None,
+                        help="Datasets to export (default: all)")
+    parser.add_argument("--lag-minutes", type=int, default=DEFAULT_LAG_MINUTES,
+                        help="Skip rows newer than now - lag to avoid in-flight writes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    counts = run_export(args.out, args.datasets, args.lag_minutes)
+    for dataset, count in counts.items():
+        print(f"[Analytics Export] {dataset}: {count} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+Diagnosis Cache 模組
+功能：同一題、同一種錯誤的診斷結果重用 (debugging.diagnosis_cache)
+
+1. 精確命中：正規化 AST (識別字改為編號、忽略格式與註解) + 錯誤特徵 的 sha256 相同
+   -> 重用錯誤報告、路由決策與檢索教材；原始程式碼也相同 (code_hash) 且同 ZPD 等級已有鷹架回覆時一併重用。
+   只有識別字或格式不同時鷹架回覆會引用別人的變數名稱，改以語意命中處理 (重新生成鷹架回覆)
+2. 語意命中：精確未命中時，以 embedding 在同題、同錯誤類別的快取中找最相近的一筆，
+   cosine similarity >= DIAGNOSIS_CACHE_SIMILARITY 時重用錯誤報告與檢索結果，
+   鷹架回覆則依學生目前的程式碼重新生成
+3. ZPD 等級依學生自己的歷史報告判斷，不快取
+
+環境變數：
+- DIAGNOSIS_CACHE=0                 關閉快取
+- DIAGNOSIS_CACHE_SIMILARITY        語意命中門檻 (預設 0.93)
+- DIAGNOSIS_CACHE_TTL_HOURS         快取有效時間 (預設 72 小時)
+- DIAGNOSIS_CACHE_MAX_PER_PROBLEM   每題保留筆數上限，超過時淘汰最久未命中者 (預設 200)
+
+命中率與省下的費用以 save_cache_event 記入 llm_charge (model_name='semantic_cache')。
+"""
+import os
+import re
+import ast
+import asyncio
+import hashlib
+import builtins
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, delete, update, func, case
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from backend.app.agents.debugging.db import engine, diagnosis_cache_table, save_cache_event
+from .scaffolding_agent import embeddings
+from .diagnostic_agent import is_fallback_report
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("DIAGNOSIS_CACHE", "1") != "0"
+SIMILARITY_THRESHOLD = float(os.getenv("DIAGNOSIS_CACHE_SIMILARITY", 0.93))
+TTL = timedelta(hours=float(os.getenv("DIAGNOSIS_CACHE_TTL_HOURS", 72)))
+MAX_PER_PROBLEM = int(os.getenv("DIAGNOSIS_CACHE_MAX_PER_PROBLEM", 200))
+
+_BUILTIN_NAMES = set(dir(builtins))
+_WHITESPACE_RE = re.compile(r"\s+")
+_NUMBER_RE = re.compile(r"\d+")
+_QUOTED_RE = re.compile(r"'[^']*'|\"[^\"]*\"")
+
+
+# ==========================================
+# Signature
+# ==========================================
+
+class _IdentifierNormalizer(ast.NodeTransformer):
+    """將使用者自訂的識別字依出現順序改名為 v0, v1...，內建函式名稱保留"""
+
+    def __init__(self):
+        self.names: Dict[str, str] = {}
+
+    def _rename(self, name: str) -> str:
+        if name in _BUILTIN_NAMES:
+            return name
+        if name not in self.names:
+            self.names[name] = f"v{len(self.names)}"
+        return self.names[name]
+
+    def visit_Name(self, node):
+        node.id = self._rename(node.id)
+        return node
+
+    def visit_arg(self, node):
+        node.arg = self._rename(node.arg)
+        node.annotation = None
+        return node
+
+    def visit_FunctionDef(self, node):
+        node.name = self._rename(node.name)
+        self.generic_visit(node)
+        return node
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        node.name = self._rename(node.name)
+        self.generic_visit(node)
+        return node
+
+
+def normalize_code(code: str) -> str:
+    """正規化程式碼：可解析時為改名後的 AST dump，語法錯誤時為去除空白的原始碼"""
+    try:
+        tree = ast.parse(code or "")
+    except SyntaxError as e:
+        return f"syntax:{e.msg}:" + _WHITESPACE_RE.sub("", code or "")
+    tree = _IdentifierNormalizer().visit(tree)
+    return ast.dump(tree, annotate_fields=False, include_attributes=False)
+
+
+def _error_field(error_message: str, field: str) -> str:
+    """取出 submit 時組成的錯誤訊息欄位 (Input / Actual / Expected 為單行，Error 為最後一欄可跨行)"""
+    pattern = rf"^{field}: (.*)\Z" if field == "Error" else rf"^{field}: (.*)$"
+    match = re.search(pattern, error_message or "", re.MULTILINE | (re.DOTALL if field == "Error" else 0))
+    return match.group(1).strip() if match else ""
+
+
+def error_signature(error_message: str) -> Dict[str, str]:
+    """
+    錯誤特徵：執行錯誤 / 逾時取最後一行 (例外類別 + 遮蔽數字與字串常值的訊息)，
+    答案錯誤則以失敗測資的輸入區分
+    """
+    error = _error_field(error_message, "Error")
+    if error and error != "None":
+        last_line = error.strip().splitlines()[-1]
+        kind = last_line.split(":", 1)[0].strip() or "Error"
+        masked = _NUMBER_RE.sub("<n>", _QUOTED_RE.sub("<s>", last_line))
+        return {"kind": kind[:100], "signature": masked}
+    return {"kind": "WA", "signature": f"WA:{_error_field(error_message, 'Input')}"}
+
+
+def cache_signature(code: str, error_message: str) -> Dict[str, str]:
+    err = error_signature(error_message)
+    digest = hashlib.sha256(f"{normalize_code(code)}\n{err['signature']}".encode("utf-8")).hexdigest()
+    code_hash = hashlib.sha256((code or "").encode("utf-8")).hexdigest()
+    return {"signature": digest, "error_kind": err["kind"], "code_hash": code_hash}
+
+
+def _embedding_text(code: str, error_message: str) -> str:
+    return f"{error_signature(error_message)['signature']}\n{code}"
+
+
+# ==========================================
+# Lookup / Store
+# ==========================================
+
+def _entry_dict(row) -> Dict[str, Any]:
+    mapping = row._mapping
+    return {
+        "id": mapping["id"],
+        "code_hash": mapping["code_hash"],
+        "evidence_report": mapping["evidence_report"] or {},
+        "search_query": mapping["search_query"] or "",
+        "retrieved_docs": mapping["retrieved_docs"] or [],
+        "scaffolds": mapping["scaffolds"] or {},
+        "report_cost": mapping["report_cost"] or 0.0,
+        "scaffold_cost": mapping["scaffold_cost"] or 0.0,
+    }
+
+
+_ENTRY_COLUMNS = [
+    diagnosis_cache_table.c.id,
+    diagnosis_cache_table.c.code_hash,
+    diagnosis_cache_table.c.evidence_report,
+    diagnosis_cache_table.c.search_query,
+    diagnosis_cache_table.c.retrieved_docs,
+    diagnosis_cache_table.c.scaffolds,
+    diagnosis_cache_table.c.report_cost,
+    diagnosis_cache_table.c.scaffold_cost,
+]
+
+
+def _lookup_exact(problem_id: str, signature: str) -> Optional[Dict[str, Any]]:
+    with engine.connect() as conn:
+        row = conn.execute(
+            select(*_ENTRY_COLUMNS).where(
+                diagnosis_cache_table.c.problem_id == problem_id,
+                diagnosis_cache_table.c.signature == signature,
+                diagnosis_cache_table.c.created_at >= datetime.now() - TTL,
+            ).limit(1)
+        ).fetchone()
+    return _entry_dict(row) if row else None
+
+
+def _lookup_similar(problem_id: str, error_kind: str, vector) -> Optional[Dict[str, Any]]:
+    distance = diagnosis_cache_table.c.embedding.cosine_distance(vector)
+    with engine.connect() as conn:
+        row = conn.execute(
+            select(*_ENTRY_COLUMNS, distance.label("distance")).where(
+                diagnosis_cache_table.c.problem_id == problem_id,
+                diagnosis_cache_table.c.error_kind == error_kind,
+                diagnosis_cache_table.c.embedding.isnot(None),
+                diagnosis_cache_table.c.created_at >= datetime.now() - TTL,
+            ).order_by(distance).limit(1)
+        ).fetchone()
+    if row is None or 1 - row._mapping["distance"] < SIMILARITY_THRESHOLD:
+        return None
+    entry = _entry_dict(row)
+    entry["similarity"] = round(1 - row._mapping["distance"], 4)
+    return entry
+
+
+async def lookup(problem_id: str, code: str, error_message: str) -> Dict[str, Any]:
+    """
+    回傳 {"signature", "error_kind", "embedding", "entry", "match"}：
+    match 為 "exact" / "semantic" / None，entry 為命中的快取內容
+    """
+    result = {**cache_signature(code, error_message), "embedding": None, "entry": None, "match": None}
+    if not CACHE_ENABLED:
+        return result
+    try:
+        entry = await asyncio.to_thread(_lookup_exact, problem_id, result["signature"])
+        if entry:
+            if entry["code_hash"] == result["code_hash"]:
+                return {**result, "entry": entry, "match": "exact"}
+            # 只差在識別字 / 格式：錯誤報告可沿用，鷹架回覆需依目前的程式碼重新生成
+            logger.info(f"Diagnosis cache hit on {problem_id} with different identifiers, regenerating scaffold")
+            return {**result, "entry": {**entry, "similarity": 1.0}, "match": "semantic"}
+
+        result["embedding"] = await asyncio.to_thread(embeddings.embed_query, _embedding_text(code, error_message))
+        entry = await asyncio.to_thread(_lookup_similar, problem_id, result["error_kind"], result["embedding"])
+        if entry:
+            logger.info(f"Diagnosis cache semantic hit on {problem_id} (similarity={entry['similarity']})")
+            return {**result, "entry": entry, "match": "semantic"}
+    except Exception as e:
+        logger.warning(f"Diagnosis cache lookup failed: {e}")
+    return result
+
+
+def _evict(conn, problem_id: str):
+    """淘汰過期與超出每題上限 (最久未命中) 的快取"""
+    conn.execute(delete(diagnosis_cache_table).where(
+        diagnosis_cache_table.c.problem_id == problem_id,
+        diagnosis_cache_table.c.created_at < datetime.now() - TTL,
+    ))
+    keep = select(diagnosis_cache_table.c.id).where(
+        diagnosis_cache_table.c.problem_id == problem_id
+    ).order_by(
+        func.coalesce(diagnosis_cache_table.c.last_hit_at, diagnosis_cache_table.c.created_at).desc()
+    ).limit(MAX_PER_PROBLEM)
+    conn.execute(delete(diagnosis_cache_table).where(
+        diagnosis_cache_table.c.problem_id == problem_id,
+        diagnosis_cache_table.c.id.notin_(keep.scalar_subquery()),
+    ))
+
+
+def _store(problem_id: str, lookup_result: Dict[str, Any], values: Dict[str, Any], zpd_level: int, scaffold: str):
+    scaffold_patch = {str(zpd_level): scaffold} if scaffold else {}
+    stmt = pg_insert(diagnosis_cache_table).values(
+        problem_id=problem_id,
+        signature=lookup_result["signature"],
+        code_hash=lookup_result.get("code_hash"),
+        error_kind=lookup_result["error_kind"],
+        embedding=lookup_result["embedding"],
+        scaffolds=scaffold_patch,
+        hit_count=0,
+        **values,
+    )
+    # 同一 signature 但原始程式碼不同 (改了變數名稱)：鷹架回覆改為這份程式碼的版本，舊的不再合併
+    same_code = diagnosis_cache_table.c.code_hash == stmt.excluded.code_hash
+    merged = func.coalesce(diagnosis_cache_table.c.scaffolds, func.jsonb_build_object()).op("||")(stmt.excluded.scaffolds)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[diagnosis_cache_table.c.problem_id, diagnosis_cache_table.c.signature],
+        set_={
+            "scaffolds": case((same_code, merged), else_=stmt.excluded.scaffolds),
+            "code_hash": stmt.excluded.code_hash,
+        },
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt)
+        _evict(conn, problem_id)
+
+
+def _touch(entry_id: int, zpd_level: int, scaffold: str, exact: bool):
+    values = {"hit_count": diagnosis_cache_table.c.hit_count + 1, "last_hit_at": func.now()}
+    if exact and scaffold:
+        values["scaffolds"] = func.coalesce(diagnosis_cache_table.c.scaffolds, func.jsonb_build_object()).op("||")(
+            func.jsonb_build_object(str(zpd_level), scaffold)
+        )
+    with engine.begin() as conn:
+        conn.execute(update(diagnosis_cache_table).where(diagnosis_cache_table.c.id == entry_id).values(**values))
+
+
+def record(
+    student_id: str,
+    problem_id: str,
+    lookup_result: Dict[str, Any],
+    evidence_report: Dict[str, Any],
+    search_query: str,
+    retrieved_docs: list,
+    zpd_level: int,
+    scaffold: str,
+    scaffold_reused: bool,
+    report_cost: float,
+    scaffold_cost: float,
+):
+    """
+    流程結束後呼叫：
+    - 未命中：寫入新快取 (含本次 ZPD 等級的鷹架回覆)
+    - 精確命中：累計命中次數，補上本次新生成的鷹架回覆
+    - 語意命中：累計命中次數，並以本次的程式碼特徵另存一筆，之後相同程式碼可精確命中
+      (signature 相同只差識別字時改寫該筆的 code_hash 與鷹架回覆)
+    命中時省下的費用 = 快取的報告費用 (+ 重用鷹架回覆時的鷹架費用)
+    診斷失敗的替代報告 (fallback) 不寫入也不更新快取，只記為未命中，下次提交重新診斷。
+    """
+    if not CACHE_ENABLED:
+        return
+    entry, match = lookup_result.get("entry"), lookup_result.get("match")
+    try:
+        if is_fallback_report(evidence_report):
+            save_cache_event(student_id, "code_correction", hit=False, problem_id=problem_id)
+            return
+        if entry:
+            saved = entry["report_cost"] + (entry["scaffold_cost"] if scaffold_reused else 0.0)
+            _touch(entry["id"], zpd_level, None if scaffold_reused else scaffold, match == "exact")
+            save_cache_event(student_id, "code_correction", hit=True, saved_cost=saved, problem_id=problem_id)
+            if match == "exact":
+                return
+            report_cost, scaffold_cost = entry["report_cost"], scaffold_cost
+        else:
+            save_cache_event(student_id, "code_correction", hit=False, problem_id=problem_id)
+
+        if not evidence_report:
+            return
+        _store(problem_id, lookup_result, {
+            "evidence_report": evidence_report,
+            "search_query": search_query or "",
+            "retrieved_docs": retrieved_docs or [],
+            "report_cost": report_cost,
+            "scaffold_cost": scaffold_cost,
+        }, zpd_level, scaffold)
+    except Exception as e:
+        logger.warning(f"Diagnosis cache store failed: {e}")
+
+
+def invalidate_problems(problem_ids: List[str]) -> int:
+    """題目或測資變更時清除這些題目的所有快取，回傳刪除筆數"""
+    if not problem_ids:
+        return 0
+    with engine.begin() as conn:
+        return conn.execute(
+            delete(diagnosis_cache_table).where(diagnosis_cache_table.c.problem_id.in_(list(problem_ids)))
+        ).rowcount
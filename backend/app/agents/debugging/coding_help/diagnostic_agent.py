@@ -10,16 +10,17 @@ import logging
 from typing import TypedDict, List, Dict, Any, Optional
 from datetime import datetime
 
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
 from pydantic import BaseModel, Field
-from backend.app.agents.debugging.db import save_llm_charge
+from backend.app.agents.debugging.llm_client import get_chat_model
+from backend.app.agents.debugging.prompt_templates import PromptTemplate
+from backend.app.agents.debugging.structured_output import ainvoke_structured, StructuredOutputError
 
 logger = logging.getLogger(__name__)
 
-# 初始化 LLM (增加逾時與重試設定以提升穩定性)
-llm = ChatOpenAI(model="gpt-5.1", temperature=0.3, request_timeout=120, max_retries=3)
-llm2 = ChatOpenAI(model="gpt-4o-mini", temperature=0.3, request_timeout=120, max_retries=3)
+# 初始化 LLM (逾時與重試次數依 usage_type，見 llm_client.USAGE_POLICIES)
+llm = get_chat_model("gpt-5.1", usage_type="code_correction", temperature=0.3)
+llm2 = get_chat_model("gpt-4o-mini", usage_type="code_correction", temperature=0.3)
 
 
 class ErrorReport(BaseModel):
@@ -31,6 +32,39 @@ class ErrorReport(BaseModel):
     error_code: str = Field(description="觸發錯誤的程式碼片段")
 
 
+# 固定指令在前 (system)，題目與學生內容在後，讓 OpenAI prompt caching 命中共同前綴
+ERROR_REPORT_PROMPT = PromptTemplate(
+    name="error_report",
+    usage_type="code_correction",
+    static_blocks=[
+        """
+        你是程式碼分析專家，也是一位專業的 Python 教學助理。
+        請分析學生的錯誤並只輸出 JSON，不要有其他文字。
+        """,
+        """
+        格式規範:
+        {
+            "error_type": "Syntax (語法錯誤) / Logic (邏輯錯誤) / Runtime (執行錯誤)",
+            "location": "行號或區塊",
+            "misconception": "詳細解釋學生誤解的觀念 (繁體中文)",
+            "severity": "High/Medium/Low",
+            "error_code": "觸發錯誤的程式碼片段"
+        }
+        """,
+    ],
+    context="""
+        程式題目: {problem_info}
+    """,
+    dynamic="""
+        學生程式碼:
+        ```python
+        {current_code}
+        ```
+        程式碼錯誤訊息: {error_message}
+    """,
+)
+
+
 class ZPDResult(BaseModel):
     """ZPD 判斷結果"""
     zpd_level: int = Field(description="ZPD 等級: 1 (最具體) ~ 3 (最抽象)")
@@ -55,71 +89,45 @@ async def generate_error_report(
     Returns:
         包含錯誤分析的報告 (dict)
     """
-    prompt = f"""
-    你是一位專業的 Python 教學助理。請分析學生的錯誤並輸出 JSON。
-    
-    程式題目: {json.dumps(problem_info, ensure_ascii=False)}
-    學生程式碼: 
-    ```python
-    {current_code}
-    ```
-    程式碼錯誤訊息: {error_message}
-
-    格式規範:
-    {{
-        "error_type": "Syntax (語法錯誤) / Logic (邏輯錯誤) / Runtime (執行錯誤)",
-        "location": "行號或區塊",
-        "misconception": "詳細解釋學生誤解的觀念 (繁體中文)",
-        "severity": "High/Medium/Low",
-        "error_code": "觸發錯誤的程式碼片段"
-    }}
-    """
+    messages = ERROR_REPORT_PROMPT.messages(
+        problem_info=json.dumps(problem_info, ensure_ascii=False),
+        current_code=current_code,
+        error_message=error_message,
+    )
     
     try:
-        response = await llm.ainvoke([
-            SystemMessage(content="你是程式碼分析專家。請只輸出 JSON，不要有其他文字。"),
-            HumanMessage(content=prompt)
-        ])
-        
-        content = response.content.replace("```json", "").replace("```", "").strip()
-        report = json.loads(content)
-        # 記錄 token 用量
-        if student_id:
-            usage = response.response_metadata.get("token_usage", {})
-            details = usage.get("prompt_tokens_details") or {}
-            save_llm_charge(
-                student_id=student_id,
-                usage_type="code_correction",
-                model_name="gpt-5.1",
-                input_tokens=usage.get("prompt_tokens", 0),
-                cached_input_tokens=details.get("cached_tokens", 0),
-                output_tokens=usage.get("completion_tokens", 0),
-                problem_id=problem_id,
-            )
+        report = (await ainvoke_structured(
+            llm, messages, ErrorReport, usage_type="code_correction",
+            student_id=student_id, problem_id=problem_id,
+        )).model_dump()
         # 確保錯誤程式碼欄位存在
-        if "error_code" not in report:
+        if not report["error_code"]:
             report["error_code"] = current_code
             
         return report
         
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing error: {e}")
-        return {
-            "error_type": "Unknown",
-            "location": "Unknown",
-            "misconception": "解析失敗",
-            "severity": "Medium",
-            "error_code": current_code
-        }
+    except StructuredOutputError as e:
+        logger.error(f"Error report parsing failed: {e}")
+        return fallback_report(current_code, "解析失敗")
     except Exception as e:
         logger.error(f"Error report generation failed: {e}")
-        return {
-            "error_type": "Unknown",
-            "location": "Unknown",
-            "misconception": str(e),
-            "severity": "Medium",
-            "error_code": current_code
-        }
+        return fallback_report(current_code, str(e))
+
+
+def fallback_report(current_code: str, misconception: str) -> Dict[str, Any]:
+    """診斷失敗時的替代報告 (fallback=True，不寫入診斷快取)"""
+    return {
+        "error_type": "Unknown",
+        "location": "Unknown",
+        "misconception": misconception,
+        "severity": "Medium",
+        "error_code": current_code,
+        "fallback": True,
+    }
+
+
+def is_fallback_report(report: Optional[Dict[str, Any]]) -> bool:
+    return bool(report and report.get("fallback"))
 
 
 async def determine_zpd_level(
@@ -173,34 +181,23 @@ async def determine_zpd_level(
     """
     
     try:
-        response = await llm2.ainvoke([
-            SystemMessage(content="你是教育心理學專家。請只輸出 JSON。"),
-            HumanMessage(content=prompt)
-        ])
-        
-        content = response.content.replace("```json", "").replace("```", "").strip()
-        result = json.loads(content)
-        # 記錄 token 用量
-        if student_id:
-            usage = response.response_metadata.get("token_usage", {})
-            details = usage.get("prompt_tokens_details") or {}
-            save_llm_charge(
-                student_id=student_id,
-                usage_type="code_correction",
-                model_name="gpt-4o-mini",
-                input_tokens=usage.get("prompt_tokens", 0),
-                cached_input_tokens=details.get("cached_tokens", 0),
-                output_tokens=usage.get("completion_tokens", 0),
-                problem_id=problem_id,
-            )
+        result = await ainvoke_structured(
+            llm2,
+            [
+                SystemMessage(content="你是教育心理學專家。請只輸出 JSON。"),
+                HumanMessage(content=prompt)
+            ],
+            ZPDResult, usage_type="code_correction",
+            student_id=student_id, problem_id=problem_id,
+        )
         # 確保 zpd_level 在有效範圍
-        zpd_level = result.get("zpd_level", 3)
-        if not isinstance(zpd_level, int) or zpd_level < 1 or zpd_level > 3:
+        zpd_level = result.zpd_level
+        if zpd_level < 1 or zpd_level > 3:
             zpd_level = 3
             
         return {
             "zpd_level": zpd_level,
-            "reasoning": result.get("reasoning", "")
+            "reasoning": result.reasoning
         }
         
     except Exception as e:
@@ -8,24 +8,26 @@ import os
 import json
 import re
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator
 from datetime import datetime
 
 import tiktoken
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from pydantic import BaseModel, Field
 from backend.app.agents.debugging.db import save_llm_charge
+from backend.app.agents.debugging.llm_client import get_chat_model, hedged_ainvoke
+from backend.app.agents.debugging.prompt_templates import PromptTemplate
 
-from .scaffolding_agent import generate_scaffold_response
+from .scaffolding_agent import generate_scaffold_response, stream_llm_text
 
 logger = logging.getLogger(__name__)
 
 # 初始化 LLM
-llm = ChatOpenAI(model="gpt-5.1", temperature=0.3)
-llm2 = ChatOpenAI(model="gpt-4o-mini", temperature=0.3)
+llm = get_chat_model("gpt-5.1", usage_type="code_correction", temperature=0.3)
+llm2 = get_chat_model("gpt-4o-mini", usage_type="code_correction", temperature=0.3)
 # 常數定義
 MAX_TOKEN_LIMIT = 350
+CHAT_HISTORY_WINDOW = 4  # 生成回覆時參考的最近對話則數
 
 def count_tokens(text: str) -> int:
     """計算 Token 數量"""
@@ -55,6 +57,44 @@ def clean_markdown_filter(text: str) -> str:
     return text.strip()
 
 
+class MarkdownStreamFilter:
+    """
+    串流版 clean_markdown_filter：每次 feed 一段 token，回傳可以送出的已清理文字。
+    標記只在同一行內配對，因此已結束的行可直接清理；最後一行若還有未配對的 * 或結尾的 #，
+    則從該處起暫不送出，等後續 token 或 flush。
+    """
+
+    def __init__(self):
+        self._raw = ""
+        self._sent = 0
+
+    @staticmethod
+    def _stable_length(raw: str) -> int:
+        line_start = raw.rfind("\n") + 1
+        line = raw[line_start:]
+        if line.count("*") % 2 == 1 or line.endswith("*"):
+            return line_start + line.index("*")
+        stripped = line.rstrip("#")
+        return line_start + len(stripped)
+
+    def _emit(self, cleaned: str) -> str:
+        if len(cleaned) <= self._sent:
+            return ""
+        delta = cleaned[self._sent:]
+        self._sent = len(cleaned)
+        return delta
+
+    def feed(self, chunk: str) -> str:
+        self._raw += chunk
+        # 結尾空白先保留不送出：後面還有文字時會一併送出，串流結束時則與 clean_markdown_filter 一樣被 strip 掉
+        stable = self._raw[:self._stable_length(self._raw)].rstrip()
+        return self._emit(clean_markdown_filter(stable))
+
+    def flush(self) -> str:
+        """串流結束：送出剩餘文字 (最終內容以 clean_markdown_filter(全文) 為準)"""
+        return self._emit(clean_markdown_filter(self._raw))
+
+
 async def validate_input(
     message: str,
     student_id: str = None,
@@ -153,6 +193,79 @@ async def validate_input(
     #     }
 
 
+CHAT_PROMPT = PromptTemplate(
+    name="help_chat",
+    usage_type="code_correction",
+    static_blocks=[
+        """
+        你是一位程式設計輔導老師，請根據對話紀錄和學生現在提問，提供適當的引導。
+        **注意**：輸出格式需參考 samples
+        """,
+        """
+        【教學策略】依本次 ZPD 等級:
+        - ZPD 等級 1: 引導學生思考修正邏輯，可提供部分範例。
+        - ZPD 等級 2: 給予具體提示。
+        - ZPD 等級 3: 僅給予方向性提示。
+        """,
+        """
+        請遵守：
+        1. 使用繁體中文，**簡單明瞭字數100字內**，條列式回覆，不帶任何情緒。
+        2. 嚴禁使用 Markdown 語法。
+        3. 依照策略強度提供引導，不要直接給出完整正確答案。
+        4. **不可回答與題目無相關問題**
+        """,
+    ],
+    context="""
+        題目資訊：
+        題目: {title}
+        描述: {description}
+    """,
+    dynamic="""
+        學生錯誤程式碼診斷結果：{evidence_report}
+
+        本次教學策略: ZPD 等級 {zpd_level}
+    """,
+)
+
+
+def build_chat_messages(
+    message: str,
+    zpd_level: int,
+    evidence_report: Dict[str, Any],
+    problem_info: Dict[str, str],
+    chat_log: List[Dict[str, Any]],
+) -> list:
+    """
+    組出對話回覆的 prompt (一般與串流回覆共用)
+    固定指令、題目與診斷、對話歷史依序排列，同一段對話的每一輪都能命中前一輪的 prompt 前綴
+    """
+    if zpd_level not in (1, 2, 3):
+        zpd_level = 3
+    context = CHAT_PROMPT.render_user(
+        title=problem_info.get('title', ''),
+        description=problem_info.get('description', ''),
+        evidence_report=json.dumps(evidence_report, ensure_ascii=False),
+        zpd_level=zpd_level,
+    )
+    
+    # 建構對話歷史
+    messages = [SystemMessage(content=CHAT_PROMPT.system), SystemMessage(content=context)]
+    
+    # 從 chat_log 建構對話歷史 (取最近 CHAT_HISTORY_WINDOW 則)
+    recent_chat = chat_log[-CHAT_HISTORY_WINDOW:]
+    for entry in recent_chat:
+        role = entry.get("role", "")
+        content = entry.get("content", "")
+        if role == "user":
+            messages.append(HumanMessage(content=content))
+        elif role == "agent":
+            messages.append(AIMessage(content=content))
+    
+    # 加入當前使用者訊息
+    messages.append(HumanMessage(content=message))
+    return messages
+
+
 async def generate_chat_response(
     message: str,
     zpd_level: int,
@@ -175,50 +288,10 @@ async def generate_chat_response(
     Returns:
         AI 回覆文字
     """
-    # 根據 ZPD 等級決定教學策略
-    strategies = {
-        1: "引導學生思考修正邏輯，可提供部分範例。",
-        2: "給予具體提示。",
-        3: "僅給予方向性提示。"
-    }
-    strategy = strategies.get(zpd_level, strategies.get(3))
-    
-    problem_context = f"題目: {problem_info.get('title', '')}\n描述: {problem_info.get('description', '')}"
-    
-    # 建構對話歷史
-    messages = [
-        SystemMessage(content=f"""
-        你是一位程式設計輔導老師，請根據對話紀錄和學生現在提問，提供適當的引導。
-
-        題目資訊：{problem_context}
-        **注意**：輸出格式需參考 samples
-        學生錯誤程式碼診斷結果：{json.dumps(evidence_report, ensure_ascii=False)}
-        
-        【教學策略 (ZPD 等級 {zpd_level})】: {strategy}
-
-        請遵守：
-        1. 使用繁體中文，**簡單明瞭字數100字內**，條列式回覆，不帶任何情緒。
-        2. 嚴禁使用 Markdown 語法。
-        3. 依照策略強度提供引導，不要直接給出完整正確答案。
-        4. **不可回答與題目無相關問題**
-        """)
-    ]
-    
-    # 從 chat_log 建構對話歷史 (取最近 4 則)
-    recent_chat = chat_log[-4:] if len(chat_log) > 4 else chat_log
-    for entry in recent_chat:
-        role = entry.get("role", "")
-        content = entry.get("content", "")
-        if role == "user":
-            messages.append(HumanMessage(content=content))
-        elif role == "agent":
-            messages.append(AIMessage(content=content))
-    
-    # 加入當前使用者訊息
-    messages.append(HumanMessage(content=message))
+    messages = build_chat_messages(message, zpd_level, evidence_report, problem_info, chat_log)
     
     try:
-        response = await llm.ainvoke(messages)
+        response, model_name = await hedged_ainvoke(llm, messages, usage_type="code_correction")
         # 記錄 token 用量
         if student_id:
             usage = response.response_metadata.get("token_usage", {})
@@ -226,7 +299,7 @@ async def generate_chat_response(
             save_llm_charge(
                 student_id=student_id,
                 usage_type="code_correction",
-                model_name="gpt-5.1",
+                model_name=model_name,
                 input_tokens=usage.get("prompt_tokens", 0),
                 cached_input_tokens=details.get("cached_tokens", 0),
                 output_tokens=usage.get("completion_tokens", 0),
@@ -239,6 +312,48 @@ async def generate_chat_response(
         return "系統暫時無法回應，請稍後再試。"
 
 
+async def stream_chat_response(
+    message: str,
+    zpd_level: int,
+    evidence_report: Dict[str, Any],
+    problem_info: Dict[str, str],
+    chat_log: List[Dict[str, Any]],
+    student_id: str = None,
+    problem_id: str = None,
+) -> AsyncIterator[str]:
+    """
+    generate_chat_response 的串流版本：逐段 yield 原始 token (未過濾 Markdown)，
+    由呼叫端以 MarkdownStreamFilter 處理。
+    """
+    messages = build_chat_messages(message, zpd_level, evidence_report, problem_info, chat_log)
+    async for text in stream_llm_text(
+        llm, messages, "gpt-5.1",
+        student_id=student_id, problem_id=problem_id,
+        fallback="系統暫時無法回應，請稍後再試。",
+    ):
+        yield text
+
+
+def build_chat_entries(message: str, response: str, zpd_level: int, **agent_fields) -> List[Dict[str, Any]]:
+    """產生一問一答兩則待追加的對話紀錄"""
+    timestamp = datetime.now().isoformat()
+    return [
+        {
+            "role": "user",
+            "content": message,
+            "zpd": zpd_level,
+            "timestamp": timestamp
+        },
+        {
+            "role": "agent",
+            "content": response,
+            "zpd": zpd_level,
+            "timestamp": timestamp,
+            **agent_fields
+        }
+    ]
+
+
 async def process_chat(
     message: str,
     zpd_level: int,
@@ -251,8 +366,11 @@ async def process_chat(
     """
     處理聊天請求的主要流程
     
+    Args:
+        chat_log: 最近的對話紀錄 (只需最後 CHAT_HISTORY_WINDOW 則)
+
     Returns:
-        包含 response, is_valid, updated_chat_log 的結果
+        包含 response, is_valid, new_messages (待追加到 chat_log 的訊息) 的結果
     """
     # Step 1: 輸入驗證
     validation = await validate_input(message, student_id=student_id, problem_id=problem_id)
@@ -261,7 +379,7 @@ async def process_chat(
         return {
             "is_valid": False,
             "response": validation["reason"],
-            "updated_chat_log": chat_log  # 不更新對話紀錄
+            "new_messages": []  # 不更新對話紀錄
         }
     
     # Step 2: 生成回覆
@@ -275,24 +393,11 @@ async def process_chat(
         problem_id=problem_id,
     )
     
-    # Step 3: 更新對話紀錄
-    timestamp = datetime.now().isoformat()
-    updated_chat_log = chat_log.copy()
-    updated_chat_log.append({
-        "role": "user",
-        "content": message,
-        "zpd": zpd_level,
-        "timestamp": timestamp
-    })
-    updated_chat_log.append({
-        "role": "agent",
-        "content": response,
-        "zpd": zpd_level,
-        "timestamp": timestamp
-    })
+    # Step 3: 產生待追加的對話紀錄 (由呼叫端以 append_chat_messages 寫入)
+    new_messages = build_chat_entries(message, response, zpd_level)
     
     return {
         "is_valid": True,
         "response": response,
-        "updated_chat_log": updated_chat_log
+        "new_messages": new_messages
     }
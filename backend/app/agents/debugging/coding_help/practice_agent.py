@@ -6,15 +6,120 @@ import os
 import json
 import logging
 from typing import List, Dict, Any
+from pydantic import BaseModel
 
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage
-from backend.app.agents.debugging.db import save_llm_charge
+from backend.app.agents.debugging.llm_client import get_chat_model
+from backend.app.agents.debugging.prompt_templates import PromptTemplate
+from backend.app.agents.debugging.structured_output import ainvoke_structured, StructuredOutputError
 
 logger = logging.getLogger(__name__)
 
-# 初始化 LLM (增加逾時與重試設定以提升穩定性)
-llm = ChatOpenAI(model="gpt-5.1", temperature=0.2, request_timeout=120, max_retries=3)
+# 初始化 LLM (逾時與重試次數依 usage_type，見 llm_client.USAGE_POLICIES)
+llm = get_chat_model("gpt-5.1", usage_type="practice", temperature=0.2)
+
+
+class PracticeCode(BaseModel):
+    content: str
+    language: str
+
+
+class PracticeQuestionContent(BaseModel):
+    text: str
+    code: PracticeCode
+
+
+class PracticeOption(BaseModel):
+    id: int
+    label: str
+    feedback: str
+
+
+class PracticeAnswerConfig(BaseModel):
+    correct_id: int
+    explanation: str
+
+
+class PracticeQuestion(BaseModel):
+    id: str
+    type: str
+    question: PracticeQuestionContent
+    options: List[PracticeOption]
+    answer_config: PracticeAnswerConfig
+
+
+class PracticeQuestionSet(BaseModel):
+    """練習題輸出結構 (structured output 的根節點需為 object)"""
+    questions: List[PracticeQuestion]
+
+
+PRACTICE_PROMPT = PromptTemplate(
+    name="practice",
+    usage_type="practice",
+    static_blocks=[
+        """
+        你是程式教育專家。請分析學生的錯誤歷史，並針對其中「最關鍵的一個錯誤觀念」設計一題觀念辨析題。
+        請只輸出 JSON，不要有其他文字。
+        """,
+        """
+        【出題原則】：
+        1. **單一核心**：只針對一個具體的邏輯誤解。
+        2. **簡潔描述**：題目敘述不超過 60 字，直接切入核心問題，語境自然。
+        3. **純文字選項**：選項內容必須是「自然語言邏輯描述」，禁止在選項中出現程式碼。
+        4. 選項feedback：簡單明瞭，不超過 20 字。
+        5. **排除模糊**：確保正確選項有唯一的邏輯標準，錯誤選項必須是學生常犯的邏輯陷阱。
+        6. **展示程式碼**：題目中可包含一段短小（10行內）的範例程式碼作為背景。
+        """,
+        """
+        格式規範 (JSON):
+        {
+            "questions": [
+                {
+                    "id": "Q1",
+                    "type": "logic",
+                    "question": {
+                        "text": "題目描述",
+                        "code": { "content": "```\n<帶有錯誤的完整程式碼>\n```", "language": "python" }
+                    },
+                    "options": [
+                        { "id": 1, "label": "選項描述...", "feedback": "❌ 錯誤原因..." },
+                        { "id": 2, "label": "選項描述...", "feedback": "✅ 正確！..." },
+                        { "id": 3, "label": "選項描述...", "feedback": "❌ 錯誤原因..." }
+                    ],
+                    "answer_config": { "correct_id": 2, "explanation": "詳解..." }
+                }
+            ]
+        }
+        """,
+    ],
+    context="""
+        題目目標: {problem_info}
+    """,
+    dynamic="""
+        學生錯誤歷史: {misconceptions}
+        {avoid}
+    """,
+)
+
+
+def summarize_misconceptions(reports: List[Dict]) -> List[Dict[str, Any]]:
+    """整理 evidence report 中的錯誤觀念 (出題與題庫分群共用)"""
+    misconceptions = []
+    for i, report in enumerate(reports, 1):
+        if report:
+            misconceptions.append({
+                "index": i,
+                "error_type": report.get("error_type", "Unknown"),
+                "misconception": report.get("misconception", ""),
+                "error_code": report.get("error_code", "")
+            })
+    return misconceptions
+
+
+def _avoid_block(avoid_questions: List[str]) -> str:
+    if not avoid_questions:
+        return ""
+    listed = "\n".join(f"- {text}" for text in avoid_questions)
+    return f"已出過的題目 (請換不同的情境或切入角度，避免重複):\n{listed}"
 
 
 async def generate_practice_questions(
@@ -23,6 +128,8 @@ async def generate_practice_questions(
     current_report: Dict[str, Any] = None,
     student_id: str = None,
     problem_id: str = None,
+    usage_type: str = "practice",
+    avoid_questions: List[str] = None,
 ) -> List[Dict[str, Any]]:
     """
     根據學生的錯誤歷史生成練習選擇題
@@ -31,6 +138,8 @@ async def generate_practice_questions(
         previous_reports: 歷史錯誤報告列表
         problem_info: 題目資訊
         current_report: 當前錯誤報告 (可選)
+        usage_type: 計費用途 (預先生成的草稿為 practice_draft)
+        avoid_questions: 同一錯誤觀念群已出過的題目敘述，生成時避開
         
     Returns:
         練習題列表
@@ -45,79 +154,25 @@ async def generate_practice_questions(
         return []
     
     # 整理錯誤觀念摘要
-    misconceptions = []
-    for i, report in enumerate(all_reports, 1):
-        if report:
-            misconceptions.append({
-                "index": i,
-                "error_type": report.get("error_type", "Unknown"),
-                "misconception": report.get("misconception", ""),
-                "error_code": report.get("error_code", "")
-            })
+    misconceptions = summarize_misconceptions(all_reports)
     
     misconceptions_text = json.dumps(misconceptions, ensure_ascii=False, indent=2)
     
-    prompt = f"""
-    你是程式教育專家。請分析學生的錯誤歷史，並針對其中「最關鍵的一個錯誤觀念」設計一題觀念辨析題。
-
-    題目目標: {json.dumps(problem_info, ensure_ascii=False)}
-    學生錯誤歷史: {misconceptions_text}
-
-    【出題原則】：
-    1. **單一核心**：只針對一個具體的邏輯誤解。
-    2. **簡潔描述**：題目敘述不超過 60 字，直接切入核心問題，語境自然。
-    3. **純文字選項**：選項內容必須是「自然語言邏輯描述」，禁止在選項中出現程式碼。
-    4. 選項feedback：簡單明瞭，不超過 20 字。
-    5. **排除模糊**：確保正確選項有唯一的邏輯標準，錯誤選項必須是學生常犯的邏輯陷阱。
-    6. **展示程式碼**：題目中可包含一段短小（10行內）的範例程式碼作為背景。
-
-    格式規範 (JSON Array):
-    [
-        {{
-            "id": "Q1",
-            "type": "logic", 
-            "question": {{
-                "text": "題目描述",
-                "code": {{ "content": "```\n<帶有錯誤的完整程式碼>\n```", "language": "python" }}
-            }},
-            "options": [
-                {{ "id": 1, "label": "選項描述...", "feedback": "❌ 錯誤原因..." }},
-                {{ "id": 2, "label": "選項描述...", "feedback": "✅ 正確！..." }},
-                {{ "id": 3, "label": "選項描述...", "feedback": "❌ 錯誤原因..." }}
-            ],
-            "answer_config": {{ "correct_id": 2, "explanation": "詳解..." }}
-        }}
-    ]
-    """
+    messages = PRACTICE_PROMPT.messages(
+        problem_info=json.dumps(problem_info, ensure_ascii=False),
+        misconceptions=misconceptions_text,
+        avoid=_avoid_block(avoid_questions),
+    )
     
     try:
-        response = await llm.ainvoke([
-            SystemMessage(content="你是程式教育專家。請只輸出 JSON Array，不要有其他文字。"),
-            HumanMessage(content=prompt)
-        ])
-        
-        content = response.content.replace("```json", "").replace("```", "").strip()
-        practice_q = json.loads(content)
-        # 記錄 token 用量
-        if student_id:
-            usage = response.response_metadata.get("token_usage", {})
-            details = usage.get("prompt_tokens_details") or {}
-            save_llm_charge(
-                student_id=student_id,
-                usage_type="practice",
-                model_name="gpt-5.1",
-                input_tokens=usage.get("prompt_tokens", 0),
-                cached_input_tokens=details.get("cached_tokens", 0),
-                output_tokens=usage.get("completion_tokens", 0),
-                problem_id=problem_id,
-            )
-        if isinstance(practice_q, list):
-            return practice_q
-        else:
-            return [practice_q]
+        result = await ainvoke_structured(
+            llm, messages, PracticeQuestionSet, usage_type=usage_type,
+            student_id=student_id, problem_id=problem_id,
+        )
+        return [q.model_dump() for q in result.questions]
             
-    except json.JSONDecodeError as e:
-        logger.error(f"Practice question JSON parsing error: {e}")
+    except StructuredOutputError as e:
+        logger.error(f"Practice question parsing failed: {e}")
         return []
     except Exception as e:
         logger.error(f"Practice question generation failed: {e}")
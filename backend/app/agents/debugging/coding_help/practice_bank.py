@@ -0,0 +1,343 @@
+"""
+Practice Bank 模組
+功能：同一題、錯誤觀念相近的學生共用練習題 (debugging.practice_bank)
+
+1. 分群：以學生 evidence report 的錯誤觀念摘要 (error_type + misconception，不含學生程式碼) 做 embedding，
+   與同題題庫中最相近的一筆 cosine similarity >= PRACTICE_BANK_SIMILARITY 時歸入同一群 (cluster_id)
+2. 取用：在相近的題目中挑選「該學生尚未拿過」的一組 (practice_bank_serve)，直接回傳，不呼叫 LLM
+3. 未命中：照常生成，並把同群已有的題目敘述交給 LLM 避開，生成後存入題庫；
+   同群題目都發過給這位學生時也會生成新的一組，群內題目因此逐漸多樣
+4. 每題保留筆數有上限，超過時淘汰最久未取用者；題目內容變更時清除 (invalidate_problems)
+5. 預先生成的草稿 (practice_drafts) 以 draft_practice_questions 取得，不記錄發放與命中；
+   草稿採用時才以 confirm_serve 補記，捨棄的草稿不會讓該學生之後拿不到這組題目
+
+環境變數：
+- PRACTICE_BANK=0                   關閉題庫
+- PRACTICE_BANK_SIMILARITY          同群門檻 (預設 0.9)
+- PRACTICE_BANK_MAX_PER_PROBLEM     每題保留筆數上限 (預設 100)
+- PRACTICE_BANK_AVOID_LIMIT         未命中時交給 LLM 避開的同群題目數 (預設 5)
+
+命中率與省下的費用以 save_cache_event 記入 llm_charge (model_name='semantic_cache')。
+"""
+import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, delete, update, insert, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from backend.app.agents.debugging.db import (
+    engine,
+    practice_bank_table,
+    practice_bank_serve_table,
+    llm_charge_table,
+    llm_charge_ledger,
+    llm_charge_scope,
+    save_cache_event,
+)
+from .practice_agent import generate_practice_questions, summarize_misconceptions
+from .scaffolding_agent import embeddings
+
+logger = logging.getLogger(__name__)
+
+BANK_ENABLED = os.getenv("PRACTICE_BANK", "1") != "0"
+SIMILARITY_THRESHOLD = float(os.getenv("PRACTICE_BANK_SIMILARITY", 0.9))
+MAX_PER_PROBLEM = int(os.getenv("PRACTICE_BANK_MAX_PER_PROBLEM", 100))
+AVOID_LIMIT = int(os.getenv("PRACTICE_BANK_AVOID_LIMIT", 5))
+
+bank = practice_bank_table
+serve = practice_bank_serve_table
+
+
+def _embedding_text(misconceptions: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"{m['error_type']}: {m['misconception']}" for m in misconceptions)
+
+
+# ==========================================
+# Lookup
+# ==========================================
+
+def _nearest_unseen(problem_id: str, student_id: str, vector):
+    """同題中與錯誤觀念最相近、且該學生尚未拿過的一組題目 (未達門檻回傳 None)"""
+    distance = bank.c.embedding.cosine_distance(vector)
+    seen = select(serve.c.bank_id).where(serve.c.student_id == student_id)
+    with engine.connect() as conn:
+        row = conn.execute(
+            select(bank.c.id, bank.c.code_question, bank.c.cost, distance.label("distance")).where(
+                bank.c.problem_id == problem_id,
+                bank.c.embedding.isnot(None),
+                bank.c.id.notin_(seen.scalar_subquery()),
+            ).order_by(distance).limit(1)
+        ).fetchone()
+    if row is None or 1 - row.distance < SIMILARITY_THRESHOLD:
+        return None
+    return row
+
+
+def _nearest_cluster(problem_id: str, vector) -> Optional[int]:
+    """同題中最相近的錯誤觀念群 (不論是否發過)，未達門檻回傳 None"""
+    distance = bank.c.embedding.cosine_distance(vector)
+    with engine.connect() as conn:
+        row = conn.execute(
+            select(bank.c.cluster_id, distance.label("distance")).where(
+                bank.c.problem_id == problem_id,
+                bank.c.embedding.isnot(None),
+            ).order_by(distance).limit(1)
+        ).fetchone()
+    if row is None or 1 - row.distance < SIMILARITY_THRESHOLD:
+        return None
+    return row.cluster_id
+
+
+def _cluster_question_texts(problem_id: str, cluster_id: int) -> List[str]:
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(bank.c.code_question).where(
+                bank.c.problem_id == problem_id,
+                bank.c.cluster_id == cluster_id,
+            ).order_by(bank.c.created_at.desc()).limit(AVOID_LIMIT)
+        ).fetchall()
+    return [
+        q["question"]["text"]
+        for row in rows for q in (row.code_question or [])
+        if isinstance(q, dict) and isinstance(q.get("question"), dict) and q["question"].get("text")
+    ]
+
+
+# ==========================================
+# Store
+# ==========================================
+
+def _mark_served(conn, bank_id: int, student_id: str):
+    conn.execute(
+        pg_insert(serve).values(bank_id=bank_id, student_id=student_id)
+        .on_conflict_do_nothing(index_elements=[serve.c.bank_id, serve.c.student_id])
+    )
+    conn.execute(
+        update(bank).where(bank.c.id == bank_id)
+        .values(serve_count=bank.c.serve_count + 1, last_served_at=func.now())
+    )
+
+
+def _serve(bank_id: int, student_id: str):
+    with engine.begin() as conn:
+        _mark_served(conn, bank_id, student_id)
+
+
+def confirm_serve(conn, pending: Dict[str, Any], student_id: str):
+    """草稿採用時補記發放 (需在呼叫端的 transaction 中執行)；題庫中的該筆已被淘汰時略過"""
+    exists = conn.execute(select(bank.c.id).where(bank.c.id == pending["bank_id"])).fetchone()
+    if exists:
+        _mark_served(conn, pending["bank_id"], student_id)
+
+
+def _evict(conn, problem_id: str):
+    """淘汰超出每題上限 (最久未取用) 的題目，發放紀錄由外鍵一併刪除"""
+    keep = select(bank.c.id).where(bank.c.problem_id == problem_id).order_by(
+        func.coalesce(bank.c.last_served_at, bank.c.created_at).desc()
+    ).limit(MAX_PER_PROBLEM)
+    conn.execute(delete(bank).where(
+        bank.c.problem_id == problem_id,
+        bank.c.id.notin_(keep.scalar_subquery()),
+    ))
+
+
+def _store(
+    problem_id: str,
+    student_id: str,
+    cluster_id: Optional[int],
+    vector,
+    misconceptions: List[Dict[str, Any]],
+    questions: List[Dict[str, Any]],
+    cost: float,
+    mark_served: bool = True,
+) -> int:
+    with engine.begin() as conn:
+        bank_id = conn.execute(
+            insert(bank).values(
+                problem_id=problem_id,
+                cluster_id=cluster_id or 0,
+                embedding=vector,
+                misconceptions=misconceptions,
+                code_question=questions,
+                cost=cost,
+                serve_count=0,
+            ).returning(bank.c.id)
+        ).scalar()
+        if cluster_id is None:
+            # 新的錯誤觀念群，以第一筆的 id 作為 cluster_id
+            conn.execute(update(bank).where(bank.c.id == bank_id).values(cluster_id=bank_id))
+        if mark_served:
+            _mark_served(conn, bank_id, student_id)
+        _evict(conn, problem_id)
+    return bank_id
+
+
+# ==========================================
+# 取得練習題
+# ==========================================
+
+async def serve_practice_questions(
+    previous_reports: List[Dict],
+    problem_info: Dict[str, str],
+    current_report: Dict[str, Any] = None,
+    student_id: str = None,
+    problem_id: str = None,
+    usage_type: str = "practice",
+) -> List[Dict[str, Any]]:
+    """
+    與 generate_practice_questions 相同的介面：
+    題庫中有相近且該學生未拿過的題目時直接回傳，否則生成並存入題庫。
+    """
+    questions, _ = await _lookup_or_generate(
+        previous_reports, problem_info, current_report, student_id, problem_id, usage_type, defer_serve=False
+    )
+    return questions
+
+
+async def draft_practice_questions(
+    previous_reports: List[Dict],
+    problem_info: Dict[str, str],
+    student_id: str,
+    problem_id: str,
+    usage_type: str = "practice_draft",
+) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    草稿用：與 serve_practice_questions 相同的取用與生成，但不記錄發放與命中。
+    回傳 (練習題, pending)；pending 為 {"bank_id", "hit", "saved_cost"} 或 None，
+    草稿採用時以 confirm_serve 補記發放，命中則另以 save_cache_event 記錄。
+    """
+    return await _lookup_or_generate(
+        previous_reports, problem_info, None, student_id, problem_id, usage_type, defer_serve=True
+    )
+
+
+async def _lookup_or_generate(
+    previous_reports: List[Dict],
+    problem_info: Dict[str, str],
+    current_report: Optional[Dict[str, Any]],
+    student_id: Optional[str],
+    problem_id: Optional[str],
+    usage_type: str,
+    defer_serve: bool,
+) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    all_reports = list(previous_reports or [])
+    if current_report:
+        all_reports.append(current_report)
+    misconceptions = summarize_misconceptions(all_reports)
+
+    if not (BANK_ENABLED and student_id and problem_id and misconceptions):
+        questions = await generate_practice_questions(
+            previous_reports=previous_reports,
+            problem_info=problem_info,
+            current_report=current_report,
+            student_id=student_id,
+            problem_id=problem_id,
+            usage_type=usage_type,
+        )
+        return questions, None
+
+    vector, cluster_id, avoid = None, None, []
+    try:
+        vector = await asyncio.to_thread(embeddings.embed_query, _embedding_text(misconceptions))
+        entry = await asyncio.to_thread(_nearest_unseen, problem_id, student_id, vector)
+        if entry and entry.code_question:
+            logger.info(f"Practice bank hit on {problem_id} for {student_id} (similarity={round(1 - entry.distance, 4)})")
+            if defer_serve:
+                return entry.code_question, {"bank_id": entry.id, "hit": True, "saved_cost": entry.cost or 0.0}
+            await asyncio.to_thread(_serve, entry.id, student_id)
+            save_cache_event(student_id, usage_type, hit=True, saved_cost=entry.cost or 0.0, problem_id=problem_id)
+            return entry.code_question, None
+
+        cluster_id = await asyncio.to_thread(_nearest_cluster, problem_id, vector)
+        if cluster_id is not None:
+            avoid = await asyncio.to_thread(_cluster_question_texts, problem_id, cluster_id)
+        save_cache_event(student_id, usage_type, hit=False, problem_id=problem_id)
+    except Exception as e:
+        logger.warning(f"Practice bank lookup failed: {e}")
+
+    with llm_charge_scope() as costs:
+        questions = await generate_practice_questions(
+            previous_reports=previous_reports,
+            problem_info=problem_info,
+            current_report=current_report,
+            student_id=student_id,
+            problem_id=problem_id,
+            usage_type=usage_type,
+            avoid_questions=avoid,
+        )
+
+    pending = None
+    if questions and vector is not None:
+        try:
+            bank_id = await asyncio.to_thread(
+                _store, problem_id, student_id, cluster_id, vector,
+                [{k: m[k] for k in ("error_type", "misconception")} for m in misconceptions],
+                questions, sum(costs), not defer_serve,
+            )
+            if defer_serve:
+                pending = {"bank_id": bank_id, "hit": False, "saved_cost": 0.0}
+        except Exception as e:
+            logger.warning(f"Practice bank store failed: {e}")
+    return questions, pending
+
+
+# ==========================================
+# 維護 / 統計
+# ==========================================
+
+def invalidate_problems(problem_ids: List[str]) -> int:
+    """題目內容變更時清除這些題目的題庫，回傳刪除筆數"""
+    if not problem_ids:
+        return 0
+    with engine.begin() as conn:
+        return conn.execute(
+            delete(bank).where(bank.c.problem_id.in_(list(problem_ids)))
+        ).rowcount
+
+
+def bank_report(problem_id: str) -> Dict[str, Any]:
+    """單題題庫的分群概況與命中率 (llm_charge 的 semantic_cache 列，usage_type 為 practice / practice_draft)"""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(bank.c.id, bank.c.cluster_id, bank.c.misconceptions, bank.c.serve_count, bank.c.cost)
+            .where(bank.c.problem_id == problem_id)
+            .order_by(bank.c.id)
+        ).fetchall()
+
+    clusters: Dict[int, Dict[str, Any]] = {}
+    for row in rows:
+        cluster = clusters.setdefault(row.cluster_id, {
+            "cluster_id": row.cluster_id,
+            "misconceptions": row.misconceptions or [],
+            "entries": 0,
+            "serves": 0,
+            "cost": 0.0,
+        })
+        cluster["entries"] += 1
+        cluster["serves"] += row.serve_count or 0
+        cluster["cost"] = round(cluster["cost"] + (row.cost or 0.0), 6)
+
+    llm_charge_ledger.flush()
+    t = llm_charge_table
+    with engine.connect() as conn:
+        hits, misses, saved = conn.execute(
+            select(
+                func.coalesce(func.sum(t.c.cache_hits), 0),
+                func.coalesce(func.sum(t.c.cache_misses), 0),
+                func.coalesce(func.sum(t.c.saved_cost), 0),
+            ).where(
+                t.c.model_name == "semantic_cache",
+                t.c.usage_type.in_(["practice", "practice_draft"]),
+                t.c.problem_id == problem_id,
+            )
+        ).fetchone()
+
+    return {
+        "clusters": sorted(clusters.values(), key=lambda c: c["serves"], reverse=True),
+        "hits": int(hits),
+        "misses": int(misses),
+        "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        "saved_cost": round(float(saved), 6),
+    }
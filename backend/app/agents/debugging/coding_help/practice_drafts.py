@@ -0,0 +1,313 @@
+"""
+Practice Drafts 模組
+功能：學生接近 AC 時預先生成練習題草稿 (debugging.debugging_practice_draft)，AC 時直接搬入 debugging_practice
+
+1. 預先生成：非 AC 提交通過的測資比例 >= SPECULATIVE_PRACTICE_PASS_RATIO，且已有 evidence report 時，
+   以 AnalysisQueue 背景生成 (task_id = {student}_{problem}_practice_draft)，
+   AC 後的練習題任務以 wait_for_prefix 等待進行中的草稿，不會重複生成
+2. 升級：AC 時以相同方式撈取最近的 evidence report，草稿依據的報告相同且未過期才搬入；
+   草稿無論是否採用都會刪除，不採用時走原本的即時生成
+3. 成本控制：同一學生同一題最多生成 SPECULATIVE_PRACTICE_MAX_GENERATIONS 次、
+   每日費用上限、佇列過長時不排入；報告未變動時不重新生成
+
+環境變數：
+- SPECULATIVE_PRACTICE=0                    關閉預先生成
+- SPECULATIVE_PRACTICE_PASS_RATIO           觸發門檻 (預設 0.6)
+- SPECULATIVE_PRACTICE_TTL_HOURS            草稿有效時間 (預設 24 小時)
+- SPECULATIVE_PRACTICE_MAX_GENERATIONS      同一學生同一題的生成次數上限 (預設 3)
+- SPECULATIVE_PRACTICE_DAILY_BUDGET         每日草稿費用上限 USD (預設 5，process 內累計)
+- SPECULATIVE_PRACTICE_MAX_QUEUE            AnalysisQueue 等待中的任務超過此數時不排入 (預設 5)
+
+草稿費用以 usage_type='practice_draft' 記入 llm_charge，採用率見 draft_stats。
+草稿取自題庫 (practice_bank) 時不立即記錄發放與命中，採用時才補記 (bank_serve 欄位)。
+"""
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, delete, desc, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from backend.app.agents.debugging.db import (
+    engine,
+    evidence_report_table,
+    latest_submission_table,
+    practice_table,
+    practice_draft_table,
+    in_current_term,
+    llm_charge_scope,
+    save_cache_event,
+)
+from backend.app.agents.debugging.OJ.queue_manager import analysis_queue
+from .practice_bank import draft_practice_questions, confirm_serve
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_ENABLED = os.getenv("SPECULATIVE_PRACTICE", "1") != "0"
+PASS_RATIO = float(os.getenv("SPECULATIVE_PRACTICE_PASS_RATIO", 0.6))
+TTL = timedelta(hours=float(os.getenv("SPECULATIVE_PRACTICE_TTL_HOURS", 24)))
+MAX_GENERATIONS = int(os.getenv("SPECULATIVE_PRACTICE_MAX_GENERATIONS", 3))
+DAILY_BUDGET = float(os.getenv("SPECULATIVE_PRACTICE_DAILY_BUDGET", 5.0))
+MAX_QUEUE = int(os.getenv("SPECULATIVE_PRACTICE_MAX_QUEUE", 5))
+
+# AC 後生成練習題時使用的報告數量 (與草稿的 evidence_hash 需一致)
+REPORT_LIMIT = 5
+
+
+def draft_task_id(student_id: str, problem_id: str) -> str:
+    return f"{student_id}_{problem_id}_practice_draft"
+
+
+# ==========================================
+# Stats / Budget
+# ==========================================
+
+class DraftStats:
+    """草稿的排入、生成、採用與捨棄次數，以及當日費用 (process 內累計)"""
+
+    FIELDS = ("scheduled", "generated", "unchanged", "capped", "promoted", "stale", "missing", "skipped_budget", "skipped_queue")
+
+    def __init__(self):
+        self._counts = {field: 0 for field in self.FIELDS}
+        self._day = date.today()
+        self._spent = 0.0
+        self._lock = threading.Lock()
+
+    def incr(self, field: str):
+        with self._lock:
+            self._counts[field] += 1
+
+    def _roll(self):
+        if self._day != date.today():
+            self._day = date.today()
+            self._spent = 0.0
+
+    def add_cost(self, cost: float):
+        with self._lock:
+            self._roll()
+            self._spent += cost
+
+    def over_budget(self) -> bool:
+        with self._lock:
+            self._roll()
+            return self._spent >= DAILY_BUDGET
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._roll()
+            counts = dict(self._counts)
+            spent = self._spent
+        decided = counts["promoted"] + counts["stale"] + counts["missing"]
+        return {
+            **counts,
+            "promotion_rate": round(counts["promoted"] / decided, 4) if decided else 0.0,
+            "spent_today": round(spent, 6),
+            "daily_budget": DAILY_BUDGET,
+        }
+
+
+draft_stats = DraftStats()
+
+
+# ==========================================
+# Evidence
+# ==========================================
+
+def load_recent_reports(student_id: str, problem_id: str, limit: int = REPORT_LIMIT) -> List[Dict[str, Any]]:
+    """本學期最近的 evidence report (新到舊)"""
+    stmt = select(evidence_report_table.c.evidence_report).where(
+        evidence_report_table.c.student_id == student_id,
+        evidence_report_table.c.problem_id == problem_id,
+        in_current_term(evidence_report_table.c.submitted_at)
+    ).order_by(desc(evidence_report_table.c.submitted_at)).limit(limit)
+    with engine.connect() as conn:
+        rows = conn.execute(stmt).fetchall()
+    return [row[0] for row in rows if row[0]]
+
+
+def evidence_hash(reports: List[Dict[str, Any]]) -> str:
+    return hashlib.sha256(json.dumps(reports, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _latest_pass_ratio(student_id: str, problem_id: str) -> float:
+    """由 latest_submission 的 passed_cases ("3/5") 計算通過比例，已 AC 或無紀錄時為 0"""
+    stmt = select(latest_submission_table.c.verdict, latest_submission_table.c.passed_cases).where(
+        latest_submission_table.c.student_id == student_id,
+        latest_submission_table.c.problem_id == problem_id,
+    )
+    with engine.connect() as conn:
+        row = conn.execute(stmt).fetchone()
+    if not row or row.verdict == "AC" or not row.passed_cases:
+        return 0.0
+    passed, _, total = row.passed_cases.partition("/")
+    try:
+        return int(passed) / int(total) if int(total) else 0.0
+    except ValueError:
+        return 0.0
+
+
+# ==========================================
+# 預先生成
+# ==========================================
+
+async def maybe_schedule(
+    student_id: str,
+    problem_id: str,
+    problem_info: Dict[str, str],
+    pass_ratio: Optional[float] = None,
+) -> bool:
+    """
+    接近 AC 時排入草稿生成任務 (fire-and-forget)。
+    pass_ratio 未提供時依最新提交計算；回傳是否排入。
+    """
+    if not SPECULATIVE_ENABLED:
+        return False
+    try:
+        if pass_ratio is None:
+            pass_ratio = await asyncio.to_thread(_latest_pass_ratio, student_id, problem_id)
+        if pass_ratio < PASS_RATIO:
+            return False
+        if analysis_queue.queue.qsize() > MAX_QUEUE:
+            draft_stats.incr("skipped_queue")
+            return False
+        if draft_stats.over_budget():
+            draft_stats.incr("skipped_budget")
+            return False
+
+        added = await analysis_queue.add_task(
+            generate_draft, student_id, problem_id, problem_info,
+            task_id=draft_task_id(student_id, problem_id)
+        )
+        if added:
+            draft_stats.incr("scheduled")
+        return added
+    except Exception as e:
+        logger.error(f"[Practice Draft] schedule failed for {student_id}/{problem_id}: {e}")
+        return False
+
+
+def _get_draft(student_id: str, problem_id: str):
+    t = practice_draft_table
+    stmt = select(t.c.evidence_hash, t.c.generations, t.c.created_at).where(
+        t.c.student_id == student_id,
+        t.c.problem_id == problem_id,
+    )
+    with engine.connect() as conn:
+        return conn.execute(stmt).fetchone()
+
+
+def _save_draft(student_id: str, problem_id: str, questions: List[Dict], digest: str, report_count: int, cost: float,
+                bank_serve: Optional[Dict[str, Any]] = None):
+    t = practice_draft_table
+    stmt = pg_insert(t).values(
+        student_id=student_id,
+        problem_id=problem_id,
+        code_question=questions,
+        bank_serve=bank_serve,
+        evidence_hash=digest,
+        report_count=report_count,
+        generations=1,
+        cost=cost,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[t.c.student_id, t.c.problem_id],
+        set_={
+            "code_question": stmt.excluded.code_question,
+            "bank_serve": stmt.excluded.bank_serve,
+            "evidence_hash": stmt.excluded.evidence_hash,
+            "report_count": stmt.excluded.report_count,
+            "generations": t.c.generations + 1,
+            "cost": t.c.cost + stmt.excluded.cost,
+            "created_at": datetime.now(),
+        },
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt)
+
+
+async def generate_draft(student_id: str, problem_id: str, problem_info: Dict[str, str]):
+    """背景任務：依目前的 evidence report 生成草稿；報告未變動或已達生成上限時略過"""
+    reports = await asyncio.to_thread(load_recent_reports, student_id, problem_id)
+    if not reports:
+        return
+    digest = evidence_hash(reports)
+
+    existing = await asyncio.to_thread(_get_draft, student_id, problem_id)
+    if existing:
+        if existing.evidence_hash == digest and existing.created_at >= datetime.now() - TTL:
+            draft_stats.incr("unchanged")
+            return
+        if (existing.generations or 0) >= MAX_GENERATIONS:
+            draft_stats.incr("capped")
+            return
+    if draft_stats.over_budget():
+        draft_stats.incr("skipped_budget")
+        return
+
+    with llm_charge_scope() as costs:
+        questions, bank_serve = await draft_practice_questions(
+            previous_reports=reports,
+            problem_info=problem_info,
+            student_id=student_id,
+            problem_id=problem_id,
+        )
+    cost = sum(costs)
+    draft_stats.add_cost(cost)
+    if not questions:
+        return
+
+    await asyncio.to_thread(_save_draft, student_id, problem_id, questions, digest, len(reports), cost, bank_serve)
+    draft_stats.incr("generated")
+    logger.info(f"[Practice Draft] saved for {student_id}/{problem_id} ({len(reports)} report(s), ${cost:.4f})")
+
+
+# ==========================================
+# 升級
+# ==========================================
+
+def promote(student_id: str, problem_id: str, reports: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+    """
+    AC 時將草稿搬入 debugging_practice 並回傳練習題。
+    草稿依據的報告與 reports 不同、已過期或為空時捨棄並回傳 None。
+    草稿取自題庫時，在同一個 transaction 中補記發放，命中的省下費用於成功後記錄。
+    """
+    t = practice_draft_table
+    with engine.begin() as conn:
+        row = conn.execute(
+            delete(t).where(
+                t.c.student_id == student_id,
+                t.c.problem_id == problem_id,
+            ).returning(t.c.code_question, t.c.bank_serve, t.c.evidence_hash, t.c.created_at)
+        ).fetchone()
+        if row is None:
+            draft_stats.incr("missing")
+            return None
+
+        if (
+            not row.code_question
+            or row.evidence_hash != evidence_hash(reports)
+            or row.created_at < datetime.now() - TTL
+        ):
+            draft_stats.incr("stale")
+            logger.info(f"[Practice Draft] discarded stale draft for {student_id}/{problem_id}")
+            return None
+
+        conn.execute(insert(practice_table).values(
+            student_id=student_id,
+            problem_id=problem_id,
+            code_question=row.code_question,
+            answer_is_correct=False
+        ))
+        if row.bank_serve:
+            confirm_serve(conn, row.bank_serve, student_id)
+    if row.bank_serve and row.bank_serve.get("hit"):
+        save_cache_event(student_id, "practice_draft", hit=True,
+                         saved_cost=row.bank_serve.get("saved_cost") or 0.0, problem_id=problem_id)
+    draft_stats.incr("promoted")
+    logger.info(f"[Practice Draft] promoted for {student_id}/{problem_id}")
+    return row.code_question
@@ -7,9 +7,9 @@ Scaffolding Agent 模組
 import os
 import json
 import logging
-from typing import TypedDict, List, Dict, Any, Literal
+from typing import TypedDict, List, Dict, Any, Literal, AsyncIterator
 
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
 from pydantic import BaseModel, Field
 from sqlalchemy import create_engine, select
@@ -17,6 +17,9 @@ from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy import Column, Integer, Text, JSON
 from pgvector.sqlalchemy import Vector
 from backend.app.agents.debugging.db import save_llm_charge
+from backend.app.agents.debugging.llm_client import get_chat_model, get_embeddings, hedged_ainvoke
+from backend.app.agents.debugging.prompt_templates import PromptTemplate
+from backend.app.agents.debugging.structured_output import ainvoke_structured
 
 logger = logging.getLogger(__name__)
 
@@ -43,10 +46,12 @@ class DocumentChunk(Base):
     embedding = Column(Vector(EMBEDDING_DIM), nullable=False)
 
 
-# 初始化 LLM (增加逾時與重試設定以提升穩定性)
-llm = ChatOpenAI(model="gpt-5.1", temperature=0.3, request_timeout=120, max_retries=3)
-llm2 = ChatOpenAI(model="gpt-4o-mini", temperature=0.3, request_timeout=120, max_retries=3)
-embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+# 初始化 LLM (逾時與重試次數依 usage_type，見 llm_client.USAGE_POLICIES)
+llm = get_chat_model("gpt-5.1", usage_type="code_correction", temperature=0.3)
+llm2 = get_chat_model("gpt-4o-mini", usage_type="code_correction", temperature=0.3)
+embeddings = get_embeddings(EMBEDDING_MODEL)
+
+SCAFFOLD_FALLBACK = "系統無法生成引導，請修改程式碼再試一次。"
 
 
 class RouteQuery(BaseModel):
@@ -121,31 +126,16 @@ async def decide_retrieval(
     """
     
     try:
-        response = await llm2.ainvoke([
-            SystemMessage(content="你是教學資源規劃專家。請只輸出 JSON。"),
-            HumanMessage(content=prompt)
-        ])
-        
-        content = response.content.replace("```json", "").replace("```", "").strip()
-        result = json.loads(content)
-        # 記錄 token 用量
-        if student_id:
-            usage = response.response_metadata.get("token_usage", {})
-            details = usage.get("prompt_tokens_details") or {}
-            save_llm_charge(
-                student_id=student_id,
-                usage_type="code_correction",
-                model_name="gpt-4o-mini",
-                input_tokens=usage.get("prompt_tokens", 0),
-                cached_input_tokens=details.get("cached_tokens", 0),
-                output_tokens=usage.get("completion_tokens", 0),
-                problem_id=problem_id,
-            )
-        return {
-            "datasource": result.get("datasource", "no_retrieval"),
-            "search_query": result.get("search_query", ""),
-            "reasoning": result.get("reasoning", "")
-        }
+        result = await ainvoke_structured(
+            llm2,
+            [
+                SystemMessage(content="你是教學資源規劃專家。請只輸出 JSON。"),
+                HumanMessage(content=prompt)
+            ],
+            RouteQuery, usage_type="code_correction",
+            student_id=student_id, problem_id=problem_id,
+        )
+        return result.model_dump()
         
     except Exception as e:
         logger.error(f"Router decision failed: {e}")
@@ -156,6 +146,105 @@ async def decide_retrieval(
         }
 
 
+SCAFFOLD_PROMPT = PromptTemplate(
+    name="scaffold",
+    usage_type="code_correction",
+    static_blocks=[
+        """
+        你是一位專業且耐心的 Python 老師。請針對學生的錯誤提供引導。
+        **注意**: 輸出格式需參考題目的 samples
+        """,
+        """
+        【教學策略】依本次 ZPD 等級:
+        - ZPD 等級 1: 引導學生思考修正邏輯，可提供部分範例程式碼片段。
+        - ZPD 等級 2: 給予具體提示，指出錯誤方向但不直接給答案。
+        - ZPD 等級 3: 僅給予方向性提示，讓學生自行思考和探索。
+        """,
+        """
+        請遵守：
+        1. 使用繁體中文，**簡單明瞭字數100字內**，條列式回覆，不帶任何情緒。
+        2. 不要給學生參考教材來源資訊(例如：可參考C1 PPT第X頁)。
+        3. 嚴禁使用 Markdown 語法 (不要使用 **, #, ` 等符號)。
+        4. 依照策略強度提供引導，不要直接給出完整正確答案。
+        5. 回覆應該是 2-4 個條列式重點。
+        """,
+    ],
+    context="""
+        程式題目: {problem_info}
+    """,
+    dynamic="""
+        學生程式碼:
+        ```python
+        {current_code}
+        ```
+
+        診斷結果: {misconception}
+        參考教材: {rag_context}
+
+        本次教學策略: ZPD 等級 {zpd_level}
+    """,
+)
+
+
+def build_scaffold_messages(
+    zpd_level: int,
+    evidence_report: Dict[str, Any],
+    problem_info: Dict[str, str],
+    current_code: str,
+    retrieved_docs: List[str] = None,
+) -> list:
+    """組出鷹架回覆的 messages (一般與串流回覆共用)"""
+    if zpd_level not in (1, 2, 3):
+        zpd_level = 3
+    return SCAFFOLD_PROMPT.messages(
+        problem_info=json.dumps(problem_info, ensure_ascii=False),
+        current_code=current_code,
+        misconception=evidence_report.get('misconception', '無'),
+        rag_context="\n".join(retrieved_docs) if retrieved_docs else "無相關教材",
+        zpd_level=zpd_level,
+    )
+
+
+async def stream_llm_text(
+    model: ChatOpenAI,
+    messages: list,
+    model_name: str,
+    student_id: str = None,
+    problem_id: str = None,
+    usage_type: str = "code_correction",
+    fallback: str = None,
+) -> AsyncIterator[str]:
+    """
+    以串流呼叫 LLM，逐段 yield 回覆文字；結束後依 usage_metadata 記錄 token 用量。
+    尚未送出任何文字就失敗時改 yield fallback (若有)，已送出部分文字則直接結束。
+    """
+    aggregate = None
+    sent = False
+    try:
+        async for chunk in model.astream(messages, stream_usage=True):
+            aggregate = chunk if aggregate is None else aggregate + chunk
+            if chunk.content:
+                sent = True
+                yield chunk.content
+    except Exception as e:
+        logger.error(f"LLM streaming failed ({model_name}): {e}")
+        if not sent and fallback:
+            yield fallback
+
+    if student_id and aggregate is not None:
+        usage = aggregate.usage_metadata or {}
+        details = usage.get("input_token_details") or {}
+        save_llm_charge(
+            student_id=student_id,
+            usage_type=usage_type,
+            model_name=model_name,
+            input_tokens=usage.get("input_tokens", 0),
+            cached_input_tokens=details.get("cache_read", 0),
+            output_tokens=usage.get("output_tokens", 0),
+            problem_id=problem_id,
+        )
+
+
 async def generate_scaffold_response(
     zpd_level: int,
     evidence_report: Dict[str, Any],
@@ -178,42 +267,10 @@ async def generate_scaffold_response(
     Returns:
         引導式回覆文字
     """
-    # 根據 ZPD 等級決定教學策略
-    strategies = {
-        1: "引導學生思考修正邏輯，可提供部分範例程式碼片段。",
-        2: "給予具體提示，指出錯誤方向但不直接給答案。",
-        3: "僅給予方向性提示，讓學生自行思考和探索。"
-    }
-    strategy = strategies.get(zpd_level, strategies[3])
-    
-    rag_context = "\n".join(retrieved_docs) if retrieved_docs else "無相關教材"
-    
-    prompt = f"""
-    你是一位專業且耐心的 Python 老師。請針對學生的錯誤提供引導。
-    
-    程式題目: {json.dumps(problem_info, ensure_ascii=False)}
-    **注意**: 輸出格式需參考 samples
-    
-    學生程式碼: 
-    ```python
-    {current_code}
-    ```
-    
-    診斷結果: {evidence_report.get('misconception', '無')}
-    參考教材: {rag_context}
-    
-    【教學策略 (ZPD 等級 {zpd_level})】: {strategy}
-    
-    請遵守：
-    1. 使用繁體中文，**簡單明瞭字數100字內**，條列式回覆，不帶任何情緒。
-    2. 不要給學生參考教材來源資訊(例如：可參考C1 PPT第X頁)。
-    3. 嚴禁使用 Markdown 語法 (不要使用 **, #, ` 等符號)。
-    4. 依照策略強度提供引導，不要直接給出完整正確答案。
-    5. 回覆應該是 2-4 個條列式重點。
-    """
+    messages = build_scaffold_messages(zpd_level, evidence_report, problem_info, current_code, retrieved_docs)
     
     try:
-        response = await llm.ainvoke([HumanMessage(content=prompt)])
+        response, model_name = await hedged_ainvoke(llm, messages, usage_type="code_correction")
         # 記錄 token 用量
         if student_id:
             usage = response.response_metadata.get("token_usage", {})
@@ -221,7 +278,7 @@ async def generate_scaffold_response(
             save_llm_charge(
                 student_id=student_id,
                 usage_type="code_correction",
-                model_name="gpt-5.1",
+                model_name=model_name,
                 input_tokens=usage.get("prompt_tokens", 0),
                 cached_input_tokens=details.get("cached_tokens", 0),
                 output_tokens=usage.get("completion_tokens", 0),
@@ -231,7 +288,26 @@ async def generate_scaffold_response(
         
     except Exception as e:
         logger.error(f"Scaffold generation failed: {e}")
-        return "系統無法生成引導，請修改程式碼再試一次。"
+        return SCAFFOLD_FALLBACK
+
+
+async def stream_scaffold_response(
+    zpd_level: int,
+    evidence_report: Dict[str, Any],
+    problem_info: Dict[str, str],
+    current_code: str,
+    retrieved_docs: List[str] = None,
+    student_id: str = None,
+    problem_id: str = None,
+) -> AsyncIterator[str]:
+    """generate_scaffold_response 的串流版本：逐段 yield 原始 token (未過濾 Markdown)"""
+    messages = build_scaffold_messages(zpd_level, evidence_report, problem_info, current_code, retrieved_docs)
+    async for text in stream_llm_text(
+        llm, messages, "gpt-5.1",
+        student_id=student_id, problem_id=problem_id,
+        fallback=SCAFFOLD_FALLBACK,
+    ):
+        yield text
 
 
 async def run_scaffolding(
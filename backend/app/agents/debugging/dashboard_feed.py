@@ -0,0 +1,155 @@
+"""
+Dashboard Feed: 教師儀表板即時推播
+
+寫入端 (提交 / Pre-coding 作答 / 觀念建構完成) 在 commit 後呼叫 dashboard_feed.publish(event)，
+/dashboard/stream 的每個 SSE 連線訂閱自己題目的事件，前端直接套用差異，不再重複呼叫完整的
+/dashboard/precoding、/dashboard/coding_help。
+
+- 單一 process: 事件直接在 process 內 fan-out 給訂閱者
+- 多 worker: 設定 DASHBOARD_NOTIFY_CHANNEL 後改走 Postgres NOTIFY，
+  每個 worker 由一條 LISTEN 連線收事件後再於本地 fan-out
+"""
+import os
+import json
+import select
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Optional, Set
+
+from sqlalchemy import text
+
+from .db import engine
+
+logger = logging.getLogger(__name__)
+
+# Postgres NOTIFY payload 上限為 8000 bytes，事件只放差異欄位
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+
+class DashboardFeed:
+    """以 problem_id 分組的 in-process pub/sub，可選擇以 Postgres LISTEN/NOTIFY 串接多個 worker"""
+
+    def __init__(self, channel: Optional[str] = None, queue_size: int = 200):
+        self.channel = channel if channel is not None else os.getenv("DASHBOARD_NOTIFY_CHANNEL")
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event = threading.Event()
+        self._listener: Optional[threading.Thread] = None
+
+    # ------------------------------------------
+    # Lifecycle
+    # ------------------------------------------
+
+    async def start(self):
+        """綁定事件迴圈；有設定 channel 時啟動 LISTEN 執行緒 (應用程式啟動時呼叫一次)"""
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        if self.channel:
+            self._stop_event.clear()
+            self._listener = threading.Thread(target=self._listen, name="dashboard-feed-listener", daemon=True)
+            self._listener.start()
+
+    async def stop(self):
+        self._stop_event.set()
+        if self._listener is not None:
+            await asyncio.to_thread(self._listener.join, 5)
+            self._listener = None
+        self._loop = None
+
+    # ------------------------------------------
+    # Subscribe
+    # ------------------------------------------
+
+    def subscribe(self, problem_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[problem_id].add(queue)
+        return queue
+
+    def unsubscribe(self, problem_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(problem_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            self._subscribers.pop(problem_id, None)
+
+    # ------------------------------------------
+    # Publish
+    # ------------------------------------------
+
+    def publish(self, event: Dict[str, Any]):
+        """
+        發布事件 (可在任意執行緒呼叫，須在寫入 commit 後呼叫)。
+        event 需包含 "type" 與 "problem_id"。推播失敗不影響寫入流程。
+        """
+        if self._loop is None:
+            return
+        try:
+            if self.channel:
+                payload = json.dumps(event, ensure_ascii=False, default=str)
+                if len(payload.encode("utf-8")) <= NOTIFY_PAYLOAD_LIMIT:
+                    with engine.begin() as conn:
+                        conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                     {"channel": self.channel, "payload": payload})
+                    return
+                logger.warning(f"Dashboard event too large for NOTIFY, delivering locally: {event.get('type')}")
+            self._dispatch(event)
+        except Exception as e:
+            logger.error(f"Dashboard feed publish error: {e}")
+
+    def _dispatch(self, event: Dict[str, Any]):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._fan_out, event)
+
+    def _fan_out(self, event: Dict[str, Any]):
+        for queue in list(self._subscribers.get(event.get("problem_id"), ())):
+            if queue.full():
+                # 連線過慢：丟棄最舊的事件，避免拖累其他訂閱者
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    # ------------------------------------------
+    # LISTEN Backplane
+    # ------------------------------------------
+
+    def _listen(self):
+        """背景執行緒：LISTEN channel，將收到的 NOTIFY 轉交本地訂閱者 (斷線自動重連)"""
+        while not self._stop_event.is_set():
+            raw = None
+            try:
+                raw = engine.raw_connection()
+                raw.detach()  # 長期佔用的連線不佔連線池名額
+                dbapi_conn = raw.dbapi_connection
+                dbapi_conn.autocommit = True
+                with dbapi_conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+                logger.info(f"Dashboard feed listening on channel '{self.channel}'.")
+
+                while not self._stop_event.is_set():
+                    if select.select([dbapi_conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    dbapi_conn.poll()
+                    while dbapi_conn.notifies:
+                        notify = dbapi_conn.notifies.pop(0)
+                        try:
+                            self._dispatch(json.loads(notify.payload))
+                        except ValueError:
+                            logger.warning(f"Ignoring malformed dashboard event: {notify.payload[:200]}")
+            except Exception as e:
+                logger.error(f"Dashboard feed listener error: {e}")
+                self._stop_event.wait(5)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+
+
+dashboard_feed = DashboardFeed()
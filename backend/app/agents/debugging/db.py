@@ -1,16 +1,29 @@
 import os
 import json
 import atexit
+import asyncio
+import difflib
+import hashlib
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
 from sqlalchemy import (
-    create_engine, MetaData, Table, Column, String, Integer, Float, DateTime, Boolean,
-    select, insert, update, and_, func, desc
+    create_engine, MetaData, Table, Column, String, Integer, BigInteger, Float, DateTime, Boolean, Text,
+    select, insert, update, and_, func, desc, text, true, tuple_
 )
-from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.exc import OperationalError
+from cachetools import LRUCache
+from pgvector.sqlalchemy import Vector
 from dotenv import load_dotenv
 from sshtunnel import SSHTunnelForwarder
 
-from .OJ.models import ProblemConfig, TestCase, CaseResult, CaseStatus
+from .OJ.models import ProblemConfig, CaseResult, CaseStatus
+from .OJ.case_store import CaseStore, CaseSet, LazyTestCase
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -78,7 +91,6 @@ problem_table = Table(
     "problem",
     metadata,
     Column("problem_id", String, primary_key=True),
-    Column("test_cases", JSONB),
     Column("time_limit", Integer),
     Column("judge_type", String),
     Column("entry_point", String),
@@ -97,10 +109,247 @@ submission_table = Table(
     Column("code", JSONB),
     Column("output", JSONB),
     Column("submitted_at", DateTime, server_default=func.now()),
+    Column("id", BigInteger),  # 由 sequence 預設值產生，作為同一時間提交的排序依據 (x9y0z1a2b3c4)
+    schema="debugging",
+    extend_existing=True,
+)
+
+# 內容定址儲存 (Content-Addressed Blob Store)
+# 提交的程式碼與每筆測資的 input / expected / actual 以 sha256 去重後存放於此，
+# submission.code 存 {"hash": ...}，output.details 每筆存 input_hash / expected_hash / actual_hash
+content_blob_table = Table(
+    "content_blob",
+    metadata,
+    Column("hash", String(64), primary_key=True),  # sha256(content) hex
+    Column("content", Text, nullable=False),        # JSON 文字 (保留原始型別)
+    Column("size", Integer),
+    Column("created_at", DateTime, server_default=func.now()),
+    schema="debugging",
+    extend_existing=True,
+)
+
+BLOB_FIELDS = ("input", "expected", "actual")
+
+
+def blob_ref(value, pending: dict) -> str:
+    """計算 value 的內容雜湊並放入 pending (hash -> JSON 文字)，None 不建立 blob"""
+    if value is None:
+        return None
+    content = json.dumps(value, ensure_ascii=False, sort_keys=True)
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    pending[digest] = content
+    return digest
+
+
+def put_blobs(conn, pending: dict):
+    """寫入尚不存在的 blob (需在呼叫端的 transaction 中執行)"""
+    if not pending:
+        return
+    stmt = pg_insert(content_blob_table).values([
+        {"hash": digest, "content": content, "size": len(content)}
+        for digest, content in pending.items()
+    ]).on_conflict_do_nothing(index_elements=[content_blob_table.c.hash])
+    conn.execute(stmt)
+
+
+def load_blobs(conn, hashes) -> dict:
+    """批次讀取 blob，回傳 hash -> 原始值"""
+    hashes = {h for h in hashes if h}
+    if not hashes:
+        return {}
+    rows = conn.execute(
+        select(content_blob_table.c.hash, content_blob_table.c.content)
+        .where(content_blob_table.c.hash.in_(hashes))
+    ).fetchall()
+    return {row.hash: json.loads(row.content) for row in rows}
+
+
+def collect_blob_hashes(code, output) -> set:
+    """列出一筆提交 (code / output) 引用的所有 blob hash"""
+    hashes = set()
+    if isinstance(code, dict) and code.get("hash"):
+        hashes.add(code["hash"])
+    details = output.get("details") if isinstance(output, dict) else None
+    for detail in details or []:
+        if isinstance(detail, dict):
+            hashes.update(detail.get(f"{field}_hash") for field in BLOB_FIELDS)
+    hashes.discard(None)
+    return hashes
+
+
+def hydrate_submission(code, output, blobs: dict):
+    """
+    將 hash 引用還原為舊格式：code -> {"content": ...}，details 補回 input / expected / actual。
+    舊資料 (未轉換) 原樣回傳。
+    """
+    if isinstance(code, dict) and "hash" in code:
+        code = {"content": blobs.get(code["hash"], "")}
+    if isinstance(output, dict) and isinstance(output.get("details"), list):
+        details = []
+        for detail in output["details"]:
+            if isinstance(detail, dict) and any(f"{field}_hash" in detail for field in BLOB_FIELDS):
+                detail = dict(detail)
+                for field in BLOB_FIELDS:
+                    detail[field] = blobs.get(detail.pop(f"{field}_hash", None))
+            details.append(detail)
+        output = {**output, "details": details}
+    return code, output
+
+
+def load_submission_content(conn, code, output):
+    """讀取並還原單筆提交的 code / output"""
+    return hydrate_submission(code, output, load_blobs(conn, collect_blob_hashes(code, output)))
+
+
+# 題目測資 (取代 problem.test_cases JSONB)
+# 每筆測資一列，input / output 內容存於 content_blob；公開的題目查詢不會讀取此表
+problem_test_case_table = Table(
+    "problem_test_case",
+    metadata,
+    Column("problem_id", String, primary_key=True),
+    Column("case_no", Integer, primary_key=True),  # 1 起算，與判題結果的 case_id 相同
+    Column("input_hash", String(64)),
+    Column("output_hash", String(64)),
+    Column("input_size", Integer),
+    Column("output_size", Integer),
+    schema="debugging",
+    extend_existing=True,
+)
+
+
+def _fetch_blob_texts(hashes) -> dict:
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(content_blob_table.c.hash, content_blob_table.c.content)
+            .where(content_blob_table.c.hash.in_(hashes))
+        ).fetchall()
+    return {row.hash: row.content for row in rows}
+
+
+case_store = CaseStore(_fetch_blob_texts)
+
+
+def _test_case_row(problem_id: str, case_no: int, test_case: dict, pending: dict) -> dict:
+    input_hash = blob_ref(test_case.get("input"), pending)
+    output_hash = blob_ref(test_case.get("output"), pending)
+    return {
+        "problem_id": problem_id,
+        "case_no": case_no,
+        "input_hash": input_hash,
+        "output_hash": output_hash,
+        "input_size": len(pending[input_hash]) if input_hash else 0,
+        "output_size": len(pending[output_hash]) if output_hash else 0,
+    }
+
+
+def save_problem_test_cases(conn, problem_id: str, test_cases: list):
+    """以 test_cases ([{"input", "output"}]) 取代題目的全部測資 (需在呼叫端的 transaction 中執行)"""
+    blobs = {}
+    rows = [_test_case_row(problem_id, i, tc, blobs) for i, tc in enumerate(test_cases, start=1)]
+    put_blobs(conn, blobs)
+    conn.execute(problem_test_case_table.delete().where(problem_test_case_table.c.problem_id == problem_id))
+    if rows:
+        conn.execute(insert(problem_test_case_table), rows)
+
+
+def put_problem_test_case(conn, problem_id: str, case_no: int, test_case: dict):
+    """新增或取代單筆測資 (需在呼叫端的 transaction 中執行)"""
+    blobs = {}
+    row = _test_case_row(problem_id, case_no, test_case, blobs)
+    put_blobs(conn, blobs)
+    stmt = pg_insert(problem_test_case_table).values(**row)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[problem_test_case_table.c.problem_id, problem_test_case_table.c.case_no],
+        set_={key: stmt.excluded[key] for key in row if key not in ("problem_id", "case_no")},
+    ))
+
+
+def get_problem_test_case_refs(conn, problem_id: str) -> list:
+    """只讀取測資的 hash 與大小 (依 case_no 排序)"""
+    return conn.execute(
+        select(problem_test_case_table)
+        .where(problem_test_case_table.c.problem_id == problem_id)
+        .order_by(problem_test_case_table.c.case_no)
+    ).fetchall()
+
+
+def load_problem_test_cases(conn, problem_id: str) -> list:
+    """讀取完整測資內容 [{"input", "output"}] (教師編輯 / 匯出用，判題請用 load_problem_config)"""
+    refs = get_problem_test_case_refs(conn, problem_id)
+    blobs = load_blobs(conn, {h for r in refs for h in (r.input_hash, r.output_hash)})
+    return [{"input": blobs.get(r.input_hash), "output": blobs.get(r.output_hash)} for r in refs]
+
+
+# 每位學生每題的最新提交 (於 save_submission 同一 transaction 中更新)
+# verdict 為標準化結果 (CaseStatus: AC / WA / TLE / RE)，供教師儀表板直接讀取
+latest_submission_table = Table(
+    "debugging_latest_submission",
+    metadata,
+    Column("student_id", String, primary_key=True),
+    Column("problem_id", String, primary_key=True),
+    Column("verdict", String),          # 標準化 verdict
+    Column("raw_verdict", String),      # compute_verdict 原始字串
+    Column("passed_cases", String),
+    Column("submission_count", Integer, default=1),
+    Column("submitted_at", DateTime, server_default=func.now()),
     schema="debugging",
     extend_existing=True,
 )
 
+
+def normalize_verdict(verdict: str) -> str:
+    """將 compute_verdict 的字串標準化為 CaseStatus (無法辨識時回傳原字串)"""
+    if "Accepted" in verdict or "AC" in verdict:
+        return CaseStatus.AC.value
+    if "Wrong" in verdict:
+        return CaseStatus.WA.value
+    if "Time" in verdict:
+        return CaseStatus.TLE.value
+    if "Runtime" in verdict or "Error" in verdict:
+        return CaseStatus.RE.value
+    return verdict
+
+
+# 學期分區 (Term Partitioning)
+# debugging_code_submission / debugging_dialogue 依學期 RANGE 分區 (上學期 8/1 起、下學期 2/1 起)，
+# 熱門查詢預設加上 submitted_at >= 本學期開始，讓 Postgres 只掃描本學期分區。
+# num (第幾次提交) 以所有學期累計，計算 num 與依 num 取提交的查詢不套用 in_current_term，
+# 關閉裁剪時 num 的意義不變；報告與對話依 num 查詢時仍可裁剪 (新的 num 只會出現在本學期)。
+# - DEBUGGING_TERM_START: 指定本學期開始日 (ISO 格式)，例如學期中途調整或測試
+# - DEBUGGING_TERM_PRUNING=0: 關閉裁剪，查詢涵蓋所有學期
+TERM_START_MONTHS = (2, 8)
+
+
+def term_start_of(moment: datetime) -> datetime:
+    """moment 所屬學期的開始時間"""
+    if moment.month >= TERM_START_MONTHS[1]:
+        return datetime(moment.year, TERM_START_MONTHS[1], 1)
+    if moment.month >= TERM_START_MONTHS[0]:
+        return datetime(moment.year, TERM_START_MONTHS[0], 1)
+    return datetime(moment.year - 1, TERM_START_MONTHS[1], 1)
+
+
+def next_term_start(term_start: datetime) -> datetime:
+    if term_start.month >= TERM_START_MONTHS[1]:
+        return datetime(term_start.year + 1, TERM_START_MONTHS[0], 1)
+    return datetime(term_start.year, TERM_START_MONTHS[1], 1)
+
+
+def current_term_start():
+    """本學期開始時間；關閉裁剪時回傳 None"""
+    if os.getenv("DEBUGGING_TERM_PRUNING", "1") == "0":
+        return None
+    override = os.getenv("DEBUGGING_TERM_START")
+    if override:
+        return datetime.fromisoformat(override)
+    return term_start_of(datetime.now())
+
+
+def in_current_term(column):
+    """查詢條件：column 落在本學期 (關閉裁剪時恆為真)"""
+    term_start = current_term_start()
+    return true() if term_start is None else column >= term_start
+
 # ==========================================
 # 2. Pre-Coding Tables (觀念建構)
 # ==========================================
@@ -140,6 +389,100 @@ precoding_student_answers_table = Table(
     extend_existing=True,
 )
 
+# ==========================================
+# 2.1 Pre-Coding Dashboard Aggregates (儀表板增量統計)
+# ==========================================
+
+# 每位學生每題的作答摘要 (首答 / 最新作答)，於 process_precoding_submission 寫入時更新
+precoding_question_summary_table = Table(
+    "precoding_question_summary",
+    metadata,
+    Column("student_id", String, primary_key=True),
+    Column("problem_id", String, primary_key=True),
+    Column("stage", String, primary_key=True),       # logic / explain_code / error_code
+    Column("q_id", String, primary_key=True),
+    Column("first_option_id", Integer),
+    Column("first_is_correct", Boolean),
+    Column("latest_option_id", Integer),
+    Column("latest_is_correct", Boolean),
+    Column("attempts", Integer, default=1),
+    Column("updated_at", DateTime, server_default=func.now(), onupdate=func.now()),
+    schema="debugging",
+    extend_existing=True,
+)
+
+# 每題首答選項分佈計數器
+precoding_option_stats_table = Table(
+    "precoding_option_stats",
+    metadata,
+    Column("problem_id", String, primary_key=True),
+    Column("stage", String, primary_key=True),
+    Column("q_id", String, primary_key=True),
+    Column("option_id", Integer, primary_key=True),
+    Column("count", Integer, default=0),
+    schema="debugging",
+    extend_existing=True,
+)
+
+
+def record_precoding_attempt(conn, student_id: str, problem_id: str, stage: str,
+                             question_id: str, selected_option_id: int, is_correct: bool):
+    """
+    增量更新 Pre-coding 儀表板統計 (需在呼叫端的 transaction 中執行)。
+    首次作答時同時累加該選項的首答計數。
+    回傳 {"attempts", "previous_latest_is_correct"}，供儀表板推播計算差異。
+    """
+    summary = precoding_question_summary_table
+    previous_latest_is_correct = conn.execute(
+        select(summary.c.latest_is_correct).where(
+            and_(
+                summary.c.student_id == student_id,
+                summary.c.problem_id == problem_id,
+                summary.c.stage == stage,
+                summary.c.q_id == question_id,
+            )
+        ).with_for_update()
+    ).scalar()
+
+    stmt = pg_insert(summary).values(
+        student_id=student_id,
+        problem_id=problem_id,
+        stage=stage,
+        q_id=question_id,
+        first_option_id=selected_option_id,
+        first_is_correct=is_correct,
+        latest_option_id=selected_option_id,
+        latest_is_correct=is_correct,
+        attempts=1,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[summary.c.student_id, summary.c.problem_id, summary.c.stage, summary.c.q_id],
+        set_={
+            "latest_option_id": stmt.excluded.latest_option_id,
+            "latest_is_correct": stmt.excluded.latest_is_correct,
+            "attempts": summary.c.attempts + 1,
+            "updated_at": func.now(),
+        },
+    ).returning(summary.c.attempts)
+    attempts = conn.execute(stmt).scalar()
+
+    if attempts == 1:
+        stats = precoding_option_stats_table
+        stats_stmt = pg_insert(stats).values(
+            problem_id=problem_id,
+            stage=stage,
+            q_id=question_id,
+            option_id=selected_option_id,
+            count=1,
+        )
+        stats_stmt = stats_stmt.on_conflict_do_update(
+            index_elements=[stats.c.problem_id, stats.c.stage, stats.c.q_id, stats.c.option_id],
+            set_={"count": stats.c.count + 1},
+        )
+        conn.execute(stats_stmt)
+
+    return {"attempts": attempts, "previous_latest_is_correct": previous_latest_is_correct}
+
 # ==========================================
 # 2.5 Pre-Coding Logic Chatbot Tables (觀念建構 - 對話式)
 # ==========================================
@@ -167,7 +510,8 @@ precoding_logic_logs_table = Table(
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("student_id", String(50), nullable=False),
     Column("problem_id", String(50), nullable=False),
-    Column("chat_log", JSONB, default=[]),  # [{"role":..., "content":..., "stage":..., "score":..., "timestamp":...}]
+    Column("chat_log", JSONB, default=[]),  # [{"role":..., "content":..., "stage":..., "score":..., "timestamp":..., "seq":...}]
+    Column("message_seq", Integer, default=0),  # 已寫入的訊息數 (最後一則訊息的 seq)
     Column("updated_at", DateTime, server_default=func.now(), onupdate=func.now()),
     schema="debugging",
     extend_existing=True,
@@ -185,12 +529,14 @@ dialogue_table = Table(
     Column("student_id", String, nullable=False),
     Column("problem_id", String, nullable=False),
     Column("num", Integer),            # 標記是第幾次 submit 的對話
-    Column("chat_log", JSONB, default=[]),  # 新欄位：儲存完整對話紀錄 [{"role": "user/agent", "content": "...", "zpd": 1, "timestamp": ...}]
+    Column("chat_log", JSONB, default=[]),  # 新欄位：儲存完整對話紀錄 [{"role": "user/agent", "content": "...", "zpd": 1, "timestamp": ..., "seq": 1}]
+    Column("message_seq", Integer, default=0),  # 已寫入的訊息數 (最後一則訊息的 seq)
     # 以下欄位將不再使用，保留以相容舊資料
     Column("student_question", JSONB), 
     Column("agent_reply", JSONB),      
     Column("zpd_level", Integer),      
     Column("submitted_at", DateTime, server_default=func.now()),
+    Column("updated_at", DateTime, server_default=func.now(), onupdate=func.now()),  # 最後追加訊息的時間 (analytics_export 的 watermark)
     schema="debugging",
     extend_existing=True,
 )
@@ -226,6 +572,124 @@ practice_table = Table(
     extend_existing=True,
 )
 
+# 4. 診斷快取表 (同題相同錯誤的報告 / 檢索 / 鷹架回覆重用，見 coding_help/diagnosis_cache.py)
+DIAGNOSIS_EMBEDDING_DIM = 1536
+diagnosis_cache_table = Table(
+    "diagnosis_cache",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("problem_id", String, nullable=False),
+    Column("signature", String(64), nullable=False),   # sha256(正規化 AST + 錯誤特徵)
+    Column("code_hash", String(64)),                   # sha256(原始程式碼)，相同時才重用鷹架回覆
+    Column("error_kind", String(100)),                 # 例外類別 / WA / TLE，語意比對時必須相同
+    Column("embedding", Vector(DIAGNOSIS_EMBEDDING_DIM)),
+    Column("evidence_report", JSONB),
+    Column("search_query", Text),
+    Column("retrieved_docs", JSONB),
+    Column("scaffolds", JSONB),                        # {"<zpd_level>": 鷹架回覆}
+    Column("report_cost", Float, default=0.0),         # 產生報告與路由決策的 LLM 費用
+    Column("scaffold_cost", Float, default=0.0),       # 產生一則鷹架回覆的 LLM 費用
+    Column("hit_count", Integer, default=0),
+    Column("created_at", DateTime, server_default=func.now()),
+    Column("last_hit_at", DateTime),
+    schema="debugging",
+    extend_existing=True,
+)
+
+# 5. 練習題草稿表 (接近 AC 時預先生成，AC 時搬入 debugging_practice，見 coding_help/practice_drafts.py)
+practice_draft_table = Table(
+    "debugging_practice_draft",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("student_id", String, nullable=False),
+    Column("problem_id", String, nullable=False),
+    Column("code_question", JSONB),
+    Column("bank_serve", JSONB),             # 取自題庫時待補記的發放 {"bank_id", "hit", "saved_cost"}，採用時才記錄
+    Column("evidence_hash", String(64)),     # 生成時依據的 evidence report 的 sha256
+    Column("report_count", Integer),
+    Column("generations", Integer, default=1),  # 同一學生同一題已生成的草稿次數
+    Column("cost", Float, default=0.0),      # 生成草稿的 LLM 費用
+    Column("created_at", DateTime, server_default=func.now()),
+    schema="debugging",
+    extend_existing=True,
+)
+
+# 6. 練習題題庫 (同題、錯誤觀念相近的學生共用練習題，見 coding_help/practice_bank.py)
+practice_bank_table = Table(
+    "practice_bank",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("problem_id", String, nullable=False),
+    Column("cluster_id", Integer, nullable=False),     # 錯誤觀念群 (群內第一筆的 id)
+    Column("embedding", Vector(DIAGNOSIS_EMBEDDING_DIM)),  # 錯誤觀念摘要的 embedding
+    Column("misconceptions", JSONB),                   # 生成時依據的錯誤觀念摘要
+    Column("code_question", JSONB),
+    Column("cost", Float, default=0.0),                # 生成這組題目的 LLM 費用
+    Column("serve_count", Integer, default=0),
+    Column("created_at", DateTime, server_default=func.now()),
+    Column("last_served_at", DateTime),
+    schema="debugging",
+    extend_existing=True,
+)
+
+# 題庫題目已發給哪些學生 (同一學生不重複拿到同一組題目)
+practice_bank_serve_table = Table(
+    "practice_bank_serve",
+    metadata,
+    Column("bank_id", Integer, primary_key=True),
+    Column("student_id", String, primary_key=True),
+    Column("served_at", DateTime, server_default=func.now()),
+    schema="debugging",
+    extend_existing=True,
+)
+
+# ==========================================
+# 3.1 Chat Log Append (debugging_dialogue / precoding_logic_logs 共用)
+# ==========================================
+# chat_log 只以 jsonb || 在資料庫端追加，不再讀出整份陣列後整份寫回；
+# 每則訊息帶有該對話內遞增的 seq，並以 message_seq 欄位記錄目前的最大值。
+
+def number_chat_messages(messages: list, start: int = 0) -> list:
+    """為新對話的初始訊息加上 seq (從 start + 1 開始)"""
+    return [{**msg, "seq": start + i + 1} for i, msg in enumerate(messages)]
+
+
+def append_chat_messages(conn, table: Table, row_id: int, messages: list) -> int:
+    """
+    將 messages 追加到 table.chat_log 尾端 (需在呼叫端的 transaction 中執行)。
+    同一列的並發追加由 UPDATE 的列鎖序列化，不會互相覆蓋。
+    回傳追加後的 message_seq。
+    """
+    touch_updated_at = ", updated_at = NOW()" if "updated_at" in table.c else ""
+    stmt = text(f"""
+        UPDATE {table.schema}.{table.name} AS t
+        SET chat_log = COALESCE(t.chat_log, '[]'::jsonb) || (
+                SELECT COALESCE(jsonb_agg(
+                    m.elem || jsonb_build_object(
+                        'seq', COALESCE(t.message_seq, jsonb_array_length(COALESCE(t.chat_log, '[]'::jsonb))) + m.ord
+                    ) ORDER BY m.ord
+                ), '[]'::jsonb)
+                FROM jsonb_array_elements(CAST(:messages AS jsonb)) WITH ORDINALITY AS m(elem, ord)
+            ),
+            message_seq = COALESCE(t.message_seq, jsonb_array_length(COALESCE(t.chat_log, '[]'::jsonb)))
+                          + jsonb_array_length(CAST(:messages AS jsonb)){touch_updated_at}
+        WHERE t.id = :row_id
+        RETURNING t.message_seq
+    """)
+    return conn.execute(stmt, {"row_id": row_id, "messages": json.dumps(messages, ensure_ascii=False)}).scalar()
+
+
+def get_recent_chat_messages(conn, table: Table, row_id: int, k: int) -> list:
+    """只取出 chat_log 的最後 k 則訊息 (在資料庫端切片)"""
+    stmt = text(f"""
+        SELECT COALESCE(jsonb_agg(e.elem ORDER BY e.ord), '[]'::jsonb)
+        FROM {table.schema}.{table.name} AS t
+        CROSS JOIN LATERAL jsonb_array_elements(COALESCE(t.chat_log, '[]'::jsonb)) WITH ORDINALITY AS e(elem, ord)
+        WHERE t.id = :row_id
+          AND e.ord > jsonb_array_length(COALESCE(t.chat_log, '[]'::jsonb)) - :k
+    """)
+    return conn.execute(stmt, {"row_id": row_id, "k": k}).scalar() or []
+
 # ==========================================
 # 4. LLM Charge Tables (Token 費用追蹤)
 # ==========================================
@@ -234,6 +698,8 @@ practice_table = Table(
 LLM_PRICING = {
     "gpt-5.1":      {"input": 1.25,  "cached_input": 0.125, "output": 10.00},
     "gpt-4o-mini":  {"input": 0.40,  "cached_input": 0.10,  "output": 1.60},
+    # OpenAI Batch API (半價，整章批次生成題目時使用)
+    "gpt-5.1-batch": {"input": 0.625, "cached_input": 0.0625, "output": 5.00},
     # Fallback for unknown models
     "default":      {"input": 1.25,  "cached_input": 0.125, "output": 10.00},
 }
@@ -254,12 +720,173 @@ llm_charge_table = Table(
     Column("cached_input_cost", Float, default=0.0),
     Column("output_cost", Float, default=0.0),
     Column("total_cost", Float, default=0.0),
+    Column("cache_hits", Integer, default=0),     # model_name='semantic_cache' 的列才有值
+    Column("cache_misses", Integer, default=0),
+    Column("saved_cost", Float, default=0.0),     # 快取命中省下的 LLM 費用
+    Column("parse_attempts", Integer, default=0),  # structured output 解析次數
+    Column("parse_failures", Integer, default=0),  # 首次解析失敗 (需容錯或修復)
+    Column("parse_repairs", Integer, default=0),   # 修復呼叫後解析成功
     Column("created_at", DateTime, server_default=func.now()),
     schema="debugging",
     extend_existing=True,
 )
 
 
+class LLMChargeLedger:
+    """
+    LLM 費用緩衝帳本。
+    save_llm_charge 只在記憶體中依 (student_id, problem_id, usage_type, model_name) 累加，
+    由背景 task 定期以 INSERT ... ON CONFLICT DO UPDATE 批次寫入 llm_charge，
+    避免每次 LLM 呼叫都在 event loop 中同步 SELECT + UPDATE。
+    """
+    AMOUNT_FIELDS = (
+        "input_tokens", "cached_input_tokens", "output_tokens", "total_tokens",
+        "input_cost", "cached_input_cost", "output_cost", "total_cost",
+        "cache_hits", "cache_misses", "saved_cost",
+        "parse_attempts", "parse_failures", "parse_repairs",
+    )
+    MAX_ATTEMPTS = 5  # 單列連續寫入失敗幾次後丟棄
+
+    def __init__(self, flush_interval_sec: float = 5.0):
+        self.flush_interval_sec = flush_interval_sec
+        self._lock = threading.Lock()
+        self._pending = {}  # {(student_id, problem_id or "", usage_type, model_name): row}
+        self._attempts = {}  # {key: 連續寫入失敗次數}，只在 flush 中存取
+        self._task = None
+
+    def record(self, student_id: str, usage_type: str, model_name: str, problem_id: str = None, **amounts):
+        """累加一筆費用 (不碰資料庫，可於 sync / async 環境直接呼叫)"""
+        key = (student_id, problem_id or "", usage_type, model_name)
+        with self._lock:
+            row = self._pending.get(key)
+            if row is None:
+                row = {
+                    "student_id": student_id,
+                    "problem_id": problem_id,
+                    "usage_type": usage_type,
+                    "model_name": model_name,
+                    **{f: 0 for f in self.AMOUNT_FIELDS},
+                }
+                self._pending[key] = row
+            for f in self.AMOUNT_FIELDS:
+                row[f] += amounts.get(f, 0)
+
+    def _merge_back(self, batch: dict):
+        """寫入失敗時將資料併回緩衝區，等待下次 flush 重試"""
+        with self._lock:
+            for key, row in batch.items():
+                existing = self._pending.get(key)
+                if existing is None:
+                    self._pending[key] = row
+                else:
+                    for f in self.AMOUNT_FIELDS:
+                        existing[f] += row[f]
+
+    def _upsert(self, rows: list):
+        """一個 transaction 內以多列 INSERT ... ON CONFLICT DO UPDATE 累加寫入"""
+        stmt = pg_insert(llm_charge_table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[
+                llm_charge_table.c.student_id,
+                func.coalesce(llm_charge_table.c.problem_id, ""),
+                llm_charge_table.c.usage_type,
+                llm_charge_table.c.model_name,
+            ],
+            set_={f: llm_charge_table.c[f] + stmt.excluded[f] for f in self.AMOUNT_FIELDS},
+        )
+        with engine.begin() as conn:
+            conn.execute(stmt)
+
+    def flush(self) -> int:
+        """
+        將緩衝區寫入 llm_charge，回傳寫入的列數。
+        整批寫入失敗時改為逐列寫入，讓正常的列不受單一壞列影響；
+        仍失敗的列併回緩衝區，連續失敗 MAX_ATTEMPTS 次即丟棄並記錄 (避免無限重試)。
+        連線層級的錯誤 (OperationalError) 視為資料庫暫時不可用，不計入失敗次數。
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        try:
+            self._upsert(list(batch.values()))
+        except Exception as e:
+            logger.warning("[LLM Charge] Failed to flush %d charge record(s), retrying row by row: %s", len(batch), e)
+        else:
+            self._attempts.clear()
+            logger.debug("[LLM Charge] flushed %d record(s)", len(batch))
+            return len(batch)
+
+        written, retry = 0, {}
+        keys = list(batch)
+        for i, key in enumerate(keys):
+            try:
+                self._upsert([batch[key]])
+            except OperationalError as e:
+                logger.warning("[LLM Charge] Database unavailable, keeping %d record(s) for next flush: %s", len(keys) - i, e)
+                retry.update((k, batch[k]) for k in keys[i:])
+                break
+            except Exception as e:
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts >= self.MAX_ATTEMPTS:
+                    self._attempts.pop(key, None)
+                    logger.error("[LLM Charge] Dropping charge record after %d failed attempts: %s (%s)", attempts, batch[key], e)
+                else:
+                    self._attempts[key] = attempts
+                    retry[key] = batch[key]
+            else:
+                self._attempts.pop(key, None)
+                written += 1
+
+        if retry:
+            self._merge_back(retry)
+        logger.info("[LLM Charge] flushed %d of %d record(s) row by row", written, len(batch))
+        return written
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_sec)
+            await asyncio.to_thread(self.flush)
+
+    async def start(self):
+        """啟動定期 flush 的背景 task（應在應用程式啟動時呼叫一次）"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止背景 task 並寫入剩餘資料（應在應用程式關閉時呼叫）"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+
+llm_charge_ledger = LLMChargeLedger()
+# 非 API Server 的情境 (例如腳本) 也要確保結束前寫入
+atexit.register(llm_charge_ledger.flush)
+
+# 目前作用中的費用收集器 (llm_charge_scope)，用來得知一段流程實際花費的 LLM 費用
+_charge_collector: contextvars.ContextVar = contextvars.ContextVar("llm_charge_collector", default=None)
+
+
+@contextmanager
+def llm_charge_scope():
+    """
+    收集 scope 內 save_llm_charge 的費用 (yield 的 list 內為每筆 total_cost)。
+    巢狀使用時內層的費用也會計入外層；scope 內建立的 asyncio task 會繼承同一個收集器。
+    """
+    parent = _charge_collector.get()
+    costs = []
+    token = _charge_collector.set(costs)
+    try:
+        yield costs
+    finally:
+        _charge_collector.reset(token)
+        if parent is not None:
+            parent.extend(costs)
+
+
 def save_llm_charge(
     student_id: str,
     usage_type: str,
@@ -270,7 +897,7 @@ def save_llm_charge(
     problem_id: str = None,
 ):
     """
-    計算 LLM 費用並寫入 llm_charge 資料表。
+    計算 LLM 費用並記入 llm_charge_ledger (定期批次寫入 llm_charge 資料表)。
     usage_type: 'problem_generate' | 'intention' | 'code_correction' | 'practice'
     """
     pricing = LLM_PRICING.get(model_name, LLM_PRICING["default"])
@@ -280,72 +907,60 @@ def save_llm_charge(
     total_tokens      = input_tokens + cached_input_tokens + output_tokens
     total_cost        = input_cost + cached_input_cost + output_cost
 
-    try:
-        with engine.begin() as conn:
-            # 1. 查詢是否有符合條件的既有記錄
-            if problem_id is not None:
-                # 有 problem_id → 四欄全比對
-                stmt = select(llm_charge_table.c.id).where(
-                    and_(
-                        llm_charge_table.c.student_id == student_id,
-                        llm_charge_table.c.problem_id == problem_id,
-                        llm_charge_table.c.usage_type == usage_type,
-                        llm_charge_table.c.model_name == model_name,
-                    )
-                ).limit(1)
-            else:
-                # 無 problem_id → 三欄比對，且 problem_id IS NULL
-                stmt = select(llm_charge_table.c.id).where(
-                    and_(
-                        llm_charge_table.c.student_id == student_id,
-                        llm_charge_table.c.problem_id == None,
-                        llm_charge_table.c.usage_type == usage_type,
-                        llm_charge_table.c.model_name == model_name,
-                    )
-                ).limit(1)
-
-            existing = conn.execute(stmt).fetchone()
-
-            if existing:
-                # 2a. 找到 → 累加
-                conn.execute(
-                    update(llm_charge_table).where(
-                        llm_charge_table.c.id == existing.id
-                    ).values(
-                        input_tokens=llm_charge_table.c.input_tokens + input_tokens,
-                        cached_input_tokens=llm_charge_table.c.cached_input_tokens + cached_input_tokens,
-                        output_tokens=llm_charge_table.c.output_tokens + output_tokens,
-                        total_tokens=llm_charge_table.c.total_tokens + total_tokens,
-                        input_cost=llm_charge_table.c.input_cost + input_cost,
-                        cached_input_cost=llm_charge_table.c.cached_input_cost + cached_input_cost,
-                        output_cost=llm_charge_table.c.output_cost + output_cost,
-                        total_cost=llm_charge_table.c.total_cost + total_cost,
-                    )
-                )
-                action = "accumulated"
-            else:
-                # 2b. 沒找到 → 新增
-                conn.execute(insert(llm_charge_table).values(
-                    student_id=student_id,
-                    problem_id=problem_id,
-                    usage_type=usage_type,
-                    model_name=model_name,
-                    input_tokens=input_tokens,
-                    cached_input_tokens=cached_input_tokens,
-                    output_tokens=output_tokens,
-                    total_tokens=total_tokens,
-                    input_cost=input_cost,
-                    cached_input_cost=cached_input_cost,
-                    output_cost=output_cost,
-                    total_cost=total_cost,
-                ))
-                action = "inserted"
-
-        print(f"[LLM Charge] {action} | {usage_type} | {model_name} | "
-              f"tokens: in={input_tokens}, cached={cached_input_tokens}, out={output_tokens} | "
-              f"cost: ${total_cost:.6f}")
-    except Exception as e:
-        print(f"[LLM Charge] Warning: Failed to save charge record: {e}")
+    llm_charge_ledger.record(
+        student_id=student_id,
+        usage_type=usage_type,
+        model_name=model_name,
+        problem_id=problem_id,
+        input_tokens=input_tokens,
+        cached_input_tokens=cached_input_tokens,
+        output_tokens=output_tokens,
+        total_tokens=total_tokens,
+        input_cost=input_cost,
+        cached_input_cost=cached_input_cost,
+        output_cost=output_cost,
+        total_cost=total_cost,
+    )
+    collector = _charge_collector.get()
+    if collector is not None:
+        collector.append(total_cost)
+
+    logger.debug(f"[LLM Charge] buffered | {usage_type} | {model_name} | "
+                 f"tokens: in={input_tokens}, cached={cached_input_tokens}, out={output_tokens} | "
+                 f"cost: ${total_cost:.6f}")
+
+
+def save_cache_event(student_id: str, usage_type: str, hit: bool, saved_cost: float = 0.0, problem_id: str = None):
+    """
+    記錄一次回應快取查詢 (model_name='semantic_cache')：
+    命中率 = cache_hits / (cache_hits + cache_misses)，saved_cost 為命中時省下的 LLM 費用
+    """
+    llm_charge_ledger.record(
+        student_id=student_id,
+        usage_type=usage_type,
+        model_name="semantic_cache",
+        problem_id=problem_id,
+        cache_hits=1 if hit else 0,
+        cache_misses=0 if hit else 1,
+        saved_cost=saved_cost if hit else 0.0,
+    )
+
+
+def save_parse_event(student_id: str, usage_type: str, model_name: str, failed: bool, repaired: bool,
+                     problem_id: str = None):
+    """
+    記錄一次 structured output 解析 (記在產生該回覆的模型列上)：
+    失敗率 = parse_failures / parse_attempts，修復成功率 = parse_repairs / parse_failures
+    """
+    llm_charge_ledger.record(
+        student_id=student_id,
+        usage_type=usage_type,
+        model_name=model_name,
+        problem_id=problem_id,
+        parse_attempts=1,
+        parse_failures=1 if failed else 0,
+        parse_repairs=1 if repaired else 0,
+    )
 
 
 
@@ -411,11 +1026,11 @@ users_table = Table(
 # ==========================================
 
 def load_problem_config(problem_id: str) -> ProblemConfig:
+    """題目設定；測資只讀取 hash，內容在判題存取時才由 case_store 載入"""
     with engine.connect() as conn:
         row = conn.execute(
             select(
                 problem_table.c.problem_id,
-                problem_table.c.test_cases,
                 problem_table.c.time_limit,
                 problem_table.c.judge_type,
                 problem_table.c.entry_point,
@@ -423,13 +1038,14 @@ def load_problem_config(problem_id: str) -> ProblemConfig:
                 problem_table.c.end_time,
             ).where(problem_table.c.problem_id == problem_id)
         ).fetchone()
+        refs = get_problem_test_case_refs(conn, problem_id) if row else []
 
     if not row:
         raise ValueError("Problem not found")
 
     row_mapping = row._mapping if hasattr(row, "_mapping") else row
-    tc_list = row_mapping["test_cases"] or []
-    test_cases = [TestCase(tc["input"], tc["output"]) for tc in tc_list]
+    case_set = CaseSet(case_store, [h for r in refs for h in (r.input_hash, r.output_hash)])
+    test_cases = [LazyTestCase(r.case_no, r.input_hash, r.output_hash, case_set) for r in refs]
 
     return ProblemConfig(
         problem_id=row_mapping["problem_id"],
@@ -442,23 +1058,57 @@ def load_problem_config(problem_id: str) -> ProblemConfig:
     )
 
 def save_submission(problem_id, student_id, code, verdict, results):
+    # 程式碼與測資內容改存 content_blob，提交列只保留 hash 引用
+    blobs = {}
+    code_hash = blob_ref(code, blobs)
     summary = {
         "verdict": verdict,
         "passed_cases": f"{len([r for r in results if r.status == CaseStatus.AC])}/{len(results)}",
-        "details": [vars(r) for r in results],
+        "details": [
+            {
+                "case_id": r.case_id,
+                "status": r.status,
+                "error": r.error,
+                "input_hash": blob_ref(r.input, blobs),
+                "expected_hash": blob_ref(r.expected, blobs),
+                "actual_hash": blob_ref(r.actual, blobs),
+            }
+            for r in results
+        ],
     }
     
-    with engine.connect() as conn:
+    latest_stmt = pg_insert(latest_submission_table).values(
+        student_id=student_id,
+        problem_id=problem_id,
+        verdict=normalize_verdict(verdict),
+        raw_verdict=verdict,
+        passed_cases=summary["passed_cases"],
+        submission_count=1,
+        submitted_at=func.now(),
+    )
+    latest_stmt = latest_stmt.on_conflict_do_update(
+        index_elements=[latest_submission_table.c.student_id, latest_submission_table.c.problem_id],
+        set_={
+            "verdict": latest_stmt.excluded.verdict,
+            "raw_verdict": latest_stmt.excluded.raw_verdict,
+            "passed_cases": latest_stmt.excluded.passed_cases,
+            "submission_count": latest_submission_table.c.submission_count + 1,
+            "submitted_at": latest_stmt.excluded.submitted_at,
+        },
+    )
+
+    with engine.begin() as conn:
+        put_blobs(conn, blobs)
         conn.execute(
             insert(submission_table).values(
                 problem_id=problem_id,
                 student_id=student_id,
                 result=json.dumps(verdict),
-                code={"content": code},
+                code={"hash": code_hash},
                 output=summary,
             )
         )
-        conn.commit()
+        conn.execute(latest_stmt)
 
 def get_latest_submission(student_id: str, problem_id: str):
     stmt = select(
@@ -468,29 +1118,33 @@ def get_latest_submission(student_id: str, problem_id: str):
         submission_table.c.submitted_at
     ).where(
         submission_table.c.student_id == student_id,
-        submission_table.c.problem_id == problem_id
+        submission_table.c.problem_id == problem_id,
+        in_current_term(submission_table.c.submitted_at)
     ).order_by(
         submission_table.c.submitted_at.desc()
     ).limit(1)
 
     with engine.connect() as conn:
         row = conn.execute(stmt).fetchone()
+        if row:
+            row_mapping = row._mapping if hasattr(row, "_mapping") else row
+            code, output = load_submission_content(conn, row_mapping["code"], row_mapping["output"])
 
     if row:
-        row_mapping = row._mapping if hasattr(row, "_mapping") else row
         return {
-            "code": row_mapping["code"],           
+            "code": code,           
             "result": row_mapping["result"],       
-            "output": row_mapping["output"],       
+            "output": output,       
             "submitted_at": row_mapping["submitted_at"]
         }
     return None
 
 def get_submission_count(student_id: str, problem_id: str) -> int:
+    """所有學期的提交次數 (即最新一次提交的 num)"""
     with engine.connect() as conn:
         query = select(func.count()).select_from(submission_table).where(
             submission_table.c.student_id == student_id,
-            submission_table.c.problem_id == problem_id
+            submission_table.c.problem_id == problem_id,
         )
         count = conn.execute(query).scalar()
         return count if count else 0
@@ -534,4 +1188,293 @@ def update_practice_answer(practice_id: int, student_answers: list, is_all_corre
         answer_is_correct=is_all_correct
     )
     with engine.begin() as conn:
-        conn.execute(stmt)
\ No newline at end of file
+        conn.execute(stmt)
+
+def parse_submission_code(raw_code) -> str:
+    """將 submission.code (JSONB {"content": ...} 或字串) 轉為程式碼文字"""
+    if isinstance(raw_code, dict):
+        return raw_code.get("content", "")
+    if isinstance(raw_code, str):
+        try:
+            return json.loads(raw_code).get("content", "")
+        except Exception:
+            return raw_code
+    return str(raw_code) if raw_code is not None else ""
+
+
+def parse_submission_verdict(output, result) -> str:
+    """優先從 output.verdict 取得判題結果，否則退回 result 欄位"""
+    if output and isinstance(output, dict):
+        return output.get("verdict", "Unknown")
+    return str(result).strip('"') if result is not None else ""
+
+
+# 單一 round-trip 取得學生於某題的工作區狀態
+# dialogue 的 num 選擇規則與 /help/history 相同：優先取最新提交的 num，否則退回最大 num
+# 提交次數 (num) 以所有學期累計；最新提交 / 報告 / 對話只看本學期 (:term_start，關閉裁剪時為 datetime.min)
+STUDENT_WORKSPACE_SQL = text("""
+WITH sub_count AS (
+    SELECT count(*) AS submission_num
+    FROM debugging.debugging_code_submission
+    WHERE student_id = :student_id AND problem_id = :problem_id
+),
+latest_sub AS (
+    SELECT
+        CASE WHEN s.code ? 'hash' THEN jsonb_build_object('content', b.content::jsonb) ELSE s.code END AS code,
+        s.result, s.output, s.submitted_at
+    FROM debugging.debugging_code_submission s
+    LEFT JOIN debugging.content_blob b ON b.hash = s.code->>'hash'
+    WHERE s.student_id = :student_id AND s.problem_id = :problem_id AND s.submitted_at >= :term_start
+    ORDER BY s.submitted_at DESC, s.id DESC
+    LIMIT 1
+),
+latest_report AS (
+    SELECT max(num) AS latest_report_num
+    FROM debugging.debugging_evidence_report
+    WHERE student_id = :student_id AND problem_id = :problem_id AND submitted_at >= :term_start
+),
+latest_practice AS (
+    SELECT id, code_question, answer_is_correct, student_answer
+    FROM debugging.debugging_practice
+    WHERE student_id = :student_id AND problem_id = :problem_id
+    ORDER BY submitted_at DESC
+    LIMIT 1
+),
+dialogue_num AS (
+    SELECT COALESCE(
+        max(num) FILTER (WHERE num = (SELECT submission_num FROM sub_count)),
+        max(num)
+    ) AS num
+    FROM debugging.debugging_dialogue
+    WHERE student_id = :student_id AND problem_id = :problem_id AND submitted_at >= :term_start
+),
+dialogue_head AS (
+    SELECT COALESCE(jsonb_agg(m.elem ORDER BY d.id, m.ord), '[]'::jsonb) AS chat_log
+    FROM debugging.debugging_dialogue d
+    CROSS JOIN LATERAL jsonb_array_elements(COALESCE(d.chat_log, '[]'::jsonb))
+        WITH ORDINALITY AS m(elem, ord)
+    WHERE d.student_id = :student_id AND d.problem_id = :problem_id AND d.submitted_at >= :term_start
+      AND d.num = (SELECT num FROM dialogue_num)
+)
+SELECT
+    sc.submission_num,
+    ls.code, ls.result, ls.output, ls.submitted_at,
+    lr.latest_report_num,
+    lp.id AS practice_id, lp.code_question, lp.answer_is_correct, lp.student_answer,
+    dn.num AS dialogue_num,
+    dh.chat_log
+FROM sub_count sc
+LEFT JOIN latest_sub ls ON TRUE
+LEFT JOIN latest_report lr ON TRUE
+LEFT JOIN latest_practice lp ON TRUE
+LEFT JOIN dialogue_num dn ON TRUE
+LEFT JOIN dialogue_head dh ON TRUE
+""")
+
+
+def get_student_workspace(student_id: str, problem_id: str) -> dict:
+    """
+    一次查詢取得學生工作區所需的所有資料：
+    最新提交 (code / verdict)、練習題狀態、提交次數、最新報告 num 與最新對話紀錄。
+    """
+    with engine.connect() as conn:
+        row = conn.execute(
+            STUDENT_WORKSPACE_SQL,
+            {"student_id": student_id, "problem_id": problem_id,
+             "term_start": current_term_start() or datetime.min}
+        ).fetchone()
+
+    mapping = row._mapping
+    has_submission = mapping["submitted_at"] is not None
+
+    code_content = ""
+    result_display = ""
+    if has_submission:
+        code_content = parse_submission_code(mapping["code"])
+        result_display = parse_submission_verdict(mapping["output"], mapping["result"])
+
+    if mapping["practice_id"] is not None:
+        practice_info = {
+            "exists": True,
+            "completed": mapping["answer_is_correct"] if mapping["answer_is_correct"] is not None else False,
+            "data": mapping["code_question"],
+            "student_answer": mapping["student_answer"],
+            "id": mapping["practice_id"]
+        }
+    else:
+        practice_info = {"exists": False, "completed": False, "data": None, "id": None}
+
+    return {
+        "code": code_content,
+        "result": result_display,
+        "is_accepted": "Accepted" in result_display or "AC" in result_display,
+        "practice": practice_info,
+        "submitted_at": mapping["submitted_at"],
+        "submission_num": mapping["submission_num"] or 0,
+        "latest_report_num": mapping["latest_report_num"] or 0,
+        "dialogue_num": mapping["dialogue_num"],
+        "chat_log": mapping["chat_log"] or [],
+    }
+
+
+# ==========================================
+# Submission History (分頁歷史與版本差異)
+# ==========================================
+# submission 沒有 num 欄位，num 為依 (submitted_at, id) 排序的第幾次提交 (與 /help/init 相同)
+
+SUBMISSION_HISTORY_MAX_LIMIT = 100
+
+# 提交紀錄不會被修改，差異結果依兩筆提交的 id 快取
+_submission_diff_cache = LRUCache(maxsize=1024)
+_submission_diff_lock = threading.Lock()
+
+
+def encode_history_cursor(submitted_at: datetime, submission_id: int) -> str:
+    return f"{submitted_at.isoformat()}|{submission_id}"
+
+
+def decode_history_cursor(cursor: str):
+    """next_cursor -> (submitted_at, id)；舊格式 (只有 submitted_at) 的 id 為 None"""
+    submitted_at, _, submission_id = cursor.partition("|")
+    return datetime.fromisoformat(submitted_at), int(submission_id) if submission_id else None
+
+
+def get_submission_history(student_id: str, problem_id: str, limit: int = 20, before: str = None) -> dict:
+    """
+    Keyset 分頁取得提交摘要 (新到舊)，不讀取 code 與逐筆測資結果。
+    before: 上一頁回傳的 next_cursor ((submitted_at, id))，None 表示第一頁。
+    """
+    limit = max(1, min(limit, SUBMISSION_HISTORY_MAX_LIMIT))
+    t = submission_table
+    conditions = [
+        t.c.student_id == student_id,
+        t.c.problem_id == problem_id,
+    ]
+    if before is not None:
+        before_at, before_id = decode_history_cursor(before)
+        if before_id is None:
+            conditions.append(t.c.submitted_at < before_at)
+        else:
+            # 同一時間的提交以 id 區分，不會因游標落在同一時間而被略過
+            conditions.append(tuple_(t.c.submitted_at, t.c.id) < tuple_(before_at, before_id))
+
+    with engine.connect() as conn:
+        # 本頁第一筆的 num = 游標之前的提交數 (只走 (student_id, problem_id, submitted_at, id) 索引)
+        newest_num = conn.execute(
+            select(func.count()).select_from(t).where(and_(*conditions))
+        ).scalar() or 0
+        rows = conn.execute(
+            select(
+                t.c.id,
+                t.c.submitted_at,
+                t.c.result,
+                t.c.output["verdict"].astext.label("verdict"),
+                t.c.output["passed_cases"].astext.label("passed_cases"),
+            )
+            .where(and_(*conditions))
+            .order_by(desc(t.c.submitted_at), desc(t.c.id))
+            .limit(limit)
+        ).fetchall()
+
+    items = []
+    for i, row in enumerate(rows):
+        mapping = row._mapping
+        items.append({
+            "num": newest_num - i,
+            "verdict": mapping["verdict"] or parse_submission_verdict(None, mapping["result"]),
+            "passed_cases": mapping["passed_cases"],
+            "submitted_at": mapping["submitted_at"],
+        })
+
+    has_more = newest_num > len(items)
+    return {
+        "items": items,
+        "next_cursor": encode_history_cursor(rows[-1].submitted_at, rows[-1].id) if items and has_more else None,
+    }
+
+
+def _get_submission_id_by_num(conn, student_id: str, problem_id: str, num: int):
+    stmt = select(submission_table.c.id).where(
+        submission_table.c.student_id == student_id,
+        submission_table.c.problem_id == problem_id,
+    ).order_by(submission_table.c.submitted_at.asc(), submission_table.c.id.asc()).offset(num - 1).limit(1)
+    return conn.execute(stmt).scalar()
+
+
+def _get_submissions_by_id(conn, student_id: str, problem_id: str, submission_ids) -> dict:
+    rows = conn.execute(
+        select(
+            submission_table.c.id,
+            submission_table.c.code,
+            submission_table.c.result,
+            submission_table.c.output,
+        ).where(
+            submission_table.c.student_id == student_id,
+            submission_table.c.problem_id == problem_id,
+            submission_table.c.id.in_(list(submission_ids)),
+        )
+    ).fetchall()
+    return {row.id: row for row in rows}
+
+
+def get_submission_diff(student_id: str, problem_id: str, from_num: int, to_num: int):
+    """
+    比較兩次提交：程式碼 unified diff、verdict / 通過數變化、狀態改變的測資。
+    任一 num 不存在時回傳 None。
+    """
+    if from_num < 1 or to_num < 1:
+        return None
+    with engine.connect() as conn:
+        from_id = _get_submission_id_by_num(conn, student_id, problem_id, from_num)
+        to_id = _get_submission_id_by_num(conn, student_id, problem_id, to_num)
+        if from_id is None or to_id is None:
+            return None
+
+        # num 只用於標示，快取鍵以提交 id 為準 (num 對應的提交改變時不會命中舊結果)
+        key = (from_id, to_id, from_num, to_num)
+        with _submission_diff_lock:
+            if key in _submission_diff_cache:
+                return _submission_diff_cache[key]
+
+        rows = _get_submissions_by_id(conn, student_id, problem_id, {from_id, to_id})
+        from_row, to_row = rows.get(from_id), rows.get(to_id)
+        if from_row is None or to_row is None:
+            return None
+        blobs = load_blobs(conn, collect_blob_hashes(from_row.code, None) | collect_blob_hashes(to_row.code, None))
+
+    def case_statuses(output) -> dict:
+        details = output.get("details", []) if isinstance(output, dict) else []
+        return {d.get("case_id"): d.get("status") for d in details if isinstance(d, dict)}
+
+    def passed_cases(output):
+        return output.get("passed_cases") if isinstance(output, dict) else None
+
+    from_m, to_m = from_row._mapping, to_row._mapping
+    from_code = parse_submission_code(hydrate_submission(from_m["code"], None, blobs)[0])
+    to_code = parse_submission_code(hydrate_submission(to_m["code"], None, blobs)[0])
+    from_cases = case_statuses(from_m["output"])
+    to_cases = case_statuses(to_m["output"])
+
+    diff = {
+        "from_num": from_num,
+        "to_num": to_num,
+        "from_verdict": parse_submission_verdict(from_m["output"], from_m["result"]),
+        "to_verdict": parse_submission_verdict(to_m["output"], to_m["result"]),
+        "from_passed_cases": passed_cases(from_m["output"]),
+        "to_passed_cases": passed_cases(to_m["output"]),
+        "code_diff": "".join(difflib.unified_diff(
+            from_code.splitlines(keepends=True),
+            to_code.splitlines(keepends=True),
+            fromfile=f"#{from_num}",
+            tofile=f"#{to_num}",
+        )),
+        "case_changes": [
+            {"case_id": case_id, "from": from_cases.get(case_id), "to": to_cases.get(case_id)}
+            for case_id in sorted(set(from_cases) | set(to_cases), key=lambda c: (c is None, c))
+            if from_cases.get(case_id) != to_cases.get(case_id)
+        ],
+    }
+
+    with _submission_diff_lock:
+        _submission_diff_cache[key] = diff
+    return diff
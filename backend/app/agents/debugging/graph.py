@@ -5,12 +5,15 @@ Agent 邏輯已拆分至 coding_help 資料夾中的獨立模組。
 """
 import os
 import json
+import time
+import asyncio
 import logging
-from typing import TypedDict, List, Dict, Any, Literal
+from functools import wraps
+from typing import TypedDict, List, Dict, Any, Literal, Annotated
 from datetime import datetime
 
 # LangChain / LangGraph
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_openai import OpenAIEmbeddings
 from langchain_core.messages import SystemMessage, HumanMessage
 from pydantic import BaseModel, Field
 from langgraph.graph import StateGraph, END, START
@@ -23,11 +26,16 @@ from backend.app.agents.debugging.coding_help.diagnostic_agent import (
 from backend.app.agents.debugging.coding_help.scaffolding_agent import (
     decide_retrieval,
     generate_scaffold_response,
-    get_relevant_documents
-)
-from backend.app.agents.debugging.coding_help.practice_agent import (
-    generate_practice_questions
+    stream_scaffold_response,
+    get_relevant_documents,
+    SCAFFOLD_FALLBACK
 )
+from backend.app.agents.debugging.coding_help import diagnosis_cache
+from backend.app.agents.debugging.db import llm_charge_scope
+from backend.app.agents.debugging.llm_client import get_chat_model
+from backend.app.agents.debugging.coding_help.help_chat import MarkdownStreamFilter, clean_markdown_filter
+from backend.app.agents.debugging.response_stream import response_streams
+from backend.app.agents.debugging.coding_help.practice_bank import serve_practice_questions
 
 # ======================================================
 # 1. 環境設定
@@ -36,11 +44,24 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # 初始化 LLM
-llm = ChatOpenAI(model="gpt-5.1", temperature=0.3)
+llm = get_chat_model("gpt-5.1", usage_type="code_correction", temperature=0.3)
+
+# concurrent (預設): 診斷報告與推測檢索並行、ZPD 與路由並行
+# sequential: 舊的逐步流程，保留作為延遲比較基準
+GRAPH_MODE = os.getenv("DEBUGGING_GRAPH_MODE", "concurrent")
+# 推測檢索: 與錯誤報告並行，以「題目標題 + 錯誤訊息」先行檢索教材；
+# 路由決定需要檢索時直接採用這份結果 (路由只決定要不要檢索)，不再以路由的查詢重新檢索。
+# 推測檢索沒有結果時才改用路由的查詢。設為 0 則一律以路由的查詢檢索 (多一次 embedding 與查詢)
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "1") != "0"
 
 # ======================================================
 # 2. State & Models 定義
 # ======================================================
+def merge_dicts(left: Dict[str, float], right: Dict[str, float]) -> Dict[str, float]:
+    """並行節點各自回報的耗時 / 費用，合併而非覆寫"""
+    return {**(left or {}), **(right or {})}
+
+
 class AgentState(TypedDict):
     student_id: str
     problem_id: str
@@ -55,6 +76,12 @@ class AgentState(TypedDict):
     initial_response: str       
     practice_question: List[Dict]
     is_correct: bool            
+    speculative_docs: List[str]
+    stream_key: str
+    cache: Dict[str, Any]           # diagnosis_cache.lookup 的結果
+    scaffold_reused: bool
+    node_timings: Annotated[Dict[str, float], merge_dicts]
+    node_costs: Annotated[Dict[str, float], merge_dicts]
 
 
 class RouteQuery(BaseModel):
@@ -67,33 +94,66 @@ class RouteQuery(BaseModel):
 # 3. Agent Nodes (使用 coding_help 模組)
 # ======================================================
 
+def timed(name: str):
+    """記錄節點耗時 (ms) 至 node_timings、LLM 費用 (USD) 至 node_costs"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(state: AgentState):
+            started = time.perf_counter()
+            with llm_charge_scope() as costs:
+                result = await func(state)
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            return {**(result or {}), "node_timings": {name: elapsed_ms}, "node_costs": {name: sum(costs)}}
+        return wrapper
+    return decorator
+
+
+def cache_hit(state: AgentState) -> bool:
+    return bool((state.get('cache') or {}).get('entry'))
+
+
+@timed("cache_lookup")
+async def cache_lookup_node(state: AgentState):
+    """查詢診斷快取，命中時直接帶入錯誤報告、路由決策與檢索教材"""
+    result = await diagnosis_cache.lookup(state.get('problem_id'), state['current_code'], state['error_message'])
+    entry = result["entry"]
+    if not entry:
+        return {"cache": result}
+    return {
+        "cache": result,
+        "evidence_report": entry["evidence_report"],
+        "search_query": entry["search_query"],
+        "retrieved_docs": entry["retrieved_docs"],
+    }
+
+
+@timed("analyze_code")
 async def diagnostic_agent(state: AgentState):
     """分析錯誤並對應課程概念 - 呼叫 coding_help.diagnostic_agent"""
-    student_id = state.get('student_id')
-    problem_id = state.get('problem_id')
     # 生成錯誤報告
     report = await generate_error_report(
         current_code=state['current_code'],
         error_message=state['error_message'],
         problem_info=state['problem_info'],
-        student_id=student_id,
-        problem_id=problem_id,
+        student_id=state.get('student_id'),
+        problem_id=state.get('problem_id'),
     )
-    
-    # 判斷 ZPD Level
+    return {"evidence_report": report}
+
+
+@timed("zpd")
+async def zpd_node(state: AgentState):
+    """判斷 ZPD Level (只依賴錯誤報告，可與路由並行)"""
     zpd_result = await determine_zpd_level(
         previous_reports=state['previous_reports'],
-        current_report=report,
-        student_id=student_id,
-        problem_id=problem_id,
+        current_report=state['evidence_report'],
+        student_id=state.get('student_id'),
+        problem_id=state.get('problem_id'),
     )
-    
-    return {
-        "evidence_report": report,
-        "zpd_level": zpd_result["zpd_level"]
-    }
+    return {"zpd_level": zpd_result["zpd_level"]}
 
 
+@timed("router")
 async def router_node(state: AgentState):
     """決定是否需要檢索教材 - 呼叫 coding_help.scaffolding_agent"""
     route_result = await decide_retrieval(
@@ -109,15 +169,39 @@ async def router_node(state: AgentState):
     return {"search_query": search_query}
 
 
+def speculative_query(state: AgentState) -> str:
+    """推測檢索的查詢字串：題目標題 + 錯誤訊息"""
+    problem_info = state.get('problem_info') or {}
+    return f"{problem_info.get('title', '')}\n{state.get('error_message', '')}".strip()
+
+
+@timed("speculative_retrieve")
+async def speculative_retrieval_node(state: AgentState):
+    """與錯誤報告生成同時進行的教材檢索 (embedding + 向量查詢不佔用事件迴圈)"""
+    docs = await asyncio.to_thread(get_relevant_documents, speculative_query(state))
+    return {"speculative_docs": docs}
+
+
+@timed("retrieve")
 async def retrieval_node(state: AgentState):
     """執行教材檢索 - 呼叫 coding_help.scaffolding_agent"""
-    docs = get_relevant_documents(state['search_query'])
+    if cache_hit(state):
+        return {}
+    if not state.get('search_query'):
+        return {"retrieved_docs": []}
+    # 路由決定需要檢索且推測檢索已有結果：直接採用，省去第二次 embedding 與查詢
+    speculative_docs = state.get('speculative_docs')
+    if speculative_docs:
+        logger.info(f"Speculative retrieval hit for {state.get('student_id')} on {state.get('problem_id')}")
+        return {"retrieved_docs": speculative_docs}
+    docs = await asyncio.to_thread(get_relevant_documents, state['search_query'])
     return {"retrieved_docs": docs}
 
 
+@timed("scaffold_help")
 async def scaffolding_agent(state: AgentState):
     """引導式教學 (Scaffolding) - 呼叫 coding_help.scaffolding_agent"""
-    response = await generate_scaffold_response(
+    kwargs = dict(
         zpd_level=state['zpd_level'],
         evidence_report=state['evidence_report'],
         problem_info=state['problem_info'],
@@ -126,13 +210,53 @@ async def scaffolding_agent(state: AgentState):
         student_id=state.get('student_id'),
         problem_id=state.get('problem_id'),
     )
-    
-    return {"initial_response": response}
+    stream_key = state.get('stream_key')
+    cache = state.get('cache') or {}
+    cached = None
+    if cache.get('match') == "exact":
+        cached = cache['entry']['scaffolds'].get(str(state['zpd_level']))
+    if cached:
+        if stream_key:
+            response_streams.publish(stream_key, clean_markdown_filter(cached))
+        return {"initial_response": cached, "scaffold_reused": True}
+    if not stream_key:
+        return {"initial_response": await generate_scaffold_response(**kwargs)}
 
+    # 有訂閱需求 (/help/init 觸發)：逐段轉送過濾 Markdown 後的文字
+    md_filter = MarkdownStreamFilter()
+    parts = []
+    async for text in stream_scaffold_response(**kwargs):
+        parts.append(text)
+        response_streams.publish(stream_key, md_filter.feed(text))
+    response_streams.publish(stream_key, md_filter.flush())
+    return {"initial_response": "".join(parts)}
+
+
+async def cache_store_node(state: AgentState):
+    """將本次結果寫入診斷快取並記錄命中 / 省下的費用"""
+    costs = state.get('node_costs') or {}
+    scaffold = state.get('initial_response')
+    await asyncio.to_thread(
+        diagnosis_cache.record,
+        student_id=state.get('student_id'),
+        problem_id=state.get('problem_id'),
+        lookup_result=state.get('cache') or {},
+        evidence_report=state.get('evidence_report'),
+        search_query=state.get('search_query'),
+        retrieved_docs=state.get('retrieved_docs'),
+        zpd_level=state.get('zpd_level'),
+        scaffold=None if scaffold == SCAFFOLD_FALLBACK else scaffold,
+        scaffold_reused=bool(state.get('scaffold_reused')),
+        report_cost=costs.get("analyze_code", 0.0) + costs.get("router", 0.0),
+        scaffold_cost=costs.get("scaffold_help", 0.0),
+    )
+    return {}
 
+
+@timed("generate_practice")
 async def practice_agent(state: AgentState):
-    """生成鞏固練習題 - 呼叫 coding_help.practice_agent"""
-    practice_q = await generate_practice_questions(
+    """生成鞏固練習題 - 優先取用題庫 (coding_help.practice_bank)，未命中時呼叫 practice_agent 生成"""
+    practice_q = await serve_practice_questions(
         previous_reports=state.get('previous_reports', []),
         problem_info=state.get('problem_info', {}),
         current_report=state.get('evidence_report'),
@@ -146,18 +270,27 @@ async def practice_agent(state: AgentState):
 # ======================================================
 # 4. Graph 建構 (Workflow)
 # ======================================================
-workflow = StateGraph(AgentState)
+def check_correctness(state: AgentState):
+    """判斷是否正確，決定走哪條路 (錯誤路徑先查診斷快取)"""
+    return "generate_practice" if state.get('is_correct') else "cache_lookup"
 
-workflow.add_node("analyze_code", diagnostic_agent)
-workflow.add_node("router", router_node)
-workflow.add_node("retrieve", retrieval_node)
-workflow.add_node("scaffold_help", scaffolding_agent)
-workflow.add_node("generate_practice", practice_agent)
 
+def after_cache_lookup(state: AgentState):
+    """快取命中時跳過錯誤報告與路由決策"""
+    return "zpd" if cache_hit(state) else "analyze_code"
+
+
+def after_zpd(state: AgentState):
+    return "scaffold_help" if cache_hit(state) else "router"
 
-def check_correctness(state: AgentState):
-    """判斷是否正確，決定走哪條路"""
-    return "generate_practice" if state.get('is_correct') else "analyze_code"
+
+def after_cache_lookup_concurrent(state: AgentState):
+    """命中：ZPD 與 (空操作的) 檢索；未命中：錯誤報告與推測檢索並行"""
+    if cache_hit(state):
+        return ["zpd", "retrieve"]
+    if SPECULATIVE_RETRIEVAL:
+        return ["analyze_code", "speculative_retrieve"]
+    return "analyze_code"
 
 
 def decide_rag_path(state: AgentState):
@@ -165,11 +298,53 @@ def decide_rag_path(state: AgentState):
     return "retrieve" if state.get("search_query") else "scaffold_help"
 
 
-workflow.add_conditional_edges(START, check_correctness)
-workflow.add_edge("analyze_code", "router")
-workflow.add_conditional_edges("router", decide_rag_path, {"retrieve": "retrieve", "scaffold_help": "scaffold_help"})
-workflow.add_edge("retrieve", "scaffold_help")
-workflow.add_edge("scaffold_help", END)
-workflow.add_edge("generate_practice", END)
+def build_workflow(mode: str = GRAPH_MODE) -> StateGraph:
+    """
+    sequential: cache_lookup -> analyze_code -> zpd -> router -> retrieve(可選) -> scaffold_help
+    concurrent: cache_lookup -> analyze_code || speculative_retrieve
+                -> zpd || (router -> retrieve)
+                -> scaffold_help
+    快取命中時兩者都只執行 zpd -> scaffold_help (同 ZPD 等級已有鷹架回覆時直接重用)。
+    兩者節點相同 (LLM 呼叫與 llm_charge 記錄不變)，僅排程不同；最後由 cache_store 寫回快取。
+    """
+    workflow = StateGraph(AgentState)
+
+    workflow.add_node("cache_lookup", cache_lookup_node)
+    workflow.add_node("analyze_code", diagnostic_agent)
+    workflow.add_node("zpd", zpd_node)
+    workflow.add_node("router", router_node)
+    workflow.add_node("retrieve", retrieval_node)
+    workflow.add_node("scaffold_help", scaffolding_agent)
+    workflow.add_node("cache_store", cache_store_node)
+    workflow.add_node("generate_practice", practice_agent)
+
+    workflow.add_conditional_edges(START, check_correctness, ["generate_practice", "cache_lookup"])
+    if mode == "sequential":
+        workflow.add_conditional_edges("cache_lookup", after_cache_lookup, ["zpd", "analyze_code"])
+        workflow.add_edge("analyze_code", "zpd")
+        workflow.add_conditional_edges("zpd", after_zpd, ["scaffold_help", "router"])
+        workflow.add_conditional_edges("router", decide_rag_path, {"retrieve": "retrieve", "scaffold_help": "scaffold_help"})
+        workflow.add_edge("retrieve", "scaffold_help")
+    else:
+        workflow.add_node("speculative_retrieve", speculative_retrieval_node)
+        workflow.add_conditional_edges(
+            "cache_lookup", after_cache_lookup_concurrent,
+            ["zpd", "retrieve", "analyze_code", "speculative_retrieve"]
+        )
+        workflow.add_edge("analyze_code", "zpd")
+        workflow.add_edge("analyze_code", "router")
+        # retrieve 一律執行 (不需檢索時為空操作)，讓 scaffold_help 能以固定的 join 等待兩條分支
+        if SPECULATIVE_RETRIEVAL:
+            workflow.add_edge(["router", "speculative_retrieve"], "retrieve")
+        else:
+            workflow.add_edge("router", "retrieve")
+        workflow.add_edge(["zpd", "retrieve"], "scaffold_help")
+
+    workflow.add_edge("scaffold_help", "cache_store")
+    workflow.add_edge("cache_store", END)
+    workflow.add_edge("generate_practice", END)
+    return workflow
+
 
-app_graph = workflow.compile()
\ No newline at end of file
+workflow = build_workflow()
+app_graph = workflow.compile()
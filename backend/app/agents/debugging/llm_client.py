@@ -0,0 +1,399 @@
+"""
+LLM Client: 所有 LLM 呼叫的單一出入口 (gateway) 與完全相同呼叫的結果快取
+
+- get_chat_model(model, usage_type, **params): 相同參數共用同一個 ChatOpenAI，並掛上 llm_cache；
+  逾時與重試次數依 usage_type 的 UsagePolicy
+- hedged_ainvoke(chat_model, messages, usage_type): 依 UsagePolicy 的整體預算呼叫，
+  主要模型超過延遲目標時同時發出較便宜模型的備援請求 (hedged request)
+- parse_completion(...): OpenAI SDK 的 structured output 呼叫 (problem_generate 使用)，同樣經過 llm_cache
+- 所有 client 共用同一組 HTTP/2 連線池 (httpx)，避免各模組各自建立連線
+- llm_cache: 記憶體 LRU + 磁碟 diskcache 兩層，key 為 (模型與參數, 完整 messages) 的 sha256
+  命中時回傳的結果不帶 token 用量，呼叫端原本的 save_llm_charge 會記為 0
+
+環境變數:
+- LLM_CACHE=0               關閉快取
+- LLM_CACHE_TTL_SEC         預設有效時間 (預設 86400 秒)
+- LLM_CACHE_DIR             磁碟快取目錄 (預設系統暫存目錄下 cookai_llm_cache)
+- LLM_CACHE_MEMORY_ITEMS    記憶體 LRU 筆數 (預設 512)
+- LLM_HEDGE=0               關閉 hedged request
+- LLM_HTTP2=0               改用 HTTP/1.1
+- LLM_HTTP_MAX_CONNECTIONS / LLM_HTTP_MAX_KEEPALIVE  連線池上限 (預設 100 / 20)
+
+單次呼叫可用 llm_cache_options(enabled=False) 略過快取，或以 ttl= 指定該次寫入的有效時間。
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+import diskcache
+import httpx
+from cachetools import LRUCache
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import Generation
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from openai import OpenAI
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+DEFAULT_TTL_SEC = float(os.getenv("LLM_CACHE_TTL_SEC", 86400))
+DEFAULT_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "cookai_llm_cache"))
+MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", 512))
+
+# 單次呼叫的快取設定 (llm_cache_options)
+_cache_options: contextvars.ContextVar = contextvars.ContextVar("llm_cache_options", default=None)
+
+
+@contextmanager
+def llm_cache_options(enabled: bool = True, ttl: Optional[float] = None):
+    """
+    with llm_cache_options(enabled=False): 這段期間的 LLM 呼叫不讀也不寫快取
+    with llm_cache_options(ttl=600):       這段期間寫入的快取 600 秒後過期
+    """
+    token = _cache_options.set({"enabled": enabled, "ttl": ttl})
+    try:
+        yield
+    finally:
+        _cache_options.reset(token)
+
+
+def _options() -> Dict[str, Any]:
+    return _cache_options.get() or {"enabled": True, "ttl": None}
+
+
+# ==========================================
+# Cache
+# ==========================================
+
+class TieredLLMCache(BaseCache):
+    """
+    LangChain BaseCache 實作：記憶體 LRU 在前、diskcache 在後 (多 worker 共用磁碟層)。
+    值以 langchain_core.load.dumps 序列化，兩層存相同內容。
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, memory_items: int = MEMORY_ITEMS,
+                 ttl_sec: float = DEFAULT_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._memory = LRUCache(maxsize=memory_items)  # {key: (expires_at, payload)}
+        self._lock = threading.Lock()
+        self._disk = diskcache.Cache(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\n{prompt}".encode("utf-8")).hexdigest()
+
+    # ------------------------------------------
+    # Raw key / payload
+    # ------------------------------------------
+
+    def get_raw(self, key: str) -> Optional[str]:
+        if not CACHE_ENABLED or not _options()["enabled"]:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+
+        payload, expire_time = self._disk.get(key, expire_time=True)
+        if payload is None:
+            self.misses += 1
+            return None
+        # 磁碟命中：以磁碟剩餘的有效時間放回記憶體層
+        with self._lock:
+            self._memory[key] = (expire_time or now + self.ttl_sec, payload)
+        self.hits += 1
+        return payload
+
+    def set_raw(self, key: str, payload: str):
+        options = _options()
+        if not CACHE_ENABLED or not options["enabled"]:
+            return
+        ttl = options["ttl"] if options["ttl"] is not None else self.ttl_sec
+        with self._lock:
+            self._memory[key] = (time.time() + ttl, payload)
+        try:
+            self._disk.set(key, payload, expire=ttl)
+        except Exception as e:
+            logger.warning(f"LLM cache disk write failed: {e}")
+
+    # ------------------------------------------
+    # BaseCache
+    # ------------------------------------------
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        payload = self.get_raw(self.make_key(prompt, llm_string))
+        if payload is None:
+            return None
+        generations = [loads(item) for item in json.loads(payload)]
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if message is not None:
+                # 命中不產生費用：清掉 token 用量，呼叫端記錄的費用為 0
+                message.response_metadata = {**message.response_metadata, "token_usage": {}, "llm_cache_hit": True}
+                message.usage_metadata = None
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        self.set_raw(self.make_key(prompt, llm_string), json.dumps([dumps(g) for g in return_val]))
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._memory.clear()
+        self._disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 4) if total else 0.0}
+
+
+llm_cache = TieredLLMCache()
+
+
+# ==========================================
+# Gateway: 用途別逾時、預算與 hedge
+# ==========================================
+
+@dataclass(frozen=True)
+class UsagePolicy:
+    """
+    timeout_sec:     單次 HTTP 請求逾時 (傳給 ChatOpenAI / OpenAI client)
+    max_retries:     SDK 重試次數
+    budget_sec:      hedged_ainvoke 整體上限 (含重試與 hedge)，超過即拋 LLMBudgetExceeded
+    hedge_after_sec: 主要模型超過此時間仍未回覆，另以 hedge_model 同時發出備援請求
+    """
+    timeout_sec: float
+    max_retries: int
+    budget_sec: float
+    hedge_after_sec: Optional[float] = None
+    hedge_model: Optional[str] = None
+
+
+# usage_type 與 save_llm_charge 相同
+USAGE_POLICIES: Dict[str, UsagePolicy] = {
+    # 學生等待診斷與鷹架回覆，延遲最敏感
+    "code_correction": UsagePolicy(timeout_sec=45, max_retries=2, budget_sec=90,
+                                   hedge_after_sec=20, hedge_model="gpt-4o-mini"),
+    "intention": UsagePolicy(timeout_sec=30, max_retries=2, budget_sec=60,
+                             hedge_after_sec=15, hedge_model="gpt-4o-mini"),
+    # 練習題可稍後再看，不 hedge
+    "practice": UsagePolicy(timeout_sec=120, max_retries=3, budget_sec=240),
+    # 接近 AC 時預先生成的練習題草稿，可能被捨棄，重試較少
+    "practice_draft": UsagePolicy(timeout_sec=120, max_retries=1, budget_sec=180),
+    # 教師端生成題目，品質優先
+    "problem_generate": UsagePolicy(timeout_sec=180, max_retries=2, budget_sec=400),
+}
+DEFAULT_POLICY = UsagePolicy(timeout_sec=120, max_retries=3, budget_sec=240)
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "1") != "0"
+
+
+def get_policy(usage_type: Optional[str]) -> UsagePolicy:
+    return USAGE_POLICIES.get(usage_type, DEFAULT_POLICY)
+
+
+class LLMBudgetExceeded(TimeoutError):
+    """hedged_ainvoke 超過用途的 budget_sec"""
+
+
+class GatewayStats:
+    """各 usage_type 的呼叫、hedge 與逾時次數 (process 內累計)"""
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, usage_type: str, field: str):
+        with self._lock:
+            counts = self._counts.setdefault(usage_type, {"calls": 0, "hedged": 0, "hedge_wins": 0, "timeouts": 0, "errors": 0})
+            counts[field] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._counts.items()}
+
+
+gateway_stats = GatewayStats()
+
+
+# ==========================================
+# Clients
+# ==========================================
+
+HTTP2_ENABLED = os.getenv("LLM_HTTP2", "1") != "0"
+HTTP_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 100)),
+    max_keepalive_connections=int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", 20)),
+    keepalive_expiry=60,
+)
+
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional[httpx.AsyncClient] = None
+_http_lock = threading.Lock()
+
+
+def _http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """所有 LLM 呼叫共用的 HTTP/2 連線池 (逾時由各 model / 請求自行指定)"""
+    global _http_client, _http_async_client
+    with _http_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(http2=HTTP2_ENABLED, limits=HTTP_LIMITS)
+            _http_async_client = httpx.AsyncClient(http2=HTTP2_ENABLED, limits=HTTP_LIMITS)
+    return _http_client, _http_async_client
+
+
+_models: Dict[str, ChatOpenAI] = {}
+_models_lock = threading.Lock()
+
+
+def get_chat_model(model: str, usage_type: Optional[str] = None, **params) -> ChatOpenAI:
+    """
+    相同 (model, 參數) 回傳同一個 ChatOpenAI，共用 HTTP 連線池與 llm_cache。
+    逾時與重試次數依 usage_type 的 UsagePolicy，params 可個別覆寫。
+    """
+    policy = get_policy(usage_type)
+    params.setdefault("request_timeout", policy.timeout_sec)
+    params.setdefault("max_retries", policy.max_retries)
+    key = json.dumps({"model": model, **params}, sort_keys=True, default=str)
+    with _models_lock:
+        chat_model = _models.get(key)
+        if chat_model is None:
+            http_client, http_async_client = _http_clients()
+            chat_model = ChatOpenAI(
+                model=model, cache=llm_cache,
+                http_client=http_client, http_async_client=http_async_client,
+                **params,
+            )
+            _models[key] = chat_model
+    return chat_model
+
+
+def get_embeddings(model: str) -> OpenAIEmbeddings:
+    http_client, http_async_client = _http_clients()
+    return OpenAIEmbeddings(model=model, http_client=http_client, http_async_client=http_async_client)
+
+
+_openai_client: Optional[OpenAI] = None
+
+
+def get_openai_client() -> OpenAI:
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=_http_clients()[0])
+    return _openai_client
+
+
+def _backup_model(chat_model: ChatOpenAI, policy: UsagePolicy) -> Optional[ChatOpenAI]:
+    if not HEDGE_ENABLED or policy.hedge_after_sec is None or not policy.hedge_model:
+        return None
+    if chat_model.model_name == policy.hedge_model:
+        return None
+    params = {"temperature": chat_model.temperature} if chat_model.temperature is not None else {}
+    return get_chat_model(policy.hedge_model, usage_type=None,
+                          request_timeout=chat_model.request_timeout,
+                          max_retries=chat_model.max_retries, **params)
+
+
+async def hedged_ainvoke(chat_model: ChatOpenAI, messages: list, usage_type: str, **kwargs) -> Tuple[BaseMessage, str]:
+    """
+    依 usage_type 的 UsagePolicy 呼叫 LLM，回傳 (回覆, 實際回覆的模型名稱)。
+
+    主要模型超過 hedge_after_sec 未回覆時，另以較便宜的 hedge_model 同時發出請求，
+    先成功的回覆勝出並取消另一個；任一方失敗時等待另一方，兩方皆失敗拋出最後的例外。
+    整體超過 budget_sec 拋出 LLMBudgetExceeded。
+    呼叫端以回傳的模型名稱記錄 save_llm_charge。kwargs (如 response_format) 兩方相同。
+    """
+    policy = get_policy(usage_type)
+    gateway_stats.incr(usage_type, "calls")
+    deadline = time.monotonic() + policy.budget_sec
+
+    primary = asyncio.ensure_future(chat_model.ainvoke(messages, **kwargs))
+    pending: Dict[asyncio.Future, str] = {primary: chat_model.model_name}
+    backup = _backup_model(chat_model, policy)
+    last_error: Optional[BaseException] = None
+
+    try:
+        if backup is not None:
+            await asyncio.wait({primary}, timeout=min(policy.hedge_after_sec, policy.budget_sec))
+            if not primary.done():
+                logger.info(f"[LLM Gateway] hedge {usage_type}: {chat_model.model_name} -> {backup.model_name}")
+                gateway_stats.incr(usage_type, "hedged")
+                pending[asyncio.ensure_future(backup.ainvoke(messages, **kwargs))] = backup.model_name
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = await asyncio.wait(set(pending), timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                model_name = pending.pop(task)
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    logger.warning(f"[LLM Gateway] {usage_type} {model_name} failed: {last_error}")
+                    continue
+                if task is not primary:
+                    gateway_stats.incr(usage_type, "hedge_wins")
+                return task.result(), model_name
+
+        if last_error is not None and not pending:
+            gateway_stats.incr(usage_type, "errors")
+            raise last_error
+        gateway_stats.incr(usage_type, "timeouts")
+        raise LLMBudgetExceeded(f"{usage_type} exceeded {policy.budget_sec}s")
+    finally:
+        for task in pending:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # 同時完成但未採用的結果：取出例外，避免 never retrieved 警告
+
+
+def parse_completion(
+    model: str,
+    messages: List[Dict[str, str]],
+    response_format: Type[BaseModel],
+    usage_type: str = "problem_generate",
+    **params,
+) -> Tuple[BaseModel, Optional[Any]]:
+    """
+    OpenAI structured output (beta.chat.completions.parse)，回傳 (parsed, usage)。
+    key 含 response_format 的 JSON schema；快取命中時 usage 為 None。
+    逾時與重試依 usage_type 的 UsagePolicy。
+    """
+    key = hashlib.sha256(json.dumps({
+        "model": model,
+        "messages": messages,
+        "schema": response_format.model_json_schema(),
+        "params": params,
+    }, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+    payload = llm_cache.get_raw(key)
+    if payload is not None:
+        return response_format.model_validate_json(payload), None
+
+    policy = get_policy(usage_type)
+    gateway_stats.incr(usage_type, "calls")
+    client = get_openai_client().with_options(timeout=policy.timeout_sec, max_retries=policy.max_retries)
+    completion = client.beta.chat.completions.parse(
+        model=model, messages=messages, response_format=response_format, **params
+    )
+    parsed = completion.choices[0].message.parsed
+    if parsed is not None:
+        llm_cache.set_raw(key, parsed.model_dump_json())
+    return parsed, completion.usage
@@ -31,7 +31,7 @@ problem_table = Table(
     Column("create_time", DateTime),
     # New columns
     Column("hint", Text),
-    Column("test_cases", JSON),
+    # 測資存於 debugging.problem_test_case (db.problem_test_case_table)，不隨題目讀取
     Column("time_limit", Integer, default=1000),
     Column("memory_limit", Integer, default=256),
     Column("judge_type", String, default="custom"),
@@ -60,7 +60,6 @@ class Problem(Base):
             "samples": self.samples,
             "create_time": self.create_time.isoformat() if self.create_time else None,
             "hint": self.hint,
-            "test_cases": self.test_cases,
             "time_limit": self.time_limit,
             "memory_limit": self.memory_limit,
             "judge_type": self.judge_type,
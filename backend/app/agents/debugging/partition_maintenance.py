@@ -0,0 +1,288 @@
+"""
+Partition Maintenance: 學期分區的建立、卸載與封存
+
+debugging_code_submission / debugging_dialogue 依 submitted_at 以學期 RANGE 分區
+(見 migration r3s4t5u6v7w8)。此工具建議每日由排程執行:
+
+1. 預先建立本學期與之後 N 個學期的分區 (若 default 分區已有該區間資料，一併搬入新分區)
+2. 超過保留期限 (RETENTION_TERMS 個學期，含本學期) 的分區:
+   - COPY 匯出為 <archive>/<table>/<partition>.csv.gz，並寫出 <partition>.json (區間、欄位、列數)
+   - DETACH PARTITION 後 DROP，或以 --keep-detached 移至 debugging_archive schema 保留
+
+封存檔可用 COPY ... FROM PROGRAM 'gunzip -c ...' 還原後再 ATTACH 回分區表。
+
+用法:
+    python -m backend.app.agents.debugging.partition_maintenance --archive-dir ./partition_archive
+    python -m backend.app.agents.debugging.partition_maintenance --dry-run
+"""
+import os
+import re
+import gzip
+import json
+import argparse
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from .db import engine, term_start_of, next_term_start
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = "debugging"
+ARCHIVE_SCHEMA = "debugging_archive"
+PARTITION_COLUMN = "submitted_at"
+PARTITIONED_TABLES = ["debugging_code_submission", "debugging_dialogue"]
+
+DEFAULT_ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR", "./partition_archive")
+DEFAULT_RETENTION_TERMS = int(os.getenv("RETENTION_TERMS", 4))
+DEFAULT_TERMS_AHEAD = 1
+
+_BOUND_RE = re.compile(r"FROM \((?P<lower>[^)]*)\) TO \((?P<upper>[^)]*)\)")
+
+
+# ==========================================
+# Terms & Partitions
+# ==========================================
+
+def previous_term_start(term_start: datetime) -> datetime:
+    return term_start_of(term_start - timedelta(days=1))
+
+
+def partition_name(table_name: str, term_start: datetime) -> str:
+    return f"{table_name}_p{term_start:%Y%m}"
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    value = value.strip()
+    if value == "MINVALUE" or value == "MAXVALUE":
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def list_partitions(conn, table_name: str) -> List[Dict]:
+    """列出分區與其區間 (lower / upper 為 None 代表 MINVALUE / MAXVALUE)"""
+    rows = conn.execute(
+        text(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = CAST(:parent AS regclass)
+            ORDER BY c.relname
+            """
+        ),
+        {"parent": f"{SCHEMA}.{table_name}"},
+    ).fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        if bound == "DEFAULT":
+            partitions.append({"name": name, "default": True, "lower": None, "upper": None})
+            continue
+        match = _BOUND_RE.search(bound)
+        if not match:
+            logger.warning(f"Unrecognized partition bound for {name}: {bound}")
+            continue
+        partitions.append({
+            "name": name,
+            "default": False,
+            "lower": _parse_bound(match.group("lower")),
+            "upper": _parse_bound(match.group("upper")),
+        })
+    return partitions
+
+
+def _is_partitioned(conn, table_name: str) -> bool:
+    return bool(conn.execute(
+        text("SELECT count(*) FROM pg_partitioned_table WHERE partrelid = to_regclass(:name)"),
+        {"name": f"{SCHEMA}.{table_name}"},
+    ).scalar())
+
+
+# ==========================================
+# Create
+# ==========================================
+
+def ensure_term_partition(conn, table_name: str, start: datetime, end: datetime, dry_run: bool = False) -> bool:
+    """建立 [start, end) 的學期分區，回傳是否新建。default 分區中落在此區間的資料會一併搬入。"""
+    parent = f"{SCHEMA}.{table_name}"
+    name = partition_name(table_name, start)
+    for partition in list_partitions(conn, table_name):
+        if partition["name"] == name:
+            return False
+        if not partition["default"] and (partition["lower"] is None or partition["lower"] < end) \
+                and (partition["upper"] is None or partition["upper"] > start):
+            logger.warning(f"{parent}: [{start:%Y-%m-%d}, {end:%Y-%m-%d}) overlaps {partition['name']}, skipped")
+            return False
+
+    if dry_run:
+        logger.info(f"[dry-run] create {SCHEMA}.{name}")
+        return True
+
+    bounds = {"start": start, "end": end}
+    default_name = f"{SCHEMA}.{table_name}_default"
+    default_has_rows = conn.execute(
+        text(f"SELECT EXISTS (SELECT 1 FROM {default_name} "
+             f"WHERE {PARTITION_COLUMN} >= :start AND {PARTITION_COLUMN} < :end)"),
+        bounds,
+    ).scalar() if conn.execute(text("SELECT to_regclass(:name)"), {"name": default_name}).scalar() else False
+
+    if default_has_rows:
+        # default 分區已有此區間資料：先建獨立資料表、搬入資料，再 ATTACH
+        conn.execute(text(f"CREATE TABLE {SCHEMA}.{name} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        moved = conn.execute(
+            text(
+                f"""
+                WITH moved AS (
+                    DELETE FROM {default_name}
+                    WHERE {PARTITION_COLUMN} >= :start AND {PARTITION_COLUMN} < :end
+                    RETURNING *
+                )
+                INSERT INTO {SCHEMA}.{name} SELECT * FROM moved
+                """
+            ),
+            bounds,
+        ).rowcount
+        conn.execute(text(
+            f"ALTER TABLE {parent} ATTACH PARTITION {SCHEMA}.{name} "
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        ))
+        logger.info(f"Created {SCHEMA}.{name} and moved {moved} rows from default partition")
+    else:
+        conn.execute(text(
+            f"CREATE TABLE {SCHEMA}.{name} PARTITION OF {parent} "
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        ))
+        logger.info(f"Created {SCHEMA}.{name}")
+    return True
+
+
+# ==========================================
+# Archive
+# ==========================================
+
+def archive_partition(table_name: str, partition: Dict, archive_dir: str,
+                      keep_detached: bool = False, dry_run: bool = False) -> int:
+    """
+    匯出分區為 gzip CSV 後卸載。過期分區不再有寫入，
+    因此先在一般連線 COPY (不鎖分區表)，確認列數一致後才 DETACH + DROP。
+    """
+    name = partition["name"]
+    if dry_run:
+        logger.info(f"[dry-run] archive {SCHEMA}.{name} (< {partition['upper']})")
+        return 0
+
+    out_dir = os.path.join(archive_dir, table_name)
+    os.makedirs(out_dir, exist_ok=True)
+    data_path = os.path.join(out_dir, f"{name}.csv.gz")
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position",
+            (SCHEMA, name),
+        )
+        columns = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f"SELECT count(*) FROM {SCHEMA}.{name}")
+        row_count = cursor.fetchone()[0]
+        with gzip.open(data_path, "wt", encoding="utf-8") as f:
+            cursor.copy_expert(f"COPY {SCHEMA}.{name} TO STDOUT WITH (FORMAT csv, HEADER true)", f)
+        raw.commit()
+
+        manifest = {
+            "table": f"{SCHEMA}.{table_name}",
+            "partition": name,
+            "lower": partition["lower"].isoformat() if partition["lower"] else None,
+            "upper": partition["upper"].isoformat() if partition["upper"] else None,
+            "columns": columns,
+            "rows": row_count,
+            "archived_at": datetime.now().isoformat(),
+        }
+        with open(os.path.join(out_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        # 卸載: 再次確認列數，避免匯出後仍有寫入
+        cursor.execute(f"ALTER TABLE {SCHEMA}.{table_name} DETACH PARTITION {SCHEMA}.{name}")
+        cursor.execute(f"SELECT count(*) FROM {SCHEMA}.{name}")
+        if cursor.fetchone()[0] != row_count:
+            raise RuntimeError(f"{SCHEMA}.{name} changed during archive, aborted")
+        if keep_detached:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+            cursor.execute(f"ALTER TABLE {SCHEMA}.{name} SET SCHEMA {ARCHIVE_SCHEMA}")
+        else:
+            cursor.execute(f"DROP TABLE {SCHEMA}.{name}")
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+    logger.info(f"Archived {SCHEMA}.{name}: {row_count} rows -> {data_path}")
+    return row_count
+
+
+# ==========================================
+# Entry
+# ==========================================
+
+def run_maintenance(archive_dir: str = DEFAULT_ARCHIVE_DIR, retention_terms: int = DEFAULT_RETENTION_TERMS,
+                    terms_ahead: int = DEFAULT_TERMS_AHEAD, keep_detached: bool = False,
+                    dry_run: bool = False) -> Dict[str, Dict[str, int]]:
+    """建立即將到來的學期分區並封存過期分區，回傳各表新建 / 封存的分區數"""
+    current = term_start_of(datetime.now())
+    cutoff = current
+    for _ in range(max(retention_terms, 1) - 1):
+        cutoff = previous_term_start(cutoff)
+
+    summary = {}
+    for table_name in PARTITIONED_TABLES:
+        with engine.begin() as conn:
+            if not _is_partitioned(conn, table_name):
+                logger.warning(f"{SCHEMA}.{table_name} is not partitioned, skipped")
+                continue
+
+            created = 0
+            start = current
+            for _ in range(terms_ahead + 1):
+                end = next_term_start(start)
+                created += ensure_term_partition(conn, table_name, start, end, dry_run)
+                start = end
+            expired = [
+                p for p in list_partitions(conn, table_name)
+                if not p["default"] and p["upper"] is not None and p["upper"] <= cutoff
+            ]
+
+        for partition in expired:
+            archive_partition(table_name, partition, archive_dir, keep_detached, dry_run)
+        summary[table_name] = {"created": created, "archived": len(expired)}
+        logger.info(f"[Partition Maintenance] {table_name}: created {created}, archived {len(expired)} "
+                    f"(retention from {cutoff:%Y-%m-%d})")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create upcoming term partitions and archive expired ones.")
+    parser.add_argument("--archive-dir", default=DEFAULT_ARCHIVE_DIR, help="Cold storage directory for archived partitions")
+    parser.add_argument("--retention-terms", type=int, default=DEFAULT_RETENTION_TERMS,
+                        help="Number of terms to keep online, including the current term")
+    parser.add_argument("--terms-ahead", type=int, default=DEFAULT_TERMS_AHEAD,
+                        help="Number of upcoming terms to pre-create partitions for")
+    parser.add_argument("--keep-detached", action="store_true",
+                        help=f"Move expired partitions to the {ARCHIVE_SCHEMA} schema instead of dropping them")
+    parser.add_argument("--dry-run", action="store_true", help="Only log what would be done")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    summary = run_maintenance(args.archive_dir, args.retention_terms, args.terms_ahead,
+                              args.keep_detached, args.dry_run)
+    for table_name, counts in summary.items():
+        print(f"[Partition Maintenance] {table_name}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
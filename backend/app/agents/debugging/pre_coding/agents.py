@@ -2,23 +2,18 @@
 Pre-Coding Agents Module
 """
 
-import os
-import json
 from typing import Dict, Any, List, Tuple, Optional
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
 import re
 
 import tiktoken
-from backend.app.agents.debugging.db import save_llm_charge
+from pydantic import BaseModel
+from backend.app.agents.debugging.llm_client import get_chat_model
+from backend.app.agents.debugging.structured_output import ainvoke_structured
 
 # Initialize LLM
-llm = ChatOpenAI(
-    model="gpt-5.1", 
-    temperature=0.3,
-    api_key=os.getenv("OPENAI_API_KEY")
-)
-llm2 = ChatOpenAI(model="gpt-4o-mini", temperature=0.3, api_key=os.getenv("OPENAI_API_KEY"))
+llm = get_chat_model("gpt-5.1", usage_type="intention", temperature=0.3)
+llm2 = get_chat_model("gpt-4o-mini", usage_type="intention", temperature=0.3)
 
 MAX_INTENTION_TOKEN_LIMIT = 350
 
@@ -31,7 +26,22 @@ def count_tokens(text: str) -> int:
         # Fallback approximation: 1 token ~= 1.5 chars for mixed, but safe side 1 char
         return len(text)
 
-# --- 1. 共用輔助 Agent ---
+# --- 結構化輸出 Schema ---
+
+class SuggestionOptions(BaseModel):
+    options: List[str]
+
+
+class UnderstandingResult(BaseModel):
+    reply: str
+    score: int
+    has_decomposition: bool
+
+
+class DecompositionResult(BaseModel):
+    reply: str
+    score: int
+
 
 # --- 1. 共用輔助 Agent ---
 
@@ -145,25 +155,16 @@ class SuggestionAgent:
 }}
 """
         try:
-            response = await llm.ainvoke([
-                SystemMessage(content=system_prompt),
-                HumanMessage(content="請根據學生歷史狀態與當前問題，生成建議回答")
-            ])
-            # 記錄 token 用量
-            if student_id:
-                usage = response.response_metadata.get("token_usage", {})
-                details = usage.get("prompt_tokens_details") or {}
-                save_llm_charge(
-                    student_id=student_id,
-                    usage_type="intention",
-                    model_name="gpt-5.1",
-                    input_tokens=usage.get("prompt_tokens", 0),
-                    cached_input_tokens=details.get("cached_tokens", 0),
-                    output_tokens=usage.get("completion_tokens", 0),
-                    problem_id=problem_id,
-                )
-            result = json.loads(response.content)
-            return result.get("options", [])
+            result = await ainvoke_structured(
+                llm,
+                [
+                    SystemMessage(content=system_prompt),
+                    HumanMessage(content="請根據學生歷史狀態與當前問題，生成建議回答")
+                ],
+                SuggestionOptions, usage_type="intention",
+                student_id=student_id, problem_id=problem_id,
+            )
+            return result.options
         except Exception:
             return ["我不太確定，可以給個提示嗎？", "這題的輸入是...", "需要更多說明"]
 
@@ -244,29 +245,19 @@ class UnderstandingAgent:
 
         try:
             # 4. 執行評估
-            response = await llm.ainvoke([
-                SystemMessage(content=system_prompt),
-                HumanMessage(content="請根據以上對話歷史進行評估")
-            ])
-            # 記錄 token 用量
-            if student_id:
-                usage = response.response_metadata.get("token_usage", {})
-                details = usage.get("prompt_tokens_details") or {}
-                save_llm_charge(
-                    student_id=student_id,
-                    usage_type="intention",
-                    model_name="gpt-5.1",
-                    input_tokens=usage.get("prompt_tokens", 0),
-                    cached_input_tokens=details.get("cached_tokens", 0),
-                    output_tokens=usage.get("completion_tokens", 0),
-                    problem_id=problem_id,
-                )
-            
-            result = json.loads(response.content)
+            result = await ainvoke_structured(
+                llm,
+                [
+                    SystemMessage(content=system_prompt),
+                    HumanMessage(content="請根據以上對話歷史進行評估")
+                ],
+                UnderstandingResult, usage_type="intention",
+                student_id=student_id, problem_id=problem_id,
+            )
             
-            agent_reply = result.get("reply", "請試著描述這題的輸入是什麼？")
-            score = min(4, max(1, int(result.get("score", 1))))
-            has_decomposition = result.get("has_decomposition", False)
+            agent_reply = result.reply or "請試著描述這題的輸入是什麼？"
+            score = min(4, max(1, result.score))
+            has_decomposition = result.has_decomposition
             should_transition = score >= 4
             
             # 5. 針對「Agent 這次產生的新回覆」生成建議選項
@@ -358,28 +349,18 @@ class DecompositionAgent:
 
         try:
             # 4. 執行評估
-            response = await llm.ainvoke([
-                SystemMessage(content=system_prompt),
-                HumanMessage(content="請根據以上對話歷史進行評估")
-            ])
-            # 記錄 token 用量
-            if student_id:
-                usage = response.response_metadata.get("token_usage", {})
-                details = usage.get("prompt_tokens_details") or {}
-                save_llm_charge(
-                    student_id=student_id,
-                    usage_type="intention",
-                    model_name="gpt-5.1",
-                    input_tokens=usage.get("prompt_tokens", 0),
-                    cached_input_tokens=details.get("cached_tokens", 0),
-                    output_tokens=usage.get("completion_tokens", 0),
-                    problem_id=problem_id,
-                )
-            
-            result = json.loads(response.content)
+            result = await ainvoke_structured(
+                llm,
+                [
+                    SystemMessage(content=system_prompt),
+                    HumanMessage(content="請根據以上對話歷史進行評估")
+                ],
+                DecompositionResult, usage_type="intention",
+                student_id=student_id, problem_id=problem_id,
+            )
             
-            agent_reply = result.get("reply", "請試著列出解決這題需要哪些步驟")
-            score = min(4, max(1, int(result.get("score", 1))))
+            agent_reply = result.reply or "請試著列出解決這題需要哪些步驟"
+            score = min(4, max(1, result.score))
             is_complete = score >= 4
             
             # 5. 針對新回覆生成建議
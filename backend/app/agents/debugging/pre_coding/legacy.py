@@ -10,7 +10,8 @@ from sqlalchemy import select, insert, update, and_
 from datetime import datetime
 from typing import Dict, Any, List
 
-from ..db import engine, precoding_question_table, precoding_student_answers_table
+from ..db import engine, precoding_question_table, precoding_student_answers_table, record_precoding_attempt
+from ..dashboard_feed import dashboard_feed
 
 
 def sanitize_question_data(questions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -234,9 +235,29 @@ def process_precoding_submission(
                 )
             ).values(**update_values)
         )
+
+        # 10. 增量更新儀表板統計 (首答選項分佈 / 每題最新作答)
+        attempt = record_precoding_attempt(
+            conn, student_id, problem_id, stage,
+            question_id, selected_option_id, is_correct
+        )
         conn.commit()
 
-        # 10. 回傳結果
+        # 11. 推播儀表板差異
+        dashboard_feed.publish({
+            "type": "precoding_answer",
+            "problem_id": problem_id,
+            "student_id": student_id,
+            "stage": stage,
+            "q_id": question_id,
+            "selected_option_id": selected_option_id,
+            "is_correct": is_correct,
+            "first_attempt": attempt["attempts"] == 1,
+            "previous_latest_is_correct": attempt["previous_latest_is_correct"],
+            "progress_stage": new_stage
+        })
+
+        # 12. 回傳結果
         return {
             "is_correct": is_correct,
             "feedback": feedback,
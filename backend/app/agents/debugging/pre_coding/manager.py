@@ -5,6 +5,7 @@ This module contains the main manager class that coordinates the pre-coding
 chatbot flow, including session management and stage transitions.
 """
 
+import asyncio
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timezone
 from sqlalchemy import select, insert, update, and_
@@ -13,9 +14,12 @@ from ..db import (
     engine, 
     precoding_logic_status_table, 
     precoding_logic_logs_table,
-    precoding_student_answers_table  # Legacy table for 403 fix
+    precoding_student_answers_table,  # Legacy table for 403 fix
+    number_chat_messages,
+    append_chat_messages
 )
 from ..oj_models import get_problem_by_id
+from ..dashboard_feed import dashboard_feed
 from .agents import UnderstandingAgent, DecompositionAgent, InputFilterAgent, generate_opening_question
 
 
@@ -106,10 +110,12 @@ class PreCodingManager:
             ))
             
             # Insert logs record
+            initial_log = number_chat_messages(initial_log)
             conn.execute(insert(precoding_logic_logs_table).values(
                 student_id=student_id,
                 problem_id=problem_id,
-                chat_log=initial_log
+                chat_log=initial_log,
+                message_seq=len(initial_log)
             ))
             
             conn.commit()
@@ -200,13 +206,14 @@ class PreCodingManager:
         
         # Append student message to log
         now = datetime.now(timezone.utc)
-        chat_log.append({
+        student_entry = {
             "role": "student",
             "content": message,
             "stage": current_stage,
             "score": current_score,
             "timestamp": now.isoformat()
-        })
+        }
+        chat_log.append(student_entry)
         
         # Process based on current stage
         new_stage = current_stage
@@ -257,14 +264,15 @@ class PreCodingManager:
             suggested_replies = []
         
         # Append agent reply to log (含建議回覆)
-        chat_log.append({
+        agent_entry = {
             "role": "agent",
             "content": agent_reply,
             "stage": new_stage,
             "score": new_score,
             "timestamp": datetime.now(timezone.utc).isoformat(),
             "suggested_replies": suggested_replies  # 與 agent 訊息一起儲存
-        })
+        }
+        chat_log.append(agent_entry)
         
         # Update database
         with engine.begin() as conn:
@@ -282,17 +290,29 @@ class PreCodingManager:
                 )
             )
             
-            # Update logs
-            conn.execute(
-                update(precoding_logic_logs_table).where(
+            # Append logs (jsonb || 追加本回合的兩則訊息，不整份改寫 chat_log)
+            new_messages = [student_entry, agent_entry]
+            log_id = conn.execute(
+                select(precoding_logic_logs_table.c.id).where(
                     and_(
                         precoding_logic_logs_table.c.student_id == student_id,
                         precoding_logic_logs_table.c.problem_id == problem_id
                     )
-                ).values(
-                    chat_log=chat_log
                 )
-            )
+            ).scalar()
+            message_seq = append_chat_messages(conn, precoding_logic_logs_table, log_id, new_messages) if log_id else None
+            if message_seq is None:
+                message_seq = len(chat_log)
+                chat_log[:] = number_chat_messages(chat_log)
+                conn.execute(insert(precoding_logic_logs_table).values(
+                    student_id=student_id,
+                    problem_id=problem_id,
+                    chat_log=chat_log,
+                    message_seq=message_seq
+                ))
+            else:
+                student_entry["seq"] = message_seq - 1
+                agent_entry["seq"] = message_seq
             
             if is_completed:
                 # Check if legacy record exists
@@ -329,6 +349,14 @@ class PreCodingManager:
                         )
                     )
         
+        if is_completed:
+            await asyncio.to_thread(dashboard_feed.publish, {
+                "type": "precoding_logic",
+                "problem_id": problem_id,
+                "student_id": student_id,
+                "logic_completed": True
+            })
+        
         return {
             "reply": agent_reply,
             "current_stage": new_stage,
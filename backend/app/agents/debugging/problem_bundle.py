@@ -0,0 +1,340 @@
+"""
+Problem Bundle: 以章節為單位批次匯入 / 匯出題目
+
+Bundle 為 zip 檔，每題一個資料夾:
+
+    <problem_id>/problem.yaml       題目欄位 (title、description、samples、time_limit ...)
+    <problem_id>/cases/001.in       測資輸入
+    <problem_id>/cases/001.out      測資期望輸出
+    ...
+
+- 測資依檔名排序，.in / .out 須成對；problem.yaml 內的 test_cases 會被 cases/ 覆蓋
+- stdio 題型的測資檔為純文字；function 題型 (judge_type: function) 的測資檔為 JSON
+  (輸入為引數陣列或單一值、輸出為期望的回傳值)，匯入時解析、匯出時序列化
+- description / input_description / output_description 可省略 (與題目編輯器相同，視為空字串)，
+  匯出時空白欄位不寫入
+- 描述欄位在 YAML 中使用一般換行，寫入時與 create_or_update_problem 相同轉為 <br>
+- 匯入: 每題獨立驗證，有錯誤的題目回報後略過；通過驗證的題目累積成批次，
+  以多列 INSERT ... ON CONFLICT DO UPDATE 於一個 transaction 寫入
+- 匯出: 以 server-side cursor 逐題讀取，zip 邊產生邊串流，不在記憶體中組出整個檔案
+"""
+import json
+import zipfile
+import posixpath
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import yaml
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .db import engine, save_problem_test_cases, load_problem_test_cases
+from .oj_models import problem_table
+
+PROBLEM_FILE = "problem.yaml"
+CASES_DIR = "cases"
+INPUT_SUFFIX = ".in"
+OUTPUT_SUFFIX = ".out"
+
+HTML_TEXT_FIELDS = ["description", "input_description", "output_description", "hint"]
+REQUIRED_TEXT_FIELDS = ["title"]
+TEXT_FIELDS = ["description", "input_description", "output_description"]
+OPTIONAL_TEXT_FIELDS = ["hint", "entry_point", "solution_code"]
+INT_FIELDS = {"time_limit": 1000, "memory_limit": 256}
+DATETIME_FIELDS = ["start_time", "end_time"]
+JUDGE_TYPES = ("stdio", "function")
+
+# 單一批次的題目數與測資總量上限 (先到者為準)
+IMPORT_BATCH_SIZE = 50
+IMPORT_BATCH_BYTES = 32 * 1024 * 1024
+EXPORT_FETCH_SIZE = 20
+
+
+class BundleError(ValueError):
+    """Bundle 格式錯誤 (整個檔案無法處理)"""
+
+
+def nl_to_br(text: str) -> str:
+    if not text: return ""
+    return text.replace("\n", "<br>")
+
+
+def br_to_nl(text: str) -> str:
+    if not text: return ""
+    return text.replace("<br>", "\n")
+
+
+# ==========================================
+# Import
+# ==========================================
+
+def _group_members(zf: zipfile.ZipFile) -> Dict[str, Dict[str, Any]]:
+    """依題目資料夾整理 zip 內的檔案: {problem_dir: {"yaml": ZipInfo, "cases": {stem: {".in": ZipInfo, ".out": ZipInfo}}}}"""
+    groups: Dict[str, Dict[str, Any]] = {}
+    for info in zf.infolist():
+        if info.is_dir():
+            continue
+        parts = posixpath.normpath(info.filename).split("/")
+        if parts[0] in ("", "..") or parts[0].startswith("__MACOSX"):
+            continue
+        group = groups.setdefault(parts[0], {"yaml": None, "cases": {}})
+        if parts[1:] == [PROBLEM_FILE]:
+            group["yaml"] = info
+        elif len(parts) == 3 and parts[1] == CASES_DIR:
+            stem, suffix = posixpath.splitext(parts[2])
+            if suffix in (INPUT_SUFFIX, OUTPUT_SUFFIX):
+                group["cases"].setdefault(stem, {})[suffix] = info
+    return groups
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def _validate_problem(problem_dir: str, meta: Any, chapter_id: Optional[str]) -> Tuple[Dict[str, Any], List[str]]:
+    """將 problem.yaml 轉為 problem 資料列，回傳 (row, errors)"""
+    if not isinstance(meta, dict):
+        return {}, [f"{PROBLEM_FILE} must be a mapping"]
+
+    errors = []
+    problem_id = str(meta.get("problem_id") or problem_dir)
+    if problem_id != problem_dir:
+        errors.append(f"problem_id '{problem_id}' does not match folder name")
+    if chapter_id and not problem_id.startswith(f"{chapter_id}_"):
+        errors.append(f"problem_id '{problem_id}' is not in chapter '{chapter_id}'")
+
+    row: Dict[str, Any] = {"problem_id": problem_id}
+    for field in REQUIRED_TEXT_FIELDS:
+        value = meta.get(field)
+        if not isinstance(value, str) or not value.strip():
+            errors.append(f"'{field}' is required")
+        row[field] = value
+    for field in TEXT_FIELDS:
+        value = meta.get(field)
+        if value is None:
+            value = ""
+        if not isinstance(value, str):
+            errors.append(f"'{field}' must be a string")
+        row[field] = value
+    for field in OPTIONAL_TEXT_FIELDS:
+        value = meta.get(field)
+        if value is not None and not isinstance(value, str):
+            errors.append(f"'{field}' must be a string")
+        row[field] = value
+    for field in HTML_TEXT_FIELDS:
+        if row.get(field):
+            row[field] = nl_to_br(row[field])
+
+    for field, default in INT_FIELDS.items():
+        value = meta.get(field, default)
+        if not isinstance(value, int) or value <= 0:
+            errors.append(f"'{field}' must be a positive integer")
+        row[field] = value
+    for field in DATETIME_FIELDS:
+        try:
+            row[field] = _parse_datetime(meta.get(field))
+        except ValueError:
+            errors.append(f"'{field}' is not an ISO datetime")
+
+    judge_type = meta.get("judge_type", "stdio")
+    if judge_type not in JUDGE_TYPES:
+        errors.append(f"'judge_type' must be one of {JUDGE_TYPES}")
+    if judge_type == "function" and not row.get("entry_point"):
+        errors.append("'entry_point' is required for function judge")
+    row["judge_type"] = judge_type
+
+    samples = meta.get("samples") or []
+    if not isinstance(samples, list) or not all(
+        isinstance(s, dict) and isinstance(s.get("input"), str) and isinstance(s.get("output"), str) for s in samples
+    ):
+        errors.append("'samples' must be a list of {input, output} strings")
+    row["samples"] = samples
+    return row, errors
+
+
+def parse_case(raw_input: bytes, raw_output: bytes, judge_type: Optional[str]) -> Dict[str, Any]:
+    """
+    將一組測資檔內容轉為 test case；function 題型的內容以 JSON 解析 (build_driver_code 需要引數陣列而非字串)。
+    格式錯誤時拋出 ValueError (訊息接在 "... is" 之後)。
+    """
+    try:
+        case = {"input": raw_input.decode("utf-8"), "output": raw_output.decode("utf-8")}
+    except UnicodeDecodeError:
+        raise ValueError("not valid UTF-8")
+    if judge_type == "function":
+        try:
+            case = {key: json.loads(value) for key, value in case.items()}
+        except json.JSONDecodeError as e:
+            raise ValueError(f"not valid JSON (function judge): {e}")
+    return case
+
+
+def _read_cases(
+    zf: zipfile.ZipFile, cases: Dict[str, Dict[str, zipfile.ZipInfo]], judge_type: str
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """讀取成對的測資檔 (內容轉換見 parse_case)"""
+    test_cases, errors = [], []
+    for stem in sorted(cases):
+        pair = cases[stem]
+        missing = [s for s in (INPUT_SUFFIX, OUTPUT_SUFFIX) if s not in pair]
+        if missing:
+            errors.append(f"case '{stem}' is missing {', '.join(missing)}")
+            continue
+        try:
+            test_cases.append(parse_case(zf.read(pair[INPUT_SUFFIX]), zf.read(pair[OUTPUT_SUFFIX]), judge_type))
+        except ValueError as e:
+            errors.append(f"case '{stem}' is {e}")
+    return test_cases, errors
+
+
+def _upsert_problems(rows: List[Dict[str, Any]]):
+    """
+    一個 transaction 內以多列 INSERT ... ON CONFLICT DO UPDATE 寫入一批題目 (create_time 僅在新增時設定)，
+    測資寫入 problem_test_case。
+    """
+    now = datetime.now()
+    problems = [{k: v for k, v in row.items() if k != "test_cases"} for row in rows]
+    stmt = pg_insert(problem_table).values([{**row, "create_time": now} for row in problems])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[problem_table.c.problem_id],
+        set_={key: stmt.excluded[key] for key in problems[0] if key != "problem_id"},
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt)
+        for row in rows:
+            save_problem_test_cases(conn, row["problem_id"], row["test_cases"])
+
+
+def import_bundle(fileobj, chapter_id: Optional[str] = None, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    匯入 bundle (fileobj 須可 seek，例如 UploadFile.file)。
+    回傳 {"imported": [...], "failed": {problem_id: [errors]}}，dry_run 時只驗證不寫入。
+    """
+    try:
+        zf = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        raise BundleError(f"Invalid zip file: {e}")
+
+    imported, failed = [], {}
+    batch, batch_bytes = [], 0
+
+    def flush():
+        nonlocal batch, batch_bytes
+        if batch and not dry_run:
+            _upsert_problems(batch)
+        imported.extend(row["problem_id"] for row in batch)
+        batch, batch_bytes = [], 0
+
+    with zf:
+        groups = _group_members(zf)
+        if not groups:
+            raise BundleError("Bundle contains no problems")
+
+        for problem_dir in sorted(groups):
+            group = groups[problem_dir]
+            if group["yaml"] is None:
+                failed[problem_dir] = [f"missing {PROBLEM_FILE}"]
+                continue
+            try:
+                meta = yaml.safe_load(zf.read(group["yaml"]))
+            except yaml.YAMLError as e:
+                failed[problem_dir] = [f"invalid YAML: {e}"]
+                continue
+
+            row, errors = _validate_problem(problem_dir, meta, chapter_id)
+            test_cases, case_errors = _read_cases(zf, group["cases"], row.get("judge_type"))
+            errors.extend(case_errors)
+            if errors:
+                failed[problem_dir] = errors
+                continue
+
+            row["test_cases"] = test_cases
+            batch.append(row)
+            batch_bytes += sum(info.file_size for pair in group["cases"].values() for info in pair.values())
+            if len(batch) >= IMPORT_BATCH_SIZE or batch_bytes >= IMPORT_BATCH_BYTES:
+                flush()
+        flush()
+
+    return {"imported": imported, "failed": failed, "dry_run": dry_run}
+
+
+# ==========================================
+# Export
+# ==========================================
+
+class _ZipStream:
+    """只可寫入的緩衝區: zipfile 寫入後由產生器取走已完成的位元組 (不支援 seek，zipfile 會改用 data descriptor)"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def problem_to_yaml(mapping) -> str:
+    meta = {"problem_id": mapping["problem_id"]}
+    for field in REQUIRED_TEXT_FIELDS + TEXT_FIELDS + OPTIONAL_TEXT_FIELDS:
+        # 空字串不寫入 (匯入時省略即為空字串，optional 欄位則為 NULL)
+        if mapping[field]:
+            meta[field] = br_to_nl(mapping[field]) if field in HTML_TEXT_FIELDS else mapping[field]
+    meta["samples"] = mapping["samples"] or []
+    for field in INT_FIELDS:
+        if mapping[field] is not None:
+            meta[field] = mapping[field]
+    meta["judge_type"] = mapping["judge_type"] or "stdio"
+    for field in DATETIME_FIELDS:
+        if mapping[field] is not None:
+            meta[field] = mapping[field].isoformat()
+    return yaml.safe_dump(meta, allow_unicode=True, sort_keys=False)
+
+
+def _case_text(value, judge_type: str) -> str:
+    """測資內容轉為檔案文字：function 題型一律為 JSON (字串也加上引號，匯入時才能還原型別)"""
+    if judge_type == "function":
+        return json.dumps(value, ensure_ascii=False)
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def iter_chapter_bundle(chapter_id: str) -> Iterator[bytes]:
+    """逐題產生 zip 內容 (供 StreamingResponse 使用)"""
+    stream = _ZipStream()
+    stmt = select(problem_table).where(
+        problem_table.c.problem_id.like(f"{chapter_id}_%")
+    ).order_by(problem_table.c.problem_id)
+
+    # 題目以 server-side cursor 逐批讀取，測資另以第二條連線逐題讀取
+    with engine.connect() as conn, engine.connect() as case_conn, \
+            zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        result = conn.execution_options(stream_results=True).execute(stmt)
+        for row in result.yield_per(EXPORT_FETCH_SIZE):
+            mapping = row._mapping
+            problem_id = mapping["problem_id"]
+            judge_type = mapping["judge_type"] or "stdio"
+            zf.writestr(f"{problem_id}/{PROBLEM_FILE}", problem_to_yaml(mapping))
+            for i, tc in enumerate(load_problem_test_cases(case_conn, problem_id), start=1):
+                zf.writestr(f"{problem_id}/{CASES_DIR}/{i:03d}{INPUT_SUFFIX}", _case_text(tc["input"], judge_type))
+                zf.writestr(f"{problem_id}/{CASES_DIR}/{i:03d}{OUTPUT_SUFFIX}", _case_text(tc["output"], judge_type))
+                chunk = stream.drain()
+                if chunk:
+                    yield chunk
+            chunk = stream.drain()
+            if chunk:
+                yield chunk
+    # central directory 於 ZipFile 關閉時寫出
+    chunk = stream.drain()
+    if chunk:
+        yield chunk
@@ -0,0 +1,463 @@
+"""
+Batch Generation: 整章 pre-coding 題目批次生成
+
+一次排入某章節所有題目 × explanation / debugging / architecture 的生成，背景執行，不佔用 request：
+- 進度：orchestration_jobs 一筆 job (workflow_type='precoding_batch')，每個 (題目, 類型) 一筆 agent_tasks
+  (agent_name='precoding_batch'，task_input 記 problem_id / gen_type)，進度由 agent_tasks 的狀態彙整
+- 並行：asyncio.Semaphore 限制同時生成數 (PRECODING_BATCH_CONCURRENCY)，生成函式為同步呼叫，以 to_thread 執行
+- 續跑：job 設定存於 experiment_config；resume 時略過已有 completed task 的項目，只重跑失敗或未執行者
+- Batch API (可選)：use_batch_api=True 時改為送出一個 OpenAI Batch (24h 內完成、費用半價)，
+  batch_id 存入 experiment_config，服務重啟後 resume 會接回同一個 batch 繼續輪詢
+
+環境變數：
+- PRECODING_BATCH_CONCURRENCY   同時生成數 (預設 4)
+- PRECODING_BATCH_RETRIES       單一項目失敗時的重試次數 (預設 1)
+- PRECODING_BATCH_POLL_SEC      Batch API 輪詢間隔 (預設 60 秒)
+"""
+import os
+import json
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from backend.app.agents.debugging.db import engine, precoding_question_table, problem_table, save_llm_charge
+from backend.app.agents.debugging.oj_models import Problem
+from backend.app.agents.debugging.llm_client import get_openai_client, llm_cache_options
+from backend.app.agents.debugging.structured_output import strict_response_format
+from backend.app.agents.debugging.problem_generate.code_explanation import (
+    generate_explanation_questions, build_explanation_messages, ExplanationQuestionResponse
+)
+from backend.app.agents.debugging.problem_generate.code_debugging import (
+    generate_debugging_questions, build_debugging_messages, DebuggingQuestionResponse
+)
+from backend.app.agents.debugging.problem_generate.code_architecture import (
+    generate_architecture_questions, build_architecture_messages, ArchitectureQuestion
+)
+from backend.app.utils import db_logger
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY = int(os.getenv("PRECODING_BATCH_CONCURRENCY", 4))
+ITEM_RETRIES = int(os.getenv("PRECODING_BATCH_RETRIES", 1))
+POLL_SEC = float(os.getenv("PRECODING_BATCH_POLL_SEC", 60))
+
+WORKFLOW_TYPE = "precoding_batch"
+GENERATE_MODEL = "gpt-5.1"
+BATCH_MODEL_NAME = "gpt-5.1-batch"  # llm_charge 計價用 (LLM_PRICING)
+BATCH_TERMINAL = {"completed", "failed", "expired", "cancelled"}
+
+
+@dataclass(frozen=True)
+class GenSpec:
+    column: str                                   # precoding_question 的欄位
+    generate: Callable                            # 即時生成 (同步，回傳內容或 None)
+    build_messages: Callable                      # 組裝 messages (Batch API 用)
+    response_format: Type[BaseModel]
+    to_content: Callable[[BaseModel], Any]        # 解析結果 -> 存入欄位的內容
+
+
+GEN_SPECS: Dict[str, GenSpec] = {
+    "explanation": GenSpec(
+        "explain_code_question", generate_explanation_questions, build_explanation_messages,
+        ExplanationQuestionResponse, lambda parsed: [q.model_dump() for q in parsed.questions],
+    ),
+    "debugging": GenSpec(
+        "error_code_question", generate_debugging_questions, build_debugging_messages,
+        DebuggingQuestionResponse, lambda parsed: [q.model_dump() for q in parsed.questions],
+    ),
+    "architecture": GenSpec(
+        "correct_code_template", generate_architecture_questions, build_architecture_messages,
+        ArchitectureQuestion, lambda parsed: parsed.model_dump(),
+    ),
+}
+
+# 執行中的 job (同一 process 內避免同一 job 重複執行；保留 task 參照避免被回收)
+_running: Dict[int, asyncio.Task] = {}
+
+
+# ==========================================
+# 題目資料 / 儲存 (單題生成端點共用)
+# ==========================================
+
+def load_problem_data(problem_id: str) -> Optional[Tuple]:
+    """生成函式使用的 problem_data: (title, description, input_description, output_description, samples, solution_code)"""
+    with engine.connect() as conn:
+        row = conn.execute(select(Problem).where(Problem.problem_id == problem_id)).fetchone()
+    if not row:
+        return None
+    mapping = row._mapping
+    return (
+        mapping["title"],
+        mapping["description"],
+        mapping["input_description"],
+        mapping["output_description"],
+        mapping["samples"],
+        mapping.get("solution_code", ""),
+    )
+
+
+def save_precoding_content(problem_id: str, gen_type: str, content: Any):
+    """寫入 precoding_question 的對應欄位 (不存在時新增)；同一題不同類型並行寫入也不會衝突"""
+    column = GEN_SPECS[gen_type].column
+    stmt = pg_insert(precoding_question_table).values(problem_id=problem_id, **{column: content})
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[precoding_question_table.c.problem_id],
+        set_={column: getattr(stmt.excluded, column)},
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt)
+
+
+def chapter_problem_ids(chapter_id: str) -> List[str]:
+    """章節內的題目 (problem_id 以 <chapter_id>_ 開頭，與 bundle 匯出相同)"""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(problem_table.c.problem_id)
+            .where(problem_table.c.problem_id.like(f"{chapter_id}_%"))
+            .order_by(problem_table.c.problem_id)
+        ).fetchall()
+    return [row.problem_id for row in rows]
+
+
+def _existing_items(problem_ids: List[str], gen_types: List[str]) -> set:
+    """precoding_question 中已有內容的 (problem_id, gen_type)"""
+    t = precoding_question_table
+    columns = [t.c[GEN_SPECS[g].column] for g in gen_types]
+    with engine.connect() as conn:
+        rows = conn.execute(select(t.c.problem_id, *columns).where(t.c.problem_id.in_(problem_ids))).fetchall()
+    return {
+        (row.problem_id, gen_type)
+        for row in rows for gen_type in gen_types
+        if row._mapping[GEN_SPECS[gen_type].column]
+    }
+
+
+# ==========================================
+# Job 狀態 (orchestration_jobs / agent_tasks)
+# ==========================================
+
+def _load_job(job_id: int):
+    jobs = db_logger.orchestration_jobs
+    with db_logger.engine.connect() as conn:
+        return conn.execute(
+            select(jobs.c.status, jobs.c.workflow_type, jobs.c.experiment_config, jobs.c.error_message)
+            .where(jobs.c.id == job_id)
+        ).fetchone()
+
+
+def _update_config(job_id: int, **values):
+    """合併寫入 experiment_config (Batch API 的 batch_id 等)"""
+    jobs = db_logger.orchestration_jobs
+    with db_logger.engine.begin() as conn:
+        config = conn.execute(
+            select(jobs.c.experiment_config).where(jobs.c.id == job_id).with_for_update()
+        ).scalar() or {}
+        config = {**config, **values}
+        conn.execute(update(jobs).where(jobs.c.id == job_id).values(experiment_config=config))
+
+
+def _item_states(job_id: int) -> Dict[Tuple[str, str], str]:
+    """每個 (problem_id, gen_type) 的狀態：曾完成即為 completed，否則取最新一筆 task 的狀態"""
+    # 即時生成的 task 由 log_task 以 write-behind 寫入，讀取前先寫出佇列中的事件
+    db_logger.task_log_writer.flush()
+    tasks = db_logger.agent_tasks
+    with db_logger.engine.connect() as conn:
+        rows = conn.execute(
+            select(tasks.c.status, tasks.c.task_input)
+            .where(tasks.c.job_id == job_id, tasks.c.agent_name == WORKFLOW_TYPE)
+            .order_by(tasks.c.id)
+        ).fetchall()
+    states: Dict[Tuple[str, str], str] = {}
+    for row in rows:
+        task_input = row.task_input or {}
+        key = (task_input.get("problem_id"), task_input.get("gen_type"))
+        if states.get(key) != "completed":
+            states[key] = row.status
+    return states
+
+
+def job_progress(job_id: int) -> Optional[Dict[str, Any]]:
+    job = _load_job(job_id)
+    if job is None or job.workflow_type != WORKFLOW_TYPE:
+        return None
+    config = job.experiment_config or {}
+    states = _item_states(job_id)
+    # skip_existing 時略過的項目 (precoding_question 已有內容)
+    for pid, gen_type in config.get("skipped", []):
+        states.setdefault((pid, gen_type), "skipped")
+    items = [
+        {"problem_id": pid, "gen_type": gen_type, "status": states.get((pid, gen_type), "pending")}
+        for pid in config.get("problem_ids", []) for gen_type in config.get("gen_types", [])
+    ]
+    counts = {"completed": 0, "failed": 0, "in_progress": 0, "skipped": 0, "pending": 0}
+    for item in items:
+        counts[item["status"] if item["status"] in counts else "pending"] += 1
+    return {
+        "job_id": job_id,
+        "status": job.status,
+        "error_message": job.error_message,
+        "chapter_id": config.get("chapter_id"),
+        "use_batch_api": config.get("use_batch_api", False),
+        "batch_id": config.get("batch_id"),
+        "total": len(items),
+        **counts,
+        "running": job_id in _running,
+        "items": items,
+    }
+
+
+# ==========================================
+# 執行
+# ==========================================
+
+def _generate_and_save(config: Dict[str, Any], problem_id: str, gen_type: str) -> int:
+    """即時生成單一項目並寫入，回傳題目數"""
+    problem_data = load_problem_data(problem_id)
+    if problem_data is None:
+        raise ValueError(f"Problem {problem_id} not found")
+    with llm_cache_options(enabled=not config.get("no_cache", False)):
+        content = GEN_SPECS[gen_type].generate(
+            problem_data, problem_id,
+            manual_unit=config.get("core_concept"),
+            allowed_concepts=config.get("allowed_scope"),
+            student_id=config.get("student_id"),
+        )
+    if content is None:
+        raise RuntimeError("Generation failed (returned None).")
+    save_precoding_content(problem_id, gen_type, content)
+    return len(content) if isinstance(content, list) else 1
+
+
+@db_logger.log_task(
+    agent_name=WORKFLOW_TYPE,
+    task_description="Generate pre-coding questions",
+    input_extractor=lambda state: {"problem_id": state["problem_id"], "gen_type": state["gen_type"]},
+)
+def _generate_node(state: Dict[str, Any]) -> Dict[str, Any]:
+    """單一項目的生成節點；task 的建立與完成 / 失敗由 log_task 以 write-behind 記錄"""
+    count = _generate_and_save(state["config"], state["problem_id"], state["gen_type"])
+    return {"problem_id": state["problem_id"], "gen_type": state["gen_type"], "count": count, "model_name": GENERATE_MODEL}
+
+
+async def _run_item(job_id: int, config: Dict[str, Any], problem_id: str, gen_type: str, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        for attempt in range(ITEM_RETRIES + 1):
+            result = await asyncio.to_thread(_generate_node, {
+                "job_id": job_id,
+                "iteration_count": attempt + 1,
+                "config": config,
+                "problem_id": problem_id,
+                "gen_type": gen_type,
+            })
+            if not result.get("error"):
+                return
+            logger.warning(f"[Precoding Batch] job {job_id} {gen_type} {problem_id} attempt {attempt + 1} failed: {result['error']}")
+
+
+async def _run_concurrent(job_id: int, config: Dict[str, Any], items: List[Tuple[str, str]]):
+    semaphore = asyncio.Semaphore(config.get("concurrency") or CONCURRENCY)
+    await asyncio.gather(*(_run_item(job_id, config, pid, gen_type, semaphore) for pid, gen_type in items))
+
+
+# --- OpenAI Batch API ---
+
+def _custom_id(problem_id: str, gen_type: str) -> str:
+    return f"{gen_type}::{problem_id}"
+
+
+def _submit_batch(config: Dict[str, Any], items: List[Tuple[str, str]]) -> str:
+    lines = []
+    for problem_id, gen_type in items:
+        spec = GEN_SPECS[gen_type]
+        problem_data = load_problem_data(problem_id)
+        if problem_data is None:
+            continue
+        lines.append(json.dumps({
+            "custom_id": _custom_id(problem_id, gen_type),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": GENERATE_MODEL,
+                "messages": spec.build_messages(
+                    problem_data, problem_id, config.get("core_concept"), config.get("allowed_scope")
+                ),
+                "response_format": strict_response_format(spec.response_format),
+                "temperature": 0.2,
+            },
+        }, ensure_ascii=False))
+    if not lines:
+        raise ValueError("No problems to submit")
+
+    client = get_openai_client()
+    input_file = client.files.create(
+        file=("precoding_batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+    )
+    return batch.id
+
+
+def _ingest_batch_results(job_id: int, config: Dict[str, Any], batch) -> None:
+    """讀取 batch 輸出寫入 precoding_question，每個項目記一筆 agent_tasks"""
+    client = get_openai_client()
+    results: Dict[str, Dict[str, Any]] = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if line.strip():
+                record = json.loads(line)
+                results[record["custom_id"]] = record
+
+    for problem_id, gen_type in config.get("batch_items", []):
+        spec = GEN_SPECS[gen_type]
+        task_id = db_logger.create_task(
+            job_id, WORKFLOW_TYPE, f"{gen_type} {problem_id}",
+            task_input={"problem_id": problem_id, "gen_type": gen_type}, model_name=BATCH_MODEL_NAME,
+        )
+        record = results.get(_custom_id(problem_id, gen_type))
+        try:
+            if record is None:
+                raise RuntimeError(f"No result in batch ({batch.status})")
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                raise RuntimeError(str(record.get("error") or response.get("body")))
+            body = response["body"]
+            usage = body.get("usage") or {}
+            if config.get("student_id"):
+                save_llm_charge(
+                    student_id=config["student_id"],
+                    usage_type="problem_generate",
+                    model_name=BATCH_MODEL_NAME,
+                    input_tokens=usage.get("prompt_tokens", 0),
+                    cached_input_tokens=(usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+                    output_tokens=usage.get("completion_tokens", 0),
+                    problem_id=problem_id,
+                )
+            parsed = spec.response_format.model_validate_json(body["choices"][0]["message"]["content"])
+            content = spec.to_content(parsed)
+            save_precoding_content(problem_id, gen_type, content)
+            db_logger.update_task(
+                task_id, "completed",
+                output={"problem_id": problem_id, "gen_type": gen_type,
+                        "count": len(content) if isinstance(content, list) else 1},
+                prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"),
+            )
+        except Exception as e:
+            db_logger.update_task(task_id, "failed", error_message=str(e))
+
+
+async def _run_batch_api(job_id: int, config: Dict[str, Any], items: List[Tuple[str, str]]):
+    client = get_openai_client()
+    batch_id = config.get("batch_id")
+    if batch_id:
+        batch = await asyncio.to_thread(client.batches.retrieve, batch_id)
+        logger.info(f"[Precoding Batch] job {job_id} resuming batch {batch_id} ({batch.status})")
+    else:
+        batch_id = await asyncio.to_thread(_submit_batch, config, items)
+        config = {**config, "batch_id": batch_id, "batch_items": [list(item) for item in items]}
+        await asyncio.to_thread(_update_config, job_id, batch_id=batch_id, batch_items=config["batch_items"])
+        batch = await asyncio.to_thread(client.batches.retrieve, batch_id)
+        logger.info(f"[Precoding Batch] job {job_id} submitted batch {batch_id} ({len(items)} item(s))")
+
+    while batch.status not in BATCH_TERMINAL:
+        await asyncio.sleep(POLL_SEC)
+        batch = await asyncio.to_thread(client.batches.retrieve, batch_id)
+
+    await asyncio.to_thread(_ingest_batch_results, job_id, config, batch)
+    # 已處理完這個 batch，之後 resume 重新送出仍未完成的項目
+    await asyncio.to_thread(_update_config, job_id, batch_id=None, batch_items=[])
+
+
+async def run_job(job_id: int):
+    try:
+        job = await asyncio.to_thread(_load_job, job_id)
+        config = job.experiment_config or {}
+        problem_ids, gen_types = config.get("problem_ids", []), config.get("gen_types", [])
+
+        states = await asyncio.to_thread(_item_states, job_id)
+        items = [
+            (pid, gen_type) for pid in problem_ids for gen_type in gen_types
+            if states.get((pid, gen_type)) != "completed"
+        ]
+        if config.get("skip_existing") and items:
+            existing = await asyncio.to_thread(_existing_items, problem_ids, gen_types)
+            skipped = [item for item in items if item in existing]
+            items = [item for item in items if item not in existing]
+            await asyncio.to_thread(_update_config, job_id, skipped=[list(item) for item in skipped])
+
+        await asyncio.to_thread(db_logger.update_job_status, job_id, "running")
+        logger.info(f"[Precoding Batch] job {job_id} running {len(items)} item(s) (chapter={config.get('chapter_id')})")
+
+        if items or config.get("batch_id"):
+            if config.get("use_batch_api"):
+                await _run_batch_api(job_id, config, items)
+            else:
+                await _run_concurrent(job_id, config, items)
+
+        states = await asyncio.to_thread(_item_states, job_id)
+        failed = sum(1 for item in items if states.get(item) != "completed")
+        if failed > 0:
+            await asyncio.to_thread(
+                db_logger.update_job_status, job_id, "failed", f"{failed} item(s) failed; resume to retry."
+            )
+        else:
+            await asyncio.to_thread(db_logger.update_job_status, job_id, "completed")
+        await asyncio.to_thread(db_logger.update_job_iterations_and_cost, job_id)
+    except Exception as e:
+        logger.error(f"[Precoding Batch] job {job_id} failed: {e}")
+        await asyncio.to_thread(db_logger.update_job_status, job_id, "failed", str(e))
+    finally:
+        _running.pop(job_id, None)
+
+
+def launch(job_id: int) -> bool:
+    """在背景執行 (或續跑) job；同一 job 已在執行中時回傳 False"""
+    if job_id in _running:
+        return False
+    _running[job_id] = asyncio.create_task(run_job(job_id))
+    return True
+
+
+def start_chapter_job(
+    chapter_id: str,
+    gen_types: List[str],
+    user_id: Optional[int] = None,
+    student_id: str = "teacher",
+    core_concept: Optional[str] = None,
+    allowed_scope: Optional[List[str]] = None,
+    skip_existing: bool = False,
+    no_cache: bool = False,
+    use_batch_api: bool = False,
+    concurrency: Optional[int] = None,
+) -> int:
+    """建立整章生成 job 並在背景開始執行，回傳 job_id"""
+    problem_ids = chapter_problem_ids(chapter_id)
+    if not problem_ids:
+        raise ValueError(f"No problems found in chapter '{chapter_id}'")
+
+    config = {
+        "chapter_id": chapter_id,
+        "problem_ids": problem_ids,
+        "gen_types": gen_types,
+        "student_id": student_id,
+        "core_concept": core_concept,
+        "allowed_scope": allowed_scope,
+        "skip_existing": skip_existing,
+        "no_cache": no_cache,
+        "use_batch_api": use_batch_api,
+        "concurrency": concurrency,
+    }
+    job_id = db_logger.create_job(
+        user_id, f"Generate pre-coding questions for chapter {chapter_id}", WORKFLOW_TYPE, config
+    )
+    if job_id is None:
+        raise RuntimeError("Failed to create orchestration job")
+    launch(job_id)
+    return job_id
@@ -1,9 +1,9 @@
-import os
 import json
 from typing import List
 from pydantic import BaseModel, Field
-from openai import OpenAI
 from backend.app.agents.debugging.db import save_llm_charge
+from backend.app.agents.debugging.llm_client import parse_completion
+from backend.app.agents.debugging.prompt_templates import PromptTemplate
 
 # ================= 1. 設定與常數 =================
 
@@ -18,9 +18,6 @@ CONCEPT_DETAILS = {
     'C8': 'Function函式: def, return, global, 參數。'
 }
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
 # ================= 2. Pydantic Schema =================
 
 class Option(BaseModel):
@@ -50,6 +47,84 @@ class DebuggingQuestion(BaseModel):
 class DebuggingQuestionResponse(BaseModel):
     questions: List[DebuggingQuestion]
 
+# ================= 2.5 Prompt =================
+# 固定指令 (含完整 CONCEPT_DETAILS 與 JSON 範例) 放在 system，語法範圍與原題放在 user，
+# 讓不同題目的生成共用 prompt 前綴
+
+DEBUGGING_PROMPT = PromptTemplate(
+    name="problem_generate_debugging",
+    usage_type="problem_generate",
+    static_blocks=[
+        """
+        【角色設定】你是 Python 程式教學專家，專門設計「除錯 (Debugging)」訓練。
+        """,
+        "【語法單元對照表】\n" + "\n".join(f"- {k}: {v}" for k, v in CONCEPT_DETAILS.items()),
+        """
+        【任務目標】
+        請針對【原始題目資訊】中的核心運算邏輯，設計一個「子任務」除錯題：
+        1. **子任務描述**：在 `question.text` 中說明這段程式碼「預計要完成的任務」。
+        2. **錯誤程式碼**：在 `code.content` 提供一段帶有錯誤(Bug)的程式碼，導致其無法完成上述任務。
+        3. **除錯選擇題**：設計 **1~3 題**，每題包含最多 3 個選項，讓學生找出錯誤原因。每題只能有一個選項正確，正確選項隨機分佈。
+
+        【絕對邏輯拆解機制】
+        1. **去情境化 (Pure Logic)**：禁止提及原題背景（如 BMI、餐費）。變數名必須抽象化（如 a, b, res, val）。
+        2. **關鍵邏輯子集**：程式碼僅呈現原題最核心的「運算零件」。例如：原題算平均，子任務應專注於「總和除以數量」的邏輯。
+        3. **語法嚴格限制**：生成的程式碼 **絕對不能超出** 【允許使用的語法範圍】。
+        4. **必定包含 Bug**：程式碼必須包含一個該單元程度的典型錯誤（如型態轉換失敗、邏輯運算子誤用）。
+        5. **禁止洩題**：這段程式碼不能是原題的完整解答。
+
+        【生成步驟】
+        1. 提取邏輯：分析原題的核心算式或資料處理點。
+        2. 設定任務：將該邏輯寫成一個簡單的任務目標。
+        3. 植入錯誤：撰寫一段試圖達成任務但包含 Bug 的純淨程式碼。
+        4. 設計選項：選項應針對 Bug 的原因進行自然語言描述。設計最多 3 個選項，讓學生找出錯誤原因。只能有一個選項正確，正確選項隨機分佈。
+        """,
+        """
+        【輸出規範】
+        請直接輸出 JSON 格式，結構需符合：
+        [
+            {
+                "id": "Q1",
+                "type": "debugging",
+                "options": [
+                    {
+                        "id": 1,
+                        "label": "第2行程式會產生型態錯誤，因為無法將文字與數字直接相加",
+                        "feedback": "✅ 正確：input() 讀入的是字串，必須先轉成整數才能運算。"
+                    },
+                    {
+                        "id": 2,
+                        "label": "程式會順利執行，並將數字 5 接在輸入的文字後面",
+                        "feedback": "❌ 錯誤：Python 不允許字串(str)與整數(int)直接使用 + 號運算。"
+                    }
+                ],
+                "question": {
+                    "code": {
+                        "content": "x = input('Enter number: ')\\nprint(x + 5)"
+                    },
+                    "text": "若使用者輸入 10，執行下列程式碼會發生什麼結果？"
+                },
+                "answer_config": {"correct_id": 1, "explanation": "input() 函式回傳的是字串..."}
+            }
+        ]
+        """,
+    ],
+    context="""
+        【核心概念】：{main_concept} ({main_concept_detail})
+        【允許使用的語法範圍】：
+        {allowed_scope}
+    """,
+    dynamic="""
+        【原始題目資訊】
+        ID: {problem_id}
+        標題：{title}
+        描述：{desc}
+        輸入說明：{in_desc}
+        輸出說明：{out_desc}
+        範例數據：{samples}
+    """,
+)
+
 # ================= 3. AI 生成邏輯 =================
 
 def get_unit_from_id(problem_id: str) -> str:
@@ -57,7 +132,8 @@ def get_unit_from_id(problem_id: str) -> str:
         return problem_id.split("_")[0]
     return "C1"
 
-def generate_debugging_questions(problem_data, problem_id, manual_unit=None, allowed_concepts=None, student_id=None):
+def build_debugging_messages(problem_data, problem_id, manual_unit=None, allowed_concepts=None):
+    """組裝除錯題的生成 messages (單題即時生成與整章批次生成共用)"""
     if len(problem_data) == 6:
         title, desc, in_desc, out_desc, samples, solution_code = problem_data
     else:
@@ -79,89 +155,27 @@ def generate_debugging_questions(problem_data, problem_id, manual_unit=None, all
              allowed_scope += f"\n- C1: {CONCEPT_DETAILS['C1']}"
              allowed_scope += f"\n- C2: {CONCEPT_DETAILS['C2']}"
 
-    json_example_str = """
-    [
-        {
-            "id": "Q1",
-            "type": "debugging",
-            "options": [
-                {
-                    "id": 1, 
-                    "label": "第2行程式會產生型態錯誤，因為無法將文字與數字直接相加", 
-                    "feedback": "✅ 正確：input() 讀入的是字串，必須先轉成整數才能運算。"
-                },
-                {
-                    "id": 2, 
-                    "label": "程式會順利執行，並將數字 5 接在輸入的文字後面", 
-                    "feedback": "❌ 錯誤：Python 不允許字串(str)與整數(int)直接使用 + 號運算。"
-                }
-            ],
-            "question": {
-                "code": {
-                    "content": "x = input('Enter number: ')\\nprint(x + 5)"
-                },
-                "text": "若使用者輸入 10，執行下列程式碼會發生什麼結果？"
-            },
-            "answer_config": {"correct_id": 1, "explanation": "input() 函式回傳的是字串..."}
-        }
-    ]
-    """
-
-    system_prompt = f"""
-    【角色設定】你是 Python 程式教學專家，專門設計「除錯 (Debugging)」訓練。
-
-    【核心概念】：{main_concept} ({CONCEPT_DETAILS.get(main_concept)})
-    【允許使用的語法範圍】：
-    {allowed_scope}
-
-    【任務目標】
-    請針對【原題資訊】中的核心運算邏輯，設計一個「子任務」除錯題：
-    1. **子任務描述**：在 `question.text` 中說明這段程式碼「預計要完成的任務」。
-    2. **錯誤程式碼**：在 `code.content` 提供一段帶有錯誤(Bug)的程式碼，導致其無法完成上述任務。
-    3. **除錯選擇題**：設計 **1~3 題**，每題包含最多 3 個選項，讓學生找出錯誤原因。每題只能有一個選項正確，正確選項隨機分佈。
-
-    【絕對邏輯拆解機制】
-    1. **去情境化 (Pure Logic)**：禁止提及原題背景（如 BMI、餐費）。變數名必須抽象化（如 a, b, res, val）。
-    2. **關鍵邏輯子集**：程式碼僅呈現原題最核心的「運算零件」。例如：原題算平均，子任務應專注於「總和除以數量」的邏輯。
-    3. **語法嚴格限制**：生成的程式碼 **絕對不能超出** 提供的語法範圍。
-    4. **必定包含 Bug**：程式碼必須包含一個該單元程度的典型錯誤（如型態轉換失敗、邏輯運算子誤用）。
-    5. **禁止洩題**：這段程式碼不能是原題的完整解答。
-
-    【生成步驟】
-    1. 提取邏輯：分析原題的核心算式或資料處理點。
-    2. 設定任務：將該邏輯寫成一個簡單的任務目標。
-    3. 植入錯誤：撰寫一段試圖達成任務但包含 Bug 的純淨程式碼。
-    4. 設計選項：選項應針對 Bug 的原因進行自然語言描述。設計最多 3 個選項，讓學生找出錯誤原因。只能有一個選項正確，正確選項隨機分佈。
-
-    【輸出規範】
-    請直接輸出 JSON 格式，結構需符合：
-    {json_example_str}
-    """
-
-    user_prompt = f"""
-    【原始題目資訊】
-    ID: {problem_id}
-    標題：{title}
-    描述：{desc}
-    輸入說明：{in_desc}
-    輸出說明：{out_desc}
-    範例數據：{samples}
-    """
+    return DEBUGGING_PROMPT.openai_messages(
+        main_concept=main_concept,
+        main_concept_detail=CONCEPT_DETAILS.get(main_concept),
+        allowed_scope=allowed_scope,
+        problem_id=problem_id, title=title, desc=desc,
+        in_desc=in_desc, out_desc=out_desc, samples=samples,
+    )
+
+
+def generate_debugging_questions(problem_data, problem_id, manual_unit=None, allowed_concepts=None, student_id=None):
+    messages = build_debugging_messages(problem_data, problem_id, manual_unit, allowed_concepts)
 
     try:
-        completion = openai_client.beta.chat.completions.parse(
-            model="gpt-5.1", 
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
+        parsed_obj, usage = parse_completion(
+            model="gpt-5.1",
+            messages=messages,
             response_format=DebuggingQuestionResponse,
             temperature=0.2,
         )
-        parsed_obj = completion.choices[0].message.parsed
         # 記錄 token 用量
-        if student_id and completion.usage:
-            usage = completion.usage
+        if student_id and usage:
             cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
             save_llm_charge(
                 student_id=student_id,
@@ -1,9 +1,9 @@
-import os
 import json
 from typing import List, Optional
 from pydantic import BaseModel, Field
-from openai import OpenAI
 from backend.app.agents.debugging.db import save_llm_charge
+from backend.app.agents.debugging.llm_client import parse_completion
+from backend.app.agents.debugging.prompt_templates import PromptTemplate
 
 # ================= 1. 設定與常數 =================
 
@@ -18,9 +18,6 @@ CONCEPT_DETAILS = {
     'C8': 'Function函式: def, return, global, 參數。'
 }
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
 # ================= 2. 定義資料結構 (Pydantic Schema) =================
 
 class Option(BaseModel):
@@ -50,6 +47,89 @@ class ExplanationQuestion(BaseModel):
 class ExplanationQuestionResponse(BaseModel):
     questions: List[ExplanationQuestion]
 
+# ================= 2.5 Prompt =================
+# 固定指令 (含完整 CONCEPT_DETAILS 與 JSON 範例) 放在 system，語法範圍與原題放在 user，
+# 讓不同題目的生成共用 prompt 前綴
+
+EXPLANATION_PROMPT = PromptTemplate(
+    name="problem_generate_explanation",
+    usage_type="problem_generate",
+    static_blocks=[
+        """
+        【角色設定】你是 Python 程式教學專家，專精於引導初學者進行「程式碼閱讀理解 (Code Comprehension)」。
+        """,
+        "【語法單元對照表】\n" + "\n".join(f"- {k}: {v}" for k, v in CONCEPT_DETAILS.items()),
+        """
+        【嚴格限制】：
+        生成的程式碼內容 **絕對不能超出** 【允許使用的語法範圍】。如果範圍內沒有提到迴圈(C5/C6)或判斷式(C4)，則程式碼中嚴禁出現相關語法。
+
+        【任務目標】
+        請針對【原始題目資訊】中的「核心運算邏輯」，拆解出一個**子題目（關鍵邏輯片段）**。
+        設計 **1~3 題** 「程式碼行為解釋 (Behavior Description)」選擇題，每題包含最多 **3 個**選項。
+        讓學生找出錯誤原因。每題只能有一個選項正確，正確選項隨機分佈。
+        此題旨在讓學生專注理解該原題背後的純程式邏輯或數學轉換，**不需加入任何生活情境包裝**。
+
+        **絕對邏輯拆解機制 (Logic Deconstruction Rules)**
+        1. **去情境化 (Pure Logic Only)**：
+        - 程式碼應呈現純粹的邏輯運算。**不要**提到原題的背景（例如：不要提到 BMI、餐費、超市）。
+        - 變數名稱應保持抽象（如 `a`, `b`, `ans`, `val`, `temp`）。
+
+        2. **關鍵邏輯子集 (Key Logic Sub-task)**：
+        - 程式碼必須是原題目的「核心零件」。例如：
+            - 原題是「計算折扣後金額」，子題目程式碼應專注於「百分比的乘法運算」。
+            - 原題是「判斷閏年」，子題目程式碼應專注於「取餘數 `%` 的邏輯」。
+        - **複雜度必須低於原題**，只取原題中最關鍵的一步。
+
+        3. **禁止提供完整解答**：
+        - 題目中的程式碼僅為片段，**不能**是原題目的完整解答。直接複製此片段去提交原題必須無法過關。
+
+        【生成步驟】
+        1. **提取核心邏輯**：從原題中識別出最關鍵的運算邏輯（例如：單位換算、字串拼接、特定算式）。
+        2. **邏輯純化**：移除所有描述性文字與情境變數，將其轉化為簡單的變數運算。
+        3. **撰寫程式碼**：寫出該關鍵邏輯的純淨程式碼片段。
+        4. **設計選項**：選項必須是「自然語言的行為描述」，說明這段程式碼在對資料進行什麼樣的處理。
+        """,
+        """
+        【輸出規範】
+        請直接輸出 JSON 格式，結構需符合：
+        [
+            {
+                "id": "Q1",
+                "type": "code_explanation",
+                "targeted_concept": "變數交換邏輯",
+                "options": [
+                    { "id": 1, "label": "將兩個變數的數值進行交換", "feedback": "✅ 正確：透過暫存變數 temp，成功互換了 x 與 y 的值。" },
+                    { "id": 2, "label": "將兩個變數都設為相同的值", "feedback": "❌ 錯誤：這不是賦值，而是交換。" },
+                    { "id": 3, "label": "計算兩個變數的總和", "feedback": "❌ 錯誤：程式碼中沒有進行加法運算。" }
+                ],
+                "question": {
+                    "text": "這段程式碼的主要功能是什麼？",
+                    "code": {
+                        "content": "temp = x\\ncan_print = True"
+                    }
+                },
+                "answer_config": {"correct_id": 1, "explanation": "使用第三個變數作為暫存區..."}
+            }
+        ]
+        """,
+    ],
+    context="""
+        【核心概念】：**{unit_id}: {unit_topic}**
+
+        【允許使用的語法範圍】：
+        {allowed_scope}
+    """,
+    dynamic="""
+        【原始題目資訊】
+        ID: {problem_id}
+        標題：{title}
+        描述：{desc}
+        輸入說明：{in_desc}
+        輸出說明：{out_desc}
+        範例數據：{samples}
+    """,
+)
+
 # ================= 3. 核心生成邏輯 =================
 
 def get_unit_from_id(problem_id: str) -> str:
@@ -57,7 +137,8 @@ def get_unit_from_id(problem_id: str) -> str:
         return problem_id.split("_")[0]
     return "C1"
 
-def generate_explanation_questions(problem_data, problem_id, manual_unit=None, allowed_concepts=None, student_id=None):
+def build_explanation_messages(problem_data, problem_id, manual_unit=None, allowed_concepts=None):
+    """組裝程式碼解釋題的生成 messages (單題即時生成與整章批次生成共用)"""
     # problem_data format: (title, description, input_description, output_description, samples, [solution_code])
     if len(problem_data) == 6:
         title, desc, in_desc, out_desc, samples, solution_code = problem_data
@@ -81,95 +162,28 @@ def generate_explanation_questions(problem_data, problem_id, manual_unit=None, a
             allowed_scope += f"\n- C1: {CONCEPT_DETAILS['C1']}"
             allowed_scope += f"\n- C2: {CONCEPT_DETAILS['C2']}"
 
-    json_example_str = """
-    [
-        {
-            "id": "Q1",
-            "type": "code_explanation",
-            "targeted_concept": "變數交換邏輯",
-            "options": [
-                { "id": 1, "label": "將兩個變數的數值進行交換", "feedback": "✅ 正確：透過暫存變數 temp，成功互換了 x 與 y 的值。" },
-                { "id": 2, "label": "將兩個變數都設為相同的值", "feedback": "❌ 錯誤：這不是賦值，而是交換。" },
-                { "id": 3, "label": "計算兩個變數的總和", "feedback": "❌ 錯誤：程式碼中沒有進行加法運算。" }
-            ],
-            "question": {
-                "text": "這段程式碼的主要功能是什麼？",
-                "code": {
-                    "content": "temp = x\\ncan_print = True"
-                }
-            },
-            "answer_config": {"correct_id": 1, "explanation": "使用第三個變數作為暫存區..."}
-        }
-    ]
-    """
-
-    system_prompt = f"""
-    【角色設定】你是 Python 程式教學專家，專精於引導初學者進行「程式碼閱讀理解 (Code Comprehension)」。
-
-    【核心概念】：**{unit_id}: {unit_topic}**
-
-    【允許使用的語法範圍】：
-    {allowed_scope}
-
-    【嚴格限制】：
-    生成的程式碼內容 **絕對不能超出** 以上提供的「允許使用的語法範圍」。如果範圍內沒有提到迴圈(C5/C6)或判斷式(C4)，則程式碼中嚴禁出現相關語法。
-
-    【任務目標】
-    請針對【原始題目資訊】中的「核心運算邏輯」，拆解出一個**子題目（關鍵邏輯片段）**。
-    設計 **1~3 題** 「程式碼行為解釋 (Behavior Description)」選擇題，每題包含最多 **3 個**選項。
-    讓學生找出錯誤原因。每題只能有一個選項正確，正確選項隨機分佈。
-    此題旨在讓學生專注理解該原題背後的純程式邏輯或數學轉換，**不需加入任何生活情境包裝**。
-
-    **絕對邏輯拆解機制 (Logic Deconstruction Rules)**
-    1. **去情境化 (Pure Logic Only)**：
-    - 程式碼應呈現純粹的邏輯運算。**不要**提到原題的背景（例如：不要提到 BMI、餐費、超市）。
-    - 變數名稱應保持抽象（如 `a`, `b`, `ans`, `val`, `temp`）。
-    
-    2. **關鍵邏輯子集 (Key Logic Sub-task)**：
-    - 程式碼必須是原題目的「核心零件」。例如：
-        - 原題是「計算折扣後金額」，子題目程式碼應專注於「百分比的乘法運算」。
-        - 原題是「判斷閏年」，子題目程式碼應專注於「取餘數 `%` 的邏輯」。
-    - **複雜度必須低於原題**，只取原題中最關鍵的一步。
-
-    3. **禁止提供完整解答**：
-    - 題目中的程式碼僅為片段，**不能**是原題目的完整解答。直接複製此片段去提交原題必須無法過關。
-
-    【生成步驟】
-    1. **提取核心邏輯**：從原題中識別出最關鍵的運算邏輯（例如：單位換算、字串拼接、特定算式）。
-    2. **邏輯純化**：移除所有描述性文字與情境變數，將其轉化為簡單的變數運算。
-    3. **撰寫程式碼**：寫出該關鍵邏輯的純淨程式碼片段。
-    4. **設計選項**：選項必須是「自然語言的行為描述」，說明這段程式碼在對資料進行什麼樣的處理。
-
-    【輸出規範】
-    請直接輸出 JSON 格式，結構需符合：
-    {json_example_str}
-    """
-
-    user_prompt = f"""
-    【原始題目資訊】
-    ID: {problem_id}
-    標題：{title}
-    描述：{desc}
-    輸入說明：{in_desc}
-    輸出說明：{out_desc}
-    範例數據：{samples}
-    """
+    return EXPLANATION_PROMPT.openai_messages(
+        unit_id=unit_id,
+        unit_topic=unit_topic,
+        allowed_scope=allowed_scope,
+        problem_id=problem_id, title=title, desc=desc,
+        in_desc=in_desc, out_desc=out_desc, samples=samples,
+    )
+
+
+def generate_explanation_questions(problem_data, problem_id, manual_unit=None, allowed_concepts=None, student_id=None):
+    messages = build_explanation_messages(problem_data, problem_id, manual_unit, allowed_concepts)
 
     try:
-        completion = openai_client.beta.chat.completions.parse(
-            model="gpt-5.1", 
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
+        parsed_obj, usage = parse_completion(
+            model="gpt-5.1",
+            messages=messages,
             response_format=ExplanationQuestionResponse,
             temperature=0.2,
         )
 
-        parsed_obj = completion.choices[0].message.parsed
         # 記錄 token 用量
-        if student_id and completion.usage:
-            usage = completion.usage
+        if student_id and usage:
             cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
             save_llm_charge(
                 student_id=student_id,
@@ -0,0 +1,136 @@
+"""
+Prompt Templates: 固定指令在前、題目與學生內容在後的 prompt 組裝
+
+OpenAI 的 prompt caching 只對「完全相同的開頭」生效 (至少 1024 tokens，之後每 128 tokens 一段)。
+若把題目或學生程式碼插在 prompt 前段，後面再長的規則與 JSON 範例也無法命中。
+PromptTemplate 依變動頻率由低到高排列:
+
+1. static_blocks: 角色、規則、rubric、CONCEPT_DETAILS、JSON 格式範例 (所有呼叫相同)
+   -> system message；原樣輸出不做 format，JSON 範例的大括號不需跳脫
+2. context: 同一題共用的內容 (題目資訊、語法範圍)
+   -> user message 開頭
+3. dynamic: 每次呼叫不同的內容 (學生程式碼、錯誤訊息、診斷結果)
+   -> user message 結尾
+
+context / dynamic 以 str.format 填值，填入的值不會再被解析。
+實際命中率由 llm_charge 帳本的 cached_input_tokens / input_tokens 依 usage_type 統計 (prompt_cache_report)。
+"""
+import textwrap
+import logging
+from functools import cached_property
+from typing import Any, Dict, List, Optional, Sequence
+
+import tiktoken
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from sqlalchemy import select, func
+
+from backend.app.agents.debugging.db import engine, llm_charge_table, llm_charge_ledger
+
+logger = logging.getLogger(__name__)
+
+# OpenAI prompt caching 的最小前綴長度
+CACHE_MIN_PREFIX_TOKENS = 1024
+
+PROMPT_TEMPLATES: Dict[str, "PromptTemplate"] = {}
+
+_encoding = None
+
+
+def _count_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    return len(_encoding.encode(text))
+
+
+def _block(text: str) -> str:
+    return textwrap.dedent(text).strip()
+
+
+class PromptTemplate:
+    def __init__(
+        self,
+        name: str,
+        usage_type: str,
+        static_blocks: Sequence[str],
+        dynamic: str,
+        context: str = "",
+    ):
+        self.name = name
+        self.usage_type = usage_type
+        self.system = "\n\n".join(_block(b) for b in static_blocks)
+        self.context = _block(context)
+        self.dynamic = _block(dynamic)
+        PROMPT_TEMPLATES[name] = self
+
+    @cached_property
+    def prefix_tokens(self) -> int:
+        """所有呼叫共用的前綴 (system message) token 數"""
+        return _count_tokens(self.system)
+
+    def render_user(self, **values: Any) -> str:
+        parts = [self.context.format(**values)] if self.context else []
+        parts.append(self.dynamic.format(**values))
+        return "\n\n".join(parts)
+
+    def messages(self, **values: Any) -> List[BaseMessage]:
+        """LangChain messages: [SystemMessage(固定指令), HumanMessage(題目 + 本次內容)]"""
+        return [SystemMessage(content=self.system), HumanMessage(content=self.render_user(**values))]
+
+    def openai_messages(self, **values: Any) -> List[Dict[str, str]]:
+        """OpenAI SDK 格式的 messages"""
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.render_user(**values)},
+        ]
+
+
+def template_summary() -> List[Dict[str, Any]]:
+    """已載入模板的固定前綴長度，未達 CACHE_MIN_PREFIX_TOKENS 的前綴不會被 OpenAI 快取"""
+    return [
+        {
+            "name": t.name,
+            "usage_type": t.usage_type,
+            "prefix_tokens": t.prefix_tokens,
+            "cacheable": t.prefix_tokens >= CACHE_MIN_PREFIX_TOKENS,
+        }
+        for t in PROMPT_TEMPLATES.values()
+    ]
+
+
+def prompt_cache_report(problem_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    依 usage_type 統計 llm_charge 帳本中的 prompt 快取命中率 (cached_input_tokens / input_tokens)。
+    不含 semantic_cache 的列 (那些是本地快取事件，沒有 token)。
+    """
+    # 先寫入緩衝中的費用，報表才包含最近的呼叫
+    llm_charge_ledger.flush()
+
+    t = llm_charge_table
+    stmt = (
+        select(
+            t.c.usage_type,
+            func.coalesce(func.sum(t.c.input_tokens), 0).label("input_tokens"),
+            func.coalesce(func.sum(t.c.cached_input_tokens), 0).label("cached_input_tokens"),
+            func.coalesce(func.sum(t.c.input_cost), 0).label("input_cost"),
+            func.coalesce(func.sum(t.c.cached_input_cost), 0).label("cached_input_cost"),
+        )
+        .where(t.c.model_name != "semantic_cache")
+        .group_by(t.c.usage_type)
+    )
+    if problem_id:
+        stmt = stmt.where(t.c.problem_id == problem_id)
+
+    with engine.connect() as conn:
+        rows = conn.execute(stmt).fetchall()
+
+    return {
+        row.usage_type: {
+            "input_tokens": int(row.input_tokens),
+            "cached_input_tokens": int(row.cached_input_tokens),
+            "hit_ratio": round(row.cached_input_tokens / row.input_tokens, 4) if row.input_tokens else 0.0,
+            "input_cost": round(float(row.input_cost), 6),
+            "cached_input_cost": round(float(row.cached_input_cost), 6),
+        }
+        for row in rows
+    }
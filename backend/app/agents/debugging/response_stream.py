@@ -0,0 +1,104 @@
+"""
+Response Stream: 鷹架回覆的 token 即時轉送
+
+/help/init 觸發的診斷在 AnalysisQueue 背景執行，scaffold_help 節點以串流呼叫 LLM，
+把過濾 Markdown 後的文字 publish 到以分析任務 id 為 key 的 stream；
+/help/init/stream 的 SSE 連線訂閱同一個 key，先補送已產生的片段，再持續轉送，
+對話紀錄寫入資料庫後收到 done 事件 (內容與 /help/init resumed 回應相同)。
+
+AnalysisQueue 為單一 process 內的佇列，stream 也只在同一 process 內轉送；
+結束後保留 RETAIN_SEC 秒供晚到的訂閱者取得結果，之後一律改由資料庫讀取。
+"""
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RETAIN_SEC = 120
+
+
+def scaffold_stream_key(student_id: str, problem_id: str, num: int) -> str:
+    """與 /help/init 的分析任務 id 相同"""
+    return f"{student_id}_{problem_id}_{num}"
+
+
+class ResponseStream:
+    """單一回覆的片段緩衝，opened_at 起算首個 token 的時間 (TTFT)"""
+
+    def __init__(self):
+        self.opened_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.chunks: List[str] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def ttft_ms(self) -> Optional[int]:
+        if self.first_token_at is None:
+            return None
+        return round((self.first_token_at - self.opened_at) * 1000)
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, text: str):
+        if not text:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.chunks.append(text)
+        self._notify()
+
+    def finish(self, result: Dict[str, Any]):
+        self.result = result
+        self._notify()
+
+    async def events(self) -> AsyncIterator[Tuple[str, Any]]:
+        """依序產生 ("token", 文字) 與最後的 ("done", 結果)"""
+        sent = 0
+        while True:
+            while sent < len(self.chunks):
+                yield "token", self.chunks[sent]
+                sent += 1
+            if self.result is not None:
+                yield "done", self.result
+                return
+            await self._changed.wait()
+
+
+class ResponseStreamBroker:
+    def __init__(self, retain_sec: float = RETAIN_SEC):
+        self.retain_sec = retain_sec
+        self._streams: Dict[str, ResponseStream] = {}
+
+    def open(self, key: str) -> ResponseStream:
+        """開始一則新回覆 (觸發分析時呼叫，TTFT 由此起算)"""
+        stream = ResponseStream()
+        self._streams[key] = stream
+        return stream
+
+    def get(self, key: str) -> Optional[ResponseStream]:
+        return self._streams.get(key)
+
+    def publish(self, key: str, text: str):
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = self.open(key)
+        stream.publish(text)
+
+    def finish(self, key: str, result: Dict[str, Any]):
+        stream = self._streams.get(key)
+        if stream is None:
+            return
+        stream.finish(result)
+        asyncio.get_running_loop().call_later(self.retain_sec, self._discard, key, stream)
+
+    def _discard(self, key: str, stream: ResponseStream):
+        if self._streams.get(key) is stream:
+            self._streams.pop(key, None)
+
+
+response_streams = ResponseStreamBroker()
@@ -0,0 +1,223 @@
+"""
+Structured Output: 以 Pydantic schema 約束並解析 LLM 的 JSON 回覆
+
+- ainvoke_structured(chat_model, messages, schema, usage_type, ...):
+  以 OpenAI json_schema (strict) response_format 呼叫 (經 llm_client.hedged_ainvoke)，回傳 schema 實例
+- parse_structured: 先直接驗證；失敗時去除 ``` 圍欄並以 parse_partial_json 補齊被截斷的 JSON 再驗證
+- 仍無法解析時才發出修復呼叫：只送出原始輸出與驗證錯誤給 REPAIR_MODEL (不重送整段 prompt)
+- 每次解析記入 llm_charge 帳本 (parse_attempts / parse_failures / parse_repairs)，
+  失敗率 = parse_failures / parse_attempts，依 usage_type 統計
+- 不做串流中的增量 JSON 解析：結構化輸出的呼叫端都要完整物件才能進行下一步
+  (錯誤報告、ZPD、路由、練習題)，沒有可提前使用部分欄位的地方；
+  且串流無法經過 hedged_ainvoke 的 hedge 與整體預算。需要逐字顯示的回覆 (鷹架、對話) 走純文字串流
+
+環境變數:
+- STRUCTURED_REPAIR_MODEL    修復呼叫使用的模型 (預設 gpt-4o-mini)
+- STRUCTURED_REPAIR_RETRIES  修復呼叫次數上限 (預設 1，0 為不修復)
+"""
+import os
+import copy
+import logging
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple, Type, TypeVar
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.utils.json import parse_partial_json
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, func
+
+from backend.app.agents.debugging.db import engine, llm_charge_table, llm_charge_ledger, save_llm_charge, save_parse_event
+from backend.app.agents.debugging.llm_client import get_chat_model, hedged_ainvoke
+
+logger = logging.getLogger(__name__)
+
+REPAIR_MODEL = os.getenv("STRUCTURED_REPAIR_MODEL", "gpt-4o-mini")
+REPAIR_RETRIES = int(os.getenv("STRUCTURED_REPAIR_RETRIES", 1))
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class StructuredOutputError(ValueError):
+    """LLM 回覆經修復後仍不符合 schema"""
+
+
+# ==========================================
+# Schema -> response_format
+# ==========================================
+
+def _strictify(node: Any):
+    """OpenAI strict 模式: 每個 object 需列出全部 required、禁止額外欄位、不支援 default"""
+    if not isinstance(node, dict):
+        return
+    node.pop("default", None)
+    if node.get("type") == "object":
+        properties = node.get("properties", {})
+        node["additionalProperties"] = False
+        node["required"] = list(properties)
+        for prop in properties.values():
+            _strictify(prop)
+    if "items" in node:
+        _strictify(node["items"])
+    for key in ("anyOf", "allOf", "oneOf"):
+        for sub in node.get(key, []):
+            _strictify(sub)
+    for sub in node.get("$defs", {}).values():
+        _strictify(sub)
+
+
+@lru_cache(maxsize=None)
+def strict_response_format(schema: Type[BaseModel]) -> Dict[str, Any]:
+    json_schema = copy.deepcopy(schema.model_json_schema())
+    _strictify(json_schema)
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema.__name__, "schema": json_schema, "strict": True},
+    }
+
+
+# ==========================================
+# Parsing
+# ==========================================
+
+def _strip_fences(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+
+def parse_structured(text: str, schema: Type[T]) -> Tuple[Optional[T], Optional[str]]:
+    """回傳 (schema 實例, None) 或 (None, 驗證錯誤訊息)"""
+    try:
+        return schema.model_validate_json(text), None
+    except ValidationError as e:
+        error = str(e)
+
+    # 容錯: 去除 Markdown 圍欄、補齊被截斷的括號與字串
+    try:
+        partial = parse_partial_json(_strip_fences(text))
+    except Exception:
+        partial = None
+    if partial is not None:
+        try:
+            return schema.model_validate(partial), None
+        except ValidationError as e:
+            error = str(e)
+    return None, error
+
+
+# ==========================================
+# LLM 呼叫
+# ==========================================
+
+def _charge(response, model_name: str, usage_type: str, student_id: Optional[str], problem_id: Optional[str]):
+    if not student_id:
+        return
+    usage = response.response_metadata.get("token_usage", {})
+    details = usage.get("prompt_tokens_details") or {}
+    save_llm_charge(
+        student_id=student_id,
+        usage_type=usage_type,
+        model_name=model_name,
+        input_tokens=usage.get("prompt_tokens", 0),
+        cached_input_tokens=details.get("cached_tokens", 0),
+        output_tokens=usage.get("completion_tokens", 0),
+        problem_id=problem_id,
+    )
+
+
+def _repair_messages(raw: str, error: str) -> list:
+    return [
+        SystemMessage(content="你是 JSON 修復工具。請依照指定的 JSON schema 修正下列輸出，"
+                              "保留原本的內容與語意，只輸出修正後的 JSON。"),
+        HumanMessage(content=f"驗證錯誤:\n{error}\n\n原始輸出:\n{raw}"),
+    ]
+
+
+async def ainvoke_structured(
+    chat_model: ChatOpenAI,
+    messages: list,
+    schema: Type[T],
+    usage_type: str,
+    student_id: str = None,
+    problem_id: str = None,
+) -> T:
+    """
+    以 schema 約束輸出並解析；token 費用與解析結果皆記入 llm_charge。
+    解析失敗時以 REPAIR_MODEL 修復，仍失敗拋出 StructuredOutputError。
+    """
+    response_format = strict_response_format(schema)
+    response, model_name = await hedged_ainvoke(
+        chat_model, messages, usage_type=usage_type, response_format=response_format
+    )
+    _charge(response, model_name, usage_type, student_id, problem_id)
+
+    refusal = response.additional_kwargs.get("refusal")
+    if refusal:
+        if student_id:
+            save_parse_event(student_id, usage_type, model_name, failed=True, repaired=False, problem_id=problem_id)
+        raise StructuredOutputError(f"{schema.__name__}: model refused ({refusal})")
+
+    raw = response.content
+    parsed, error = parse_structured(raw, schema)
+    failed = parsed is None
+
+    attempts = 0
+    while parsed is None and attempts < REPAIR_RETRIES:
+        attempts += 1
+        logger.warning(f"[Structured Output] {usage_type} {schema.__name__} parse failed, repairing: {error[:200]}")
+        repair_model = get_chat_model(REPAIR_MODEL, usage_type=usage_type, temperature=0)
+        repair_response, repair_model_name = await hedged_ainvoke(
+            repair_model, _repair_messages(raw, error), usage_type=usage_type, response_format=response_format
+        )
+        _charge(repair_response, repair_model_name, usage_type, student_id, problem_id)
+        parsed, error = parse_structured(repair_response.content, schema)
+
+    if student_id:
+        save_parse_event(
+            student_id, usage_type, model_name,
+            failed=failed, repaired=failed and parsed is not None, problem_id=problem_id,
+        )
+    if parsed is None:
+        raise StructuredOutputError(f"{schema.__name__}: {error}")
+    return parsed
+
+
+# ==========================================
+# 統計
+# ==========================================
+
+def parse_failure_report(problem_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """依 usage_type 統計 llm_charge 帳本中的解析失敗率與修復成功率"""
+    llm_charge_ledger.flush()
+
+    t = llm_charge_table
+    stmt = (
+        select(
+            t.c.usage_type,
+            func.coalesce(func.sum(t.c.parse_attempts), 0).label("attempts"),
+            func.coalesce(func.sum(t.c.parse_failures), 0).label("failures"),
+            func.coalesce(func.sum(t.c.parse_repairs), 0).label("repairs"),
+        )
+        .group_by(t.c.usage_type)
+        .having(func.coalesce(func.sum(t.c.parse_attempts), 0) > 0)
+    )
+    if problem_id:
+        stmt = stmt.where(t.c.problem_id == problem_id)
+
+    with engine.connect() as conn:
+        rows = conn.execute(stmt).fetchall()
+
+    return {
+        row.usage_type: {
+            "attempts": int(row.attempts),
+            "failures": int(row.failures),
+            "repairs": int(row.repairs),
+            "failure_rate": round(row.failures / row.attempts, 4),
+            "repair_rate": round(row.repairs / row.failures, 4) if row.failures else 0.0,
+        }
+        for row in rows
+    }
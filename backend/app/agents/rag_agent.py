@@ -1,11 +1,12 @@
 
 import os
 from typing import List, Dict, Any, Tuple, Optional
-from sqlalchemy import create_engine, text, MetaData, Table, select
+from sqlalchemy import create_engine, text, select
 from dotenv import load_dotenv
 from pgvector.sqlalchemy import Vector
 
 from backend.app.services.embedding_service import embedding_service
+from backend.app.utils.schema_registry import get_registry, LazyTable
 
 # --- Database Setup ---
 load_dotenv()
@@ -14,11 +15,11 @@ if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable not set.")
 
 engine = create_engine(DATABASE_URL)
-metadata = MetaData()
 
-# Reflect existing tables
-document_chunks = Table('document_chunks', metadata, autoload_with=engine)
-document_content = Table('document_content', metadata, autoload_with=engine)
+# Existing tables are reflected lazily on first use (only .name is needed for the raw SQL below)
+schema_registry = get_registry(engine)
+document_chunks = LazyTable(schema_registry, 'document_chunks')
+document_content = LazyTable(schema_registry, 'document_content')
 
 
 class RAGAgent:
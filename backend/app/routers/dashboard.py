@@ -5,8 +5,11 @@ Dashboard Router: 教師儀表板 API
 """
 from fastapi import APIRouter, HTTPException, Query
 from typing import Dict, Any, List, Optional
-from sqlalchemy import select, desc, func
+from sqlalchemy import select, desc, text
+from datetime import datetime
+from sse_starlette.sse import EventSourceResponse
 from collections import defaultdict
+import json
 import logging
 
 from backend.app.agents.debugging.db import (
@@ -14,10 +17,19 @@ from backend.app.agents.debugging.db import (
     precoding_question_table,
     precoding_student_answers_table,
     precoding_logic_status_table,
-    submission_table,
-    practice_table
+    precoding_question_summary_table,
+    precoding_option_stats_table,
+    latest_submission_table,
+    practice_table,
+    dialogue_table,
+    current_term_start
 )
 from backend.app.agents.debugging.oj_models import Problem, Session as OJSession
+from backend.app.agents.debugging.dashboard_feed import dashboard_feed
+from backend.app.agents.debugging.prompt_templates import prompt_cache_report, template_summary
+from backend.app.agents.debugging.structured_output import parse_failure_report
+from backend.app.agents.debugging.coding_help.practice_drafts import draft_stats
+from backend.app.agents.debugging.coding_help.practice_bank import bank_report
 
 router = APIRouter(prefix="/dashboard", tags=["Teacher Dashboard"])
 logger = logging.getLogger(__name__)
@@ -57,35 +69,50 @@ def get_problem_list():
 # Helper Functions
 # ==========================================
 
-def get_first_attempt_result(responses: List[Dict], question_id: str) -> Optional[Dict]:
-    """取得某題的首次作答紀錄"""
-    for r in responses:
-        if r.get("q_id") == question_id:
-            return r
-    return None
-
-
-def get_latest_attempt_result(responses: List[Dict], question_id: str) -> Optional[Dict]:
-    """取得某題的最新作答紀錄"""
-    latest = None
-    for r in responses:
-        if r.get("q_id") == question_id:
-            latest = r
-    return latest
-
-
-def calculate_first_attempt_score(responses: List[Dict], all_question_ids: List[str]) -> str:
-    """計算首答正確率 (幾分之幾)"""
-    if not all_question_ids:
-        return "0/0"
-    
-    correct_count = 0
-    for qid in all_question_ids:
-        first = get_first_attempt_result(responses, qid)
-        if first and first.get("is_correct"):
-            correct_count += 1
-    
-    return f"{correct_count}/{len(all_question_ids)}"
+def build_question_stats(questions: List[Dict], option_counts: Dict[str, Dict[int, int]]) -> List[Dict]:
+    """整理每題的選項分佈統計"""
+    return [
+        {
+            "q_id": q["id"],
+            "question_text": q.get("question", {}).get("text", ""),
+            "options": [
+                {
+                    "option_id": opt["id"],
+                    "label": opt.get("label", ""),
+                    "count": option_counts.get(q["id"], {}).get(opt["id"], 0)
+                }
+                for opt in q.get("options", [])
+            ]
+        }
+        for q in questions
+    ]
+
+
+def build_stage_summary(summary_rows: Dict[str, Dict], question_ids: List[str]) -> Dict[str, Any]:
+    """由預先彙整的每題摘要計算首答情況、首答分數與最終答對數"""
+    first_attempts = []
+    first_correct = 0
+    final_correct = 0
+    for qid in question_ids:
+        row = summary_rows.get(qid)
+        if not row:
+            continue
+        first_attempts.append({
+            "q_id": qid,
+            "selected_option_id": row["first_option_id"],
+            "is_correct": bool(row["first_is_correct"])
+        })
+        if row["first_is_correct"]:
+            first_correct += 1
+        if row["latest_is_correct"]:
+            final_correct += 1
+
+    total = len(question_ids)
+    return {
+        "first_attempts": first_attempts,
+        "score": f"{first_correct}/{total}",
+        "final_correct": f"{final_correct}/{total}"
+    }
 
 
 # ==========================================
@@ -96,6 +123,7 @@ def calculate_first_attempt_score(responses: List[Dict], all_question_ids: List[
 def get_precoding_dashboard(problem_id: str = Query(..., description="Problem ID")):
     """
     取得 Pre-coding 儀表板資料
+    讀取 process_precoding_submission 寫入時維護的統計表，不再逐筆重算作答紀錄
     回傳：
     - students: 學生列表 (包含觀念建構狀態、首答情況、分數)
     - question_stats: 每題的選項分佈統計
@@ -103,7 +131,10 @@ def get_precoding_dashboard(problem_id: str = Query(..., description="Problem ID
     try:
         with engine.connect() as conn:
             # 1. 取得題目資訊
-            q_stmt = select(precoding_question_table).where(
+            q_stmt = select(
+                precoding_question_table.c.explain_code_question,
+                precoding_question_table.c.error_code_question
+            ).where(
                 precoding_question_table.c.problem_id == problem_id
             )
             question_row = conn.execute(q_stmt).fetchone()
@@ -119,124 +150,60 @@ def get_precoding_dashboard(problem_id: str = Query(..., description="Problem ID
             error_q_ids = [q["id"] for q in error_questions]
             
             # 2. 取得所有學生的 Logic Chat 狀態
-            logic_stmt = select(precoding_logic_status_table).where(
+            logic_stmt = select(
+                precoding_logic_status_table.c.student_id,
+                precoding_logic_status_table.c.is_completed
+            ).where(
                 precoding_logic_status_table.c.problem_id == problem_id
             )
-            logic_rows = conn.execute(logic_stmt).fetchall()
-            logic_status_map = {}
-            for row in logic_rows:
-                mapping = row._mapping
-                logic_status_map[mapping["student_id"]] = mapping["is_completed"]
+            logic_status_map = {
+                row.student_id: row.is_completed
+                for row in conn.execute(logic_stmt).fetchall()
+            }
             
-            # 3. 取得所有學生的作答紀錄
-            ans_stmt = select(precoding_student_answers_table).where(
+            # 3. 取得學生進度 (不讀取 JSONB 作答紀錄)
+            ans_stmt = select(
+                precoding_student_answers_table.c.student_id,
+                precoding_student_answers_table.c.progress_stage
+            ).where(
                 precoding_student_answers_table.c.problem_id == problem_id
             )
             ans_rows = conn.execute(ans_stmt).fetchall()
             
-            students = []
-            # 統計用
-            explain_option_stats = defaultdict(lambda: defaultdict(int))  # {q_id: {option_id: count}}
-            error_option_stats = defaultdict(lambda: defaultdict(int))
+            # 4. 取得每位學生每題的作答摘要 {student_id: {stage: {q_id: row}}}
+            summary_stmt = select(precoding_question_summary_table).where(
+                precoding_question_summary_table.c.problem_id == problem_id
+            )
+            summary_map = defaultdict(lambda: defaultdict(dict))
+            for row in conn.execute(summary_stmt).fetchall():
+                mapping = row._mapping
+                summary_map[mapping["student_id"]][mapping["stage"]][mapping["q_id"]] = mapping
             
-            for row in ans_rows:
+            # 5. 取得首答選項分佈 {stage: {q_id: {option_id: count}}}
+            stats_stmt = select(precoding_option_stats_table).where(
+                precoding_option_stats_table.c.problem_id == problem_id
+            )
+            option_counts = defaultdict(lambda: defaultdict(dict))
+            for row in conn.execute(stats_stmt).fetchall():
                 mapping = row._mapping
-                student_id = mapping["student_id"]
-                explain_responses = mapping["explain_responses"] or []
-                error_responses = mapping["error_responses"] or []
-                
-                # 觀念建構狀態
-                logic_completed = logic_status_map.get(student_id, False)
-                
-                # 程式碼解釋：首答情況
-                explain_first_attempts = []
-                for qid in explain_q_ids:
-                    first = get_first_attempt_result(explain_responses, qid)
-                    if first:
-                        explain_first_attempts.append({
-                            "q_id": qid,
-                            "selected_option_id": first.get("selected_option_id"),
-                            "is_correct": first.get("is_correct", False)
-                        })
-                        # 統計選項分佈
-                        explain_option_stats[qid][first.get("selected_option_id")] += 1
-                
-                # 程式除錯：首答情況
-                error_first_attempts = []
-                for qid in error_q_ids:
-                    first = get_first_attempt_result(error_responses, qid)
-                    if first:
-                        error_first_attempts.append({
-                            "q_id": qid,
-                            "selected_option_id": first.get("selected_option_id"),
-                            "is_correct": first.get("is_correct", False)
-                        })
-                        error_option_stats[qid][first.get("selected_option_id")] += 1
-                
-                # 計算分數
-                explain_score = calculate_first_attempt_score(explain_responses, explain_q_ids)
-                error_score = calculate_first_attempt_score(error_responses, error_q_ids)
-                
-                # 最終狀態 (使用最新作答判斷)
-                explain_final_correct = sum(
-                    1 for qid in explain_q_ids 
-                    if get_latest_attempt_result(explain_responses, qid) and 
-                       get_latest_attempt_result(explain_responses, qid).get("is_correct")
-                )
-                error_final_correct = sum(
-                    1 for qid in error_q_ids 
-                    if get_latest_attempt_result(error_responses, qid) and 
-                       get_latest_attempt_result(error_responses, qid).get("is_correct")
-                )
-                
+                option_counts[mapping["stage"]][mapping["q_id"]][mapping["option_id"]] = mapping["count"]
+            
+            students = []
+            for row in ans_rows:
+                student_id = row.student_id
+                student_summary = summary_map.get(student_id, {})
                 students.append({
                     "student_id": student_id,
-                    "logic_completed": logic_completed,
-                    "explain_code": {
-                        "first_attempts": explain_first_attempts,
-                        "score": explain_score,
-                        "final_correct": f"{explain_final_correct}/{len(explain_q_ids)}"
-                    },
-                    "error_code": {
-                        "first_attempts": error_first_attempts,
-                        "score": error_score,
-                        "final_correct": f"{error_final_correct}/{len(error_q_ids)}"
-                    },
-                    "is_completed": mapping["progress_stage"] == "completed"
+                    "logic_completed": logic_status_map.get(student_id, False),
+                    "explain_code": build_stage_summary(student_summary.get("explain_code", {}), explain_q_ids),
+                    "error_code": build_stage_summary(student_summary.get("error_code", {}), error_q_ids),
+                    "is_completed": row.progress_stage == "completed"
                 })
             
-            # 4. 整理題目統計
+            # 6. 整理題目統計
             question_stats = {
-                "explain_code": [
-                    {
-                        "q_id": q["id"],
-                        "question_text": q.get("question", {}).get("text", ""),
-                        "options": [
-                            {
-                                "option_id": opt["id"],
-                                "label": opt.get("label", ""),
-                                "count": explain_option_stats[q["id"]].get(opt["id"], 0)
-                            }
-                            for opt in q.get("options", [])
-                        ]
-                    }
-                    for q in explain_questions
-                ],
-                "error_code": [
-                    {
-                        "q_id": q["id"],
-                        "question_text": q.get("question", {}).get("text", ""),
-                        "options": [
-                            {
-                                "option_id": opt["id"],
-                                "label": opt.get("label", ""),
-                                "count": error_option_stats[q["id"]].get(opt["id"], 0)
-                            }
-                            for opt in q.get("options", [])
-                        ]
-                    }
-                    for q in error_questions
-                ]
+                "explain_code": build_question_stats(explain_questions, option_counts["explain_code"]),
+                "error_code": build_question_stats(error_questions, option_counts["error_code"])
             }
             
             return {
@@ -266,31 +233,11 @@ def get_coding_help_dashboard(problem_id: str = Query(..., description="Problem
     """
     try:
         with engine.connect() as conn:
-            # 1. 取得所有學生的最新提交
-            # 使用子查詢取得每位學生的最新提交
-            subq = (
-                select(
-                    submission_table.c.student_id,
-                    func.max(submission_table.c.submitted_at).label("max_time")
-                )
-                .where(submission_table.c.problem_id == problem_id)
-                .group_by(submission_table.c.student_id)
-                .subquery()
-            )
-            
-            latest_stmt = (
-                select(
-                    submission_table.c.student_id,
-                    submission_table.c.result,
-                    submission_table.c.output
-                )
-                .join(
-                    subq,
-                    (submission_table.c.student_id == subq.c.student_id) &
-                    (submission_table.c.submitted_at == subq.c.max_time)
-                )
-                .where(submission_table.c.problem_id == problem_id)
-            )
+            # 1. 取得所有學生的最新提交 (由 save_submission 維護的最新提交表)
+            latest_stmt = select(
+                latest_submission_table.c.student_id,
+                latest_submission_table.c.verdict
+            ).where(latest_submission_table.c.problem_id == problem_id)
             
             submission_rows = conn.execute(latest_stmt).fetchall()
             
@@ -317,29 +264,7 @@ def get_coding_help_dashboard(problem_id: str = Query(..., description="Problem
                 mapping = row._mapping
                 student_id = mapping["student_id"]
                 
-                # 解析 verdict
-                result = mapping["result"]
-                output = mapping["output"]
-                
-                verdict = "Unknown"
-                if output and isinstance(output, dict):
-                    verdict = output.get("verdict", "Unknown")
-                elif result:
-                    # result 可能是 JSON string 或直接字串
-                    if isinstance(result, str):
-                        verdict = result.strip('"')
-                    else:
-                        verdict = str(result)
-                
-                # 標準化 verdict
-                if "Accepted" in verdict or "AC" in verdict:
-                    verdict = "AC"
-                elif "Wrong" in verdict:
-                    verdict = "WA"
-                elif "Time" in verdict:
-                    verdict = "TLE"
-                elif "Runtime" in verdict or "Error" in verdict:
-                    verdict = "RE"
+                verdict = mapping["verdict"] or "Unknown"
                 
                 verdict_stats[verdict] += 1
                 
@@ -366,3 +291,125 @@ def get_coding_help_dashboard(problem_id: str = Query(..., description="Problem
     except Exception as e:
         logger.error(f"Dashboard CodingHelp Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/coding_help/latency")
+def get_coding_help_latency(problem_id: str = Query(..., description="Problem ID")):
+    """
+    CodingHelp 回覆的首個 token 時間 (TTFT) 統計，依回覆類型 (scaffold / chat) 分組。
+    資料來源為串流回覆寫入 chat_log 的 ttft_ms (本學期)。
+    """
+    stmt = text(f"""
+        SELECT COALESCE(m.elem->>'type', 'chat') AS reply_type,
+               count(*) AS replies,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY (m.elem->>'ttft_ms')::float) AS p50,
+               percentile_cont(0.95) WITHIN GROUP (ORDER BY (m.elem->>'ttft_ms')::float) AS p95,
+               max((m.elem->>'ttft_ms')::float) AS max
+        FROM {dialogue_table.schema}.{dialogue_table.name} d
+        CROSS JOIN LATERAL jsonb_array_elements(COALESCE(d.chat_log, '[]'::jsonb)) AS m(elem)
+        WHERE d.problem_id = :problem_id
+          AND d.submitted_at >= :term_start
+          AND m.elem->>'role' = 'agent'
+          AND jsonb_typeof(m.elem->'ttft_ms') = 'number'
+        GROUP BY 1
+    """)
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(stmt, {
+                "problem_id": problem_id,
+                "term_start": current_term_start() or datetime.min
+            }).fetchall()
+        return {
+            "status": "success",
+            "ttft_ms": {
+                row.reply_type: {
+                    "count": row.replies,
+                    "p50": round(row.p50),
+                    "p95": round(row.p95),
+                    "max": round(row.max)
+                }
+                for row in rows
+            }
+        }
+    except Exception as e:
+        logger.error(f"Dashboard Latency Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/coding_help/practice_drafts")
+def get_practice_draft_stats():
+    """
+    預先生成練習題草稿的統計 (process 內累計)：
+    promotion_rate 為 AC 時草稿被採用的比例，stale 為依據的報告已變動或過期而捨棄的次數
+    """
+    return {"status": "success", "drafts": draft_stats.snapshot()}
+
+
+@router.get("/coding_help/practice_bank")
+def get_practice_bank(problem_id: str = Query(..., description="Problem ID")):
+    """
+    練習題庫的錯誤觀念群 (依取用次數排序) 與題庫命中率；
+    saved_cost 為命中時省下的生成費用
+    """
+    try:
+        return {"status": "success", **bank_report(problem_id)}
+    except Exception as e:
+        logger.error(f"Dashboard Practice Bank Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/llm/prompt_cache")
+def get_prompt_cache_stats(problem_id: Optional[str] = Query(None, description="Problem ID (不填為全部)")):
+    """
+    OpenAI prompt caching 命中率 (llm_charge 的 cached_input_tokens / input_tokens)，依 usage_type 分組；
+    templates 列出各 prompt 模板的固定前綴長度，未達 1024 tokens 的前綴不會被快取。
+    """
+    try:
+        return {
+            "status": "success",
+            "usage_types": prompt_cache_report(problem_id),
+            "templates": template_summary(),
+        }
+    except Exception as e:
+        logger.error(f"Dashboard Prompt Cache Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/llm/structured_output")
+def get_structured_output_stats(problem_id: Optional[str] = Query(None, description="Problem ID (不填為全部)")):
+    """
+    structured output 解析統計，依 usage_type 分組：
+    failure_rate 為首次解析失敗比例，repair_rate 為失敗後經修復呼叫成功的比例
+    """
+    try:
+        return {"status": "success", "usage_types": parse_failure_report(problem_id)}
+    except Exception as e:
+        logger.error(f"Dashboard Structured Output Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ==========================================
+# Live Dashboard Feed (SSE)
+# ==========================================
+
+@router.get("/stream")
+async def stream_dashboard(problem_id: str = Query(..., description="Problem ID")):
+    """
+    儀表板即時推播 (Server-Sent Events)
+    前端先呼叫 /dashboard/precoding 或 /dashboard/coding_help 取得初始資料，
+    之後套用此處推送的差異事件：
+    - verdict: 學生最新提交結果
+    - precoding_answer: Pre-coding 作答 (首答、最新作答、階段進度)
+    - precoding_logic: 觀念建構完成
+    """
+    queue = dashboard_feed.subscribe(problem_id)
+
+    async def event_generator():
+        try:
+            while True:
+                event = await queue.get()
+                yield {"event": event["type"], "data": json.dumps(event, ensure_ascii=False, default=str)}
+        finally:
+            dashboard_feed.unsubscribe(problem_id, queue)
+
+    return EventSourceResponse(event_generator(), ping=15)
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, HTTPException, Query, Path, Depends, BackgroundTasks
 from typing import Optional, List, Dict, Any
-import json, re
+import json, re, time
+import asyncio
 import logging
-from sqlalchemy import select, desc, insert, update, delete, text, asc, func
+from sqlalchemy import select, desc, insert, delete, text, asc, func
 from pydantic import BaseModel
+from sse_starlette.sse import EventSourceResponse
 
 # --- OJ & Core Imports ---
 from backend.app.agents.debugging.OJ.judge_core import run_judge, compute_verdict
@@ -15,8 +17,18 @@ from backend.app.agents.debugging.db import (
     save_submission, 
     get_latest_submission,
     get_submission_count,   
-    get_practice_status,    
     update_practice_answer,
+    get_student_workspace,
+    normalize_verdict,
+    number_chat_messages,
+    append_chat_messages,
+    get_recent_chat_messages,
+    get_submission_history,
+    get_submission_diff,
+    blob_ref,
+    put_blobs,
+    load_submission_content,
+    in_current_term,
     engine,                 
     dialogue_table,         
     evidence_report_table,  
@@ -27,24 +39,33 @@ from backend.app.agents.debugging.db import (
 from backend.app.agents.debugging.oj_models import get_problems_by_chapter, get_problem_by_id
 from backend.app.agents.debugging.pre_coding import get_student_precoding_state, process_precoding_submission
 from backend.app.agents.debugging.pre_coding.manager import PreCodingManager
+from backend.app.agents.debugging.dashboard_feed import dashboard_feed
+from backend.app.agents.debugging.response_stream import response_streams, scaffold_stream_key
 
 # --- Graph Import ---
-from backend.app.agents.debugging.graph import app_graph
+from backend.app.agents.debugging.graph import app_graph, GRAPH_MODE
+from backend.app.agents.debugging.llm_client import get_chat_model
 
 # --- Help Chat Import (僅用於 /help/chat 端點) ---
-from backend.app.agents.debugging.coding_help.help_chat import process_chat
+from backend.app.agents.debugging.coding_help.help_chat import (
+    process_chat,
+    validate_input,
+    stream_chat_response,
+    build_chat_entries,
+    MarkdownStreamFilter,
+    CHAT_HISTORY_WINDOW
+)
+from backend.app.agents.debugging.coding_help import practice_drafts
 
 # LangChain Imports (For Chat)
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from langchain_openai import ChatOpenAI
-import os
 from datetime import datetime
 
 router = APIRouter(prefix="/debugging", tags=["Online Judge & Problems"])
 logger = logging.getLogger(__name__)
 
 # 初始化 Chat LLM 用於一般對話
-chat_llm = ChatOpenAI(model="gpt-4o", temperature=0.3, api_key=os.getenv("OPENAI_API_KEY"))
+chat_llm = get_chat_model("gpt-4o", usage_type="code_correction", temperature=0.3)
 
 # ==========================================
 # Pydantic Models
@@ -100,18 +121,26 @@ async def run_background_graph_task(initial_state: Dict, submission_num: int):
     """
     背景任務：使用 LangGraph app_graph 執行完整的診斷/練習題生成流程。
     根據 is_correct 決定走哪條路：
-    - is_correct=False: 執行診斷 -> 路由 -> 檢索(可選) -> 鷹架回覆
+    - is_correct=False: 執行診斷 (與推測檢索並行) -> ZPD / 路由並行 -> 檢索(可選) -> 鷹架回覆
     - is_correct=True: 生成練習題
+    端到端與各節點耗時寫入 log，可用 DEBUGGING_GRAPH_MODE=sequential 對照舊流程。
     """
     student_id = initial_state["student_id"]
     problem_id = initial_state["problem_id"]
     is_correct = initial_state.get("is_correct", False)
+    stream_key = initial_state.get("stream_key")
     
     logger.info(f"Starting background GRAPH task for {student_id} on {problem_id} (Sub#{submission_num}, is_correct={is_correct})")
 
     try:
         # 執行 LangGraph
+        started = time.perf_counter()
         final_state = await app_graph.ainvoke(initial_state)
+        total_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(
+            f"[Graph Latency] mode={GRAPH_MODE} is_correct={is_correct} total_ms={total_ms} "
+            f"nodes={json.dumps(final_state.get('node_timings', {}))}"
+        )
         
         if is_correct:
             # --- AC 路徑：儲存練習題 ---
@@ -134,40 +163,61 @@ async def run_background_graph_task(initial_state: Dict, submission_num: int):
             scaffold_response = final_state.get("initial_response", "")
             zpd = final_state.get("zpd_level", 1)
             
-            # 1. 儲存診斷報告 (Evidence Report) - 包含錯誤程式碼
+            # 1. 儲存診斷報告 (Evidence Report) - 錯誤程式碼與提交共用 content_blob
+            blobs = {}
+            code_hash = blob_ref(initial_state["current_code"], blobs)
             with engine.begin() as conn:
+                put_blobs(conn, blobs)
                 conn.execute(insert(evidence_report_table).values(
                     student_id=student_id,
                     problem_id=problem_id,
                     num=submission_num,
                     evidence_report=report,
-                    code={"content": initial_state["current_code"]}
+                    code={"hash": code_hash}
                 ))
+
+            # 接近 AC 時依新的報告預先生成練習題草稿
+            await practice_drafts.maybe_schedule(student_id, problem_id, initial_state.get("problem_info", {}))
             
             # 2. 儲存對話紀錄 (使用新的 chat_log 格式)
             if scaffold_response:
                 timestamp = datetime.now().isoformat()
-                initial_chat_log = [
-                    {
-                        "role": "agent",
-                        "content": clean_markdown_filter(scaffold_response),
-                        "zpd": zpd,
-                        "timestamp": timestamp,
-                        "type": "scaffold"
-                    }
-                ]
+                agent_message = {
+                    "role": "agent",
+                    "content": clean_markdown_filter(scaffold_response),
+                    "zpd": zpd,
+                    "timestamp": timestamp,
+                    "type": "scaffold"
+                }
+                stream = response_streams.get(stream_key) if stream_key else None
+                if stream is not None and stream.ttft_ms is not None:
+                    agent_message["ttft_ms"] = stream.ttft_ms
+                initial_chat_log = number_chat_messages([agent_message])
                 
                 with engine.begin() as conn:
                     conn.execute(insert(dialogue_table).values(
                         student_id=student_id,
                         problem_id=problem_id,
                         num=submission_num,
-                        chat_log=initial_chat_log
+                        chat_log=initial_chat_log,
+                        message_seq=len(initial_chat_log)
                     ))
                 logger.info(f"Background Task - Diagnosis & Scaffold saved for {student_id}")
+                if stream_key:
+                    response_streams.finish(stream_key, {
+                        "status": "completed",
+                        "reply": agent_message["content"],
+                        "zpd_level": zpd,
+                        "num": submission_num,
+                        "chat_log": initial_chat_log
+                    })
+            elif stream_key:
+                response_streams.finish(stream_key, {"status": "error", "message": "No scaffold generated."})
 
     except Exception as e:
         logger.error(f"Background Graph Task Failed: {e}")
+        if stream_key:
+            response_streams.finish(stream_key, {"status": "error", "message": "AI diagnosis failed."})
 
 # ==========================================
 # Online Judge API Endpoints
@@ -217,6 +267,13 @@ async def submit_code(
             verdict,
             results
         )
+        await asyncio.to_thread(dashboard_feed.publish, {
+            "type": "verdict",
+            "problem_id": payload.problem_id,
+            "student_id": payload.student_id,
+            "verdict": normalize_verdict(verdict),
+            "submission_num": this_submission_num
+        })
     except Exception as e:
         logger.error(f"DB Save Error: {e}")
 
@@ -243,7 +300,8 @@ async def submit_code(
         with engine.connect() as conn:
             stmt = select(evidence_report_table.c.evidence_report).where(
                 evidence_report_table.c.student_id == payload.student_id,
-                evidence_report_table.c.problem_id == payload.problem_id
+                evidence_report_table.c.problem_id == payload.problem_id,
+                in_current_term(evidence_report_table.c.submitted_at)
             ).order_by(desc(evidence_report_table.c.submitted_at)).limit(3)
             result = conn.execute(stmt).fetchall()
             previous_reports = [row[0] for row in result if row[0]]
@@ -314,18 +372,19 @@ async def submit_code(
             # Step 2: 重新撈取 Evidence Reports
             current_reports = []
             try:
-                with engine.connect() as conn:
-                    stmt = select(evidence_report_table.c.evidence_report).where(
-                        evidence_report_table.c.student_id == student_id,
-                        evidence_report_table.c.problem_id == problem_id
-                    ).order_by(desc(evidence_report_table.c.submitted_at)).limit(5)
-                    rows = conn.execute(stmt).fetchall()
-                    current_reports = [row[0] for row in rows if row[0]]
+                current_reports = await asyncio.to_thread(practice_drafts.load_recent_reports, student_id, problem_id)
             except Exception as e:
                 logger.error(f"Practice Gen: Failed to fetch reports: {e}")
 
             # Step 3: 決定動作
             if current_reports:
+                # Case 2.0: 已有依相同報告預先生成的草稿 → 直接採用
+                try:
+                    if await asyncio.to_thread(practice_drafts.promote, student_id, problem_id, current_reports):
+                        return
+                except Exception as e:
+                    logger.error(f"Practice Gen: Failed to promote draft: {e}")
+
                 # Case 2.1: 有報告 → 生成練習題
                 logger.info(f"Practice Gen: Found {len(current_reports)} report(s). Generating practice questions.")
                 app_graph_inputs["previous_reports"] = current_reports
@@ -358,6 +417,11 @@ async def submit_code(
         # 實際 AI 分析將在使用者切換至「程式修正」分頁時才觸發
         logger.info(f"Error detected. AI analysis will be triggered on-demand when user accesses coding help.")
 
+        # 通過多數測資且已有診斷報告時，預先生成練習題草稿 (AC 時直接採用)
+        if previous_reports and problem.test_cases:
+            pass_ratio = sum(1 for r in results if r.status == "AC") / len(problem.test_cases)
+            await practice_drafts.maybe_schedule(payload.student_id, payload.problem_id, problem_info, pass_ratio)
+
     # ============================================================
     # Response
     # ============================================================
@@ -463,64 +527,17 @@ async def precoding_logic_chat_endpoint(payload: PreCodingChatRequest):
 def get_student_code_endpoint(student_id: str, problem_id: str):
     """獲取學生最新提交狀態"""
     try:
-        submission = get_latest_submission(student_id, problem_id)
-        
-        code_content = ""
-        result_display = ""
-        is_accepted = False
-        
-        if submission:
-            raw_code = submission["code"]
-            if isinstance(raw_code, dict):
-                code_content = raw_code.get("content", "")
-            elif isinstance(raw_code, str):
-                try:
-                    code_json = json.loads(raw_code)
-                    code_content = code_json.get("content", "")
-                except:
-                    code_content = raw_code
-            
-            output_data = submission["output"]
-            if output_data and isinstance(output_data, dict):
-                verdict = output_data.get("verdict", "Unknown")
-                result_display = verdict
-                if "Accepted" in verdict or "AC" in verdict:
-                    is_accepted = True
-            else:
-                raw_res = str(submission["result"])
-                result_display = raw_res.strip('"')
-                if "Accepted" in raw_res or "AC" in raw_res:
-                    is_accepted = True
-
-        practice_info = get_practice_status(student_id, problem_id)
-
-        # Calculate submission_num for frontend
-        sub_num = get_submission_count(student_id, problem_id)
-
-        # Calculate latest_report_num for frontend (V3)
-        latest_report_num = 0
-        try:
-            with engine.connect() as conn:
-                stmt = select(func.max(evidence_report_table.c.num)).where(
-                    evidence_report_table.c.student_id == student_id,
-                    evidence_report_table.c.problem_id == problem_id
-                )
-                row = conn.execute(stmt).fetchone()
-                if row and row[0]:
-                    latest_report_num = row[0]
-        except Exception as e:
-            logger.warning(f"Failed to get latest report num: {e}")
-
+        workspace = get_student_workspace(student_id, problem_id)
         return {
             "status": "success",
             "data": {
-                "code": code_content,
-                "result": result_display, 
-                "is_accepted": is_accepted,
-                "practice": practice_info,
-                "submitted_at": submission["submitted_at"] if submission else None,
-                "submission_num": sub_num,
-                "latest_report_num": latest_report_num
+                "code": workspace["code"],
+                "result": workspace["result"],
+                "is_accepted": workspace["is_accepted"],
+                "practice": workspace["practice"],
+                "submitted_at": workspace["submitted_at"],
+                "submission_num": workspace["submission_num"],
+                "latest_report_num": workspace["latest_report_num"]
             }
         }
 
@@ -528,6 +545,60 @@ def get_student_code_endpoint(student_id: str, problem_id: str):
         logger.error(f"Error getting student code: {e}")
         return {"status": "error", "message": str(e)}
 
+@router.get("/workspace/{student_id}/{problem_id}")
+def get_student_workspace_endpoint(student_id: str, problem_id: str):
+    """
+    取得學生工作區 (單一 DB round-trip)
+    包含 /student_code 的所有欄位，以及最新對話紀錄 (dialogue_num, chat_log)
+    """
+    try:
+        return {
+            "status": "success",
+            "data": get_student_workspace(student_id, problem_id)
+        }
+    except Exception as e:
+        logger.error(f"Error getting student workspace: {e}")
+        return {"status": "error", "message": str(e)}
+
+@router.get("/submissions/{student_id}/{problem_id}")
+def get_submission_history_endpoint(
+    student_id: str,
+    problem_id: str,
+    limit: int = Query(20, ge=1, le=100, description="Page size"),
+    before: Optional[str] = Query(None, description="next_cursor from the previous page")
+):
+    """
+    提交歷史 (Keyset 分頁，新到舊)
+    只回傳摘要 (num, verdict, passed_cases, submitted_at)，程式碼差異請用 /diff
+    """
+    try:
+        return {
+            "status": "success",
+            **get_submission_history(student_id, problem_id, limit=limit, before=before)
+        }
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    except Exception as e:
+        logger.error(f"Error getting submission history: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/submissions/{student_id}/{problem_id}/diff")
+def get_submission_diff_endpoint(
+    student_id: str,
+    problem_id: str,
+    from_num: int = Query(..., ge=1),
+    to_num: int = Query(..., ge=1)
+):
+    """比較兩次提交的程式碼與測資結果 (伺服器端計算並快取)"""
+    try:
+        diff = get_submission_diff(student_id, problem_id, from_num, to_num)
+    except Exception as e:
+        logger.error(f"Error computing submission diff: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if diff is None:
+        raise HTTPException(status_code=404, detail="Submission not found.")
+    return {"status": "success", "data": diff}
+
 @router.get("/problems/chapter/{chapter_id}")
 def list_problems_by_chapter_endpoint(
     chapter_id: str = Path(...),
@@ -635,12 +706,14 @@ async def init_coding_help(payload: InitHelpRequest):
                      trans_conn.execute(dialogue_table.delete().where(
                          dialogue_table.c.student_id == payload.student_id,
                          dialogue_table.c.problem_id == payload.problem_id,
-                         dialogue_table.c.num == target_num
+                         dialogue_table.c.num == target_num,
+                         in_current_term(dialogue_table.c.submitted_at)
                      ))
                      trans_conn.execute(evidence_report_table.delete().where(
                          evidence_report_table.c.student_id == payload.student_id,
                          evidence_report_table.c.problem_id == payload.problem_id,
-                         evidence_report_table.c.num == target_num
+                         evidence_report_table.c.num == target_num,
+                         in_current_term(evidence_report_table.c.submitted_at)
                      ))
             
             # 1. 檢查是否已有對話紀錄 (Target Num)
@@ -648,7 +721,8 @@ async def init_coding_help(payload: InitHelpRequest):
                 check_stmt = select(dialogue_table).where(
                     dialogue_table.c.student_id == payload.student_id,
                     dialogue_table.c.problem_id == payload.problem_id,
-                    dialogue_table.c.num == target_num
+                    dialogue_table.c.num == target_num,
+                    in_current_term(dialogue_table.c.submitted_at)
                 ).limit(1)
                 existing_dialogue = conn.execute(check_stmt).fetchone()
                 
@@ -678,7 +752,8 @@ async def init_coding_help(payload: InitHelpRequest):
             check_report_stmt = select(evidence_report_table).where(
                 evidence_report_table.c.student_id == payload.student_id,
                 evidence_report_table.c.problem_id == payload.problem_id,
-                evidence_report_table.c.num == target_num
+                evidence_report_table.c.num == target_num,
+                in_current_term(evidence_report_table.c.submitted_at)
             ).limit(1)
             existing_report = conn.execute(check_report_stmt).fetchone()
             
@@ -704,18 +779,22 @@ async def init_coding_help(payload: InitHelpRequest):
         
         stmt_sub = select(submission_table).where(
             submission_table.c.student_id == payload.student_id,
-            submission_table.c.problem_id == payload.problem_id
-        ).order_by(asc(submission_table.c.submitted_at)).offset(offset_val).limit(1)
+            submission_table.c.problem_id == payload.problem_id,
+        ).order_by(asc(submission_table.c.submitted_at), asc(submission_table.c.id)).offset(offset_val).limit(1)
 
         with engine.connect() as conn:
              submission_row = conn.execute(stmt_sub).fetchone()
+             if submission_row:
+                 snapshot_code, snapshot_output = load_submission_content(
+                     conn, submission_row._mapping["code"], submission_row._mapping["output"]
+                 )
         
         target_submission = None
         if submission_row:
              mapping = submission_row._mapping
              target_submission = {
-                 "code": mapping["code"],
-                 "output": mapping["output"],
+                 "code": snapshot_code,
+                 "output": snapshot_output,
                  "submitted_at": mapping["submitted_at"]
              }
              logger.info(f"Snapshot Submission Found: Time={mapping['submitted_at']}")
@@ -764,7 +843,8 @@ async def init_coding_help(payload: InitHelpRequest):
             with engine.connect() as conn2:
                 stmt = select(evidence_report_table.c.evidence_report).where(
                     evidence_report_table.c.student_id == payload.student_id,
-                    evidence_report_table.c.problem_id == payload.problem_id
+                    evidence_report_table.c.problem_id == payload.problem_id,
+                    in_current_term(evidence_report_table.c.submitted_at)
                 ).order_by(desc(evidence_report_table.c.submitted_at)).limit(3)
                 result = conn2.execute(stmt).fetchall()
                 previous_reports = [row[0] for row in result if row[0]]
@@ -800,7 +880,8 @@ async def init_coding_help(payload: InitHelpRequest):
             "practice_question": []
         }
         
-        task_id = f"{payload.student_id}_{payload.problem_id}_{target_num}"
+        task_id = scaffold_stream_key(payload.student_id, payload.problem_id, target_num)
+        initial_state["stream_key"] = task_id
         
         added = await analysis_queue.add_task(
             run_background_graph_task,
@@ -808,6 +889,9 @@ async def init_coding_help(payload: InitHelpRequest):
             target_num,
             task_id=task_id
         )
+        if added:
+            # 回覆的 token 由 /help/init/stream 轉送，TTFT 由此起算
+            response_streams.open(task_id)
         
         if not added:
             logger.info(f"Task {task_id} is already processing. Returning pending.")
@@ -819,7 +903,7 @@ async def init_coding_help(payload: InitHelpRequest):
         
         return {
             "status": "started",
-            "message": "AI analysis has been triggered. Please poll for results.",
+            "message": "AI analysis has been triggered. Subscribe to /help/init/stream or poll for results.",
             "num": target_num
         }
 
@@ -827,6 +911,162 @@ async def init_coding_help(payload: InitHelpRequest):
         logger.error(f"CodingHelp Init Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+INIT_STREAM_TIMEOUT_SEC = 180
+
+
+def _sse(event: str, data: Dict[str, Any]) -> Dict[str, str]:
+    return {"event": event, "data": json.dumps(data, ensure_ascii=False, default=str)}
+
+
+def _load_scaffold_dialogue(student_id: str, problem_id: str, num: int) -> Optional[Dict[str, Any]]:
+    """已寫入的鷹架回覆 (與 /help/init resumed 回應相同格式)"""
+    with engine.connect() as conn:
+        row = conn.execute(select(dialogue_table.c.chat_log).where(
+            dialogue_table.c.student_id == student_id,
+            dialogue_table.c.problem_id == problem_id,
+            dialogue_table.c.num == num,
+            in_current_term(dialogue_table.c.submitted_at)
+        ).limit(1)).fetchone()
+    if not row:
+        return None
+    chat_log = row[0] or []
+    agent_msg = next((m for m in reversed(chat_log) if m.get("role") == "agent"), {})
+    return {
+        "status": "resumed",
+        "reply": agent_msg.get("content", ""),
+        "zpd_level": agent_msg.get("zpd", 1),
+        "num": num,
+        "chat_log": chat_log
+    }
+
+
+@router.get("/help/init/stream/{student_id}/{problem_id}")
+async def init_coding_help_stream(
+    student_id: str,
+    problem_id: str,
+    submission_num: int = Query(..., ge=1, description="The num returned by /help/init")
+):
+    """
+    訂閱 /help/init 觸發的鷹架回覆 (SSE)：
+    - token: {"text": 已過濾 Markdown 的片段} (連線前已產生的片段會先補送)
+    - done: 對話紀錄寫入後送出，內容與 /help/init resumed 回應相同，另含 ttft_ms
+    - error: 分析失敗或沒有進行中的分析
+    """
+    key = scaffold_stream_key(student_id, problem_id, submission_num)
+
+    async def event_generator():
+        stream = response_streams.get(key)
+        if stream is None:
+            existing = await asyncio.to_thread(_load_scaffold_dialogue, student_id, problem_id, submission_num)
+            if existing:
+                yield _sse("done", existing)
+            else:
+                yield _sse("error", {"message": "No analysis in progress. Call /help/init first."})
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + INIT_STREAM_TIMEOUT_SEC
+        events = stream.events()
+        while True:
+            try:
+                event, data = await asyncio.wait_for(anext(events), timeout=max(deadline - loop.time(), 0))
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                yield _sse("error", {"message": "AI diagnosis is still processing. Please poll /help/init."})
+                break
+            if event == "token":
+                yield _sse("token", {"text": data})
+            elif data.get("status") == "error":
+                yield _sse("error", data)
+            else:
+                yield _sse("done", {**data, "ttft_ms": stream.ttft_ms})
+
+    return EventSourceResponse(event_generator(), ping=15)
+
+
+def _load_chat_context(payload: ChatRequest) -> Dict[str, Any]:
+    """讀取對話所需的 evidence report、zpd、最近訊息與題目資訊 (一般與串流對話共用)"""
+    latest_num = get_submission_count(payload.student_id, payload.problem_id)
+    # V3: Use submission_num from request if provided, else fall back to latest_num
+    target_num = payload.submission_num if (payload.submission_num is not None and payload.submission_num > 0) else latest_num
+    logger.info(f"Chat for {payload.student_id} on {payload.problem_id}, using num={target_num} (latest={latest_num})")
+    
+    with engine.connect() as conn:
+        # 1. 取得 evidence report (for TARGET num)
+        stmt_rep = select(evidence_report_table).where(
+            evidence_report_table.c.student_id == payload.student_id,
+            evidence_report_table.c.problem_id == payload.problem_id,
+            evidence_report_table.c.num == target_num,
+            in_current_term(evidence_report_table.c.submitted_at)
+        )
+        report_row = conn.execute(stmt_rep).fetchone()
+        
+        context_report = {}
+        if report_row:
+            context_report = report_row._mapping["evidence_report"]
+        
+        # 2. 取得現有對話 (for TARGET num)：只讀取 id、zpd 與最近幾則訊息，不載入整份 chat_log
+        stmt_dial = select(
+            dialogue_table.c.id,
+            func.jsonb_path_query_first(dialogue_table.c.chat_log, text("'$[*] ? (@.zpd > 0).zpd'")).label("zpd")
+        ).where(
+            dialogue_table.c.student_id == payload.student_id,
+            dialogue_table.c.problem_id == payload.problem_id,
+            dialogue_table.c.num == target_num,
+            in_current_term(dialogue_table.c.submitted_at)
+        ).limit(1)
+        dialogue_row = conn.execute(stmt_dial).fetchone()
+        
+        recent_chat_log = []
+        zpd_val = 1
+        dialogue_id = None
+        
+        if dialogue_row:
+            mapping = dialogue_row._mapping
+            dialogue_id = mapping["id"]
+            if mapping["zpd"]:
+                zpd_val = mapping["zpd"]
+            recent_chat_log = get_recent_chat_messages(conn, dialogue_table, dialogue_id, CHAT_HISTORY_WINDOW)
+    
+    # 3. 取得題目資訊
+    problem_info_raw = get_problem_by_id(payload.problem_id)
+    problem_info = {
+        "title": problem_info_raw.get("title", ""),
+        "description": problem_info_raw.get("description", ""),
+        "input_description": problem_info_raw.get("input_description", ""),
+        "output_description": problem_info_raw.get("output_description", "")
+    }
+    return {
+        "target_num": target_num,
+        "evidence_report": context_report,
+        "zpd_level": zpd_val,
+        "dialogue_id": dialogue_id,
+        "chat_log": recent_chat_log,
+        "problem_info": problem_info,
+    }
+
+
+def _save_chat_messages(payload: ChatRequest, context: Dict[str, Any], new_messages: List[Dict]):
+    """追加對話紀錄 (jsonb || 追加，不整份改寫)，回傳 (寫入的訊息, message_seq)"""
+    with engine.begin() as conn:
+        message_seq = None
+        if context["dialogue_id"]:
+            message_seq = append_chat_messages(conn, dialogue_table, context["dialogue_id"], new_messages)
+        if message_seq is None:
+            # 新增記錄 (如果不存在或已被刪除) - use target_num, not latest_num
+            new_messages = number_chat_messages(new_messages)
+            message_seq = len(new_messages)
+            conn.execute(insert(dialogue_table).values(
+                student_id=payload.student_id,
+                problem_id=payload.problem_id,
+                num=context["target_num"],
+                chat_log=new_messages,
+                message_seq=message_seq
+            ))
+    return new_messages, message_seq
+
+
 @router.post("/help/chat")
 async def chat_with_agent(payload: ChatRequest):
     """
@@ -834,64 +1074,15 @@ async def chat_with_agent(payload: ChatRequest):
     使用新的 help_chat 模組，包含 Input Guard 和 chat_log 格式
     """
     try:
-        latest_num = get_submission_count(payload.student_id, payload.problem_id)
-        # V3: Use submission_num from request if provided, else fall back to latest_num
-        target_num = payload.submission_num if (payload.submission_num is not None and payload.submission_num > 0) else latest_num
-        logger.info(f"Chat for {payload.student_id} on {payload.problem_id}, using num={target_num} (latest={latest_num})")
-        
-        with engine.connect() as conn:
-            # 1. 取得 evidence report (for TARGET num)
-            stmt_rep = select(evidence_report_table).where(
-                evidence_report_table.c.student_id == payload.student_id,
-                evidence_report_table.c.problem_id == payload.problem_id,
-                evidence_report_table.c.num == target_num
-            )
-            report_row = conn.execute(stmt_rep).fetchone()
-            
-            context_report = {}
-            if report_row:
-                context_report = report_row._mapping["evidence_report"]
-            
-            # 2. 取得現有對話紀錄 (for TARGET num)
-            stmt_dial = select(dialogue_table).where(
-                dialogue_table.c.student_id == payload.student_id,
-                dialogue_table.c.problem_id == payload.problem_id,
-                dialogue_table.c.num == target_num
-            ).limit(1)
-            dialogue_row = conn.execute(stmt_dial).fetchone()
-            
-            existing_chat_log = []
-            zpd_val = 1
-            dialogue_id = None
-            
-            if dialogue_row:
-                mapping = dialogue_row._mapping
-                existing_chat_log = mapping.get("chat_log") or []
-                dialogue_id = mapping.get("id")
-                
-                # 從 chat_log 取得 zpd_level
-                if existing_chat_log:
-                    for msg in existing_chat_log:
-                        if msg.get("zpd"):
-                            zpd_val = msg.get("zpd", 1)
-                            break
-        
-        # 3. 取得題目資訊
-        problem_info_raw = get_problem_by_id(payload.problem_id)
-        problem_info = {
-            "title": problem_info_raw.get("title", ""),
-            "description": problem_info_raw.get("description", ""),
-            "input_description": problem_info_raw.get("input_description", ""),
-            "output_description": problem_info_raw.get("output_description", "")
-        }
+        context = _load_chat_context(payload)
         
         # 4. 使用 help_chat 模組處理對話
         chat_result = await process_chat(
             message=payload.message,
-            zpd_level=zpd_val,
-            evidence_report=context_report,
-            problem_info=problem_info,
-            chat_log=existing_chat_log,
+            zpd_level=context["zpd_level"],
+            evidence_report=context["evidence_report"],
+            problem_info=context["problem_info"],
+            chat_log=context["chat_log"],
             student_id=payload.student_id,
             problem_id=payload.problem_id,
         )
@@ -903,46 +1094,94 @@ async def chat_with_agent(payload: ChatRequest):
                 "is_valid": False
             }
         
-        # 6. 更新對話紀錄 (使用 UPDATE 或 INSERT)
-        updated_chat_log = chat_result["updated_chat_log"]
-        
-        if dialogue_id:
-            # 更新現有記錄
-            with engine.begin() as conn:
-                conn.execute(
-                    update(dialogue_table).where(
-                        dialogue_table.c.id == dialogue_id
-                    ).values(
-                        chat_log=updated_chat_log
-                    )
-                )
-        else:
-            # 新增記錄 (如果不存在) - use target_num, not latest_num
-            with engine.begin() as conn:
-                conn.execute(insert(dialogue_table).values(
-                    student_id=payload.student_id,
-                    problem_id=payload.problem_id,
-                    num=target_num,
-                    chat_log=updated_chat_log
-                ))
+        # 6. 追加對話紀錄
+        new_messages, message_seq = _save_chat_messages(payload, context, chat_result["new_messages"])
 
         return {
             "reply": chat_result["response"],
             "is_valid": True,
-            "chat_log": updated_chat_log
+            "messages": new_messages,
+            "message_seq": message_seq
         }
 
     except Exception as e:
         logger.error(f"Chat Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.post("/help/chat/stream")
+async def chat_with_agent_stream(payload: ChatRequest):
+    """
+    /help/chat 的 SSE 版本：
+    - token: {"text": 已過濾 Markdown 的片段}
+    - done: 與 /help/chat 回應相同 (對話紀錄已寫入)，另含 ttft_ms
+    - error: {"message": ...}
+    ttft_ms 為收到請求到送出第一個 token 的時間，與回覆一起存入 chat_log。
+    """
+    received_at = time.perf_counter()
+    try:
+        context = _load_chat_context(payload)
+    except Exception as e:
+        logger.error(f"Chat Stream Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_generator():
+        try:
+            validation = await validate_input(payload.message, student_id=payload.student_id, problem_id=payload.problem_id)
+            if not validation["is_valid"]:
+                yield _sse("done", {"reply": validation["reason"], "is_valid": False})
+                return
+
+            md_filter = MarkdownStreamFilter()
+            parts = []
+            ttft_ms = None
+            async for chunk in stream_chat_response(
+                message=payload.message,
+                zpd_level=context["zpd_level"],
+                evidence_report=context["evidence_report"],
+                problem_info=context["problem_info"],
+                chat_log=context["chat_log"],
+                student_id=payload.student_id,
+                problem_id=payload.problem_id,
+            ):
+                parts.append(chunk)
+                delta = md_filter.feed(chunk)
+                if delta:
+                    if ttft_ms is None:
+                        ttft_ms = round((time.perf_counter() - received_at) * 1000)
+                    yield _sse("token", {"text": delta})
+            tail = md_filter.flush()
+            if tail:
+                yield _sse("token", {"text": tail})
+
+            reply = clean_markdown_filter("".join(parts))
+            total_ms = round((time.perf_counter() - received_at) * 1000)
+            logger.info(f"[Chat Stream] {payload.student_id}/{payload.problem_id} ttft_ms={ttft_ms} total_ms={total_ms}")
+
+            new_messages = build_chat_entries(payload.message, reply, context["zpd_level"], ttft_ms=ttft_ms, total_ms=total_ms)
+            new_messages, message_seq = await asyncio.to_thread(_save_chat_messages, payload, context, new_messages)
+            yield _sse("done", {
+                "reply": reply,
+                "is_valid": True,
+                "messages": new_messages,
+                "message_seq": message_seq,
+                "ttft_ms": ttft_ms
+            })
+        except Exception as e:
+            logger.error(f"Chat Stream Error: {e}")
+            yield _sse("error", {"message": "系統暫時無法回應，請稍後再試。"})
+
+    return EventSourceResponse(event_generator(), ping=15)
+
+
 @router.get("/help/history/{student_id}/{problem_id}")
 def get_history_endpoint(
     student_id: str, 
     problem_id: str,
-    submission_num: Optional[int] = Query(None, description="Target submission number")
+    submission_num: Optional[int] = Query(None, description="Target submission number"),
+    last: Optional[int] = Query(None, ge=1, description="Only return the last N messages")
 ):
-    """取得對話歷史 (僅使用 chat_log 格式)"""
+    """取得對話歷史 (僅使用 chat_log 格式)，指定 last 時只在資料庫端取出最後 N 則"""
     try:
         latest_num = get_submission_count(student_id, problem_id)
         if latest_num == 0:
@@ -951,11 +1190,15 @@ def get_history_endpoint(
         # V3: Use submission_num if provided, else latest
         target_num = submission_num if (submission_num is not None and submission_num > 0) else latest_num
 
+        # 指定 last 時只需要 id，不載入 chat_log
+        columns = [dialogue_table.c.id] if last is not None else [dialogue_table]
+
         with engine.connect() as conn:
-            stmt = select(dialogue_table).where(
+            stmt = select(*columns).where(
                 dialogue_table.c.student_id == student_id,
                 dialogue_table.c.problem_id == problem_id,
-                dialogue_table.c.num == target_num 
+                dialogue_table.c.num == target_num,
+                in_current_term(dialogue_table.c.submitted_at)
             ).order_by(dialogue_table.c.id.asc())
             rows = conn.execute(stmt).fetchall()
             
@@ -966,18 +1209,30 @@ def get_history_endpoint(
                 max_num_stmt = select(func.max(dialogue_table.c.num)).where(
                     dialogue_table.c.student_id == student_id,
                     dialogue_table.c.problem_id == problem_id,
+                    in_current_term(dialogue_table.c.submitted_at),
                 )
                 max_row = conn.execute(max_num_stmt).fetchone()
                 if max_row and max_row[0]:
                     fallback_num = max_row[0]
                     logger.info(f"Found latest dialogue at num={fallback_num}")
-                    stmt_fallback = select(dialogue_table).where(
+                    stmt_fallback = select(*columns).where(
                         dialogue_table.c.student_id == student_id,
                         dialogue_table.c.problem_id == problem_id,
                         dialogue_table.c.num == fallback_num,
+                        in_current_term(dialogue_table.c.submitted_at)
                     ).order_by(dialogue_table.c.id.asc())
                     rows = conn.execute(stmt_fallback).fetchall()
         
+            # 只取最後 N 則：由最新一列往前補足
+            if last is not None:
+                recent_chat_log = []
+                for r in reversed(rows):
+                    remaining = last - len(recent_chat_log)
+                    if remaining <= 0:
+                        break
+                    recent_chat_log = get_recent_chat_messages(conn, dialogue_table, r._mapping["id"], remaining) + recent_chat_log
+                return {"chat_log": recent_chat_log}
+        
         # 回傳 chat_log 格式
         all_chat_log = []
         
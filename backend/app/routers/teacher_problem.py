@@ -1,15 +1,27 @@
-from fastapi import APIRouter, HTTPException, Query, Path, Depends
+from fastapi import APIRouter, HTTPException, Query, Path, Depends, UploadFile, File
+from fastapi.responses import StreamingResponse
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel
-from sqlalchemy import select, text, insert, update
+from sqlalchemy import select, text, insert, update, func
 import json
 from datetime import datetime
 
-from backend.app.agents.debugging.db import engine
+from backend.app.agents.debugging.db import (
+    engine, save_problem_test_cases, put_problem_test_case, load_problem_test_cases, problem_test_case_table
+)
 from backend.app.agents.debugging.oj_models import Problem, PrecodingQuestion
+from backend.app.agents.debugging.coding_help.diagnosis_cache import invalidate_problems
+from backend.app.agents.debugging.coding_help.practice_bank import invalidate_problems as invalidate_practice_bank
+from backend.app.agents.debugging.llm_client import llm_cache_options
+from backend.app.agents.debugging.problem_bundle import (
+    BundleError, import_bundle, iter_chapter_bundle, parse_case, nl_to_br, br_to_nl
+)
 from backend.app.agents.debugging.problem_generate.code_explanation import generate_explanation_questions
 from backend.app.agents.debugging.problem_generate.code_debugging import generate_debugging_questions
 from backend.app.agents.debugging.problem_generate.code_architecture import generate_architecture_questions
+from backend.app.agents.debugging.problem_generate.batch_job import (
+    GEN_SPECS, load_problem_data, save_precoding_content, start_chapter_job, job_progress, launch
+)
 
 router = APIRouter(prefix="/teacher/problem", tags=["Teacher Problem Management"])
 
@@ -35,14 +47,6 @@ class ProblemData(BaseModel):
 class GeneratedContent(BaseModel):
     content: Any # Use Any to allow structured list or dict
 
-def nl_to_br(text: str) -> str:
-    if not text: return ""
-    return text.replace("\n", "<br>")
-
-def br_to_nl(text: str) -> str:
-    if not text: return ""
-    return text.replace("<br>", "\n")
-
 # --- Endpoints ---
 
 @router.get("/list")
@@ -61,6 +65,75 @@ def get_all_problems():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/bundle/import")
+def import_problem_bundle(
+    file: UploadFile = File(..., description="zip: <problem_id>/problem.yaml + <problem_id>/cases/*.in|*.out"),
+    chapter_id: Optional[str] = Query(None, description="限制所有題目必須屬於此章節"),
+    dry_run: bool = Query(False, description="只驗證不寫入"),
+):
+    """
+    批次匯入整個章節的題目。上傳檔由 UploadFile 暫存於磁碟，逐題驗證後分批寫入；
+    有錯誤的題目列於 failed 並略過，其餘照常匯入。
+    """
+    try:
+        result = import_bundle(file.file, chapter_id=chapter_id, dry_run=dry_run)
+    except BundleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not dry_run:
+        invalidate_problems(result["imported"])
+        invalidate_practice_bank(result["imported"])
+    return {"status": "success", **result}
+
+@router.get("/bundle/export")
+def export_problem_bundle(chapter_id: str = Query(..., description="章節 ID (匯出 problem_id 以 <chapter_id>_ 開頭的題目)")):
+    """串流匯出章節題目 bundle (格式與 /bundle/import 相同)"""
+    return StreamingResponse(
+        iter_chapter_bundle(chapter_id),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{chapter_id}_problems.zip"'},
+    )
+
+@router.put("/{problem_id}/test_cases/{case_no}")
+def upload_test_case(
+    problem_id: str,
+    case_no: int = Path(..., ge=1, description="測資編號 (1 起算)，等於目前測資數 + 1 時為新增"),
+    input_file: UploadFile = File(...),
+    output_file: UploadFile = File(...),
+):
+    """
+    上傳單筆測資檔 (取代或新增)，大型測資不必與題目一起放在同一個 request body。
+    檔案格式與 bundle 的 cases/*.in|*.out 相同：function 題型為 JSON，其餘為純文字。
+    """
+    raw_input, raw_output = input_file.file.read(), output_file.file.read()
+
+    try:
+        with engine.begin() as conn:
+            # 鎖定題目列，避免同時新增測資時編號衝突
+            problem = conn.execute(
+                select(Problem.judge_type).where(Problem.problem_id == problem_id).with_for_update()
+            ).fetchone()
+            if not problem:
+                raise HTTPException(status_code=404, detail="Problem not found")
+            try:
+                test_case = parse_case(raw_input, raw_output, problem.judge_type)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Test case files are {e}")
+            count = conn.execute(
+                select(func.count()).select_from(problem_test_case_table)
+                .where(problem_test_case_table.c.problem_id == problem_id)
+            ).scalar()
+            if case_no > count + 1:
+                raise HTTPException(status_code=400, detail=f"case_no must be <= {count + 1}")
+            put_problem_test_case(conn, problem_id, case_no, test_case)
+        invalidate_problems([problem_id])
+        return {"status": "success", "case_no": case_no, "total": max(count, case_no)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/", response_model=Dict[str, str])
 def create_or_update_problem(problem: ProblemData):
     """
@@ -74,6 +147,7 @@ def create_or_update_problem(problem: ProblemData):
             existing = conn.execute(stmt).fetchone()
 
             problem_dict = problem.dict()
+            test_cases = problem_dict.pop("test_cases")
             
             # Convert newlines to <br>
             for field in ["description", "input_description", "output_description", "hint"]:
@@ -93,7 +167,15 @@ def create_or_update_problem(problem: ProblemData):
                 insert_stmt = insert(Problem).values(**problem_dict)
                 conn.execute(insert_stmt)
                 msg = f"Problem {problem.problem_id} created."
-                
+
+            # 測資另存於 problem_test_case (未提供時保留原測資)
+            if test_cases is not None:
+                save_problem_test_cases(conn, problem.problem_id, test_cases)
+
+        # 題目內容或測資變更後，舊的診斷快取與練習題庫不再適用
+        if existing:
+            invalidate_problems([problem.problem_id])
+            invalidate_practice_bank([problem.problem_id])
         return {"status": "success", "message": msg}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -131,6 +213,7 @@ def get_full_problem(problem_id: str):
                 }
             
             data["precoding"] = precoding_data
+            data["test_cases"] = load_problem_test_cases(conn, problem_id)
             
             return {"status": "success", "data": data}
     except Exception as e:
@@ -140,16 +223,77 @@ class GenerateRequest(BaseModel):
     core_concept: Optional[str] = None
     allowed_scope: Optional[List[str]] = None
 
+class BatchGenerateRequest(BaseModel):
+    chapter_id: str
+    gen_types: List[str] = list(GEN_SPECS)
+    core_concept: Optional[str] = None
+    allowed_scope: Optional[List[str]] = None
+    skip_existing: bool = False      # 已有內容的 (題目, 類型) 不重新生成
+    no_cache: bool = False
+    use_batch_api: bool = False      # 改用 OpenAI Batch API (24h 內完成、費用半價)
+    concurrency: Optional[int] = None
+
+@router.post("/batch/generate")
+async def start_batch_generation(
+    request_body: BatchGenerateRequest,
+    user_id: Optional[int] = Query(default=None, description="orchestration_jobs.user_id"),
+    student_id: str = Query(default="teacher", description="記錄追蹤用的使用者 ID"),
+):
+    """
+    整章批次生成 pre-coding 題目 (章節內所有題目 × gen_types)，背景執行並立即回傳 job_id；
+    進度以 GET /batch/{job_id} 查詢，失敗的項目可用 POST /batch/{job_id}/resume 續跑
+    """
+    unknown = [g for g in request_body.gen_types if g not in GEN_SPECS]
+    if unknown or not request_body.gen_types:
+        raise HTTPException(status_code=400, detail=f"Invalid gen_types: {unknown or request_body.gen_types}")
+    try:
+        job_id = start_chapter_job(
+            request_body.chapter_id,
+            list(dict.fromkeys(request_body.gen_types)),
+            user_id=user_id,
+            student_id=student_id,
+            core_concept=request_body.core_concept,
+            allowed_scope=request_body.allowed_scope,
+            skip_existing=request_body.skip_existing,
+            no_cache=request_body.no_cache,
+            use_batch_api=request_body.use_batch_api,
+            concurrency=request_body.concurrency,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "success", "job_id": job_id}
+
+@router.get("/batch/{job_id}")
+def get_batch_generation(job_id: int):
+    """批次生成進度 (各項目狀態與 completed / failed / pending 數量)"""
+    progress = job_progress(job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return {"status": "success", **progress}
+
+@router.post("/batch/{job_id}/resume")
+async def resume_batch_generation(job_id: int):
+    """續跑批次生成：已完成的項目略過，只重新生成失敗或尚未執行的項目"""
+    if job_progress(job_id) is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    if not launch(job_id):
+        raise HTTPException(status_code=409, detail="Batch job is already running")
+    return {"status": "success", "job_id": job_id}
+
 @router.post("/{problem_id}/generate/{gen_type}")
 def generate_content(
     problem_id: str, 
     gen_type: str = Path(..., regex="^(explanation|debugging|architecture)$"),
     request_body: GenerateRequest = None,
     student_id: str = Query(default="teacher", description="記錄追蹤用的使用者 ID"),
+    no_cache: bool = Query(default=False, description="略過 LLM 快取，強制重新生成"),
 ):
     """
     Trigger generation for a specific type.
     gen_type: 'explanation', 'debugging', 'architecture'
+    相同題目與參數的生成結果會由 LLM 快取回傳；no_cache=true 時略過快取重新生成
     """
     try:
         # Default values if no body provided
@@ -157,49 +301,33 @@ def generate_content(
         allowed_concepts = request_body.allowed_scope if request_body else None
 
         # 1. Fetch Problem Data
-        with engine.connect() as conn:
-            stmt = select(Problem).where(Problem.problem_id == problem_id)
-            row = conn.execute(stmt).fetchone()
-            if not row:
-                raise HTTPException(status_code=404, detail="Problem not found")
-            
-            mapping = row._mapping
-            # Prepare problem_data tuple
-            # For architectureGen, last element should be solution_code
-            problem_data = (
-                mapping["title"],
-                mapping["description"],
-                mapping["input_description"],
-                mapping["output_description"],
-                mapping["samples"],
-                mapping.get("solution_code", "") 
-            )
+        # For architectureGen, last element should be solution_code
+        problem_data = load_problem_data(problem_id)
+        if problem_data is None:
+            raise HTTPException(status_code=404, detail="Problem not found")
             
         # 2. Generate
         result = None
-        target_column = ""
         
-        if gen_type == "explanation":
-            result = generate_explanation_questions(
-                problem_data, problem_id,
-                manual_unit=core_concept, allowed_concepts=allowed_concepts,
-                student_id=student_id,
-            )
-            target_column = "explain_code_question"
-        elif gen_type == "debugging":
-            result = generate_debugging_questions(
-                problem_data, problem_id,
-                manual_unit=core_concept, allowed_concepts=allowed_concepts,
-                student_id=student_id,
-            )
-            target_column = "error_code_question"
-        elif gen_type == "architecture":
-            result = generate_architecture_questions(
-                problem_data, problem_id,
-                manual_unit=core_concept, allowed_concepts=allowed_concepts,
-                student_id=student_id,
-            )
-            target_column = "correct_code_template"
+        with llm_cache_options(enabled=not no_cache):
+            if gen_type == "explanation":
+                result = generate_explanation_questions(
+                    problem_data, problem_id,
+                    manual_unit=core_concept, allowed_concepts=allowed_concepts,
+                    student_id=student_id,
+                )
+            elif gen_type == "debugging":
+                result = generate_debugging_questions(
+                    problem_data, problem_id,
+                    manual_unit=core_concept, allowed_concepts=allowed_concepts,
+                    student_id=student_id,
+                )
+            elif gen_type == "architecture":
+                result = generate_architecture_questions(
+                    problem_data, problem_id,
+                    manual_unit=core_concept, allowed_concepts=allowed_concepts,
+                    student_id=student_id,
+                )
         
         if result is None:
              raise HTTPException(status_code=500, detail="Generation failed (returned None).")
@@ -212,24 +340,12 @@ def generate_content(
         # If we save it now, user can fetch it. If user cancels, we might want to not save?
         # But usually generation implies overwriting.
         # Let's save it.
-        
-        with engine.begin() as conn:
-             # Check if PrecodingQuestion exists
-             check_stmt = select(PrecodingQuestion).where(PrecodingQuestion.problem_id == problem_id)
-             existing_pq = conn.execute(check_stmt).fetchone()
-             
-             if existing_pq:
-                 # Update
-                 # We need to construct the update dict carefully
-                 update_vals = {target_column: result}
-                 conn.execute(update(PrecodingQuestion).where(PrecodingQuestion.problem_id == problem_id).values(**update_vals))
-             else:
-                 # Insert
-                 insert_vals = {"problem_id": problem_id, target_column: result}
-                 conn.execute(insert(PrecodingQuestion).values(**insert_vals))
+        save_precoding_content(problem_id, gen_type, result)
                  
         return {"status": "success", "data": result}
              
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -239,26 +355,7 @@ def save_content(problem_id: str, payload: GeneratedContent, gen_type: str = Pat
     Save manually edited content.
     """
     try:
-        target_column = ""
-        if gen_type == "explanation":
-            target_column = "explain_code_question"
-        elif gen_type == "debugging":
-            target_column = "error_code_question"
-        elif gen_type == "architecture":
-            target_column = "correct_code_template"
-
-        with engine.begin() as conn:
-             # Check if PrecodingQuestion exists
-             check_stmt = select(PrecodingQuestion).where(PrecodingQuestion.problem_id == problem_id)
-             existing_pq = conn.execute(check_stmt).fetchone()
-             
-             if existing_pq:
-                 update_vals = {target_column: payload.content}
-                 conn.execute(update(PrecodingQuestion).where(PrecodingQuestion.problem_id == problem_id).values(**update_vals))
-             else:
-                 insert_vals = {"problem_id": problem_id, target_column: payload.content}
-                 conn.execute(insert(PrecodingQuestion).values(**insert_vals))
-                 
+        save_precoding_content(problem_id, gen_type, payload.content)
         return {"status": "success", "message": "Content saved."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -18,19 +18,26 @@ class EmbeddingService:
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super(EmbeddingService, cls).__new__(cls)
-            
-            # Initialize OpenAI client only once
+        return cls._instance
+
+    def _get_client(self) -> OpenAI:
+        """
+        Initializes the OpenAI client on first use, so importing this module
+        does not require OPENAI_API_KEY or build an HTTP client.
+        """
+        cls = type(self)
+        if cls._client is None:
             api_key = os.getenv("OPENAI_API_KEY")
             base_url = os.getenv("OPENAI_BASE_URL") # Optional, for custom endpoints
-            
+
             if not api_key:
                 raise ValueError("OPENAI_API_KEY environment variable not set for EmbeddingService.")
-            
+
             cls._client = OpenAI(api_key=api_key, base_url=base_url)
             cls._model_name = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
-            
+
             print(f"OpenAI EmbeddingService initialized with model: {cls._model_name}")
-        return cls._instance
+        return cls._client
 
     def create_embeddings(self, texts: List[str]) -> Tuple[List[List[float]], Dict[str, int]]:
         """
@@ -46,11 +53,12 @@ class EmbeddingService:
         """
         if not texts:
             return [], {"total_tokens": 0, "prompt_tokens": 0}
-        
+
+        client = self._get_client()
         print(f"Generating embeddings for {len(texts)} text chunks using OpenAI model: {self._model_name}...")
         
         try:
-            response = self._client.embeddings.create(
+            response = client.embeddings.create(
                 input=texts,
                 model=self._model_name
             )
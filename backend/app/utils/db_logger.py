@@ -4,13 +4,15 @@ Utility functions for logging orchestration and agent task data to the database.
 import time
 from datetime import datetime, timezone, timedelta
 from typing import Dict, Any, List, Optional
-from sqlalchemy import create_engine, MetaData, Table, insert, update, select, func, text, Column, Integer, String
+from sqlalchemy import create_engine, insert, update, select, func, text, bindparam, Column, Integer, String, DateTime
 from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
 import json
 import logging
 
+from backend.app.utils.schema_registry import get_registry, LazyTable
+
 # --- Timezone and Database Setup ---
 TAIPEI_TZ = timezone(timedelta(hours=8))
 load_dotenv()
@@ -19,60 +21,362 @@ if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable not set.")
 
 engine = create_engine(DATABASE_URL)
-metadata = MetaData()
 
 logger = logging.getLogger(__name__)
 
 # --- Table Reflection ---
-# Reflect existing tables to avoid re-declaring them
-try:
-    metadata.reflect(bind=engine) # Reflect all tables
-    orchestration_jobs = Table('orchestration_jobs', metadata, autoload_with=engine)
-    agent_tasks = Table('agent_tasks', metadata, autoload_with=engine)
-    generated_contents = Table('generated_contents', metadata, autoload_with=engine)
-    agent_task_sources = Table('agent_task_sources', metadata, autoload_with=engine)
-except Exception as e:
-    logger.error(f"Error reflecting database tables: {e}")
-    # Define tables with key columns as a fallback if reflection fails
-    # These definitions are minimal and might need more columns for full functionality
-    orchestration_jobs = Table('orchestration_jobs', metadata,
-        Column('id', Integer, primary_key=True),
-        Column('status', String),
-        Column('final_output_id', Integer),
-        Column('total_iterations', Integer),
-        Column('total_prompt_tokens', Integer),
-        Column('total_completion_tokens', Integer),
-        Column('total_latency_ms', Integer),
-        Column('estimated_carbon_g', Integer),
-        Column('updated_at', datetime),
-        # Add other essential columns if needed for the script to be parsable
-    )
-    agent_tasks = Table('agent_tasks', metadata,
-        Column('id', Integer, primary_key=True),
-        Column('job_id', Integer),
-        Column('status', String),
-        Column('prompt_tokens', Integer),
-        Column('completion_tokens', Integer),
-        Column('duration_ms', Integer),
-        Column('estimated_cost_usd', Integer),
-        Column('iteration_number', Integer),
-        Column('output', String), # Assuming JSON string for output
-        Column('error_message', String),
-        Column('completed_at', datetime),
-        # ...
-    )
-    generated_contents = Table('generated_contents', metadata,
-        Column('id', Integer, primary_key=True),
-        Column('content', String), # Assuming JSON string for content
-        Column('title', String),
-    )
-    agent_task_sources = Table('agent_task_sources', metadata,
-        Column('task_id', Integer, primary_key=True),
-        Column('source_type', String, primary_key=True),
-        Column('source_id', Integer, primary_key=True),
-    )
+# Tables are reflected lazily on first use (see schema_registry), so importing this
+# module neither connects to the database nor reflects the whole schema.
+# The fallback definitions only carry key columns and are used if reflection fails.
+schema_registry = get_registry(engine)
+
+orchestration_jobs = LazyTable(schema_registry, 'orchestration_jobs', fallback_columns=lambda: [
+    Column('id', Integer, primary_key=True),
+    Column('status', String),
+    Column('final_output_id', Integer),
+    Column('total_iterations', Integer),
+    Column('total_prompt_tokens', Integer),
+    Column('total_completion_tokens', Integer),
+    Column('total_latency_ms', Integer),
+    Column('estimated_carbon_g', Integer),
+    Column('updated_at', DateTime),
+])
+agent_tasks = LazyTable(schema_registry, 'agent_tasks', fallback_columns=lambda: [
+    Column('id', Integer, primary_key=True),
+    Column('job_id', Integer),
+    Column('status', String),
+    Column('prompt_tokens', Integer),
+    Column('completion_tokens', Integer),
+    Column('duration_ms', Integer),
+    Column('estimated_cost_usd', Integer),
+    Column('iteration_number', Integer),
+    Column('output', String), # Assuming JSON string for output
+    Column('error_message', String),
+    Column('completed_at', DateTime),
+])
+generated_contents = LazyTable(schema_registry, 'generated_contents', fallback_columns=lambda: [
+    Column('id', Integer, primary_key=True),
+    Column('content', String), # Assuming JSON string for content
+    Column('title', String),
+])
+agent_task_sources = LazyTable(schema_registry, 'agent_task_sources', fallback_columns=lambda: [
+    Column('task_id', Integer, primary_key=True),
+    Column('source_type', String, primary_key=True),
+    Column('source_id', Integer, primary_key=True),
+])
 
 import functools
+import asyncio
+import atexit
+import queue
+import threading
+
+# --- Write-behind Task Logging ---
+
+def _process_task_output(output: Any) -> Optional[Any]:
+    """Normalizes a node output into a JSON-serializable value for agent_tasks.output."""
+    if output is None:
+        return None
+    if isinstance(output, (dict, list)):
+        return output
+    if isinstance(output, str):
+        try:
+            return json.loads(output)
+        except json.JSONDecodeError:
+            return {"text_output": output} # Wrap plain strings
+    return {"value": str(output)} # Catch all other types
+
+
+class TaskLogWriter:
+    """
+    Write-behind logger for agent_tasks used by the log_task decorator.
+
+    Task ids are pre-allocated in blocks from the agent_tasks id sequence, so a node
+    gets its task_id without a round-trip. The writer thread allocates the first block
+    when it starts, and async callers (acreate_task) allocate off the event loop when
+    the block runs dry. Create/update events are queued and a background thread
+    bulk-writes them in batches. The queue is bounded; when it is full the caller drains
+    it and writes everything synchronously instead of dropping the event (backpressure).
+    Events are only dequeued under _write_lock, so writes always happen in queue order
+    (a create is never written after its update or a child before its parent). The
+    writer thread waits for new events without holding the lock, so flush() never
+    waits on an idle writer. A batch that fails to write is retried row by row; only
+    the rows that fail on their own are dropped.
+    """
+
+    def __init__(self, batch_size: int = 100, flush_interval_sec: float = 1.0,
+                 max_pending: int = 10000, id_block_size: int = 50):
+        self.batch_size = batch_size
+        self.flush_interval_sec = flush_interval_sec
+        self.id_block_size = id_block_size
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._ids: List[int] = []
+        self._ids_lock = threading.Lock()
+        self._refill_pending = False
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._has_events = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    # --- Task id allocation ---
+
+    def _allocate_ids(self, count: int) -> List[int]:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT nextval(pg_get_serial_sequence(:table_name, 'id')) FROM generate_series(1, :n)"),
+                {"table_name": agent_tasks.name, "n": count}
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _refill_ids(self):
+        try:
+            ids = self._allocate_ids(self.id_block_size)
+        finally:
+            self._refill_pending = False
+        with self._ids_lock:
+            self._ids.extend(ids)
+
+    def has_ids(self) -> bool:
+        with self._ids_lock:
+            return bool(self._ids)
+
+    def next_task_id(self) -> int:
+        with self._ids_lock:
+            if self._ids:
+                task_id = self._ids.pop(0)
+                low = len(self._ids) < self.id_block_size // 2
+            else:
+                task_id = None
+                low = False
+        if task_id is None:
+            # Cold start: allocate the first block synchronously
+            self._refill_ids()
+            return self.next_task_id()
+        if low and not self._refill_pending:
+            self._refill_pending = True
+            self._enqueue(("refill_ids", None, None))
+        return task_id
+
+    # --- Event API ---
+
+    def create_task(
+        self,
+        job_id: int,
+        agent_name: str,
+        task_description: str,
+        task_input: Optional[Dict] = None,
+        model_name: Optional[str] = None,
+        parent_task_id: Optional[int] = None,
+        model_parameters: Optional[Dict] = None,
+        iteration_number: int = 1
+    ) -> Optional[int]:
+        """Queues an agent_tasks insert and returns its pre-allocated id."""
+        try:
+            task_id = self.next_task_id()
+        except Exception as e:
+            logger.error(f"Failed to allocate task id for agent '{agent_name}'. Reason: {e}")
+            return None
+        self._enqueue(("create", task_id, {
+            "id": task_id,
+            "job_id": job_id,
+            "agent_name": agent_name,
+            "task_description": task_description,
+            "task_input": task_input,
+            "status": 'in_progress',
+            "model_name": model_name,
+            "parent_task_id": parent_task_id,
+            "model_parameters": model_parameters,
+            "iteration_number": iteration_number,
+            "created_at": datetime.now(TAIPEI_TZ),
+        }))
+        return task_id
+
+    async def acreate_task(self, **kwargs) -> Optional[int]:
+        """create_task for async callers: allocates a new id block off the event loop when none is left."""
+        if self.has_ids():
+            return self.create_task(**kwargs)
+        return await asyncio.to_thread(self.create_task, **kwargs)
+
+    def update_task(self, task_id: int, status: Optional[str] = None, output: Optional[Any] = None, **values):
+        """Queues an agent_tasks update. None values never overwrite existing data."""
+        if status is not None:
+            values["status"] = status
+            values["completed_at"] = datetime.now(TAIPEI_TZ)
+        values["output"] = _process_task_output(output)
+        values = {k: v for k, v in values.items() if v is not None}
+        if values:
+            self._enqueue(("update", task_id, values))
+
+    # --- Background writer ---
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="task-log-writer", daemon=True)
+                self._thread.start()
+
+    def _enqueue(self, event):
+        if self._stopped:
+            self._write_through([event])
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+            self._has_events.set()
+        except queue.Full:
+            logger.warning("TaskLogWriter queue is full, writing queued events synchronously.")
+            self._write_through([event])
+
+    def _drain(self) -> tuple:
+        """Dequeues every pending event (caller holds _write_lock). Returns (events, saw_stop)."""
+        events, saw_stop = [], False
+        while True:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                return events, saw_stop
+            if event is None:
+                saw_stop = True
+            else:
+                events.append(event)
+
+    def _write_through(self, events: List[tuple]):
+        """Writes the queued events followed by `events`, keeping queue order."""
+        with self._write_lock:
+            pending, saw_stop = self._drain()
+            self._write_batch(pending + events)
+        if saw_stop:
+            self._queue.put(None)
+            self._has_events.set()
+
+    def _run(self):
+        # Pre-allocate the first id block here rather than on the first caller
+        if not self.has_ids():
+            try:
+                self._refill_ids()
+            except Exception as e:
+                logger.error(f"TaskLogWriter failed to pre-allocate task ids. Reason: {e}")
+        while True:
+            # Wait without holding _write_lock; events are only dequeued under the lock
+            self._has_events.wait(self.flush_interval_sec)
+            self._has_events.clear()
+            with self._write_lock:
+                batch, stop = [], False
+                while len(batch) < self.batch_size:
+                    try:
+                        event = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if event is None:
+                        stop = True
+                        break
+                    batch.append(event)
+                if batch:
+                    self._write_batch(batch)
+            if stop:
+                return
+            if not self._queue.empty():
+                self._has_events.set()
+
+    def _write_batch(self, batch: List[tuple]):
+        creates: Dict[int, Dict[str, Any]] = {}  # insertion order = queue order
+        updates: Dict[int, Dict[str, Any]] = {}
+        refill = False
+        for kind, task_id, values in batch:
+            if kind == "refill_ids":
+                refill = True
+            elif kind == "create":
+                creates[task_id] = dict(values)
+            elif task_id in creates:
+                # Created in the same batch: fold the update into the insert row
+                creates[task_id].update(values)
+            else:
+                updates.setdefault(task_id, {}).update(values)
+
+        if refill:
+            try:
+                self._refill_ids()
+            except Exception as e:
+                logger.error(f"TaskLogWriter failed to refill task ids. Reason: {e}")
+        if not (creates or updates):
+            return
+
+        try:
+            with engine.begin() as conn:
+                self._write_rows(conn, creates, updates)
+            logger.info(f"TaskLogWriter flushed {len(creates)} create(s) and {len(updates)} update(s).")
+            return
+        except Exception as e:
+            logger.warning(f"TaskLogWriter batch write failed, retrying row by row. Reason: {e}")
+
+        # Row by row in queue order (creates first, as in the batch): one bad row no longer
+        # takes the unrelated events of the same batch down with it
+        failed = 0
+        for task_id, values in creates.items():
+            failed += not self._write_one({task_id: values}, {})
+        for task_id, values in updates.items():
+            failed += not self._write_one({}, {task_id: values})
+        if failed:
+            logger.error(f"TaskLogWriter dropped {failed} of {len(creates) + len(updates)} row(s) that failed to write.")
+
+    def _write_one(self, creates: Dict[int, Dict[str, Any]], updates: Dict[int, Dict[str, Any]]) -> bool:
+        try:
+            with engine.begin() as conn:
+                self._write_rows(conn, creates, updates)
+            return True
+        except Exception as e:
+            task_id = next(iter(creates or updates))
+            logger.error(f"TaskLogWriter failed to write task {task_id}. Reason: {e}")
+            return False
+
+    @staticmethod
+    def _write_rows(conn, creates: Dict[int, Dict[str, Any]], updates: Dict[int, Dict[str, Any]]):
+        if creates:
+            # One multi-row INSERT in queue order: every row carries the same
+            # columns (missing ones as NULL), so parents and children land in the
+            # same statement and fk_tasks_parent is checked after all of them.
+            columns = []
+            for row in creates.values():
+                columns.extend(k for k in row if k not in columns)
+            rows = [{k: row.get(k) for k in columns} for row in creates.values()]
+            conn.execute(insert(agent_tasks), rows)
+        grouped_updates: Dict[frozenset, List[Dict[str, Any]]] = {}
+        for task_id, values in updates.items():
+            row = {f"v_{k}": v for k, v in values.items()}
+            row["_task_id"] = task_id
+            grouped_updates.setdefault(frozenset(values), []).append(row)
+        for keys, rows in grouped_updates.items():
+            # bindparam names must differ from column names in UPDATE ... SET
+            stmt = update(agent_tasks).where(
+                agent_tasks.c.id == bindparam("_task_id")
+            ).values({k: bindparam(f"v_{k}") for k in keys})
+            conn.execute(stmt, rows)
+
+    def flush(self):
+        """
+        Writes every queued event synchronously (used on shutdown, and by readers that
+        need the rows of tasks they just logged). Events queued before the call are in
+        the database when it returns.
+        """
+        self._write_through([])
+
+    def stop(self, timeout: float = 10.0):
+        """Stops the writer thread after it has drained the queue."""
+        if self._stopped:
+            return
+        self._stopped = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._has_events.set()
+            self._thread.join(timeout)
+        self.flush()
+
+
+task_log_writer = TaskLogWriter()
+atexit.register(task_log_writer.stop)
 
 # --- Decorator for Task Logging ---
 
@@ -112,7 +416,7 @@ def log_task(agent_name: str, task_description: str, input_extractor: Optional[c
                 else:
                     extracted_task_input = {"user_query": state.get("user_query")}
 
-                task_id = create_task(
+                task_id = await task_log_writer.acreate_task(
                     job_id=state['job_id'],
                     agent_name=agent_name,
                     task_description=task_description,
@@ -145,16 +449,7 @@ def log_task(agent_name: str, task_description: str, input_extractor: Optional[c
                     new_iteration = result.get("iteration_count", initial_iteration)                    
                     if new_iteration != initial_iteration:
                         # Update the task's iteration_number in database
-                        try:
-                            with engine.connect() as conn:
-                                stmt = update(agent_tasks).where(
-                                    agent_tasks.c.id == task_id
-                                ).values(iteration_number=new_iteration)
-                                conn.execute(stmt)
-                                conn.commit()
-                                logger.info(f"✅ Updated task {task_id} iteration_number from {initial_iteration} to {new_iteration}")
-                        except Exception as e:
-                            logger.warning(f"Failed to update iteration_number for task {task_id}: {e}")
+                        task_log_writer.update_task(task_id, iteration_number=new_iteration)
                     
                     # Pop router_output first if it exists (for router nodes)
                     router_output = result.pop("_router_output", None)
@@ -165,7 +460,7 @@ def log_task(agent_name: str, task_description: str, input_extractor: Optional[c
                     model_name = result.pop("model_name", None)
 
                     if result.get("error"):
-                        update_task(
+                        task_log_writer.update_task(
                             task_id, 'failed', 
                             error_message=result["error"], 
                             duration_ms=duration_ms
@@ -173,7 +468,7 @@ def log_task(agent_name: str, task_description: str, input_extractor: Optional[c
                     else:
                         # Use minimal output for routers
                         db_output = router_output or result
-                        update_task(
+                        task_log_writer.update_task(
                             task_id, 'completed', 
                             output=db_output, 
                             duration_ms=duration_ms,
@@ -196,7 +491,7 @@ def log_task(agent_name: str, task_description: str, input_extractor: Optional[c
                 except Exception as e:
                     error_message = str(e)
                     duration_ms = int((time.perf_counter() - start_time) * 1000)
-                    update_task(task_id, 'failed', error_message=error_message, duration_ms=duration_ms)
+                    task_log_writer.update_task(task_id, 'failed', error_message=error_message, duration_ms=duration_ms)
                     return {"error": error_message}
             
             return async_wrapper
@@ -215,7 +510,7 @@ def log_task(agent_name: str, task_description: str, input_extractor: Optional[c
                 else:
                     extracted_task_input = {"user_query": state.get("user_query")}
 
-                task_id = create_task(
+                task_id = task_log_writer.create_task(
                     job_id=state['job_id'],
                     agent_name=agent_name,
                     task_description=task_description,
@@ -246,16 +541,7 @@ def log_task(agent_name: str, task_description: str, input_extractor: Optional[c
                     new_iteration = result.get("iteration_count", initial_iteration)
                     if new_iteration != initial_iteration:
                         # Update the task's iteration_number in database
-                        try:
-                            with engine.connect() as conn:
-                                stmt = update(agent_tasks).where(
-                                    agent_tasks.c.id == task_id
-                                ).values(iteration_number=new_iteration)
-                                conn.execute(stmt)
-                                conn.commit()
-                                logger.info(f"✅ Updated task {task_id} iteration_number from {initial_iteration} to {new_iteration}")
-                        except Exception as e:
-                            logger.warning(f"Failed to update iteration_number for task {task_id}: {e}")
+                        task_log_writer.update_task(task_id, iteration_number=new_iteration)
                     
                     # Pop router_output first if it exists (for router nodes)
                     router_output = result.pop("_router_output", None)
@@ -266,7 +552,7 @@ def log_task(agent_name: str, task_description: str, input_extractor: Optional[c
                     model_name = result.pop("model_name", None)
 
                     if result.get("error"):
-                        update_task(
+                        task_log_writer.update_task(
                             task_id, 'failed', 
                             error_message=result["error"], 
                             duration_ms=duration_ms
@@ -274,7 +560,7 @@ def log_task(agent_name: str, task_description: str, input_extractor: Optional[c
                     else:
                         # Use minimal output for orchestrators
                         db_output = router_output or result
-                        update_task(
+                        task_log_writer.update_task(
                             task_id, 'completed', 
                             output=db_output, 
                             duration_ms=duration_ms,
@@ -297,7 +583,7 @@ def log_task(agent_name: str, task_description: str, input_extractor: Optional[c
                 except Exception as e:
                     error_message = str(e)
                     duration_ms = int((time.perf_counter() - start_time) * 1000)
-                    update_task(task_id, 'failed', error_message=error_message, duration_ms=duration_ms)
+                    task_log_writer.update_task(task_id, 'failed', error_message=error_message, duration_ms=duration_ms)
                     return {"error": error_message}
             
             return sync_wrapper
@@ -418,17 +704,7 @@ def update_task(
     """Updates an agent_task record upon completion or failure."""
     try:
         with engine.connect() as conn:
-            processed_output = None
-            if output is not None:
-                if isinstance(output, (dict, list)):
-                    processed_output = output
-                elif isinstance(output, str):
-                    try:
-                        processed_output = json.loads(output)
-                    except json.JSONDecodeError:
-                        processed_output = {"text_output": output} # Wrap plain strings
-                else:
-                    processed_output = {"value": str(output)} # Catch all other types
+            processed_output = _process_task_output(output)
 
             values = { # Renamed from values_to_update to values as per snippet
                 "status": status,
@@ -0,0 +1,134 @@
+"""
+Lazy table reflection shared by modules that work against tables they do not declare.
+
+Reflecting at import time forces every process to reach the database before it can
+even start, and `metadata.reflect()` gets slower as the schema grows. LazySchemaRegistry
+reflects a single table the first time it is used and can persist reflected tables to a
+pickle snapshot (SCHEMA_SNAPSHOT_PATH) so later processes skip reflection entirely.
+"""
+import os
+import pickle
+import threading
+import logging
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import MetaData, Table, Column
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class LazySchemaRegistry:
+    """Reflects tables on first access and caches them in a private MetaData."""
+
+    def __init__(self, engine: Engine, snapshot_path: Optional[str] = None):
+        self.engine = engine
+        self.snapshot_path = snapshot_path if snapshot_path is not None else os.getenv("SCHEMA_SNAPSHOT_PATH")
+        self.metadata = MetaData()
+        self._lock = threading.Lock()
+        self._snapshot_loaded = False
+        self._fallbacks: Dict[str, Table] = {}
+
+    def _load_snapshot(self):
+        self._snapshot_loaded = True
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot: MetaData = pickle.load(f)
+            for table in snapshot.tables.values():
+                table.to_metadata(self.metadata)
+            logger.info(f"Loaded {len(snapshot.tables)} table(s) from schema snapshot {self.snapshot_path}.")
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable schema snapshot {self.snapshot_path}: {e}")
+
+    def save_snapshot(self):
+        """Writes every table known to the registry to the snapshot file."""
+        if not self.snapshot_path:
+            return
+        try:
+            with open(self.snapshot_path, "wb") as f:
+                pickle.dump(self.metadata, f)
+        except Exception as e:
+            logger.warning(f"Failed to write schema snapshot {self.snapshot_path}: {e}")
+
+    def table(
+        self,
+        name: str,
+        schema: Optional[str] = None,
+        fallback_columns: Optional[Callable[[], List[Column]]] = None,
+    ) -> Table:
+        """
+        Returns the reflected Table, reflecting it on first access.
+
+        Args:
+            name: Table name.
+            schema: Optional schema name.
+            fallback_columns: Called to build a minimal definition if reflection fails.
+                              Fallback tables are not cached in the registry metadata, so
+                              reflection is retried later; until then every failed attempt
+                              returns the same fallback Table so one statement never mixes
+                              two copies of it.
+        """
+        key = f"{schema}.{name}" if schema else name
+        with self._lock:
+            if not self._snapshot_loaded:
+                self._load_snapshot()
+            if key in self.metadata.tables:
+                return self.metadata.tables[key]
+            try:
+                table = Table(name, self.metadata, schema=schema, autoload_with=self.engine)
+            except Exception as e:
+                if fallback_columns is None:
+                    raise
+                logger.error(f"Error reflecting table '{key}': {e}")
+                if key not in self._fallbacks:
+                    self._fallbacks[key] = Table(name, MetaData(), *fallback_columns(), schema=schema)
+                return self._fallbacks[key]
+            self._fallbacks.pop(key, None)
+            self.save_snapshot()
+            return table
+
+
+class LazyTable:
+    """
+    Module-level stand-in for a reflected Table.
+
+    Behaves like the Table it wraps (`.c`, `insert(...)`, `select(...)`), but only
+    reflects it when first used. `.name` and `.schema` never touch the database.
+
+    Private names and SQLAlchemy's `is_*` flags are not forwarded: coercion checks
+    `is_clause_element` before calling `__clause_element__`, so forwarding it would make
+    `insert(lazy_table)` treat the wrapper itself as the Table and fail.
+    """
+
+    def __init__(self, registry: LazySchemaRegistry, name: str, schema: Optional[str] = None,
+                 fallback_columns: Optional[Callable[[], List[Column]]] = None):
+        self._registry = registry
+        self.name = name
+        self.schema = schema
+        self._fallback_columns = fallback_columns
+
+    def _table(self) -> Table:
+        return self._registry.table(self.name, schema=self.schema, fallback_columns=self._fallback_columns)
+
+    def __clause_element__(self) -> Table:
+        return self._table()
+
+    def __getattr__(self, attr):
+        if attr.startswith("_") or attr.startswith("is_"):
+            raise AttributeError(attr)
+        return getattr(self._table(), attr)
+
+
+_registries: Dict[str, LazySchemaRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(engine: Engine) -> LazySchemaRegistry:
+    """Returns the registry shared by every engine pointing at the same database URL."""
+    key = str(engine.url)
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = LazySchemaRegistry(engine)
+        return _registries[key]
@@ -0,0 +1,10 @@
+"""
+測試共用設定：以暫存的 SQLite 取代 DATABASE_URL，避免誤連正式資料庫。
+需在匯入任何 backend 模組前設定 (db / db_logger 於 import 時建立 engine)。
+"""
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ.pop("SCHEMA_SNAPSHOT_PATH", None)
+os.environ.setdefault("OPENAI_API_KEY", "test")
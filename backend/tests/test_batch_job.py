@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, JSON, DateTime
+
+from backend.app.utils import db_logger
+from backend.app.agents.debugging.problem_generate import batch_job
+
+
+@pytest.fixture
+def job_tables():
+    metadata = MetaData()
+    Table(
+        "orchestration_jobs", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("user_id", Integer),
+        Column("input_prompt", Text),
+        Column("status", String),
+        Column("workflow_type", String),
+        Column("experiment_config", JSON),
+        Column("error_message", Text),
+        Column("created_at", DateTime),
+        Column("updated_at", DateTime),
+    )
+    Table(
+        "agent_tasks", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("job_id", Integer),
+        Column("agent_name", String),
+        Column("task_input", JSON),
+        Column("status", String),
+    )
+    metadata.create_all(db_logger.engine)
+    yield
+    metadata.drop_all(db_logger.engine)
+
+
+def test_start_chapter_job_persists_config(job_tables, monkeypatch):
+    launched = []
+    monkeypatch.setattr(batch_job, "chapter_problem_ids", lambda chapter_id: [f"{chapter_id}_1", f"{chapter_id}_2"])
+    monkeypatch.setattr(batch_job, "launch", launched.append)
+
+    job_id = batch_job.start_chapter_job("C1", ["explanation", "debugging"], user_id=7, skip_existing=True)
+    assert launched == [job_id]
+
+    job = batch_job._load_job(job_id)
+    assert job.status == "planning"
+    assert job.workflow_type == batch_job.WORKFLOW_TYPE
+    assert job.experiment_config["problem_ids"] == ["C1_1", "C1_2"]
+    assert job.experiment_config["gen_types"] == ["explanation", "debugging"]
+    assert job.experiment_config["skip_existing"] is True
+
+    batch_job._update_config(job_id, batch_id="batch_1")
+    config = batch_job._load_job(job_id).experiment_config
+    assert config["batch_id"] == "batch_1"
+    assert config["chapter_id"] == "C1"
+
+    progress = batch_job.job_progress(job_id)
+    assert progress["total"] == 4
+    assert progress["pending"] == 4
+    assert progress["batch_id"] == "batch_1"
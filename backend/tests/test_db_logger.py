@@ -0,0 +1,98 @@
+import asyncio
+import itertools
+import threading
+import time
+
+import pytest
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, JSON, DateTime, insert, select
+
+from backend.app.utils import db_logger
+
+
+@pytest.fixture
+def task_table(monkeypatch):
+    # 其他測試可能已反射過欄位較少的 agent_tasks，改用新的 registry metadata 重新反射
+    monkeypatch.setattr(db_logger.schema_registry, "metadata", MetaData())
+    metadata = MetaData()
+    table = Table(
+        "agent_tasks", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("job_id", Integer),
+        Column("agent_name", String),
+        Column("task_description", Text),
+        Column("task_input", JSON),
+        Column("status", String),
+        Column("model_name", String),
+        Column("parent_task_id", Integer),
+        Column("model_parameters", JSON),
+        Column("iteration_number", Integer),
+        Column("output", JSON),
+        Column("error_message", Text),
+        Column("duration_ms", Integer),
+        Column("created_at", DateTime),
+        Column("completed_at", DateTime),
+    )
+    metadata.create_all(db_logger.engine)
+    yield table
+    metadata.drop_all(db_logger.engine)
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    # SQLite 沒有 sequence：以計數器配發 id，並記錄配發所在的執行緒
+    counter = itertools.count(1)
+    allocations = []
+
+    def allocate(self, count):
+        allocations.append(threading.current_thread())
+        return [next(counter) for _ in range(count)]
+
+    monkeypatch.setattr(db_logger.TaskLogWriter, "_allocate_ids", allocate)
+    writer = db_logger.TaskLogWriter(flush_interval_sec=5.0, id_block_size=4)
+    writer.allocations = allocations
+    yield writer
+    writer.stop()
+
+
+def _create(writer, **kwargs):
+    return writer.create_task(job_id=1, agent_name="node", task_description="test", **kwargs)
+
+
+def test_bad_row_does_not_drop_batch(task_table, writer):
+    # id 2 已存在：整批 INSERT 失敗後逐列重試，其餘事件仍寫入
+    with db_logger.engine.begin() as conn:
+        conn.execute(insert(task_table).values(id=2, agent_name="existing"))
+
+    first, second, third = _create(writer), _create(writer), _create(writer)
+    assert (first, second, third) == (1, 2, 3)
+    writer.update_task(first, "completed", output={"ok": True})
+    writer.flush()
+
+    with db_logger.engine.connect() as conn:
+        rows = {row.id: row for row in conn.execute(select(task_table)).fetchall()}
+    assert set(rows) == {1, 2, 3}
+    assert rows[1].status == "completed" and rows[1].output == {"ok": True}
+    assert rows[2].agent_name == "existing"
+    assert rows[3].status == "in_progress"
+
+
+def test_flush_does_not_wait_for_idle_writer(task_table, writer):
+    _create(writer)
+    writer.flush()  # 寫入執行緒已啟動並進入等待
+
+    _create(writer)
+    started = time.perf_counter()
+    writer.flush()
+    assert time.perf_counter() - started < 1.0
+
+    with db_logger.engine.connect() as conn:
+        assert len(conn.execute(select(task_table.c.id)).fetchall()) == 2
+
+
+def test_async_create_allocates_off_event_loop(task_table, writer):
+    async def create():
+        return threading.current_thread(), await writer.acreate_task(job_id=1, agent_name="node", task_description="test")
+
+    loop_thread, task_id = asyncio.run(create())
+    assert task_id == 1
+    assert writer.allocations and loop_thread not in writer.allocations
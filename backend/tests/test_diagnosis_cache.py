@@ -0,0 +1,31 @@
+from backend.app.agents.debugging.coding_help import diagnosis_cache
+from backend.app.agents.debugging.coding_help.diagnostic_agent import fallback_report
+
+
+def _record(monkeypatch, lookup_result, evidence_report):
+    calls = {"store": [], "touch": [], "events": []}
+    monkeypatch.setattr(diagnosis_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(diagnosis_cache, "_store", lambda *args: calls["store"].append(args))
+    monkeypatch.setattr(diagnosis_cache, "_touch", lambda *args: calls["touch"].append(args))
+    monkeypatch.setattr(diagnosis_cache, "save_cache_event",
+                        lambda *args, **kwargs: calls["events"].append(kwargs["hit"]))
+    diagnosis_cache.record(
+        student_id="s1", problem_id="p1", lookup_result=lookup_result,
+        evidence_report=evidence_report, search_query="", retrieved_docs=[],
+        zpd_level=1, scaffold="hint", scaffold_reused=False,
+        report_cost=0.0, scaffold_cost=0.01,
+    )
+    return calls
+
+
+def test_fallback_report_is_not_cached(monkeypatch):
+    report = fallback_report("print(1)", "LLM budget exceeded")
+    calls = _record(monkeypatch, {"signature": "sig", "code_hash": "h"}, report)
+    assert calls == {"store": [], "touch": [], "events": [False]}
+
+
+def test_regular_report_is_cached(monkeypatch):
+    report = {"error_type": "Logic", "location": "line 1", "misconception": "off by one",
+              "severity": "Medium", "error_code": "print(1)"}
+    calls = _record(monkeypatch, {"signature": "sig", "code_hash": "h"}, report)
+    assert len(calls["store"]) == 1 and calls["events"] == [False]
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from backend.app.agents.debugging import graph
+
+
+@pytest.fixture
+def stub_agents(monkeypatch):
+    queries = []
+
+    async def lookup(problem_id, code, error_message):
+        return {"entry": None}
+
+    async def generate_error_report(**kwargs):
+        return {"error_type": "Logic", "misconception": "off by one"}
+
+    async def determine_zpd_level(**kwargs):
+        return {"zpd_level": 1}
+
+    async def decide_retrieval(report, **kwargs):
+        return {"datasource": "vector_store", "search_query": "router query"}
+
+    async def generate_scaffold_response(**kwargs):
+        return f"hint with {kwargs['retrieved_docs']}"
+
+    def get_relevant_documents(query):
+        queries.append(query)
+        return [f"doc for {query}"]
+
+    monkeypatch.setattr(graph.diagnosis_cache, "lookup", lookup)
+    monkeypatch.setattr(graph.diagnosis_cache, "record", lambda **kwargs: None)
+    monkeypatch.setattr(graph, "generate_error_report", generate_error_report)
+    monkeypatch.setattr(graph, "determine_zpd_level", determine_zpd_level)
+    monkeypatch.setattr(graph, "decide_retrieval", decide_retrieval)
+    monkeypatch.setattr(graph, "generate_scaffold_response", generate_scaffold_response)
+    monkeypatch.setattr(graph, "get_relevant_documents", get_relevant_documents)
+    return queries
+
+
+def _run(mode: str):
+    app = graph.build_workflow(mode).compile()
+    return asyncio.run(app.ainvoke({
+        "student_id": "s1",
+        "problem_id": "p1",
+        "current_code": "print(1)",
+        "error_message": "E",
+        "previous_reports": [],
+        "problem_info": {"title": "T"},
+        "is_correct": False,
+    }))
+
+
+def test_concurrent_mode_retrieves_once(stub_agents, monkeypatch):
+    monkeypatch.setattr(graph, "SPECULATIVE_RETRIEVAL", True)
+    result = _run("concurrent")
+
+    assert stub_agents == ["T\nE"]
+    assert result["retrieved_docs"] == ["doc for T\nE"]
+
+
+def test_router_query_without_speculation(stub_agents, monkeypatch):
+    monkeypatch.setattr(graph, "SPECULATIVE_RETRIEVAL", False)
+    result = _run("concurrent")
+
+    assert stub_agents == ["router query"]
+    assert result["retrieved_docs"] == ["doc for router query"]
@@ -0,0 +1,24 @@
+import random
+
+import pytest
+
+from backend.app.agents.debugging.coding_help.help_chat import MarkdownStreamFilter, clean_markdown_filter
+
+
+@pytest.mark.parametrize("text", [
+    "**提示**：檢查迴圈\n\n## 步驟\n1. *看* 邊界  \n\n",
+    "  hello **wor ld**  \n# 標題\n x \n\n\n",
+    "abc #\nxyz ",
+    "a * b\n\n",
+])
+def test_stream_filter_matches_full_text_filter(text):
+    rng = random.Random(0)
+    for _ in range(200):
+        stream = MarkdownStreamFilter()
+        out, i = "", 0
+        while i < len(text):
+            n = rng.randint(1, 4)
+            out += stream.feed(text[i:i + n])
+            i += n
+        out += stream.flush()
+        assert out == clean_markdown_filter(text)
@@ -0,0 +1,150 @@
+"""
+l7m8n9o0p1q2_add_debugging_hot_path_indexes 的 EXPLAIN 回歸測試。
+
+需要 Postgres：設定 TEST_POSTGRES_URL (例如 postgresql://user:pw@localhost/test) 才會執行，
+conftest 將 DATABASE_URL 固定為 SQLite，因此另用環境變數。測試在暫存 schema 內建表、
+執行 migration 的 upgrade() 並寫入少量資料，關閉 seqscan 後確認每個熱門查詢都走該 migration 建立的索引。
+"""
+import importlib.util
+import json
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, text
+
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+pytestmark = pytest.mark.skipif(
+    not (TEST_POSTGRES_URL or "").startswith("postgresql"), reason="TEST_POSTGRES_URL (Postgres) not configured"
+)
+
+MIGRATION_PATH = (
+    Path(__file__).resolve().parents[2] / "db_migrations" / "versions" / "l7m8n9o0p1q2_add_debugging_hot_path_indexes.py"
+)
+
+# 只建立熱門查詢用到的欄位
+TABLES = {
+    "debugging_code_submission": "student_id text, problem_id text, submitted_at timestamp, code text",
+    "debugging_evidence_report": "student_id text, problem_id text, num int, submitted_at timestamp, report text",
+    "debugging_dialogue": "student_id text, problem_id text, num int, content text",
+    "debugging_practice": "student_id text, problem_id text, submitted_at timestamp, answer text",
+    "precoding_student_answers": "student_id text, problem_id text, answers text",
+    "precoding_logic_status": "student_id text, problem_id text, status text",
+    "llm_charge": "student_id text, problem_id text, usage_type text, model_name text, charge float",
+}
+
+# (資料表, 查詢)：對應 migration docstring 列出的 WHERE / ORDER BY 條件
+HOT_QUERIES = [
+    ("debugging_code_submission",
+     "SELECT * FROM {s}.debugging_code_submission WHERE student_id = 's1' AND problem_id = 'p1' "
+     "ORDER BY submitted_at DESC LIMIT 1"),
+    ("debugging_code_submission",
+     "SELECT student_id, max(submitted_at) FROM {s}.debugging_code_submission WHERE problem_id = 'p1' "
+     "GROUP BY student_id"),
+    ("debugging_evidence_report",
+     "SELECT max(num) FROM {s}.debugging_evidence_report WHERE student_id = 's1' AND problem_id = 'p1'"),
+    ("debugging_evidence_report",
+     "SELECT * FROM {s}.debugging_evidence_report WHERE student_id = 's1' AND problem_id = 'p1' "
+     "ORDER BY submitted_at DESC LIMIT 3"),
+    ("debugging_dialogue",
+     "SELECT * FROM {s}.debugging_dialogue WHERE student_id = 's1' AND problem_id = 'p1' ORDER BY num"),
+    ("debugging_practice",
+     "SELECT * FROM {s}.debugging_practice WHERE student_id = 's1' AND problem_id = 'p1' "
+     "ORDER BY submitted_at DESC LIMIT 1"),
+    ("debugging_practice",
+     "SELECT student_id, count(*) FROM {s}.debugging_practice WHERE problem_id = 'p1' GROUP BY student_id"),
+    ("precoding_student_answers",
+     "SELECT * FROM {s}.precoding_student_answers WHERE student_id = 's1' AND problem_id = 'p1'"),
+    ("precoding_student_answers",
+     "SELECT * FROM {s}.precoding_student_answers WHERE problem_id = 'p1'"),
+    ("precoding_logic_status",
+     "SELECT * FROM {s}.precoding_logic_status WHERE problem_id = 'p1'"),
+    ("llm_charge",
+     "SELECT * FROM {s}.llm_charge WHERE student_id = 's1' AND problem_id = 'p1' "
+     "AND usage_type = 'chat' AND model_name = 'gpt-4o-mini'"),
+]
+
+INDEX_SCANS = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+
+def _load_migration():
+    spec = importlib.util.spec_from_file_location("hot_path_indexes_migration", MIGRATION_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _scans(plan):
+    """回傳計畫樹中所有 (Node Type, Index Name)"""
+    found = [(plan["Node Type"], plan.get("Index Name"))]
+    for child in plan.get("Plans", []):
+        found.extend(_scans(child))
+    return found
+
+
+@pytest.fixture(scope="module")
+def pg_conn():
+    from alembic.runtime.migration import MigrationContext
+    from alembic.operations import Operations
+
+    migration = _load_migration()
+    schema = f"test_hot_path_{uuid.uuid4().hex[:8]}"
+    migration.SCHEMA = schema
+    engine = create_engine(TEST_POSTGRES_URL)
+    # 全部在同一個 transaction 內進行，結束時 rollback 即清除暫存 schema
+    with engine.connect() as conn:
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+        try:
+            for table, columns in TABLES.items():
+                conn.execute(text(f"CREATE TABLE {schema}.{table} ({columns})"))
+            # 少量資料：s0..s4 × p0..p4，每組 4 筆
+            conn.execute(text(
+                f"INSERT INTO {schema}.debugging_code_submission "
+                "SELECT 's' || s, 'p' || p, now() - n * interval '1 min', 'code' "
+                "FROM generate_series(0, 4) s, generate_series(0, 4) p, generate_series(1, 4) n"
+            ))
+            conn.execute(text(
+                f"INSERT INTO {schema}.debugging_evidence_report "
+                "SELECT 's' || s, 'p' || p, n, now() - n * interval '1 min', 'r' "
+                "FROM generate_series(0, 4) s, generate_series(0, 4) p, generate_series(1, 4) n"
+            ))
+            conn.execute(text(
+                f"INSERT INTO {schema}.debugging_dialogue SELECT 's' || s, 'p' || p, n, 'msg' "
+                "FROM generate_series(0, 4) s, generate_series(0, 4) p, generate_series(1, 4) n"
+            ))
+            conn.execute(text(
+                f"INSERT INTO {schema}.debugging_practice SELECT 's' || s, 'p' || p, now() - n * interval '1 min', 'a' "
+                "FROM generate_series(0, 4) s, generate_series(0, 4) p, generate_series(1, 4) n"
+            ))
+            for table in ("precoding_student_answers", "precoding_logic_status"):
+                conn.execute(text(
+                    f"INSERT INTO {schema}.{table} SELECT 's' || s, 'p' || p, '{{}}' "
+                    "FROM generate_series(0, 4) s, generate_series(0, 4) p"
+                ))
+            conn.execute(text(
+                f"INSERT INTO {schema}.llm_charge SELECT 's' || s, 'p' || p, u, 'gpt-4o-mini', 0.1 "
+                "FROM generate_series(0, 4) s, generate_series(0, 4) p, unnest(ARRAY['chat', 'diagnosis']) u"
+            ))
+
+            with Operations.context(MigrationContext.configure(conn)):
+                migration.upgrade()
+            for table in TABLES:
+                conn.execute(text(f"ANALYZE {schema}.{table}"))
+            conn.execute(text("SET enable_seqscan = off"))
+            yield conn, schema, migration
+        finally:
+            conn.rollback()
+    engine.dispose()
+
+
+@pytest.mark.parametrize("table,query", HOT_QUERIES)
+def test_hot_query_uses_migration_index(pg_conn, table, query):
+    conn, schema, migration = pg_conn
+    expected = {name for name, index_table, _ in migration.HOT_PATH_INDEXES if index_table == table}
+    explain = conn.execute(text("EXPLAIN (FORMAT JSON) " + query.format(s=schema))).scalar()
+    plan = (explain if isinstance(explain, list) else json.loads(explain))[0]["Plan"]
+
+    used = {index for node, index in _scans(plan) if node in INDEX_SCANS}
+    assert used & expected, f"{table}: no hot-path index scan in plan {json.dumps(plan)}"
@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from backend.app.agents.debugging.db import LLMChargeLedger
+
+
+class FakeUpsert:
+    """取代 LLMChargeLedger._upsert：含 poison 學生的批次寫入失敗，其餘記錄寫入的列"""
+
+    def __init__(self, error=ValueError("bad row")):
+        self.error = error
+        self.written = []
+
+    def __call__(self, rows):
+        if any(row["student_id"] == "poison" for row in rows):
+            raise self.error
+        self.written.extend(rows)
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    upsert = FakeUpsert()
+    monkeypatch.setattr(LLMChargeLedger, "_upsert", upsert)
+    ledger = LLMChargeLedger()
+    ledger.upsert = upsert
+    return ledger
+
+
+def test_bad_row_does_not_block_good_rows(ledger):
+    ledger.record("s1", "chat", "gpt-4o-mini", total_tokens=3)
+    ledger.record("poison", "chat", "gpt-4o-mini", total_tokens=5)
+
+    assert ledger.flush() == 1
+    assert [row["student_id"] for row in ledger.upsert.written] == ["s1"]
+    # 壞列併回緩衝區等待重試
+    assert list(ledger._pending) == [("poison", "", "chat", "gpt-4o-mini")]
+
+
+def test_poison_row_dropped_after_max_attempts(ledger):
+    ledger.record("poison", "chat", "gpt-4o-mini", total_tokens=5)
+    for _ in range(LLMChargeLedger.MAX_ATTEMPTS):
+        assert ledger.flush() == 0
+    assert ledger._pending == {} and ledger._attempts == {}
+    assert ledger.flush() == 0
+
+
+def test_database_outage_never_drops_rows(ledger):
+    ledger.upsert.error = OperationalError("INSERT", {}, Exception("connection refused"))
+    ledger.record("poison", "chat", "gpt-4o-mini", total_tokens=5)
+    for _ in range(LLMChargeLedger.MAX_ATTEMPTS + 1):
+        ledger.flush()
+    assert ledger._pending[("poison", "", "chat", "gpt-4o-mini")]["total_tokens"] == 5
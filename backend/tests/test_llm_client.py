@@ -0,0 +1,125 @@
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+from langchain_core.messages import HumanMessage
+
+from backend.app.agents.debugging import llm_client
+from backend.app.agents.debugging.llm_client import UsagePolicy, LLMBudgetExceeded
+
+
+# 各模型的回應延遲 (秒)
+MODEL_DELAYS = {"fake-primary": 0.0, "fake-slow": 2.0, "fake-backup": 0.0, "fake-slow-backup": 2.0}
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """OpenAI 相容的 /chat/completions：依模型延遲後回覆 "reply from <model>" """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        model = body["model"]
+        time.sleep(MODEL_DELAYS.get(model, 0.0))
+        payload = json.dumps({
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": f"reply from {model}"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode("utf-8")
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 用戶端已取消 (hedge 勝出或逾時)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setenv("OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setattr(llm_client, "_models", {})
+    # 每個測試以各自的 asyncio.run 執行，連線池不跨事件迴圈共用
+    monkeypatch.setattr(llm_client, "_http_client", None)
+    monkeypatch.setattr(llm_client, "_http_async_client", None)
+    monkeypatch.setattr(llm_client, "CACHE_ENABLED", False)
+    monkeypatch.setattr(llm_client, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(llm_client, "gateway_stats", llm_client.GatewayStats())
+    yield
+    server.shutdown()
+    server.server_close()
+
+
+def _policy(monkeypatch, **kwargs) -> str:
+    monkeypatch.setitem(llm_client.USAGE_POLICIES, "test", UsagePolicy(**kwargs))
+    return "test"
+
+
+def _invoke(model: str, usage_type: str):
+    chat_model = llm_client.get_chat_model(model, usage_type=usage_type)
+    return asyncio.run(llm_client.hedged_ainvoke(chat_model, [HumanMessage(content="hi")], usage_type))
+
+
+def test_primary_answers_before_hedge(fake_openai, monkeypatch):
+    usage_type = _policy(monkeypatch, timeout_sec=5, max_retries=0, budget_sec=5,
+                         hedge_after_sec=1, hedge_model="fake-backup")
+    reply, model_name = _invoke("fake-primary", usage_type)
+
+    assert (reply.content, model_name) == ("reply from fake-primary", "fake-primary")
+    assert llm_client.gateway_stats.snapshot()[usage_type]["hedged"] == 0
+
+
+def test_hedge_fires_and_backup_wins(fake_openai, monkeypatch):
+    usage_type = _policy(monkeypatch, timeout_sec=5, max_retries=0, budget_sec=5,
+                         hedge_after_sec=0.2, hedge_model="fake-backup")
+    started = time.monotonic()
+    reply, model_name = _invoke("fake-slow", usage_type)
+
+    assert (reply.content, model_name) == ("reply from fake-backup", "fake-backup")
+    assert time.monotonic() - started < MODEL_DELAYS["fake-slow"]
+    stats = llm_client.gateway_stats.snapshot()[usage_type]
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_budget_exceeded(fake_openai, monkeypatch):
+    usage_type = _policy(monkeypatch, timeout_sec=5, max_retries=0, budget_sec=0.5,
+                         hedge_after_sec=0.1, hedge_model="fake-slow-backup")
+    started = time.monotonic()
+    with pytest.raises(LLMBudgetExceeded):
+        _invoke("fake-slow", usage_type)
+
+    assert time.monotonic() - started < MODEL_DELAYS["fake-slow"]
+    assert llm_client.gateway_stats.snapshot()[usage_type]["timeouts"] == 1
+
+
+def test_policy_request_timeout(fake_openai, monkeypatch):
+    # 單次請求逾時 (timeout_sec) 早於整體預算：拋出 SDK 的逾時例外而非 LLMBudgetExceeded
+    usage_type = _policy(monkeypatch, timeout_sec=0.3, max_retries=0, budget_sec=5)
+    with pytest.raises(openai.APITimeoutError):
+        _invoke("fake-slow", usage_type)
+
+    assert llm_client.gateway_stats.snapshot()[usage_type]["errors"] == 1
+
+
+@pytest.mark.parametrize("usage_type", sorted(llm_client.USAGE_POLICIES))
+def test_usage_policies_are_consistent(usage_type):
+    policy = llm_client.get_policy(usage_type)
+    chat_model = llm_client.get_chat_model("gpt-4o-mini", usage_type=usage_type)
+    assert (chat_model.request_timeout, chat_model.max_retries) == (policy.timeout_sec, policy.max_retries)
+    # 預算至少涵蓋一次完整請求；hedge 需在單次逾時之前發出
+    assert policy.budget_sec >= policy.timeout_sec
+    if policy.hedge_after_sec is not None:
+        assert policy.hedge_model and policy.hedge_after_sec < policy.timeout_sec
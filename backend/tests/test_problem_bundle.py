@@ -0,0 +1,74 @@
+import io
+import zipfile
+
+import pytest
+import yaml
+
+from backend.app.agents.debugging import problem_bundle
+
+
+def _bundle(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    buffer.seek(0)
+    return zipfile.ZipFile(buffer)
+
+
+def _cases(zf):
+    return problem_bundle._group_members(zf)["C1_1"]["cases"]
+
+
+def test_function_cases_round_trip_as_json():
+    cases = [{"input": [[1, 2], 3], "output": [0, 1]}, {"input": "ab", "output": None}]
+    files = {}
+    for i, tc in enumerate(cases, start=1):
+        files[f"C1_1/cases/{i:03d}.in"] = problem_bundle._case_text(tc["input"], "function")
+        files[f"C1_1/cases/{i:03d}.out"] = problem_bundle._case_text(tc["output"], "function")
+
+    with _bundle(files) as zf:
+        test_cases, errors = problem_bundle._read_cases(zf, _cases(zf), "function")
+    assert errors == []
+    assert test_cases == cases
+
+
+def test_stdio_cases_stay_text():
+    with _bundle({"C1_1/cases/001.in": "1 2\n", "C1_1/cases/001.out": "3\n"}) as zf:
+        test_cases, errors = problem_bundle._read_cases(zf, _cases(zf), "stdio")
+    assert errors == []
+    assert test_cases == [{"input": "1 2\n", "output": "3\n"}]
+
+
+def test_function_case_must_be_json():
+    with _bundle({"C1_1/cases/001.in": "not json", "C1_1/cases/001.out": "1"}) as zf:
+        test_cases, errors = problem_bundle._read_cases(zf, _cases(zf), "function")
+    assert test_cases == []
+    assert "not valid JSON" in errors[0]
+
+
+def test_exported_yaml_with_empty_fields_imports():
+    mapping = {
+        "problem_id": "C1_1", "title": "Sum", "description": "Add<br>numbers",
+        "input_description": "", "output_description": "", "hint": "", "entry_point": None,
+        "solution_code": None, "samples": [], "time_limit": 1000, "memory_limit": 256,
+        "judge_type": "stdio", "start_time": None, "end_time": None,
+    }
+    meta = yaml.safe_load(problem_bundle.problem_to_yaml(mapping))
+    assert "input_description" not in meta and "hint" not in meta
+
+    row, errors = problem_bundle._validate_problem("C1_1", meta, "C1")
+    assert errors == []
+    assert row["description"] == "Add<br>numbers"
+    assert row["input_description"] == ""
+    assert row["hint"] is None
+
+
+def test_parse_case_follows_judge_type():
+    # 單筆上傳 (PUT /teacher/problem/{id}/test_cases/{n}) 與 bundle 共用同一轉換
+    assert problem_bundle.parse_case(b"[[1, 2], 3]", b"[0, 1]", "function") == {"input": [[1, 2], 3], "output": [0, 1]}
+    assert problem_bundle.parse_case(b"[1]\n", b"2\n", "stdio") == {"input": "[1]\n", "output": "2\n"}
+    with pytest.raises(ValueError, match="not valid JSON"):
+        problem_bundle.parse_case(b"1 2", b"3", "function")
+    with pytest.raises(ValueError, match="not valid UTF-8"):
+        problem_bundle.parse_case(b"\xff", b"1", "stdio")
@@ -0,0 +1,44 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, JSON, insert, update, select
+
+from backend.app.utils import db_logger
+from backend.app.utils.schema_registry import LazySchemaRegistry, LazyTable
+
+
+def test_dml_builds_on_fallback_table():
+    # 資料表尚未建立 → 反射失敗，使用 fallback 定義
+    jobs = LazyTable(LazySchemaRegistry(db_logger.engine), "missing_jobs", fallback_columns=lambda: [
+        Column("id", Integer, primary_key=True),
+        Column("status", String),
+    ])
+    assert str(insert(jobs).values(status="planning")).startswith("INSERT INTO missing_jobs")
+    # 同一個 statement 內多次取用需是同一個 Table，否則會多出 FROM
+    stmt = update(jobs).where(jobs.c.id == 1).values(status="running")
+    assert "FROM" not in str(stmt)
+    assert "missing_jobs, missing_jobs" not in str(select(jobs.c.id).where(jobs.c.id == 1))
+
+
+def test_orchestration_jobs_insert_builds():
+    stmt = insert(db_logger.orchestration_jobs).values(status="planning")
+    assert "INSERT INTO orchestration_jobs" in str(stmt)
+
+
+def test_reflected_table_round_trip():
+    metadata = MetaData()
+    Table(
+        "lazy_round_trip", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("status", String),
+        Column("config", JSON),
+    )
+    metadata.create_all(db_logger.engine)
+
+    table = LazyTable(LazySchemaRegistry(db_logger.engine), "lazy_round_trip")
+    with db_logger.engine.begin() as conn:
+        row_id = conn.execute(
+            insert(table).values(status="planning", config={"a": 1}).returning(table.c.id)
+        ).scalar_one()
+        conn.execute(update(table).where(table.c.id == row_id).values(status="running"))
+        row = conn.execute(select(table.c.status, table.c.config).where(table.c.id == row_id)).fetchone()
+    assert row.status == "running"
+    assert row.config == {"a": 1}
+    assert not hasattr(table, "is_clause_element")
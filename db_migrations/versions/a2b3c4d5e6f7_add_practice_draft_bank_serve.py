@@ -0,0 +1,37 @@
+"""add_practice_draft_bank_serve
+
+Revision ID: a2b3c4d5e6f7
+Revises: z1a2b3c4d5e6
+Create Date: 2026-10-19 01:00:00.000000
+
+詳細變更說明:
+1. debugging.debugging_practice_draft 新增欄位 'bank_serve' (JSONB)
+   - 草稿取自練習題題庫 (或生成後存入題庫) 時記錄 {"bank_id", "hit", "saved_cost"}
+   - 草稿生成時不再寫入 practice_bank_serve 與命中紀錄，AC 採用草稿時才補記；
+     捨棄的草稿不會讓該學生之後拿不到這組題目，命中率也只計入實際發出的題目
+
+設計說明:
+- 既有草稿的 bank_serve 為 NULL (生成時已記錄發放)，採用時不再補記
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a2b3c4d5e6f7'
+down_revision: Union[str, Sequence[str], None] = 'z1a2b3c4d5e6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('debugging_practice_draft', sa.Column('bank_serve', postgresql.JSONB(), nullable=True), schema='debugging')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('debugging_practice_draft', 'bank_serve', schema='debugging')
@@ -0,0 +1,85 @@
+"""add_debugging_hot_path_indexes
+
+Revision ID: l7m8n9o0p1q2
+Revises: k6l7m8n9o0p1
+Create Date: 2026-10-18 10:00:00.000000
+
+詳細變更說明:
+為 debugging schema 的熱門查詢新增複合索引。
+debugging.* 的資料表是由 backend/migrations/*.sql 與程式碼建立，先前沒有任何
+Alembic 管理的索引，以下索引依照 routers/debugging.py、routers/dashboard.py、
+agents/debugging/db.py 中實際的 WHERE / ORDER BY 條件整理 (EXPLAIN 分析結果):
+
+1. debugging_code_submission
+   - (student_id, problem_id, submitted_at): get_latest_submission、get_submission_count、
+     /help/init 依 submitted_at 的 OFFSET 查詢
+   - (problem_id, student_id, submitted_at): /dashboard/coding_help 的 GROUP BY max(submitted_at)
+2. debugging_evidence_report
+   - (student_id, problem_id, num): /help/init、/help/chat、max(num)
+   - (student_id, problem_id, submitted_at): 取得最近 N 份歷史報告
+3. debugging_dialogue
+   - (student_id, problem_id, num): /help/init、/help/chat、/help/history
+4. debugging_practice
+   - (student_id, problem_id, submitted_at): get_practice_status
+   - (problem_id, student_id): /dashboard/coding_help
+5. precoding_student_answers / precoding_logic_status
+   - precoding_student_answers (student_id, problem_id): 學生端狀態查詢
+   - (problem_id): /dashboard/precoding 依題目撈全班
+   (precoding_logic_* 的 (student_id, problem_id) 已由 UNIQUE 約束涵蓋)
+6. llm_charge
+   - (student_id, problem_id, usage_type, model_name): save_llm_charge 的累加比對
+
+設計說明:
+- 一律使用 IF NOT EXISTS，避免與 precoding_logic_chatbot.sql 已建立的索引衝突
+- 若資料表尚未建立 (例如新環境尚未執行 SQL 腳本)，該表的索引會被略過
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'l7m8n9o0p1q2'
+down_revision: Union[str, Sequence[str], None] = 'k6l7m8n9o0p1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SCHEMA = 'debugging'
+
+# (索引名稱, 資料表, 欄位)
+HOT_PATH_INDEXES = [
+    ('idx_code_submission_student_problem_time', 'debugging_code_submission', ['student_id', 'problem_id', 'submitted_at']),
+    ('idx_code_submission_problem_student_time', 'debugging_code_submission', ['problem_id', 'student_id', 'submitted_at']),
+    ('idx_evidence_report_student_problem_num', 'debugging_evidence_report', ['student_id', 'problem_id', 'num']),
+    ('idx_evidence_report_student_problem_time', 'debugging_evidence_report', ['student_id', 'problem_id', 'submitted_at']),
+    ('idx_dialogue_student_problem_num', 'debugging_dialogue', ['student_id', 'problem_id', 'num']),
+    ('idx_practice_student_problem_time', 'debugging_practice', ['student_id', 'problem_id', 'submitted_at']),
+    ('idx_practice_problem_student', 'debugging_practice', ['problem_id', 'student_id']),
+    ('idx_precoding_answers_student_problem', 'precoding_student_answers', ['student_id', 'problem_id']),
+    ('idx_precoding_answers_problem', 'precoding_student_answers', ['problem_id']),
+    ('idx_precoding_logic_status_problem', 'precoding_logic_status', ['problem_id']),
+    ('idx_llm_charge_student_problem_usage_model', 'llm_charge', ['student_id', 'problem_id', 'usage_type', 'model_name']),
+]
+
+
+def _has_table(table_name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(table_name, schema=SCHEMA)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for index_name, table_name, columns in HOT_PATH_INDEXES:
+        if not _has_table(table_name):
+            print(f"--- Skip {index_name}: table {SCHEMA}.{table_name} not found ---")
+            continue
+        op.create_index(index_name, table_name, columns, schema=SCHEMA, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for index_name, table_name, _ in reversed(HOT_PATH_INDEXES):
+        if not _has_table(table_name):
+            continue
+        op.drop_index(index_name, table_name=table_name, schema=SCHEMA, if_exists=True)
@@ -0,0 +1,84 @@
+"""add_llm_charge_ledger_unique_key
+
+Revision ID: m8n9o0p1q2r3
+Revises: l7m8n9o0p1q2
+Create Date: 2026-10-18 11:00:00.000000
+
+詳細變更說明:
+1. 合併 debugging.llm_charge 中 (student_id, problem_id, usage_type, model_name) 重複的列
+   (舊版 SELECT-then-UPDATE 在並發時可能插入重複列)
+2. 建立唯一索引 uq_llm_charge_ledger_key，供 LLMChargeLedger 的 INSERT ... ON CONFLICT DO UPDATE 使用
+
+設計說明:
+- problem_id 可為 NULL，因此索引使用 COALESCE(problem_id, '') 讓 NULL 視為同一個 key
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'm8n9o0p1q2r3'
+down_revision: Union[str, Sequence[str], None] = 'l7m8n9o0p1q2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+AMOUNT_COLUMNS = [
+    'input_tokens', 'cached_input_tokens', 'output_tokens', 'total_tokens',
+    'input_cost', 'cached_input_cost', 'output_cost', 'total_cost',
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table('llm_charge', schema='debugging'):
+        print("--- Skip: table debugging.llm_charge not found ---")
+        return
+
+    # 1. 將重複列的數值加總到 id 最小的那一列
+    sums = ",\n            ".join(f"sum({c}) AS {c}" for c in AMOUNT_COLUMNS)
+    sets = ",\n            ".join(f"{c} = agg.{c}" for c in AMOUNT_COLUMNS)
+    op.execute(
+        f"""
+        WITH agg AS (
+            SELECT
+            min(id) AS keep_id,
+            {sums}
+            FROM debugging.llm_charge
+            GROUP BY student_id, COALESCE(problem_id, ''), usage_type, model_name
+            HAVING count(*) > 1
+        )
+        UPDATE debugging.llm_charge c SET
+            {sets}
+        FROM agg
+        WHERE c.id = agg.keep_id
+        """
+    )
+
+    # 2. 刪除其餘重複列
+    op.execute(
+        """
+        DELETE FROM debugging.llm_charge c
+        USING debugging.llm_charge k
+        WHERE c.student_id = k.student_id
+          AND COALESCE(c.problem_id, '') = COALESCE(k.problem_id, '')
+          AND c.usage_type = k.usage_type
+          AND c.model_name IS NOT DISTINCT FROM k.model_name
+          AND c.id > k.id
+        """
+    )
+
+    # 3. 建立唯一索引
+    op.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_llm_charge_ledger_key
+        ON debugging.llm_charge (student_id, (COALESCE(problem_id, '')), usage_type, model_name)
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS debugging.uq_llm_charge_ledger_key")
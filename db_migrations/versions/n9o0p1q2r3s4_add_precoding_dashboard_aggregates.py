@@ -0,0 +1,121 @@
+"""add_precoding_dashboard_aggregates
+
+Revision ID: n9o0p1q2r3s4
+Revises: m8n9o0p1q2r3
+Create Date: 2026-10-18 12:00:00.000000
+
+詳細變更說明:
+1. 新增資料表 'debugging.precoding_question_summary': 每位學生每題的首答 / 最新作答摘要
+2. 新增資料表 'debugging.precoding_option_stats': 每題首答選項分佈計數器
+3. 由既有 precoding_student_answers 的 JSONB 作答紀錄回填上述兩張表
+
+設計說明:
+- 兩張表由 process_precoding_submission 於寫入時增量更新 (record_precoding_attempt)
+- /dashboard/precoding 直接讀取統計表，不再逐筆掃描作答紀錄
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'n9o0p1q2r3s4'
+down_revision: Union[str, Sequence[str], None] = 'm8n9o0p1q2r3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE SCHEMA IF NOT EXISTS debugging")
+
+    # 1. 每題作答摘要
+    op.create_table(
+        'precoding_question_summary',
+        sa.Column('student_id', sa.String(), nullable=False),
+        sa.Column('problem_id', sa.String(), nullable=False),
+        sa.Column('stage', sa.String(), nullable=False),
+        sa.Column('q_id', sa.String(), nullable=False),
+        sa.Column('first_option_id', sa.Integer(), nullable=True),
+        sa.Column('first_is_correct', sa.Boolean(), nullable=True),
+        sa.Column('latest_option_id', sa.Integer(), nullable=True),
+        sa.Column('latest_is_correct', sa.Boolean(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('updated_at', sa.TIMESTAMP(), server_default=sa.text('NOW()'), nullable=False),
+        sa.PrimaryKeyConstraint('student_id', 'problem_id', 'stage', 'q_id'),
+        schema='debugging'
+    )
+    op.create_index('idx_precoding_question_summary_problem', 'precoding_question_summary', ['problem_id'], schema='debugging')
+
+    # 2. 首答選項分佈
+    op.create_table(
+        'precoding_option_stats',
+        sa.Column('problem_id', sa.String(), nullable=False),
+        sa.Column('stage', sa.String(), nullable=False),
+        sa.Column('q_id', sa.String(), nullable=False),
+        sa.Column('option_id', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('problem_id', 'stage', 'q_id', 'option_id'),
+        schema='debugging'
+    )
+
+    # 3. 回填既有作答紀錄
+    if not sa.inspect(op.get_bind()).has_table('precoding_student_answers', schema='debugging'):
+        return
+
+    op.execute(
+        """
+        WITH responses AS (
+            SELECT a.student_id, a.problem_id, s.stage, r.elem, r.ord
+            FROM debugging.precoding_student_answers a
+            CROSS JOIN LATERAL (VALUES
+                ('logic', a.logic_responses),
+                ('explain_code', a.explain_responses),
+                ('error_code', a.error_responses)
+            ) AS s(stage, responses)
+            CROSS JOIN LATERAL jsonb_array_elements(COALESCE(s.responses, '[]'::jsonb))
+                WITH ORDINALITY AS r(elem, ord)
+            WHERE r.elem->>'q_id' IS NOT NULL
+        ),
+        ranked AS (
+            SELECT
+                student_id, problem_id, stage, elem->>'q_id' AS q_id, elem,
+                row_number() OVER (PARTITION BY student_id, problem_id, stage, elem->>'q_id' ORDER BY ord) AS rn_first,
+                row_number() OVER (PARTITION BY student_id, problem_id, stage, elem->>'q_id' ORDER BY ord DESC) AS rn_last,
+                count(*) OVER (PARTITION BY student_id, problem_id, stage, elem->>'q_id') AS attempts
+            FROM responses
+        )
+        INSERT INTO debugging.precoding_question_summary (
+            student_id, problem_id, stage, q_id,
+            first_option_id, first_is_correct, latest_option_id, latest_is_correct, attempts
+        )
+        SELECT
+            f.student_id, f.problem_id, f.stage, f.q_id,
+            (f.elem->>'selected_option_id')::int, (f.elem->>'is_correct')::boolean,
+            (l.elem->>'selected_option_id')::int, (l.elem->>'is_correct')::boolean,
+            f.attempts
+        FROM ranked f
+        JOIN ranked l
+          ON l.student_id = f.student_id AND l.problem_id = f.problem_id
+         AND l.stage = f.stage AND l.q_id = f.q_id AND l.rn_last = 1
+        WHERE f.rn_first = 1
+        ON CONFLICT DO NOTHING
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO debugging.precoding_option_stats (problem_id, stage, q_id, option_id, count)
+        SELECT problem_id, stage, q_id, first_option_id, count(*)
+        FROM debugging.precoding_question_summary
+        WHERE first_option_id IS NOT NULL
+        GROUP BY problem_id, stage, q_id, first_option_id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('precoding_option_stats', schema='debugging')
+    op.drop_index('idx_precoding_question_summary_problem', 'precoding_question_summary', schema='debugging')
+    op.drop_table('precoding_question_summary', schema='debugging')
@@ -0,0 +1,93 @@
+"""add_debugging_latest_submission
+
+Revision ID: o0p1q2r3s4t5
+Revises: n9o0p1q2r3s4
+Create Date: 2026-10-18 13:00:00.000000
+
+詳細變更說明:
+1. 新增資料表 'debugging.debugging_latest_submission': 每位學生每題的最新提交
+   - verdict 為標準化結果 (AC / WA / TLE / RE)，raw_verdict 保留 compute_verdict 原字串
+   - submission_count 為累計提交次數
+2. 建立索引 idx_latest_submission_problem，供 /dashboard/coding_help 依題目撈全班
+3. 由 debugging_code_submission 回填每位學生每題的最新一筆提交
+
+設計說明:
+- save_submission 於同一 transaction 中 INSERT ... ON CONFLICT DO UPDATE 此表
+- 儀表板不再執行 GROUP BY max(submitted_at) 子查詢，也不再於 Python 逐筆解析 verdict
+- 回填的標準化規則與 db.normalize_verdict 相同
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'o0p1q2r3s4t5'
+down_revision: Union[str, Sequence[str], None] = 'n9o0p1q2r3s4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE SCHEMA IF NOT EXISTS debugging")
+
+    # 1. 最新提交表
+    op.create_table(
+        'debugging_latest_submission',
+        sa.Column('student_id', sa.String(), nullable=False),
+        sa.Column('problem_id', sa.String(), nullable=False),
+        sa.Column('verdict', sa.String(), nullable=True),
+        sa.Column('raw_verdict', sa.String(), nullable=True),
+        sa.Column('passed_cases', sa.String(), nullable=True),
+        sa.Column('submission_count', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('submitted_at', sa.TIMESTAMP(), server_default=sa.text('NOW()'), nullable=False),
+        sa.PrimaryKeyConstraint('student_id', 'problem_id'),
+        schema='debugging'
+    )
+    op.create_index('idx_latest_submission_problem', 'debugging_latest_submission', ['problem_id'], schema='debugging')
+
+    # 2. 回填既有提交
+    if not sa.inspect(op.get_bind()).has_table('debugging_code_submission', schema='debugging'):
+        return
+
+    op.execute(
+        """
+        WITH latest AS (
+            SELECT DISTINCT ON (student_id, problem_id)
+                student_id, problem_id, submitted_at,
+                COALESCE(output->>'verdict', trim(both '"' from result #>> '{}'), 'Unknown') AS raw_verdict,
+                output->>'passed_cases' AS passed_cases
+            FROM debugging.debugging_code_submission
+            ORDER BY student_id, problem_id, submitted_at DESC
+        ),
+        counts AS (
+            SELECT student_id, problem_id, count(*) AS submission_count
+            FROM debugging.debugging_code_submission
+            GROUP BY student_id, problem_id
+        )
+        INSERT INTO debugging.debugging_latest_submission (
+            student_id, problem_id, verdict, raw_verdict, passed_cases, submission_count, submitted_at
+        )
+        SELECT
+            l.student_id, l.problem_id,
+            CASE
+                WHEN l.raw_verdict LIKE '%Accepted%' OR l.raw_verdict LIKE '%AC%' THEN 'AC'
+                WHEN l.raw_verdict LIKE '%Wrong%' THEN 'WA'
+                WHEN l.raw_verdict LIKE '%Time%' THEN 'TLE'
+                WHEN l.raw_verdict LIKE '%Runtime%' OR l.raw_verdict LIKE '%Error%' THEN 'RE'
+                ELSE l.raw_verdict
+            END,
+            l.raw_verdict, l.passed_cases, c.submission_count, COALESCE(l.submitted_at, NOW())
+        FROM latest l
+        JOIN counts c ON c.student_id = l.student_id AND c.problem_id = l.problem_id
+        ON CONFLICT DO NOTHING
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_latest_submission_problem', 'debugging_latest_submission', schema='debugging')
+    op.drop_table('debugging_latest_submission', schema='debugging')
@@ -0,0 +1,71 @@
+"""add_chat_log_message_seq
+
+Revision ID: p1q2r3s4t5u6
+Revises: o0p1q2r3s4t5
+Create Date: 2026-10-18 14:00:00.000000
+
+詳細變更說明:
+1. debugging.debugging_dialogue 新增欄位 'message_seq' (Integer)
+2. debugging.precoding_logic_logs 新增欄位 'message_seq' (Integer)
+3. 回填: 為既有 chat_log 的每則訊息加上 seq (1, 2, 3, ...)，message_seq 設為訊息數
+
+設計說明:
+- chat_log 改由 append_chat_messages 以 jsonb || 在資料庫端追加，不再讀出整份陣列後整份寫回
+- seq 為單一對話內遞增的訊息序號，message_seq 記錄目前最大值，供追加時接續編號
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'p1q2r3s4t5u6'
+down_revision: Union[str, Sequence[str], None] = 'o0p1q2r3s4t5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+CHAT_LOG_TABLES = ['debugging_dialogue', 'precoding_logic_logs']
+
+
+def _has_table(table_name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(table_name, schema='debugging')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table_name in CHAT_LOG_TABLES:
+        if not _has_table(table_name):
+            print(f"--- Skip: table debugging.{table_name} not found ---")
+            continue
+
+        op.add_column(table_name, sa.Column('message_seq', sa.Integer(), nullable=True, server_default='0'), schema='debugging')
+        op.execute(
+            f"""
+            UPDATE debugging.{table_name} AS t
+            SET chat_log = numbered.chat_log,
+                message_seq = numbered.message_seq
+            FROM (
+                SELECT
+                    d.id,
+                    COALESCE(jsonb_agg(e.elem || jsonb_build_object('seq', e.ord) ORDER BY e.ord)
+                             FILTER (WHERE e.elem IS NOT NULL), '[]'::jsonb) AS chat_log,
+                    count(e.elem)::int AS message_seq
+                FROM debugging.{table_name} d
+                LEFT JOIN LATERAL jsonb_array_elements(
+                    CASE WHEN jsonb_typeof(d.chat_log) = 'array' THEN d.chat_log ELSE '[]'::jsonb END
+                ) WITH ORDINALITY AS e(elem, ord) ON TRUE
+                GROUP BY d.id
+            ) AS numbered
+            WHERE t.id = numbered.id
+            """
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table_name in CHAT_LOG_TABLES:
+        if not _has_table(table_name):
+            continue
+        op.drop_column(table_name, 'message_seq', schema='debugging')
@@ -0,0 +1,168 @@
+"""add_content_blob_store
+
+Revision ID: q2r3s4t5u6v7
+Revises: p1q2r3s4t5u6
+Create Date: 2026-10-18 15:00:00.000000
+
+詳細變更說明:
+1. 新增資料表 'debugging.content_blob' (hash PK, content, size)，以 sha256 去重存放內容
+2. 轉換既有資料:
+   - debugging_code_submission.code: {"content": ...} -> {"hash": ...}
+   - debugging_code_submission.output.details[*]: input / expected / actual -> input_hash / expected_hash / actual_hash
+   - debugging_evidence_report.code: {"content": ...} -> {"hash": ...}
+
+設計說明:
+- content 為值的 JSON 文字 (保留原始型別)，hash = sha256(content)
+- 相同的程式碼、測資輸入與期望輸出 (以及 AC 測資的實際輸出) 只存一份
+- 轉換後需執行 VACUUM FULL (或 pg_repack) 才會實際釋放資料表與 TOAST 空間
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'q2r3s4t5u6v7'
+down_revision: Union[str, Sequence[str], None] = 'p1q2r3s4t5u6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+BLOB_FIELDS = ['input', 'expected', 'actual']
+CODE_TABLES = ['debugging_code_submission', 'debugging_evidence_report']
+
+
+def _hash(expr: str) -> str:
+    return f"encode(sha256(convert_to(({expr})::text, 'UTF8')), 'hex')"
+
+
+def _has_table(table_name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(table_name, schema='debugging')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE SCHEMA IF NOT EXISTS debugging")
+    op.create_table(
+        'content_blob',
+        sa.Column('hash', sa.String(64), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('NOW()'), nullable=False),
+        sa.PrimaryKeyConstraint('hash'),
+        schema='debugging'
+    )
+
+    # 1. 程式碼
+    for table_name in CODE_TABLES:
+        if not _has_table(table_name):
+            print(f"--- Skip: table debugging.{table_name} not found ---")
+            continue
+        op.execute(
+            f"""
+            INSERT INTO debugging.content_blob (hash, content, size)
+            SELECT DISTINCT ON (h) h, c, length(c)
+            FROM (
+                SELECT to_jsonb(code->>'content')::text AS c
+                FROM debugging.{table_name}
+                WHERE jsonb_typeof(code) = 'object' AND code ? 'content'
+            ) s
+            CROSS JOIN LATERAL (SELECT {_hash('s.c')} AS h) x
+            ON CONFLICT DO NOTHING
+            """
+        )
+        op.execute(
+            f"""
+            UPDATE debugging.{table_name}
+            SET code = jsonb_build_object('hash', {_hash("to_jsonb(code->>'content')")})
+            WHERE jsonb_typeof(code) = 'object' AND code ? 'content'
+            """
+        )
+
+    if not _has_table('debugging_code_submission'):
+        return
+
+    # 2. 逐筆測資的 input / expected / actual
+    op.execute(
+        f"""
+        INSERT INTO debugging.content_blob (hash, content, size)
+        SELECT DISTINCT ON (h) h, c, length(c)
+        FROM (
+            SELECT v.val::text AS c
+            FROM debugging.debugging_code_submission s
+            CROSS JOIN LATERAL jsonb_array_elements(s.output->'details') d(elem)
+            CROSS JOIN LATERAL (VALUES (d.elem->'input'), (d.elem->'expected'), (d.elem->'actual')) v(val)
+            WHERE jsonb_typeof(s.output->'details') = 'array'
+              AND jsonb_typeof(d.elem) = 'object'
+              AND v.val IS NOT NULL AND v.val <> 'null'::jsonb
+        ) vals
+        CROSS JOIN LATERAL (SELECT {_hash('vals.c')} AS h) x
+        ON CONFLICT DO NOTHING
+        """
+    )
+    hash_fields = ", ".join(
+        "'{f}_hash', CASE WHEN d.elem->'{f}' IS NULL OR d.elem->'{f}' = 'null'::jsonb THEN NULL ELSE {h} END".format(
+            f=f, h=_hash("d.elem->'%s'" % f)
+        )
+        for f in BLOB_FIELDS
+    )
+    op.execute(
+        f"""
+        UPDATE debugging.debugging_code_submission s
+        SET output = jsonb_set(s.output, '{{details}}', (
+            SELECT COALESCE(jsonb_agg(
+                CASE WHEN jsonb_typeof(d.elem) = 'object'
+                     THEN (d.elem - 'input' - 'expected' - 'actual') || jsonb_build_object({hash_fields})
+                     ELSE d.elem END
+                ORDER BY d.ord
+            ), '[]'::jsonb)
+            FROM jsonb_array_elements(s.output->'details') WITH ORDINALITY d(elem, ord)
+        ))
+        WHERE jsonb_typeof(s.output->'details') = 'array'
+          AND EXISTS (
+              SELECT 1 FROM jsonb_array_elements(s.output->'details') e(elem)
+              WHERE jsonb_typeof(e.elem) = 'object' AND (e.elem ? 'input' OR e.elem ? 'expected' OR e.elem ? 'actual')
+          )
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # 1. 還原程式碼
+    for table_name in CODE_TABLES:
+        if not _has_table(table_name):
+            continue
+        op.execute(
+            f"""
+            UPDATE debugging.{table_name} t
+            SET code = jsonb_build_object('content', b.content::jsonb #>> '{{}}')
+            FROM debugging.content_blob b
+            WHERE jsonb_typeof(t.code) = 'object' AND t.code ? 'hash' AND b.hash = t.code->>'hash'
+            """
+        )
+
+    # 2. 還原逐筆測資內容
+    if _has_table('debugging_code_submission'):
+        restore_fields = ", ".join(
+            f"'{f}', (SELECT b.content::jsonb FROM debugging.content_blob b WHERE b.hash = d.elem->>'{f}_hash')"
+            for f in BLOB_FIELDS
+        )
+        op.execute(
+            f"""
+            UPDATE debugging.debugging_code_submission s
+            SET output = jsonb_set(s.output, '{{details}}', (
+                SELECT COALESCE(jsonb_agg(
+                    CASE WHEN jsonb_typeof(d.elem) = 'object' AND d.elem ? 'input_hash'
+                         THEN (d.elem - 'input_hash' - 'expected_hash' - 'actual_hash') || jsonb_build_object({restore_fields})
+                         ELSE d.elem END
+                    ORDER BY d.ord
+                ), '[]'::jsonb)
+                FROM jsonb_array_elements(s.output->'details') WITH ORDINALITY d(elem, ord)
+            ))
+            WHERE jsonb_typeof(s.output->'details') = 'array'
+            """
+        )
+
+    op.drop_table('content_blob', schema='debugging')
@@ -0,0 +1,225 @@
+"""partition_debugging_logs_by_term
+
+Revision ID: r3s4t5u6v7w8
+Revises: q2r3s4t5u6v7
+Create Date: 2026-10-18 16:00:00.000000
+
+詳細變更說明:
+1. debugging.debugging_code_submission、debugging.debugging_dialogue 改為依 submitted_at
+   的 RANGE 分區表 (每學期一個分區: 上學期 8/1 ~ 2/1、下學期 2/1 ~ 8/1)
+   - 原資料表更名為 <table>_legacy，本學期以前的資料原地掛為分區 FROM (MINVALUE) TO (本學期開始)，
+     不需搬移歷史資料
+   - 本學期的資料移入本學期分區
+   - 建立本學期、下學期分區與 <table>_default 分區 (接住尚未建立分區的時間)
+2. submitted_at 設為 NOT NULL (NULL 先回填為 1970-01-01，歸入 legacy 分區)
+3. 有 id 欄位的資料表改以 (id, submitted_at) 為主鍵，id 的 sequence 改由新資料表擁有；
+   legacy 資料表的主鍵 (id) 於掛為分區前重建為 (id, submitted_at) (分區的主鍵須與分區表一致)
+4. 原資料表上的非唯一索引 (熱門查詢索引) 以相同定義建立在分區表上，legacy 分區沿用既有索引
+
+設計說明:
+- 分區切點以執行 migration 當下的學期計算，之後的學期分區由
+  python -m backend.app.agents.debugging.partition_maintenance 預先建立，並負責卸載、封存過期分區
+- 查詢端以 db.in_current_term 加上 submitted_at >= 本學期開始，Postgres 只掃描本學期分區；
+  num (第幾次提交) 仍以所有學期累計，既有報告與對話的 num 不需改寫
+- llm_charge 不分區: 自 m8n9o0p1q2r3 起為 (student_id, problem_id, usage_type, model_name) 累加表，
+  列數不隨時間成長，且唯一鍵須包含分區鍵
+- agent_tasks 不分區: generated_contents、task_evaluations、agent_task_sources 與 parent_task_id
+  皆以外鍵參照 agent_tasks(id)，分區表的唯一鍵必須包含分區鍵，無法維持這些外鍵
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'r3s4t5u6v7w8'
+down_revision: Union[str, Sequence[str], None] = 'q2r3s4t5u6v7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SCHEMA = 'debugging'
+PARTITION_COLUMN = 'submitted_at'
+PARTITIONED_TABLES = ['debugging_code_submission', 'debugging_dialogue']
+
+# 學期開始月份 (與 db.TERM_START_MONTHS 相同)
+TERM_START_MONTHS = (2, 8)
+
+
+def _term_start_of(moment: datetime) -> datetime:
+    if moment.month >= TERM_START_MONTHS[1]:
+        return datetime(moment.year, TERM_START_MONTHS[1], 1)
+    if moment.month >= TERM_START_MONTHS[0]:
+        return datetime(moment.year, TERM_START_MONTHS[0], 1)
+    return datetime(moment.year - 1, TERM_START_MONTHS[1], 1)
+
+
+def _next_term_start(term_start: datetime) -> datetime:
+    if term_start.month >= TERM_START_MONTHS[1]:
+        return datetime(term_start.year + 1, TERM_START_MONTHS[0], 1)
+    return datetime(term_start.year, TERM_START_MONTHS[1], 1)
+
+
+def _has_table(table_name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(table_name, schema=SCHEMA)
+
+
+def _has_column(table_name: str, column_name: str) -> bool:
+    columns = sa.inspect(op.get_bind()).get_columns(table_name, schema=SCHEMA)
+    return any(c['name'] == column_name for c in columns)
+
+
+def _index_defs(table_name: str):
+    """回傳資料表上的非唯一索引 (名稱, CREATE INDEX 定義)"""
+    rows = op.get_bind().execute(
+        sa.text(
+            """
+            SELECT c.relname, pg_get_indexdef(i.indexrelid)
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = CAST(:table_name AS regclass) AND NOT i.indisunique
+            """
+        ),
+        {"table_name": f"{SCHEMA}.{table_name}"},
+    ).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+def _all_index_names(table_name: str):
+    rows = op.get_bind().execute(
+        sa.text("SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE i.indrelid = CAST(:table_name AS regclass)"),
+        {"table_name": f"{SCHEMA}.{table_name}"},
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _primary_key_name(table_name: str):
+    return op.get_bind().execute(
+        sa.text("SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table_name AS regclass) AND contype = 'p'"),
+        {"table_name": f"{SCHEMA}.{table_name}"},
+    ).scalar()
+
+
+def _replace_primary_key(table_name: str, columns: str):
+    pk_name = _primary_key_name(table_name)
+    if pk_name:
+        op.execute(f"ALTER TABLE {SCHEMA}.{table_name} DROP CONSTRAINT {pk_name}")
+    op.execute(f"ALTER TABLE {SCHEMA}.{table_name} ADD PRIMARY KEY ({columns})")
+
+
+def _reown_sequence(from_table: str, to_table: str):
+    seq = op.get_bind().execute(
+        sa.text("SELECT pg_get_serial_sequence(:table_name, 'id')"),
+        {"table_name": f"{SCHEMA}.{from_table}"},
+    ).scalar()
+    if seq:
+        op.execute(f"ALTER SEQUENCE {seq} OWNED BY {SCHEMA}.{to_table}.id")
+
+
+def _create_partition(table_name: str, start: datetime, end: datetime):
+    op.execute(
+        f"CREATE TABLE IF NOT EXISTS {SCHEMA}.{table_name}_p{start:%Y%m} "
+        f"PARTITION OF {SCHEMA}.{table_name} "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    cutover = _term_start_of(datetime.now())
+    next_start = _next_term_start(cutover)
+
+    for table_name in PARTITIONED_TABLES:
+        if not _has_table(table_name):
+            print(f"--- Skip: table {SCHEMA}.{table_name} not found ---")
+            continue
+
+        legacy = f"{table_name}_legacy"
+        index_defs = _index_defs(table_name)
+        has_id = _has_column(table_name, 'id')
+
+        # 1. 原資料表更名為 legacy (索引一併加上 _legacy，讓分區表可使用原名稱)
+        op.execute(f"ALTER TABLE {SCHEMA}.{table_name} RENAME TO {legacy}")
+        for index_name in _all_index_names(legacy):
+            op.execute(f"ALTER INDEX {SCHEMA}.{index_name} RENAME TO {index_name[:56]}_legacy")
+
+        # 2. 分區鍵不可為 NULL
+        op.execute(f"UPDATE {SCHEMA}.{legacy} SET {PARTITION_COLUMN} = '1970-01-01' WHERE {PARTITION_COLUMN} IS NULL")
+        op.execute(f"ALTER TABLE {SCHEMA}.{legacy} ALTER COLUMN {PARTITION_COLUMN} SET NOT NULL")
+
+        # 3. 分區表 (欄位順序與預設值沿用原資料表)
+        op.execute(
+            f"CREATE TABLE {SCHEMA}.{table_name} (LIKE {SCHEMA}.{legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE ({PARTITION_COLUMN})"
+        )
+        if has_id:
+            op.execute(f"ALTER TABLE {SCHEMA}.{table_name} ADD PRIMARY KEY (id, {PARTITION_COLUMN})")
+            _reown_sequence(legacy, table_name)
+
+        # 4. 本學期、下學期與 default 分區
+        _create_partition(table_name, cutover, next_start)
+        _create_partition(table_name, next_start, _next_term_start(next_start))
+        op.execute(f"CREATE TABLE {SCHEMA}.{table_name}_default PARTITION OF {SCHEMA}.{table_name} DEFAULT")
+
+        # 5. 本學期資料移入新分區，其餘歷史資料原地掛為 legacy 分區
+        op.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {SCHEMA}.{legacy} WHERE {PARTITION_COLUMN} >= '{cutover:%Y-%m-%d}' RETURNING *
+            )
+            INSERT INTO {SCHEMA}.{table_name} SELECT * FROM moved
+            """
+        )
+        if has_id:
+            # 分區不可另有主鍵：legacy 的 (id) 主鍵改為與分區表相同的 (id, submitted_at)，
+            # ATTACH 時即掛為分區表主鍵索引的一部分
+            _replace_primary_key(legacy, f"id, {PARTITION_COLUMN}")
+        op.execute(
+            f"ALTER TABLE {SCHEMA}.{table_name} ATTACH PARTITION {SCHEMA}.{legacy} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{cutover:%Y-%m-%d}')"
+        )
+
+        # 6. 索引建立於分區表 (legacy 分區上定義相同的索引會直接掛上，不重建)
+        for index_name, index_def in index_defs:
+            op.execute(index_def)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table_name in PARTITIONED_TABLES:
+        if not _has_table(table_name):
+            continue
+        legacy = f"{table_name}_legacy"
+        index_defs = _index_defs(table_name)
+
+        # 1. 取回 legacy 分區 (若已被 partition_maintenance 封存刪除則重建空表)
+        is_partition = op.get_bind().execute(
+            sa.text("SELECT count(*) FROM pg_inherits WHERE inhrelid = to_regclass(:name)"),
+            {"name": f"{SCHEMA}.{legacy}"},
+        ).scalar()
+        if is_partition:
+            op.execute(f"ALTER TABLE {SCHEMA}.{table_name} DETACH PARTITION {SCHEMA}.{legacy}")
+        elif not _has_table(legacy):
+            op.execute(f"CREATE TABLE {SCHEMA}.{legacy} (LIKE {SCHEMA}.{table_name} INCLUDING DEFAULTS)")
+
+        # 2. 其餘分區資料搬回，刪除分區表
+        op.execute(f"INSERT INTO {SCHEMA}.{legacy} SELECT * FROM {SCHEMA}.{table_name}")
+        if _has_column(table_name, 'id'):
+            _reown_sequence(table_name, legacy)
+        op.execute(f"DROP TABLE {SCHEMA}.{table_name}")
+
+        # 3. 還原名稱、主鍵與索引 (submitted_at 須先移出主鍵才能允許 NULL)
+        op.execute(f"ALTER TABLE {SCHEMA}.{legacy} RENAME TO {table_name}")
+        if _has_column(table_name, 'id'):
+            _replace_primary_key(table_name, "id")
+        op.execute(f"ALTER TABLE {SCHEMA}.{table_name} ALTER COLUMN {PARTITION_COLUMN} DROP NOT NULL")
+        for index_name in _all_index_names(table_name):
+            if index_name.endswith('_legacy'):
+                op.execute(f"ALTER INDEX {SCHEMA}.{index_name} RENAME TO {index_name[:-len('_legacy')]}")
+        existing = set(_all_index_names(table_name))
+        for index_name, index_def in index_defs:
+            if index_name not in existing:
+                op.execute(index_def)
@@ -0,0 +1,126 @@
+"""add_problem_test_case_store
+
+Revision ID: s4t5u6v7w8x9
+Revises: r3s4t5u6v7w8
+Create Date: 2026-10-18 17:00:00.000000
+
+詳細變更說明:
+1. 新增資料表 'debugging.problem_test_case' (problem_id, case_no PK)
+   - input_hash / output_hash 引用 debugging.content_blob，input_size / output_size 為內容長度
+2. 轉換既有資料: debugging.problem.test_cases 的每筆 {"input", "output"} 拆為一列，
+   內容寫入 content_blob (相同內容只存一份)
+3. 移除 debugging.problem.test_cases 欄位
+
+設計說明:
+- 判題 (load_problem_config) 只讀取 hash，測資內容於判題時才由本機快取 (OJ/case_store.py) 以 mmap 讀取
+- 公開的題目查詢 (get_problem_by_id / Problem.to_dict) 不再讀取或回傳任何測資
+- case_no 自 1 起算，與判題結果的 case_id 相同
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 's4t5u6v7w8x9'
+down_revision: Union[str, Sequence[str], None] = 'r3s4t5u6v7w8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _hash(expr: str) -> str:
+    return f"encode(sha256(convert_to(({expr})::text, 'UTF8')), 'hex')"
+
+
+def _has_test_cases_column() -> bool:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('problem', schema='debugging'):
+        return False
+    return any(c['name'] == 'test_cases' for c in inspector.get_columns('problem', schema='debugging'))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'problem_test_case',
+        sa.Column('problem_id', sa.String(), nullable=False),
+        sa.Column('case_no', sa.Integer(), nullable=False),
+        sa.Column('input_hash', sa.String(64), nullable=True),
+        sa.Column('output_hash', sa.String(64), nullable=True),
+        sa.Column('input_size', sa.Integer(), nullable=True),
+        sa.Column('output_size', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('problem_id', 'case_no'),
+        schema='debugging'
+    )
+
+    if not _has_test_cases_column():
+        print("--- Skip: column debugging.problem.test_cases not found ---")
+        return
+
+    cases_sql = """
+        SELECT p.problem_id, e.ord AS case_no, e.elem->'input' AS input, e.elem->'output' AS output
+        FROM debugging.problem p
+        CROSS JOIN LATERAL jsonb_array_elements(p.test_cases::jsonb) WITH ORDINALITY AS e(elem, ord)
+        WHERE jsonb_typeof(p.test_cases::jsonb) = 'array'
+    """
+
+    # 1. 測資內容寫入 content_blob
+    op.execute(
+        f"""
+        INSERT INTO debugging.content_blob (hash, content, size)
+        SELECT DISTINCT ON (h) h, c, length(c)
+        FROM (
+            SELECT v.val::text AS c
+            FROM ({cases_sql}) tc
+            CROSS JOIN LATERAL (VALUES (tc.input), (tc.output)) v(val)
+            WHERE v.val IS NOT NULL AND v.val <> 'null'::jsonb
+        ) vals
+        CROSS JOIN LATERAL (SELECT {_hash('vals.c')} AS h) x
+        ON CONFLICT DO NOTHING
+        """
+    )
+
+    # 2. 每筆測資一列
+    op.execute(
+        f"""
+        INSERT INTO debugging.problem_test_case (problem_id, case_no, input_hash, output_hash, input_size, output_size)
+        SELECT
+            tc.problem_id, tc.case_no,
+            CASE WHEN tc.input IS NULL OR tc.input = 'null'::jsonb THEN NULL ELSE {_hash('tc.input')} END,
+            CASE WHEN tc.output IS NULL OR tc.output = 'null'::jsonb THEN NULL ELSE {_hash('tc.output')} END,
+            COALESCE(length(tc.input::text), 0),
+            COALESCE(length(tc.output::text), 0)
+        FROM ({cases_sql}) tc
+        """
+    )
+
+    op.drop_column('problem', 'test_cases', schema='debugging')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if sa.inspect(op.get_bind()).has_table('problem', schema='debugging'):
+        op.add_column('problem', sa.Column('test_cases', postgresql.JSONB(), nullable=True), schema='debugging')
+        op.execute(
+            """
+            UPDATE debugging.problem p
+            SET test_cases = tc.test_cases
+            FROM (
+                SELECT
+                    t.problem_id,
+                    jsonb_agg(
+                        jsonb_build_object('input', bi.content::jsonb, 'output', bo.content::jsonb)
+                        ORDER BY t.case_no
+                    ) AS test_cases
+                FROM debugging.problem_test_case t
+                LEFT JOIN debugging.content_blob bi ON bi.hash = t.input_hash
+                LEFT JOIN debugging.content_blob bo ON bo.hash = t.output_hash
+                GROUP BY t.problem_id
+            ) tc
+            WHERE p.problem_id = tc.problem_id
+            """
+        )
+
+    op.drop_table('problem_test_case', schema='debugging')
@@ -0,0 +1,84 @@
+"""add_diagnosis_cache
+
+Revision ID: t5u6v7w8x9y0
+Revises: s4t5u6v7w8x9
+Create Date: 2026-10-18 18:00:00.000000
+
+詳細變更說明:
+1. 新增資料表 'debugging.diagnosis_cache'
+   - (problem_id, signature) 唯一：signature 為正規化 AST + 錯誤特徵的 sha256
+   - embedding (vector 1536) 供同題、同 error_kind 的語意比對
+   - evidence_report / search_query / retrieved_docs / scaffolds ({"<zpd>": 回覆}) 為可重用的結果
+   - report_cost / scaffold_cost 為產生結果的 LLM 費用，命中時計為省下的費用
+2. debugging.llm_charge 新增 cache_hits / cache_misses / saved_cost 欄位
+   - 由 model_name='semantic_cache' 的列記錄快取命中率與省下的費用
+
+設計說明:
+- 每題筆數有限 (DIAGNOSIS_CACHE_MAX_PER_PROBLEM)，語意比對只在單題範圍內排序，不建立向量索引
+- 淘汰依 COALESCE(last_hit_at, created_at)，由 (problem_id, last_hit_at) 索引支援
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from pgvector.sqlalchemy import Vector
+
+
+# revision identifiers, used by Alembic.
+revision: str = 't5u6v7w8x9y0'
+down_revision: Union[str, Sequence[str], None] = 's4t5u6v7w8x9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+CHARGE_COLUMNS = [
+    ('cache_hits', sa.Integer()),
+    ('cache_misses', sa.Integer()),
+    ('saved_cost', sa.Float()),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    op.create_table(
+        'diagnosis_cache',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('problem_id', sa.String(), nullable=False),
+        sa.Column('signature', sa.String(64), nullable=False),
+        sa.Column('error_kind', sa.String(100), nullable=True),
+        sa.Column('embedding', Vector(1536), nullable=True),
+        sa.Column('evidence_report', postgresql.JSONB(), nullable=True),
+        sa.Column('search_query', sa.Text(), nullable=True),
+        sa.Column('retrieved_docs', postgresql.JSONB(), nullable=True),
+        sa.Column('scaffolds', postgresql.JSONB(), nullable=True),
+        sa.Column('report_cost', sa.Float(), server_default='0', nullable=True),
+        sa.Column('scaffold_cost', sa.Float(), server_default='0', nullable=True),
+        sa.Column('hit_count', sa.Integer(), server_default='0', nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.Column('last_hit_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('problem_id', 'signature', name='uq_diagnosis_cache_signature'),
+        schema='debugging'
+    )
+    op.create_index(
+        'ix_diagnosis_cache_problem_last_hit', 'diagnosis_cache',
+        ['problem_id', 'last_hit_at'], schema='debugging'
+    )
+
+    if not sa.inspect(op.get_bind()).has_table('llm_charge', schema='debugging'):
+        print("--- Skip: table debugging.llm_charge not found ---")
+        return
+    for name, type_ in CHARGE_COLUMNS:
+        op.add_column('llm_charge', sa.Column(name, type_, server_default='0', nullable=True), schema='debugging')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if sa.inspect(op.get_bind()).has_table('llm_charge', schema='debugging'):
+        for name, _ in reversed(CHARGE_COLUMNS):
+            op.drop_column('llm_charge', name, schema='debugging')
+
+    op.drop_index('ix_diagnosis_cache_problem_last_hit', table_name='diagnosis_cache', schema='debugging')
+    op.drop_table('diagnosis_cache', schema='debugging')
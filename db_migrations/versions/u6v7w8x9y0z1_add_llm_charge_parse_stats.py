@@ -0,0 +1,45 @@
+"""add_llm_charge_parse_stats
+
+Revision ID: u6v7w8x9y0z1
+Revises: t5u6v7w8x9y0
+Create Date: 2026-10-18 19:00:00.000000
+
+詳細變更說明:
+1. debugging.llm_charge 新增 parse_attempts / parse_failures / parse_repairs 欄位
+   - structured output 每次解析記一次 parse_attempts，記在產生該回覆的模型列上
+   - parse_failures: 首次解析不符合 schema；parse_repairs: 經修復呼叫後解析成功
+
+設計說明:
+- 與費用欄位相同由 LLMChargeLedger 批次 upsert 累加，失敗率依 usage_type 彙總即可
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'u6v7w8x9y0z1'
+down_revision: Union[str, Sequence[str], None] = 't5u6v7w8x9y0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+PARSE_COLUMNS = ['parse_attempts', 'parse_failures', 'parse_repairs']
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table('llm_charge', schema='debugging'):
+        print("--- Skip: table debugging.llm_charge not found ---")
+        return
+    for name in PARSE_COLUMNS:
+        op.add_column('llm_charge', sa.Column(name, sa.Integer(), server_default='0', nullable=True), schema='debugging')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table('llm_charge', schema='debugging'):
+        return
+    for name in reversed(PARSE_COLUMNS):
+        op.drop_column('llm_charge', name, schema='debugging')
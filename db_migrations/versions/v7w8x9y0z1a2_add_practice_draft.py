@@ -0,0 +1,52 @@
+"""add_practice_draft
+
+Revision ID: v7w8x9y0z1a2
+Revises: u6v7w8x9y0z1
+Create Date: 2026-10-18 20:00:00.000000
+
+詳細變更說明:
+1. 新增資料表 'debugging.debugging_practice_draft'
+   - 學生通過多數測資但尚未 AC 時，背景依現有 evidence report 預先生成的練習題草稿
+   - (student_id, problem_id) 唯一：每位學生每題只保留最新一份草稿
+   - evidence_hash 為生成時依據之報告的 sha256，AC 時報告已變動則視為過期
+   - generations 為該學生該題累計生成次數 (成本上限)，cost 為草稿的 LLM 費用
+
+設計說明:
+- AC 時草稿搬入 debugging_practice 後即刪除，表內只有進行中的題目，不需額外索引
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'v7w8x9y0z1a2'
+down_revision: Union[str, Sequence[str], None] = 'u6v7w8x9y0z1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'debugging_practice_draft',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('student_id', sa.String(), nullable=False),
+        sa.Column('problem_id', sa.String(), nullable=False),
+        sa.Column('code_question', postgresql.JSONB(), nullable=True),
+        sa.Column('evidence_hash', sa.String(64), nullable=True),
+        sa.Column('report_count', sa.Integer(), nullable=True),
+        sa.Column('generations', sa.Integer(), server_default='1', nullable=True),
+        sa.Column('cost', sa.Float(), server_default='0', nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('student_id', 'problem_id', name='uq_practice_draft_student_problem'),
+        schema='debugging'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('debugging_practice_draft', schema='debugging')
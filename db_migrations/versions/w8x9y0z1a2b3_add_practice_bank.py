@@ -0,0 +1,71 @@
+"""add_practice_bank
+
+Revision ID: w8x9y0z1a2b3
+Revises: v7w8x9y0z1a2
+Create Date: 2026-10-18 21:00:00.000000
+
+詳細變更說明:
+1. 新增資料表 'debugging.practice_bank'
+   - 每題的練習題題庫，依學生錯誤觀念摘要的 embedding (vector 1536) 分群
+   - cluster_id 為群內第一筆的 id；同一群可有多組題目，供同群學生輪流取用
+   - misconceptions 為生成時依據的錯誤觀念摘要，cost 為生成費用 (命中時計為省下的費用)
+2. 新增資料表 'debugging.practice_bank_serve'
+   - (bank_id, student_id) 主鍵：記錄題目已發給哪些學生，同一學生不會重複拿到同一組題目
+
+設計說明:
+- 分群比對只在單題範圍內排序 (題庫筆數有限，PRACTICE_BANK_MAX_PER_PROBLEM)，不建立向量索引
+- (problem_id, cluster_id) 索引支援群內挑選未發過的題目
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from pgvector.sqlalchemy import Vector
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'w8x9y0z1a2b3'
+down_revision: Union[str, Sequence[str], None] = 'v7w8x9y0z1a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    op.create_table(
+        'practice_bank',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('problem_id', sa.String(), nullable=False),
+        sa.Column('cluster_id', sa.Integer(), nullable=False),
+        sa.Column('embedding', Vector(1536), nullable=True),
+        sa.Column('misconceptions', postgresql.JSONB(), nullable=True),
+        sa.Column('code_question', postgresql.JSONB(), nullable=True),
+        sa.Column('cost', sa.Float(), server_default='0', nullable=True),
+        sa.Column('serve_count', sa.Integer(), server_default='0', nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.Column('last_served_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        schema='debugging'
+    )
+    op.create_index(
+        'ix_practice_bank_problem_cluster', 'practice_bank',
+        ['problem_id', 'cluster_id'], schema='debugging'
+    )
+    op.create_table(
+        'practice_bank_serve',
+        sa.Column('bank_id', sa.Integer(), nullable=False),
+        sa.Column('student_id', sa.String(), nullable=False),
+        sa.Column('served_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('bank_id', 'student_id'),
+        sa.ForeignKeyConstraint(['bank_id'], ['debugging.practice_bank.id'], ondelete='CASCADE'),
+        schema='debugging'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('practice_bank_serve', schema='debugging')
+    op.drop_index('ix_practice_bank_problem_cluster', table_name='practice_bank', schema='debugging')
+    op.drop_table('practice_bank', schema='debugging')
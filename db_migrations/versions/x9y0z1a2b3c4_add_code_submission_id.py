@@ -0,0 +1,72 @@
+"""add_code_submission_id
+
+Revision ID: x9y0z1a2b3c4
+Revises: w8x9y0z1a2b3
+Create Date: 2026-10-18 22:00:00.000000
+
+詳細變更說明:
+1. debugging.debugging_code_submission 加上 id 欄位 (已存在時略過)
+   - 以 sequence debugging.debugging_code_submission_id_seq 作為預設值，既有資料依序回填
+   - 提交歷史的 keyset 游標改為 (submitted_at, id)，同一時間的提交不再被略過
+   - 版本差異的快取鍵改為兩筆提交的 id
+2. 索引 (student_id, problem_id, submitted_at) 改為 (student_id, problem_id, submitted_at, id)
+   - 依 num 取提交 (ORDER BY submitted_at, id OFFSET) 與歷史分頁皆可直接依索引排序
+
+設計說明:
+- 分區表不一定支援 identity 欄位，改用 sequence + DEFAULT nextval，分區表與一般資料表皆適用
+- id 不設唯一約束 (分區表的唯一鍵須包含分區鍵)，唯一性由 sequence 保證
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'x9y0z1a2b3c4'
+down_revision: Union[str, Sequence[str], None] = 'w8x9y0z1a2b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SCHEMA = 'debugging'
+TABLE = 'debugging_code_submission'
+SEQUENCE = f'{SCHEMA}.{TABLE}_id_seq'
+OLD_INDEX = ('idx_code_submission_student_problem_time', ['student_id', 'problem_id', 'submitted_at'])
+NEW_INDEX = ('idx_code_submission_student_problem_time_id', ['student_id', 'problem_id', 'submitted_at', 'id'])
+
+
+def _has_table(table_name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(table_name, schema=SCHEMA)
+
+
+def _has_column(table_name: str, column_name: str) -> bool:
+    columns = sa.inspect(op.get_bind()).get_columns(table_name, schema=SCHEMA)
+    return any(c['name'] == column_name for c in columns)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not _has_table(TABLE):
+        print(f"--- Skip: table {SCHEMA}.{TABLE} not found ---")
+        return
+
+    if not _has_column(TABLE, 'id'):
+        op.execute(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE}")
+        op.execute(f"ALTER TABLE {SCHEMA}.{TABLE} ADD COLUMN id BIGINT")
+        op.execute(f"UPDATE {SCHEMA}.{TABLE} SET id = nextval('{SEQUENCE}')")
+        op.execute(f"ALTER TABLE {SCHEMA}.{TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+        op.execute(f"ALTER TABLE {SCHEMA}.{TABLE} ALTER COLUMN id SET NOT NULL")
+        op.execute(f"ALTER SEQUENCE {SEQUENCE} OWNED BY {SCHEMA}.{TABLE}.id")
+
+    op.create_index(NEW_INDEX[0], TABLE, NEW_INDEX[1], schema=SCHEMA, if_not_exists=True)
+    op.drop_index(OLD_INDEX[0], table_name=TABLE, schema=SCHEMA, if_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _has_table(TABLE):
+        return
+    # id 欄位保留 (無法得知升級前是否已存在)，只還原索引
+    op.create_index(OLD_INDEX[0], TABLE, OLD_INDEX[1], schema=SCHEMA, if_not_exists=True)
+    op.drop_index(NEW_INDEX[0], table_name=TABLE, schema=SCHEMA, if_exists=True)
@@ -0,0 +1,36 @@
+"""add_diagnosis_cache_code_hash
+
+Revision ID: y0z1a2b3c4d5
+Revises: x9y0z1a2b3c4
+Create Date: 2026-10-18 23:00:00.000000
+
+詳細變更說明:
+1. debugging.diagnosis_cache 新增 code_hash 欄位 (原始程式碼的 sha256)
+   - signature 以識別字正規化後的 AST 計算，只改變數名稱的程式碼會精確命中同一筆
+   - 鷹架回覆會引用學生程式碼中的名稱，只有 code_hash 也相同時才重用；
+     否則視為語意命中，沿用錯誤報告與檢索結果、依目前的程式碼重新生成鷹架回覆
+
+設計說明:
+- 既有資料的 code_hash 為 NULL，一律不重用鷹架回覆 (之後相同程式碼命中時不會補上)
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'y0z1a2b3c4d5'
+down_revision: Union[str, Sequence[str], None] = 'x9y0z1a2b3c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('diagnosis_cache', sa.Column('code_hash', sa.String(64), nullable=True), schema='debugging')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('diagnosis_cache', 'code_hash', schema='debugging')
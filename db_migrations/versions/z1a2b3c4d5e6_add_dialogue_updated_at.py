@@ -0,0 +1,57 @@
+"""add_dialogue_updated_at
+
+Revision ID: z1a2b3c4d5e6
+Revises: y0z1a2b3c4d5
+Create Date: 2026-10-19 00:00:00.000000
+
+詳細變更說明:
+1. debugging.debugging_dialogue 新增欄位 'updated_at' (DateTime, 預設 now())
+   - 追加 chat_log 訊息時一併更新 (append_chat_messages / Core update 的 onupdate)
+   - 既有資料填入遷移當下的時間
+2. 新增索引 idx_dialogue_updated_at (updated_at)
+   - analytics_export 匯出 dialogue_messages 時先以 updated_at 篩出有新訊息的對話，
+     只展開這些對話的 chat_log，不再每次掃描整張表
+
+設計說明:
+- 既有資料的 updated_at 為遷移時間，遷移後第一次匯出會重新展開所有對話一次，
+  訊息本身仍以 timestamp 篩選，不會重複匯出
+- 分區表上建立的索引會套用到所有分區 (含之後新增的學期分區)
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'z1a2b3c4d5e6'
+down_revision: Union[str, Sequence[str], None] = 'y0z1a2b3c4d5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SCHEMA = 'debugging'
+TABLE = 'debugging_dialogue'
+INDEX = 'idx_dialogue_updated_at'
+
+
+def _has_table(table_name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(table_name, schema=SCHEMA)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not _has_table(TABLE):
+        print(f"--- Skip: table {SCHEMA}.{TABLE} not found ---")
+        return
+
+    op.add_column(TABLE, sa.Column('updated_at', sa.DateTime(), nullable=True, server_default=sa.func.now()), schema=SCHEMA)
+    op.create_index(INDEX, TABLE, ['updated_at'], schema=SCHEMA, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _has_table(TABLE):
+        return
+    op.drop_index(INDEX, table_name=TABLE, schema=SCHEMA, if_exists=True)
+    op.drop_column(TABLE, 'updated_at', schema=SCHEMA)
@@ -66,6 +66,39 @@ interface QuestionFeedbackState {
     [key: string]: boolean;
 }
 
+// --- SSE ---
+// EventSource 只支援 GET，/help/chat/stream 為 POST，因此以 fetch 讀取串流並自行解析 event/data
+const readEventStream = async (
+    url: string,
+    init: RequestInit,
+    onEvent: (event: string, data: any) => void
+): Promise<void> => {
+    const res = await fetch(url, { ...init, headers: { Accept: 'text/event-stream', ...(init.headers || {}) } });
+    if (!res.ok || !res.body) throw new Error(`Stream request failed: ${res.status}`);
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer = (buffer + decoder.decode(value, { stream: true })).replace(/\r\n/g, '\n');
+        let sep: number;
+        while ((sep = buffer.indexOf('\n\n')) >= 0) {
+            const block = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            let event = 'message';
+            const dataLines: string[] = [];
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) dataLines.push(line.slice(5).replace(/^ /, ''));
+            });
+            // 只有註解的區塊 (ping) 略過
+            if (dataLines.length > 0) onEvent(event, JSON.parse(dataLines.join('\n')));
+        }
+    }
+};
+
 const StudentCodingHelp: React.FC = () => {
     const { user } = useUser();
 
@@ -227,7 +260,8 @@ const StudentCodingHelp: React.FC = () => {
                 const problemRes = await axios.get(`${API_BASE_URL}/debugging/problems/${selectedProblemId}`);
                 setProblemData(problemRes.data);
 
-                const codeRes = await axios.get(`${API_BASE_URL}/debugging/student_code/${student.stu_id}/${selectedProblemId}`);
+                // 單一請求取得程式碼、判題結果、練習題與最新對話紀錄
+                const codeRes = await axios.get(`${API_BASE_URL}/debugging/workspace/${student.stu_id}/${selectedProblemId}`);
                 const { status, data } = codeRes.data;
 
                 if (status === "success") {
@@ -289,15 +323,11 @@ const StudentCodingHelp: React.FC = () => {
                     const subNum = data.submission_num || 0;
                     const repNum = data.latest_report_num || 0;
                     if (subNum <= repNum && !activePollingSet.current.has(selectedProblemId)) {
-                        // 此提交已有報告，嘗試載入聊天紀錄
+                        // 此提交已有報告，直接使用 workspace 回傳的聊天紀錄
                         try {
-                            const historyRes = await axios.get(
-                                `${API_BASE_URL}/debugging/help/history/${student.stu_id}/${selectedProblemId}`,
-                                { params: { submission_num: subNum } }
-                            );
                             // 再次確認仍在此題
                             if (selectedProblemIdRef.current === selectedProblemId) {
-                                const chatLog = historyRes.data.chat_log || [];
+                                const chatLog = data.chat_log || [];
                                 if (chatLog.length > 0) {
                                     const msgs: ChatMessage[] = chatLog.map((msg: any) => ({
                                         role: msg.role as 'user' | 'agent',
@@ -325,6 +355,56 @@ const StudentCodingHelp: React.FC = () => {
         fetchData();
     }, [selectedProblemId, student.stu_id]);
 
+    // ★ 鷹架回覆串流 ★
+    // 訂閱 /help/init/stream 逐字顯示回覆；串流失敗或未收到 done 時改用輪詢
+    const streamAnalysisResult = async (targetNum: number, forProblemId: string) => {
+        let text = '';
+        let finished = false;
+        try {
+            await readEventStream(
+                `${API_BASE_URL}/debugging/help/init/stream/${student.stu_id}/${forProblemId}?submission_num=${targetNum}`,
+                { method: 'GET' },
+                (event, data) => {
+                    // 串流期間可能已被取消
+                    if (!activePollingSet.current.has(forProblemId)) return;
+                    const isViewing = selectedProblemIdRef.current === forProblemId;
+
+                    if (event === 'token') {
+                        text += data.text;
+                        if (isViewing) {
+                            setChatMessages([{ role: 'agent', content: text, type: 'scaffold' }]);
+                        }
+                    } else if (event === 'done') {
+                        finished = true;
+                        activePollingSet.current.delete(forProblemId);
+                        if (isViewing) {
+                            const { chat_log, reply } = data;
+                            if (chat_log && chat_log.length > 0) {
+                                const msgs: ChatMessage[] = chat_log.map((msg: any) => ({
+                                    role: msg.role as 'user' | 'agent',
+                                    content: msg.content,
+                                    zpd: msg.zpd,
+                                    timestamp: msg.timestamp,
+                                    type: msg.type
+                                }));
+                                setChatMessages(msgs);
+                            } else if (reply) {
+                                setChatMessages([{ role: 'agent', content: reply, type: 'scaffold' }]);
+                            }
+                            setIsChatLoading(false);
+                        }
+                    }
+                    // error → 交由輪詢處理 (例如分析在其他 worker 進行)
+                }
+            );
+        } catch (error) {
+            console.warn("Scaffold stream unavailable, falling back to polling:", error);
+        }
+        if (!finished && activePollingSet.current.has(forProblemId)) {
+            pollForAnalysisResult(targetNum, forProblemId);
+        }
+    };
+
     // ★ 每題獨立輪詢函式 ★
     // forProblemId: 此輪詢所屬的題目（不依賴 closure 或 singleton ref）
     const pollForAnalysisResult = async (targetNum: number, forProblemId: string, retryCount = 0) => {
@@ -486,9 +566,9 @@ const StudentCodingHelp: React.FC = () => {
                     setIsChatLoading(false);
                 }
             } else if (status === 'started' || status === 'pending') {
-                // 加入 polling set 並開始獨立輪詢
+                // 加入 polling set 並訂閱串流 (失敗時改為獨立輪詢)
                 activePollingSet.current.add(requestProblemId);
-                pollForAnalysisResult(helpNum, requestProblemId);
+                streamAnalysisResult(helpNum, requestProblemId);
             } else {
                 if (isViewing) {
                     setChatMessages([{ role: 'agent', content: "目前無錯誤報告。", type: 'chat' }]);
@@ -626,14 +706,58 @@ const StudentCodingHelp: React.FC = () => {
         setChatMessages(prev => [...prev, { role: 'user', content: userMsg }]);
         setIsChatLoading(true);
 
+        // V3: Send activeHelpNum so backend saves to the correct dialogue
+        const payload = {
+            student_id: student.stu_id,
+            problem_id: requestProblemId, // 使用捕獲值，非 closure
+            message: userMsg,
+            submission_num: activeHelpNum
+        };
+
         try {
-            // V3: Send activeHelpNum so backend saves to the correct dialogue
-            const res = await axios.post(`${API_BASE_URL}/debugging/help/chat`, {
-                student_id: student.stu_id,
-                problem_id: requestProblemId, // 使用捕獲值，非 closure
-                message: userMsg,
-                submission_num: activeHelpNum
-            });
+            // 串流回覆：第一個 token 時新增 agent 訊息，之後持續更新最後一則，done 時以完整回覆為準
+            let streamed = false;
+            let finalReply: string | null = null;
+            let streamError: string | null = null;
+            try {
+                await readEventStream(
+                    `${API_BASE_URL}/debugging/help/chat/stream`,
+                    { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload) },
+                    (event, data) => {
+                        if (event === 'done') {
+                            finalReply = data.reply;
+                        } else if (event === 'error') {
+                            streamError = data.message;
+                            return;
+                        } else if (event !== 'token') {
+                            return;
+                        }
+                        // 守衛：若已切題則不更新 UI
+                        if (selectedProblemIdRef.current !== requestProblemId) return;
+                        const content = event === 'done' ? data.reply : data.text;
+                        const append = !streamed;
+                        streamed = true;
+                        setChatMessages(prev => {
+                            if (append) return [...prev, { role: 'agent', content, type: 'chat' }];
+                            const last = prev[prev.length - 1];
+                            const merged = event === 'done' ? content : last.content + content;
+                            return [...prev.slice(0, -1), { ...last, content: merged }];
+                        });
+                    }
+                );
+            } catch (error) {
+                console.warn("Chat stream unavailable, falling back to /help/chat:", error);
+            }
+
+            if (finalReply !== null) return;
+            if (streamed || streamError) {
+                // 已顯示部分回覆或後端回報錯誤 → 不重送，避免重複生成
+                if (selectedProblemIdRef.current !== requestProblemId) return;
+                setChatMessages(prev => [...prev, { role: 'agent', content: streamError || "發生錯誤，請稍後再試。", type: 'chat' }]);
+                return;
+            }
+
+            const res = await axios.post(`${API_BASE_URL}/debugging/help/chat`, payload);
             // 守衛：若已切題則不更新 UI
             if (selectedProblemIdRef.current !== requestProblemId) return;
             setChatMessages(prev => [...prev, { role: 'agent', content: res.data.reply, type: 'chat' }]);
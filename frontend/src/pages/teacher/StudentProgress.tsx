@@ -61,6 +61,119 @@ interface CodingHelpDashboardData {
     verdict_stats: Record<string, number>;
 }
 
+// ==========================================
+// Live Feed (SSE 差異事件)
+// ==========================================
+
+interface VerdictEvent {
+    type: 'verdict';
+    student_id: string;
+    verdict: string;
+}
+
+interface PrecodingAnswerEvent {
+    type: 'precoding_answer';
+    student_id: string;
+    stage: string;
+    q_id: string;
+    selected_option_id: number;
+    is_correct: boolean;
+    first_attempt: boolean;
+    previous_latest_is_correct: boolean | null;
+    progress_stage: string;
+}
+
+interface PrecodingLogicEvent {
+    type: 'precoding_logic';
+    student_id: string;
+    logic_completed: boolean;
+}
+
+// 取快照期間持續收到差異時，最多重取幾次快照
+const MAX_SNAPSHOT_RETRIES = 3;
+
+// "a/b" 的分子加上 delta
+const bumpFraction = (value: string, delta: number, total: number) => {
+    const match = value.match(/^(\d+)\/(\d+)$/);
+    const current = match ? parseInt(match[1]) : 0;
+    return `${current + delta}/${match ? parseInt(match[2]) : total}`;
+};
+
+const applyVerdictEvent = (data: CodingHelpDashboardData, ev: VerdictEvent): CodingHelpDashboardData => {
+    const verdictStats = { ...data.verdict_stats };
+    const existing = data.students.find(s => s.student_id === ev.student_id);
+    if (existing) {
+        verdictStats[existing.current_verdict] = Math.max((verdictStats[existing.current_verdict] || 1) - 1, 0);
+        if (verdictStats[existing.current_verdict] === 0) delete verdictStats[existing.current_verdict];
+    }
+    verdictStats[ev.verdict] = (verdictStats[ev.verdict] || 0) + 1;
+
+    const students = existing
+        ? data.students.map(s => s.student_id === ev.student_id ? { ...s, current_verdict: ev.verdict } : s)
+        : [...data.students, { student_id: ev.student_id, current_verdict: ev.verdict, practice_status: 'no_practice' }];
+    return { ...data, students, verdict_stats: verdictStats };
+};
+
+const applyPrecodingEvent = (
+    data: PrecodingDashboardData,
+    ev: PrecodingAnswerEvent | PrecodingLogicEvent
+): PrecodingDashboardData => {
+    const emptyStage = (stage: 'explain_code' | 'error_code') => {
+        const total = data.question_stats[stage].length;
+        return { first_attempts: [], score: `0/${total}`, final_correct: `0/${total}` };
+    };
+    let students = data.students;
+    if (!students.some(s => s.student_id === ev.student_id)) {
+        students = [...students, {
+            student_id: ev.student_id,
+            logic_completed: false,
+            explain_code: emptyStage('explain_code'),
+            error_code: emptyStage('error_code'),
+            is_completed: false
+        }];
+    }
+
+    if (ev.type === 'precoding_logic') {
+        return {
+            ...data,
+            students: students.map(s => s.student_id === ev.student_id ? { ...s, logic_completed: ev.logic_completed } : s)
+        };
+    }
+
+    const stage = ev.stage as 'explain_code' | 'error_code';
+    const tracked = stage === 'explain_code' || stage === 'error_code';
+    students = students.map(s => {
+        if (s.student_id !== ev.student_id) return s;
+        const updated = { ...s, is_completed: ev.progress_stage === 'completed' };
+        if (!tracked) return updated;
+
+        const total = data.question_stats[stage].length;
+        const summary = { ...s[stage] };
+        if (ev.first_attempt) {
+            summary.first_attempts = [...summary.first_attempts, {
+                q_id: ev.q_id, selected_option_id: ev.selected_option_id, is_correct: ev.is_correct
+            }];
+            summary.score = bumpFraction(summary.score, ev.is_correct ? 1 : 0, total);
+        }
+        const finalDelta = (ev.is_correct ? 1 : 0) - (ev.previous_latest_is_correct ? 1 : 0);
+        summary.final_correct = bumpFraction(summary.final_correct, finalDelta, total);
+        return { ...updated, [stage]: summary };
+    });
+
+    // 首答才計入選項分佈
+    let questionStats = data.question_stats;
+    if (tracked && ev.first_attempt) {
+        questionStats = {
+            ...questionStats,
+            [stage]: questionStats[stage].map(q => q.q_id !== ev.q_id ? q : {
+                ...q,
+                options: q.options.map(o => o.option_id === ev.selected_option_id ? { ...o, count: o.count + 1 } : o)
+            })
+        };
+    }
+    return { ...data, students, question_stats: questionStats };
+};
+
 // ==========================================
 // Component
 // ==========================================
@@ -101,33 +214,89 @@ const StudentProgress: React.FC = () => {
         fetchProblems();
     }, []);
 
-    // Fetch data when tab or problemId changes
+    // 初始資料 + 即時推播：先建立 SSE 連線，連上 (含自動重連) 後才取快照，再套用之後的差異。
+    // 取快照期間收到的差異無法判斷是否已含在快照內 (差異事件不具冪等性)，一律丟棄並重取快照。
     useEffect(() => {
         if (!problemId) return; // 等待問題列表載入完成
 
-        const fetchData = async () => {
-            setLoading(true);
+        let closed = false;
+        let live = false;      // 快照已載入，差異可直接套用
+        let fetching = false;
+        let stale = false;     // 取快照期間收到差異或重新連線，需再取一次
+        let loadedOnce = false;
+        let retries = 0;
+
+        const loadSnapshot = async () => {
+            if (fetching) {
+                stale = true;
+                return;
+            }
+            fetching = true;
+            live = false;
+            stale = false;
+            if (!loadedOnce) setLoading(true); // 重取時保留畫面，不顯示載入中
             setError(null);
             try {
                 if (activeTab === 'precoding') {
                     const res = await axios.get<PrecodingDashboardData>(
                         `${API_BASE_URL}/dashboard/precoding?problem_id=${problemId}`
                     );
-                    setPrecodingData(res.data);
+                    if (!closed) setPrecodingData(res.data);
                 } else {
                     const res = await axios.get<CodingHelpDashboardData>(
                         `${API_BASE_URL}/dashboard/coding_help?problem_id=${problemId}`
                     );
-                    setCodingHelpData(res.data);
+                    if (!closed) setCodingHelpData(res.data);
                 }
+                live = true;
+                loadedOnce = true;
             } catch (err: any) {
-                setError(err.response?.data?.detail || err.message || '載入失敗');
+                if (!closed) setError(err.response?.data?.detail || err.message || '載入失敗');
             } finally {
-                setLoading(false);
+                fetching = false;
+                if (!closed) setLoading(false);
             }
+            if (closed) return;
+            // 持續有差異進來時最多重取 MAX_SNAPSHOT_RETRIES 次，之後以最新快照為準
+            if (stale && retries < MAX_SNAPSHOT_RETRIES) {
+                retries += 1;
+                loadSnapshot();
+            } else {
+                retries = 0;
+            }
+        };
+
+        const onDelta = (apply: () => void) => {
+            if (live) apply();
+            else if (fetching) stale = true;
+            // 其餘 (快照載入失敗) 直接丟棄，下次取快照時即包含此變更
         };
 
-        fetchData();
+        const source = new EventSource(`${API_BASE_URL}/dashboard/stream?problem_id=${encodeURIComponent(problemId)}`);
+        // 斷線期間的事件不會補送，每次 (重新) 連上都重取快照
+        source.addEventListener('open', () => { loadSnapshot(); });
+        source.addEventListener('error', () => {
+            // 推播無法連線時仍顯示快照 (沒有即時更新)
+            if (!loadedOnce && !fetching) loadSnapshot();
+        });
+        if (activeTab === 'coding_help') {
+            source.addEventListener('verdict', (e) => {
+                const ev = JSON.parse((e as MessageEvent).data) as VerdictEvent;
+                onDelta(() => setCodingHelpData(prev => prev ? applyVerdictEvent(prev, ev) : prev));
+            });
+        } else {
+            const onPrecoding = (e: Event) => {
+                const ev = JSON.parse((e as MessageEvent).data) as PrecodingAnswerEvent | PrecodingLogicEvent;
+                onDelta(() => setPrecodingData(prev => prev ? applyPrecodingEvent(prev, ev) : prev));
+            };
+            source.addEventListener('precoding_answer', onPrecoding);
+            source.addEventListener('precoding_logic', onPrecoding);
+        }
+
+        return () => {
+            closed = true;
+            source.close();
+        };
     }, [activeTab, problemId, refreshKey]);
 
     // 重新整理函數